@@ -43,5 +43,15 @@ try:
 except Exception as e:
     print(f"[ComfyAI] ERROR explicitly mounting frontend static assets: {e}")
 
-NODE_CLASS_MAPPINGS = {}
-__all__ = ["NODE_CLASS_MAPPINGS"]
+# -----------------------------------------------------------
+# REGISTER NODES
+# -----------------------------------------------------------
+
+try:
+    from .backend.nodes import NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS
+except Exception as e:
+    print(f"[ComfyAI] ERROR registering nodes: {e}")
+    NODE_CLASS_MAPPINGS = {}
+    NODE_DISPLAY_NAME_MAPPINGS = {}
+
+__all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS", "WEB_DIRECTORY"]
@@ -0,0 +1,292 @@
+"""
+ComfyAI - Provider Admission Control
+
+Bounds how many requests ComfyAI sends to one provider at a time, so a burst
+of chats queues up instead of overloading (and timing out) a single local
+Ollama instance.
+
+Each provider gets one AdmissionController, owned by ProviderManager next to
+its ConnectionPool. Requests beyond `max_in_flight` wait in a bounded queue;
+waiting sessions are served round-robin so one busy browser tab cannot
+starve the others. When the queue is full a request is refused with 429,
+when it waits longer than `queue_timeout` with 503 — both carry a
+Retry-After hint derived from recent service times.
+
+Tuning lives in providers.json under the provider's options:
+
+    "options": {
+      "limits": {
+        "max_in_flight": 2,     # concurrent requests (0 = unlimited)
+        "max_queue": 32,        # waiting requests before 429
+        "queue_timeout": 60     # seconds a request may wait before 503
+      }
+    }
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, FrozenSet, Optional
+
+from .utils import metrics
+from .utils.logger import log
+
+
+# Controllers whose slot the current task (and tasks it spawns) already holds
+_held: contextvars.ContextVar[FrozenSet[int]] = contextvars.ContextVar(
+    "comfyai_admission_held", default=frozenset()
+)
+
+# Smoothing factor for the service-time average behind Retry-After
+_SERVICE_EWMA_ALPHA = 0.2
+
+
+# ============================================================
+# Settings
+# ============================================================
+
+@dataclass(frozen=True)
+class AdmissionSettings:
+    max_in_flight: int = 0
+    max_queue: int = 32
+    queue_timeout: float = 60.0
+
+    @property
+    def unlimited(self) -> bool:
+        return self.max_in_flight <= 0
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]]) -> "AdmissionSettings":
+        """Build settings from ProviderConfig.options["limits"], ignoring junk."""
+        raw = (options or {}).get("limits") or {}
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] options.limits must be an object, using defaults")
+            raw = {}
+
+        defaults = cls()
+
+        def _num(key: str, default: Any, cast: Any) -> Any:
+            value = raw.get(key, default)
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                log.warning(f"[ComfyAI] Invalid options.limits.{key}={value!r}, using {default!r}")
+                return default
+
+        return cls(
+            max_in_flight=max(0, _num("max_in_flight", defaults.max_in_flight, int)),
+            max_queue=max(0, _num("max_queue", defaults.max_queue, int)),
+            queue_timeout=max(0.0, _num("queue_timeout", defaults.queue_timeout, float)),
+        )
+
+
+# ============================================================
+# Rejection
+# ============================================================
+
+class AdmissionRejected(Exception):
+    """Raised when a provider cannot take (or queue) another request."""
+
+    def __init__(self, provider: str, status: int, retry_after: int, reason: str):
+        super().__init__(f"Provider '{provider}' is busy ({reason}), retry in {retry_after}s")
+        self.provider = provider
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "error": str(self),
+            "provider": self.provider,
+            "reason": self.reason,
+            "retry_after": self.retry_after,
+        }
+
+
+# ============================================================
+# Controller
+# ============================================================
+
+class AdmissionController:
+    """Per-provider concurrency limit with a fair, bounded wait queue."""
+
+    def __init__(self, name: str, settings: Optional[AdmissionSettings] = None):
+        self.name = name
+        self.settings = settings or AdmissionSettings()
+
+        self.in_flight = 0
+        # session -> FIFO of waiters; iteration order is the round-robin order
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+
+        # Statistics
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.service_time = 0.0  # EWMA seconds per request
+
+    # --------------------------------------------------------
+    # Acquire / release
+    # --------------------------------------------------------
+    @asynccontextmanager
+    async def slot(self, session: Optional[str] = None) -> AsyncIterator[None]:
+        """
+        Hold one in-flight slot for the duration of the block.
+
+        Re-entrant per task context: a handler that admitted a request can
+        call ChatClient methods (which admit again) without taking a second
+        slot, and tasks it spawns inherit the slot.
+        """
+        held = _held.get()
+        if id(self) in held or self.settings.unlimited:
+            yield
+            return
+
+        await self._acquire(session or "")
+        _held.set(held | {id(self)})
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            _held.set(held)
+            self._record_service(time.monotonic() - started)
+            self._release()
+
+    async def _acquire(self, session: str) -> None:
+        s = self.settings
+        if self.in_flight < s.max_in_flight and not self._queued:
+            self._admit(0.0)
+            return
+
+        if self._queued >= s.max_queue:
+            self.rejected += 1
+            metrics.incr(f"admission.{self.name}.rejected")
+            raise AdmissionRejected(self.name, 429, self.retry_after(), "queue full")
+
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session, deque()).append(fut)
+        self._queued += 1
+        self._publish()
+
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), s.queue_timeout or None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # Granted in the same tick we gave up: hand the slot back
+                self._release()
+            else:
+                fut.cancel()
+                self._forget(session, fut)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            metrics.incr(f"admission.{self.name}.timeouts")
+            raise AdmissionRejected(self.name, 503, self.retry_after(), "queue timeout")
+
+        # The releasing request transferred its slot to us
+        self.admitted += 1
+        metrics.observe(f"admission.{self.name}.wait_ms", (time.monotonic() - queued_at) * 1000)
+
+    def _admit(self, waited: float) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        metrics.observe(f"admission.{self.name}.wait_ms", waited)
+        self._publish()
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        """Pop the next live waiter, round-robin by session."""
+        while self._waiters:
+            session, queue = next(iter(self._waiters.items()))
+            fut = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._waiters.move_to_end(session)
+            else:
+                del self._waiters[session]
+            if not fut.done():
+                return fut
+        return None
+
+    def _release(self) -> None:
+        # Hand the slot straight to the next waiter
+        fut = self._next_waiter()
+        if fut is not None:
+            fut.set_result(None)
+        else:
+            self.in_flight -= 1
+        self._publish()
+
+    def reconfigure(self, settings: AdmissionSettings) -> None:
+        """
+        Apply new limits (provider edited) without dropping the queue or
+        forgetting the requests in flight, so a reload never doubles the
+        provider's concurrency.
+        """
+        self.settings = settings
+        # A raised (or removed) limit admits waiters now, not on the next release
+        while settings.unlimited or self.in_flight < settings.max_in_flight:
+            fut = self._next_waiter()
+            if fut is None:
+                break
+            self.in_flight += 1
+            fut.set_result(None)
+        self._publish()
+
+    def _forget(self, session: str, fut: asyncio.Future) -> None:
+        queue = self._waiters.get(session)
+        if queue is None or fut not in queue:
+            return
+        queue.remove(fut)
+        self._queued -= 1
+        if not queue:
+            del self._waiters[session]
+        self._publish()
+
+    # --------------------------------------------------------
+    # Backpressure hints
+    # --------------------------------------------------------
+    def _record_service(self, seconds: float) -> None:
+        if self.service_time == 0.0:
+            self.service_time = seconds
+        else:
+            self.service_time += _SERVICE_EWMA_ALPHA * (seconds - self.service_time)
+
+    def retry_after(self) -> int:
+        """Seconds until a new request would plausibly be admitted."""
+        slots = max(1, self.settings.max_in_flight)
+        estimate = self.service_time * (self._queued + 1) / slots
+        return int(min(300, max(1, math.ceil(estimate))))
+
+    def _publish(self) -> None:
+        metrics.set_gauge(f"admission.{self.name}.in_flight", self.in_flight)
+        metrics.set_gauge(f"admission.{self.name}.queued", self._queued)
+        metrics.set_gauge(f"admission.{self.name}.queued_sessions", len(self._waiters))
+
+    # --------------------------------------------------------
+    # Statistics
+    # --------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        s = self.settings
+        return {
+            "provider": self.name,
+            "max_in_flight": s.max_in_flight,
+            "max_queue": s.max_queue,
+            "queue_timeout": s.queue_timeout,
+            "in_flight": self.in_flight,
+            "queued": self._queued,
+            "queued_sessions": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "service_time_s": round(self.service_time, 3),
+        }
+
+
+__all__ = ["AdmissionSettings", "AdmissionController", "AdmissionRejected"]
@@ -8,18 +8,71 @@ Unified chat client supporting:
 
 from __future__ import annotations
 
-import aiohttp
+import asyncio
 import json
-from dataclasses import dataclass
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, replace
 from typing import (
-    Literal, TypedDict, Sequence, Dict, Any, List, Optional, Union, cast
+    Literal, TypedDict, Sequence, Dict, Any, AsyncIterator, Awaitable, Callable, List, Optional,
+    Tuple, TypeVar, Union, cast
 )
 
-from openai import AsyncOpenAI
+import aiohttp
+from openai import BadRequestError, Timeout
 from openai.types.chat import ChatCompletionMessageParam
 
 from ..config.provider_config import ProviderConfig
+from .admission import AdmissionController
+from .circuit_breaker import CircuitBreaker
+from .connection_pool import ConnectionPool, PoolSettings
+from .context_budget import estimate_tokens
+from .ollama_balancer import Endpoint, OllamaBalancer
+from .resilience import (
+    RETRY_STATUSES,
+    CallPolicy,
+    Deadline,
+    DeadlineExceeded,
+    ProviderHTTPError,
+    ResiliencePolicy,
+    call_with_retries,
+)
+from .routing import get_routing_stats
+from .structured_output import ResponseFormat
 from .utils.logger import log
+from .utils.request_context import get_session_id
+from .utils.sse import SSEDecoder
+
+T = TypeVar("T")
+
+# Provider clients return failures as text, e.g. "[Ollama ERROR] HTTP 500: ..."
+_ERROR_TEXT_RE = re.compile(r"^\[\w+ ERROR\](?: HTTP (\d{3}))?")
+
+
+def is_error_text(text: str) -> bool:
+    """Whether `text` is a provider failure rather than a model answer."""
+    return bool(_ERROR_TEXT_RE.match(text))
+
+
+def _circuit_failure(outcome: Union[str, BaseException]) -> Optional[str]:
+    """
+    Why `outcome` counts against the provider's circuit, or None.
+
+    Client errors (4xx other than 429) say nothing about the provider's
+    health and do not count.
+    """
+    if isinstance(outcome, str):
+        match = _ERROR_TEXT_RE.match(outcome)
+        status = match.group(1) if match else None
+    else:
+        match = True
+        status = getattr(outcome, "status_code", None) or getattr(outcome, "status", None)
+    if not match:
+        return None
+    if status is not None and 400 <= int(status) < 500 and int(status) != 429:
+        return None
+    return str(outcome) or type(outcome).__name__
 
 
 # ============================================================
@@ -30,6 +83,7 @@ class ChatMessage(TypedDict, total=False):
     role: Literal["system", "user", "assistant"]
     content: str
     name: Optional[str]
+    images: List[str]  # base64-encoded PNGs, for vision models
 
 
 # ============================================================
@@ -41,31 +95,309 @@ def is_gemini_provider(cfg: ProviderConfig) -> bool:
     return "googleapis.com" in base or cfg.type == "cloud"
 
 
+# ============================================================
+# Utility: wire protocol of a provider
+# ============================================================
+
+API_OLLAMA = "ollama"
+API_OPENAI = "openai"
+API_GEMINI = "gemini"
+_APIS = (API_OLLAMA, API_OPENAI, API_GEMINI)
+
+
+def provider_api(
+    name: str,
+    provider_type: str,
+    base_url: str,
+    explicit: Optional[str] = None,
+    balanced: bool = False,
+) -> str:
+    """
+    Protocol ChatClient speaks to a provider: options.api when set, Gemini
+    for googleapis.com, Ollama for `"type": "ollama"`, the provider named
+    "ollama" or a multi-endpoint provider, else OpenAI-compatible.
+    """
+    if explicit:
+        if explicit.lower() in _APIS:
+            return explicit.lower()
+        log.warning(f"[ComfyAI] Unknown options.api={explicit!r} for '{name}', detecting it")
+    if "googleapis.com" in base_url or name.lower() == "google":
+        return API_GEMINI
+    if provider_type.lower() == API_OLLAMA or name.lower() == "ollama" or balanced:
+        return API_OLLAMA
+    if "11434" in base_url:
+        # Older configs only tell by Ollama's default port
+        log.warning(
+            f"[ComfyAI] Treating '{name}' as Ollama because of its port; "
+            f'set "type": "ollama" (or options.api) in providers.json'
+        )
+        return API_OLLAMA
+    return API_OPENAI
+
+
+# ============================================================
+# Sampling parameters
+# ============================================================
+
+@dataclass(frozen=True)
+class SamplingParams:
+    """Per-request sampling knobs. None means "provider default"."""
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "SamplingParams":
+        data = data or {}
+
+        def _get(key: str, cast: Any) -> Any:
+            value = data.get(key)
+            if value is None:
+                return None
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                log.warning(f"[ComfyAI] Ignoring invalid sampling param {key}={value!r}")
+                return None
+
+        return cls(
+            temperature=_get("temperature", float),
+            top_p=_get("top_p", float),
+            max_tokens=_get("max_tokens", int),
+        )
+
+    def override(self, other: "SamplingParams") -> "SamplingParams":
+        """Return a copy where every field set on `other` wins."""
+        return SamplingParams(
+            temperature=other.temperature if other.temperature is not None else self.temperature,
+            top_p=other.top_p if other.top_p is not None else self.top_p,
+            max_tokens=other.max_tokens if other.max_tokens is not None else self.max_tokens,
+        )
+
+
+def _optional_bool(value: Any) -> Optional[bool]:
+    return None if value is None else bool(value)
+
+
 # ============================================================
 # ChatClient implementation
 # ============================================================
 
-@dataclass
+@dataclass(frozen=True)
 class ChatClient:
+    """
+    Immutable chat invocation: provider + model + sampling params.
+
+    ProviderManager keeps one ChatClient per provider; request handlers never
+    mutate it but call bind() to get a per-request copy that shares the
+    provider's pooled transport.
+    """
     provider_name: str
     base_url: str
     api_key: Optional[str]
     model: str
     provider_type: str  # "local", "cloud", "ollama", etc.
 
+    params: SamplingParams = field(default_factory=SamplingParams)
+
+    # JSON-mode request (per-request, via bind()); None = free text
+    response_format: Optional[ResponseFormat] = None
+
+    # providers.json options.structured_output; None = decide by provider
+    structured_output: Optional[bool] = field(default=None, compare=False)
+
+    # Shared long-lived transport (owned by ProviderManager)
+    pool: Optional[ConnectionPool] = field(default=None, repr=False, compare=False)
+
+    # Per-provider concurrency limit (owned by ProviderManager; None = unlimited)
+    limiter: Optional[AdmissionController] = field(default=None, repr=False, compare=False)
+
+    # Per-provider circuit breaker (owned by ProviderManager; None = never trips)
+    breaker: Optional[CircuitBreaker] = field(default=None, repr=False, compare=False)
+
+    # providers.json options.timeouts / options.retry, with per-task overrides
+    resilience: ResiliencePolicy = field(default_factory=ResiliencePolicy, repr=False, compare=False)
+
+    # Task this copy serves ("chat", "rewrite", ...; via bind()), selects the overrides
+    task: Optional[str] = field(default=None, compare=False)
+
+    # Wire protocol (API_OLLAMA / API_OPENAI / API_GEMINI; None = provider_api())
+    api: Optional[str] = field(default=None, compare=False)
+
+    # Several Ollama hosts behind this provider (owned by ProviderManager; None = base_url)
+    balancer: Optional[OllamaBalancer] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.pool is None:
+            # Standalone clients still get keep-alive across calls
+            object.__setattr__(self, "pool", ConnectionPool(self.provider_name))
+        if self.api is None:
+            api = provider_api(
+                self.provider_name, self.provider_type, self.base_url, balanced=self.balancer is not None
+            )
+            object.__setattr__(self, "api", api)
+
+    # --------------------------------------------------------
+    # Per-request binding
+    # --------------------------------------------------------
+    def bind(
+        self,
+        model: Optional[str] = None,
+        params: Optional[SamplingParams] = None,
+        response_format: Optional[ResponseFormat] = None,
+        task: Optional[str] = None,
+    ) -> "ChatClient":
+        """
+        Return a copy for one request with its own model / sampling params
+        (and, optionally, a JSON response format and the task whose
+        deadlines / retry policy apply).
+
+        The copy shares this client's connection pool, so concurrent requests
+        for different models on the same provider never interfere.
+        """
+        return replace(
+            self,
+            model=model or self.model,
+            params=self.params.override(params) if params else self.params,
+            response_format=response_format or self.response_format,
+            task=task or self.task,
+        )
+
+    # --------------------------------------------------------
+    # Admission control
+    # --------------------------------------------------------
+    @asynccontextmanager
+    async def admission(self, session: Optional[str] = None) -> AsyncIterator[None]:
+        """
+        Hold a slot on the provider's limiter for the duration of the block.
+
+        Raises AdmissionRejected when the provider's queue is full or the
+        wait times out. Re-entrant: chat() / stream_chat() inside the block
+        reuse the slot instead of queueing again. The pool is reserved
+        meanwhile, so a provider reload cannot close it under a queued request.
+        """
+        async with self.pool.reserve():
+            if self.limiter is None:
+                yield
+                return
+            async with self.limiter.slot(session or get_session_id()):
+                yield
+
+    # --------------------------------------------------------
+    # Circuit breaker
+    # --------------------------------------------------------
+    def _open_circuit_call(self) -> None:
+        """Raise CircuitOpen when the provider's circuit refuses calls."""
+        if self.breaker is not None:
+            self.breaker.acquire()
+
+    def _settle_circuit_call(
+        self,
+        outcome: Union[str, BaseException, None],
+        latency: Optional[float],
+    ) -> None:
+        """Report a call's outcome (None: no verdict, e.g. cancelled)."""
+        if self.breaker is None:
+            return
+        if outcome is None:
+            self.breaker.release()
+            return
+        error = _circuit_failure(outcome)
+        self.breaker.record(error is None, latency, error)
+
+    # --------------------------------------------------------
+    # Routing statistics
+    # --------------------------------------------------------
+    def _start_routed_call(self) -> None:
+        get_routing_stats().start(self.provider_name, self.model)
+
+    def _finish_routed_call(
+        self,
+        outcome: Union[str, BaseException, None],
+        ttft: Optional[float],
+        text: str,
+        generating: Optional[float],
+    ) -> None:
+        """
+        Feed the call into the adaptive router's statistics. `generating` is
+        the time spent producing `text` (after the first chunk for streams).
+        """
+        ok = None if outcome is None else _circuit_failure(outcome) is None
+        tokens = estimate_tokens(text, self.model) if ok and text else 0
+        get_routing_stats().finish(self.provider_name, self.model, ok, ttft, tokens, generating)
+
+    # --------------------------------------------------------
+    # Deadlines / retries
+    # --------------------------------------------------------
+    @property
+    def policy(self) -> CallPolicy:
+        """Timeouts and retry policy for this client's task."""
+        return self.resilience.for_task(self.task)
+
+    def _deadline(self, streaming: bool = False) -> Deadline:
+        return Deadline(self.provider_name, self.policy.timeouts, streaming)
+
+    def _http_timeout(self) -> aiohttp.ClientTimeout:
+        # The transport only bounds connecting; Deadline covers the rest
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.policy.timeouts.connect)
+
+    def _openai_timeout(self) -> Timeout:
+        return Timeout(None, connect=self.policy.timeouts.connect)
+
+    async def _retrying(self, attempt: Callable[[], Awaitable[T]], deadline: Deadline) -> T:
+        return await call_with_retries(attempt, self.policy.retry, deadline)
+
+    async def _post(self, url: str, payload: Dict[str, Any]) -> Tuple[int, str]:
+        """One POST; retryable statuses raise ProviderHTTPError."""
+        async with self.pool.session().post(url, json=payload, timeout=self._http_timeout()) as resp:
+            raw = await resp.text()
+            if resp.status in RETRY_STATUSES:
+                raise ProviderHTTPError(resp.status, raw, resp.headers.get("Retry-After"))
+            return resp.status, raw
+
+    async def _open_stream(self, url: str, payload: Dict[str, Any]) -> aiohttp.ClientResponse:
+        """POST and return the response once headers arrive; retryable statuses raise."""
+        resp = await self.pool.session().post(url, json=payload, timeout=self._http_timeout())
+        if resp.status in RETRY_STATUSES:
+            try:
+                raw = await resp.text()
+            finally:
+                resp.release()
+            raise ProviderHTTPError(resp.status, raw, resp.headers.get("Retry-After"))
+        return resp
+
     # --------------------------------------------------------
     # Helper detection
     # --------------------------------------------------------
     def _is_gemini(self) -> bool:
-        base = self.base_url or ""
-        return ("googleapis.com" in base) or (self.provider_name.lower() == "google")
+        return self.api == API_GEMINI
 
     def _is_ollama(self) -> bool:
-        # Name-based OR URL-based detection
-        return (
-            self.provider_name.lower() == "ollama"
-            or "11434" in self.base_url
-        )
+        return self.api == API_OLLAMA
+
+    # --------------------------------------------------------
+    # Structured output
+    # --------------------------------------------------------
+    def supports_structured_output(self) -> bool:
+        """Whether JSON mode is requested natively (Ollama format, OpenAI
+        response_format, Gemini responseSchema) rather than extracted."""
+        if self.structured_output is not None:
+            return self.structured_output
+        return True
+
+    def _format_attempts(self) -> List[Optional[ResponseFormat]]:
+        """
+        Response formats to try in order: servers that reject a schema get
+        plain JSON mode, and servers that reject JSON mode get a plain call.
+        """
+        rf = self.response_format
+        if rf is None:
+            return [None]
+        attempts: List[Optional[ResponseFormat]] = [rf]
+        if rf.schema is not None:
+            attempts.append(ResponseFormat(rf.name))
+        attempts.append(None)
+        return attempts
 
     # --------------------------------------------------------
     # Public entrypoint
@@ -74,14 +406,31 @@ class ChatClient:
         """
         Send a chat request and return text.
         """
-        if self._is_gemini():
-            return await self._chat_gemini(messages)
-
-        if self._is_ollama():
-            return await self._chat_ollama(messages)
-
-        # Default OpenAI-compatible path
-        return await self._chat_openai(messages)
+        self._start_routed_call()
+        outcome: Union[str, BaseException, None] = None
+        elapsed: Optional[float] = None
+        try:
+            async with self.admission():
+                self._open_circuit_call()
+                started = time.monotonic()
+                try:
+                    if self._is_gemini():
+                        outcome = await self._chat_gemini(messages)
+                    elif self._is_ollama():
+                        outcome = await self._chat_ollama(messages)
+                    else:
+                        # Default OpenAI-compatible path
+                        outcome = await self._chat_openai(messages)
+                    return outcome
+                except Exception as e:
+                    outcome = e
+                    raise
+                finally:
+                    elapsed = time.monotonic() - started
+                    self._settle_circuit_call(outcome, elapsed)
+        finally:
+            text = outcome if isinstance(outcome, str) else ""
+            self._finish_routed_call(outcome, None, text, elapsed)
 
     # --------------------------------------------------------
     # Streaming entrypoint
@@ -91,47 +440,139 @@ class ChatClient:
         Async generator yielding chunks of text as they arrive.
         """
         if self._is_gemini():
-            # For now, Gemini doesn't stream → yield once
-            text = await self._chat_gemini(messages)
-            yield text
-            return
-
-        if self._is_ollama():
-            async for chunk in self._stream_ollama(messages):
-                yield chunk
-            return
-
-        # Default: OpenAI-compatible streaming
-        async for chunk in self._stream_openai(messages):
-            yield chunk
+            stream = self._stream_gemini(messages)
+        elif self._is_ollama():
+            stream = self._stream_ollama(messages)
+        else:
+            # Default: OpenAI-compatible streaming
+            stream = self._stream_openai(messages)
+
+        self._start_routed_call()
+        ttft: Optional[float] = None
+        outcome: Union[str, BaseException, None] = None
+        chunks: List[str] = []
+        generating: Optional[float] = None
+        try:
+            async with self.admission():
+                self._open_circuit_call()
+                started = time.monotonic()
+                try:
+                    async for chunk in stream:
+                        if ttft is None:
+                            ttft = time.monotonic() - started
+                            if is_error_text(chunk):
+                                outcome = chunk  # errors arrive as the only chunk
+                        chunks.append(chunk)
+                        yield chunk
+                    if outcome is None:
+                        outcome = ""
+                except Exception as e:
+                    outcome = e
+                    raise
+                finally:
+                    await stream.aclose()
+                    if outcome is None and ttft is not None:
+                        outcome = ""  # consumer stopped after a healthy start
+                    self._settle_circuit_call(outcome, ttft)
+                    if ttft is not None:
+                        generating = time.monotonic() - started - ttft
+        finally:
+            # Throughput counts what followed the first chunk
+            self._finish_routed_call(outcome, ttft, "".join(chunks[1:]), generating)
 
     # --------------------------------------------------------
     # OLLAMA CHAT API (correct)
     # --------------------------------------------------------
+    def _ollama_options(self) -> Dict[str, Any]:
+        p = self.params
+        options: Dict[str, Any] = {}
+        if p.temperature is not None:
+            options["temperature"] = p.temperature
+        if p.top_p is not None:
+            options["top_p"] = p.top_p
+        if p.max_tokens is not None:
+            options["num_predict"] = p.max_tokens
+        return options
+
+    @staticmethod
+    def _ollama_messages(messages: Sequence[ChatMessage]) -> List[Dict[str, Any]]:
+        out = []
+        for m in messages:
+            msg: Dict[str, Any] = {"role": m.get("role", "user"), "content": m.get("content", "")}
+            if m.get("images"):
+                msg["images"] = list(m["images"])
+            out.append(msg)
+        return out
+
+    async def _ollama_post(self, payload: Dict[str, Any]) -> Tuple[int, str]:
+        """One /api/chat POST, to the next balanced host when there are several."""
+        if self.balancer is None:
+            return await self._post(f"{self.base_url}/api/chat", payload)
+        endpoint = self.balancer.acquire(self.model)
+        status: Optional[int] = None
+        error: Optional[BaseException] = None
+        try:
+            status, raw = await self._post(f"{endpoint.url}/api/chat", payload)
+            return status, raw
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.balancer.release(endpoint, self.model, served=status == 200, error=error)
+
+    async def _ollama_open_stream(
+        self, payload: Dict[str, Any]
+    ) -> Tuple[aiohttp.ClientResponse, Optional[Endpoint]]:
+        """Open a /api/chat stream; the balanced host (if any) must be released by the caller."""
+        if self.balancer is None:
+            return await self._open_stream(f"{self.base_url}/api/chat", payload), None
+        endpoint = self.balancer.acquire(self.model)
+        try:
+            return await self._open_stream(f"{endpoint.url}/api/chat", payload), endpoint
+        except BaseException as e:
+            self.balancer.release(endpoint, self.model, error=e)
+            raise
+
+    def _ollama_target(self) -> str:
+        if self.balancer is None:
+            return f"{self.base_url}/api/chat"
+        return f"{self.provider_name} ({len(self.balancer.endpoints)} hosts)"
+
     async def _chat_ollama(self, messages: Sequence[ChatMessage]) -> str:
         """
         Use Ollama's native /api/chat endpoint.
         """
-        url = f"{self.base_url}/api/chat"
-
         payload = {
             "model": self.model,
-            "messages": [
-                {"role": m.get("role", "user"), "content": m.get("content", "")}
-                for m in messages
-            ],
+            "messages": self._ollama_messages(messages),
             "stream": False
         }
-
-        log.info(f"[ComfyAI] Ollama request → {url}")
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as resp:
-                raw = await resp.text()
-                if resp.status != 200:
-                    return f"[Ollama ERROR] HTTP {resp.status}: {raw}"
+        options = self._ollama_options()
+        if options:
+            payload["options"] = options
+
+        log.info(f"[ComfyAI] Ollama request → {self._ollama_target()}")
+
+        deadline = self._deadline()
+        attempts = self._format_attempts()
+        async with self.pool.track():
+            for i, rf in enumerate(attempts):
+                payload.pop("format", None)
+                if rf is not None:
+                    payload["format"] = rf.ollama()
+                try:
+                    status, raw = await self._retrying(lambda: self._ollama_post(payload), deadline)
+                except ProviderHTTPError as e:
+                    return f"[Ollama ERROR] {e}"
+                if status == 400 and i + 1 < len(attempts):
+                    # Older Ollama versions only know format="json"
+                    log.warning(f"[ComfyAI] Ollama rejected response format, retrying: {raw[:200]}")
+                    continue
+                if status != 200:
+                    return f"[Ollama ERROR] HTTP {status}: {raw}"
 
                 data = json.loads(raw)
+                break
 
         try:
             return data["message"]["content"]
@@ -143,83 +584,161 @@ class ChatClient:
         Native Ollama streaming via /api/chat with stream=true.
         Yields text chunks.
         """
-        url = f"{self.base_url}/api/chat"
-
         payload = {
             "model": self.model,
-            "messages": [
-                {"role": m.get("role", "user"), "content": m.get("content", "")}
-                for m in messages
-            ],
+            "messages": self._ollama_messages(messages),
             "stream": True,
         }
+        options = self._ollama_options()
+        if options:
+            payload["options"] = options
+        if self.response_format is not None:
+            payload["format"] = self.response_format.ollama()
 
-        log.info(f"[ComfyAI] Ollama STREAM request → {url}")
+        log.info(f"[ComfyAI] Ollama STREAM request → {self._ollama_target()}")
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as resp:
-                async for line_bytes in resp.content:
-                    line = line_bytes.decode("utf-8").strip()
-                    if not line:
-                        continue
+        deadline = self._deadline(streaming=True)
+        async with self.pool.track():
+            try:
+                resp, endpoint = await self._retrying(lambda: self._ollama_open_stream(payload), deadline)
+            except ProviderHTTPError as e:
+                yield f"[Ollama ERROR] {e}"
+                return
+            error: Optional[BaseException] = None
+            try:
+                async with resp:
+                    if resp.status != 200:
+                        raw = await resp.text()
+                        yield f"[Ollama ERROR] HTTP {resp.status}: {raw}"
+                        return
 
                     try:
-                        data = json.loads(line)
-                    except Exception:
-                        continue
-
-                    msg = data.get("message", {})
-                    content = msg.get("content")
-                    if content:
-                        yield content
-
-                    if data.get("done"):
-                        break
+                        async for line_bytes in deadline.iterate(resp.content):
+                            line = line_bytes.decode("utf-8").strip()
+                            if not line:
+                                continue
+
+                            try:
+                                data = json.loads(line)
+                            except Exception:
+                                continue
+
+                            msg = data.get("message", {})
+                            content = msg.get("content")
+                            if content:
+                                yield content
+
+                            if data.get("done"):
+                                break
+                    except (GeneratorExit, asyncio.CancelledError, DeadlineExceeded):
+                        # Consumer went away (or a deadline passed): close the socket
+                        # instead of pooling it so Ollama stops generating.
+                        resp.close()
+                        raise
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                if endpoint is not None and self.balancer is not None:
+                    served = error is None and resp.status == 200
+                    self.balancer.release(endpoint, self.model, served=served, error=error)
 
     # --------------------------------------------------------
     # GOOGLE GEMINI 2.x CHAT (supports text + streaming)
     # --------------------------------------------------------
-    async def _chat_gemini(self, messages: Sequence[ChatMessage]) -> str:
-        """
-        Gemini requires a special payload structure.
-        For now, return full response as text (non-streaming).
-        Streaming is handled separately in stream endpoint.
-        """
-
+    def _gemini_url(self, method: str) -> str:
         # Convert model name (must be `models/...`)
         model_id = self.model
         if not model_id.startswith("models/"):
             model_id = f"models/{model_id}"
 
-        url = f"{self.base_url}/{model_id}:generateContent?key={self.api_key}"
+        url = f"{self.base_url}/{model_id}:{method}?key={self.api_key}"
+        if method == "streamGenerateContent":
+            url += "&alt=sse"
+        return url
 
-        # Convert messages → Gemini format
+    def _gemini_payload(
+        self,
+        messages: Sequence[ChatMessage],
+        response_format: Optional[ResponseFormat] = None,
+    ) -> Dict[str, Any]:
+        """
+        Gemini requires a special payload structure: "assistant" turns are
+        "model" turns and system messages go into systemInstruction.
+        """
         contents = []
+        system_parts = []
         for msg in messages:
             role = msg.get("role", "user")
             text = msg.get("content", "")
+            images = msg.get("images") or []
+
+            if not text and not images:
+                continue
 
-            if not text:
+            if role == "system":
+                system_parts.append({"text": text})
                 continue
 
+            parts: List[Dict[str, Any]] = [
+                {"inlineData": {"mimeType": "image/png", "data": image}} for image in images
+            ]
+            if text:
+                parts.append({"text": text})
             contents.append({
-                "role": role,
-                "parts": [{"text": text}]
+                "role": "model" if role == "assistant" else "user",
+                "parts": parts
             })
 
-        payload = {"contents": contents}
+        payload: Dict[str, Any] = {"contents": contents}
+        if system_parts:
+            payload["systemInstruction"] = {"parts": system_parts}
+
+        p = self.params
+        generation_config: Dict[str, Any] = {}
+        if p.temperature is not None:
+            generation_config["temperature"] = p.temperature
+        if p.top_p is not None:
+            generation_config["topP"] = p.top_p
+        if p.max_tokens is not None:
+            generation_config["maxOutputTokens"] = p.max_tokens
+        if response_format is not None:
+            generation_config.update(response_format.gemini())
+        if generation_config:
+            payload["generationConfig"] = generation_config
+
+        return payload
+
+    @staticmethod
+    def _gemini_text(data: Dict[str, Any]) -> str:
+        """Concatenate the text parts of the first candidate."""
+        parts = data["candidates"][0]["content"]["parts"]
+        return "".join(part.get("text", "") for part in parts)
+
+    async def _chat_gemini(self, messages: Sequence[ChatMessage]) -> str:
+        """
+        Non-streaming Gemini call; returns the full response text.
+        """
+        url = self._gemini_url("generateContent")
 
-        log.info(f"[ComfyAI] Gemini request → {url}")
+        log.info(f"[ComfyAI] Gemini request → model={self.model}")
 
+        deadline = self._deadline()
+        attempts = self._format_attempts()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as resp:
-                    raw = await resp.text()
+            async with self.pool.track():
+                for i, rf in enumerate(attempts):
+                    payload = self._gemini_payload(messages, rf)
+                    status, raw = await self._retrying(lambda: self._post(url, payload), deadline)
 
-                    if resp.status != 200:
-                        return f"[Gemini ERROR] HTTP {resp.status}: {raw}"
+                    if status == 400 and i + 1 < len(attempts):
+                        log.warning(f"[ComfyAI] Gemini rejected response schema, retrying: {raw[:200]}")
+                        continue
+                    if status != 200:
+                        return f"[Gemini ERROR] HTTP {status}: {raw}"
 
                     data = json.loads(raw)
+                    break
 
         except Exception as e:
             log.error(f"[ComfyAI] Gemini exception: {e}")
@@ -227,29 +746,116 @@ class ChatClient:
 
         # Extract text
         try:
-            return data["candidates"][0]["content"]["parts"][0]["text"]
+            return self._gemini_text(data)
         except Exception:
             return "[Gemini ERROR] malformed response"
 
+    async def _stream_gemini(self, messages: Sequence[ChatMessage]):
+        """
+        Incremental Gemini streaming via streamGenerateContent?alt=sse.
+        Each SSE event carries a partial GenerateContentResponse.
+        """
+        url = self._gemini_url("streamGenerateContent")
+        payload = self._gemini_payload(messages, self.response_format)
+
+        log.info(f"[ComfyAI] Gemini STREAM request → model={self.model}")
+
+        decoder = SSEDecoder()
+
+        deadline = self._deadline(streaming=True)
+        async with self.pool.track():
+            try:
+                resp = await self._retrying(lambda: self._open_stream(url, payload), deadline)
+            except ProviderHTTPError as e:
+                yield f"[Gemini ERROR] {e}"
+                return
+            async with resp:
+                if resp.status != 200:
+                    raw = await resp.text()
+                    yield f"[Gemini ERROR] HTTP {resp.status}: {raw}"
+                    return
+
+                try:
+                    async for chunk in deadline.iterate(resp.content.iter_any()):
+                        for event in decoder.feed(chunk):
+                            text = self._gemini_event_text(event.data)
+                            if text:
+                                yield text
+                except (GeneratorExit, asyncio.CancelledError, DeadlineExceeded):
+                    resp.close()
+                    raise
+
+                for event in decoder.close():
+                    text = self._gemini_event_text(event.data)
+                    if text:
+                        yield text
+
+    def _gemini_event_text(self, data: str) -> str:
+        try:
+            return self._gemini_text(json.loads(data))
+        except (ValueError, KeyError, IndexError, TypeError):
+            # Usage-only / safety-only frames carry no text
+            return ""
+
     # --------------------------------------------------------
     # OPENAI/OPENROUTER/LMSTUDIO CHAT
     # --------------------------------------------------------
+    def _openai_sampling(self) -> Dict[str, Any]:
+        p = self.params
+        kwargs: Dict[str, Any] = {
+            "temperature": 0.7 if p.temperature is None else p.temperature,
+            "top_p": 1 if p.top_p is None else p.top_p,
+        }
+        if p.max_tokens is not None:
+            kwargs["max_tokens"] = p.max_tokens
+        return kwargs
+
+    @staticmethod
+    def _openai_messages(messages: Sequence[ChatMessage]) -> List[ChatCompletionMessageParam]:
+        """Messages with images become multi-part content (data: URLs)."""
+        out = []
+        for m in messages:
+            if not m.get("images"):
+                out.append({k: v for k, v in m.items() if k != "images"})
+                continue
+            parts: List[Dict[str, Any]] = [
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}}
+                for image in m["images"]
+            ]
+            if m.get("content"):
+                parts.insert(0, {"type": "text", "text": m["content"]})
+            out.append({"role": m.get("role", "user"), "content": parts})
+        return cast(List[ChatCompletionMessageParam], out)
+
     async def _chat_openai(self, messages: Sequence[ChatMessage]) -> str:
-        client = AsyncOpenAI(
-            base_url=self.base_url,
-            api_key=self.api_key,
-        )
+        client = self.pool.openai_client(self.base_url, self.api_key)
 
         log.info(f"[ComfyAI] OpenAI-compatible request → model={self.model}")
 
-        msgs = cast(List[ChatCompletionMessageParam], messages)
-
-        resp = await client.chat.completions.create(
-            model=self.model,
-            messages=msgs,
-            temperature=0.7,
-            top_p=1,
-        )
+        msgs = self._openai_messages(messages)
+
+        deadline = self._deadline()
+        attempts = self._format_attempts()
+        async with self.pool.track():
+            for i, rf in enumerate(attempts):
+                kwargs = self._openai_sampling()
+                if rf is not None:
+                    kwargs["response_format"] = rf.openai()
+                try:
+                    resp = await self._retrying(
+                        lambda: client.chat.completions.create(
+                            model=self.model,
+                            messages=msgs,
+                            timeout=self._openai_timeout(),
+                            **kwargs,
+                        ),
+                        deadline,
+                    )
+                    break
+                except BadRequestError as e:
+                    if i + 1 == len(attempts):
+                        raise
+                    log.warning(f"[ComfyAI] {self.provider_name} rejected response_format, retrying: {e}")
 
         return resp.choices[0].message.content or ""
 
@@ -257,41 +863,64 @@ class ChatClient:
         """
         OpenAI / OpenRouter / LM Studio streaming using async-openai.
         """
-        client = AsyncOpenAI(
-            base_url=self.base_url,
-            api_key=self.api_key,
-        )
+        client = self.pool.openai_client(self.base_url, self.api_key)
 
         log.info(f"[ComfyAI] OpenAI-compatible STREAM request → model={self.model}")
 
-        msgs = cast(List[ChatCompletionMessageParam], messages)
+        msgs = self._openai_messages(messages)
+
+        deadline = self._deadline(streaming=True)
+        async with self.pool.track():
+            kwargs = self._openai_sampling()
+            if self.response_format is not None:
+                kwargs["response_format"] = self.response_format.openai()
+            stream = await self._retrying(
+                lambda: client.chat.completions.create(
+                    model=self.model,
+                    messages=msgs,
+                    stream=True,
+                    timeout=self._openai_timeout(),
+                    **kwargs,
+                ),
+                deadline,
+            )
 
-        stream = await client.chat.completions.create(
-            model=self.model,
-            messages=msgs,
-            temperature=0.7,
-            top_p=1,
-            stream=True,
-        )
-
-        async for event in stream:
             try:
-                delta = event.choices[0].delta
-                content = delta.content
-                if content:
-                    yield content
-            except Exception:
-                continue
-            
+                async for event in deadline.iterate(stream):
+                    try:
+                        delta = event.choices[0].delta
+                        content = delta.content
+                        if content:
+                            yield content
+                    except Exception:
+                        continue
+            except (GeneratorExit, asyncio.CancelledError, DeadlineExceeded):
+                # Abort the HTTP response so the server stops generating
+                await stream.close()
+                raise
+
     # --------------------------------------------------------
     # Factory constructor
     # --------------------------------------------------------
     @classmethod
-    def from_provider_config(cls, cfg: ProviderConfig) -> "ChatClient":
+    def from_provider_config(
+        cls,
+        cfg: ProviderConfig,
+        pool: Optional[ConnectionPool] = None,
+        limiter: Optional[AdmissionController] = None,
+    ) -> "ChatClient":
         return cls(
             provider_name=cfg.name,
             base_url=cfg.base_url or "",
             api_key=cfg.api_key,
             model=cfg.model or "",
             provider_type=cfg.type or "",
+            structured_output=_optional_bool((cfg.options or {}).get("structured_output")),
+            pool=pool or ConnectionPool(cfg.name, PoolSettings.from_options(cfg.options)),
+            limiter=limiter,
+            resilience=ResiliencePolicy.from_options(cfg.options),
+            api=provider_api(
+                cfg.name, cfg.type or "", cfg.base_url or "",
+                (cfg.options or {}).get("api"), balanced=len(cfg.endpoints) > 1,
+            ),
         )
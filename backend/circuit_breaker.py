@@ -0,0 +1,255 @@
+"""
+ComfyAI - Provider Circuit Breakers
+
+One CircuitBreaker per provider, owned by ProviderManager next to its
+ConnectionPool and AdmissionController. It watches the outcome and latency
+of recent calls:
+
+  • closed      calls flow; once `min_calls` recent calls show a failure
+                rate ≥ `failure_rate` (or a slow-call rate ≥ `slow_rate`)
+                the circuit opens
+  • open        calls are refused immediately with CircuitOpen (a 503 with
+                Retry-After) and pick_provider() skips the provider, so a
+                dead provider costs nothing instead of a timeout per request
+  • half-open   after `open_s`, up to `half_open_calls` probe calls go
+                through; a success closes the circuit, a failure reopens it
+
+A call fails when it raises (connect error, deadline, 5xx after retries) or
+returns provider error text. It is slow when its latency — time to first
+chunk for streams, the whole call otherwise — exceeds `slow_call_s`.
+
+Tuning lives in providers.json under the provider's options:
+
+    "options": {
+      "breaker": {
+        "window": 20,           # recent calls considered
+        "window_s": 120,        # ...and only those from the last N seconds
+        "min_calls": 5,
+        "failure_rate": 0.5,
+        "slow_call_s": null,    # null: latency never trips the circuit
+        "slow_rate": 0.8,
+        "open_s": 30,
+        "half_open_calls": 1
+      }
+    }
+"""
+
+from __future__ import annotations
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from .admission import AdmissionRejected
+from .utils import metrics
+from .utils.logger import log
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+# ============================================================
+# Settings
+# ============================================================
+
+@dataclass(frozen=True)
+class BreakerSettings:
+    window: int = 20
+    window_s: float = 120.0
+    min_calls: int = 5
+    failure_rate: float = 0.5
+    slow_call_s: Optional[float] = None
+    slow_rate: float = 0.8
+    open_s: float = 30.0
+    half_open_calls: int = 1
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]]) -> "BreakerSettings":
+        """Build settings from ProviderConfig.options["breaker"], ignoring junk."""
+        raw = (options or {}).get("breaker") or {}
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] options.breaker must be an object, using defaults")
+            raw = {}
+
+        defaults = cls()
+
+        def _num(key: str, default: Any, cast: Any) -> Any:
+            value = raw.get(key, default)
+            if value is None:
+                return None
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                log.warning(f"[ComfyAI] Invalid options.breaker.{key}={value!r}, using {default!r}")
+                return default
+
+        slow = _num("slow_call_s", defaults.slow_call_s, float)
+        return cls(
+            window=max(1, _num("window", defaults.window, int) or 1),
+            window_s=max(1.0, _num("window_s", defaults.window_s, float) or 1.0),
+            min_calls=max(1, _num("min_calls", defaults.min_calls, int) or 1),
+            failure_rate=min(1.0, max(0.0, _num("failure_rate", defaults.failure_rate, float) or 0.0)),
+            slow_call_s=slow if slow is not None and slow > 0 else None,
+            slow_rate=min(1.0, max(0.0, _num("slow_rate", defaults.slow_rate, float) or 0.0)),
+            open_s=max(0.0, _num("open_s", defaults.open_s, float) or 0.0),
+            half_open_calls=max(1, _num("half_open_calls", defaults.half_open_calls, int) or 1),
+        )
+
+
+# ============================================================
+# Rejection
+# ============================================================
+
+class CircuitOpen(AdmissionRejected):
+    """Raised when a provider's circuit is open: fail fast instead of waiting."""
+
+    def __init__(self, provider: str, retry_after: int):
+        super().__init__(provider, 503, retry_after, "circuit open")
+
+
+# ============================================================
+# Breaker
+# ============================================================
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a provider's recent calls."""
+
+    def __init__(self, name: str, settings: Optional[BreakerSettings] = None):
+        self.name = name
+        self.settings = settings or BreakerSettings()
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # (finished_at, failed, slow) per recent call
+        self._calls: Deque[Tuple[float, bool, bool]] = deque(maxlen=self.settings.window)
+
+        # Statistics
+        self.times_opened = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self.last_change = time.time()
+
+    # --------------------------------------------------------
+    # State
+    # --------------------------------------------------------
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.settings.open_s:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def available(self) -> bool:
+        """Whether a call would be let through right now (does not reserve it)."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        return state == HALF_OPEN and self._probes < self.settings.half_open_calls
+
+    def retry_after(self) -> int:
+        if self._state != OPEN:
+            return 1
+        left = self.settings.open_s - (time.monotonic() - self._opened_at)
+        return max(1, int(left + 0.999))
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        log.info(f"[ComfyAI] Circuit for '{self.name}': {self._state} → {state}")
+        self._state = state
+        self.last_change = time.time()
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+            metrics.incr(f"breaker.{self.name}.opened")
+        else:
+            self._calls.clear()
+        metrics.set_gauge(f"breaker.{self.name}.state", _STATE_GAUGE[state])
+
+    # --------------------------------------------------------
+    # Calls
+    # --------------------------------------------------------
+    def check(self) -> None:
+        """Raise CircuitOpen if a call would be refused (reserves nothing)."""
+        if not self.available():
+            self._reject()
+
+    def acquire(self) -> None:
+        """Let one call through or raise CircuitOpen; pair with record()/release()."""
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and self._probes < self.settings.half_open_calls:
+            self._probes += 1
+            return
+        self._reject()
+
+    def _reject(self) -> None:
+        self.rejected += 1
+        metrics.incr(f"breaker.{self.name}.rejected")
+        raise CircuitOpen(self.name, self.retry_after())
+
+    def release(self) -> None:
+        """The call ended without a verdict (e.g. cancelled by the client)."""
+        if self._state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record(self, ok: bool, latency: Optional[float] = None, error: Optional[str] = None) -> None:
+        s = self.settings
+        slow = ok and s.slow_call_s is not None and latency is not None and latency > s.slow_call_s
+        if not ok:
+            self.last_error = (error or "")[:300] or None
+            metrics.incr(f"breaker.{self.name}.failures")
+
+        if self._state == HALF_OPEN:
+            self.release()
+            self._transition(OPEN if not ok or slow else CLOSED)
+            return
+        if self._state == OPEN:
+            return  # a call admitted before the circuit opened
+
+        now = time.monotonic()
+        self._calls.append((now, not ok, slow))
+        while self._calls and now - self._calls[0][0] > s.window_s:
+            self._calls.popleft()
+
+        calls = len(self._calls)
+        if calls < s.min_calls:
+            return
+        failures = sum(1 for _, failed, _ in self._calls if failed)
+        slow_calls = sum(1 for _, _, was_slow in self._calls if was_slow)
+        if failures / calls >= s.failure_rate or (s.slow_call_s is not None and slow_calls / calls >= s.slow_rate):
+            log.warning(
+                f"[ComfyAI] Opening circuit for '{self.name}': {failures}/{calls} failed, "
+                f"{slow_calls}/{calls} slow"
+            )
+            self._transition(OPEN)
+
+    # --------------------------------------------------------
+    # Statistics
+    # --------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        calls = len(self._calls)
+        failures = sum(1 for _, failed, _ in self._calls if failed)
+        return {
+            "provider": self.name,
+            "state": state,
+            "available": self.available(),
+            "retry_after": self.retry_after() if state == OPEN else 0,
+            "recent_calls": calls,
+            "failure_rate": round(failures / calls, 3) if calls else 0.0,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+            "last_change": self.last_change,
+        }
+
+
+__all__ = ["BreakerSettings", "CircuitBreaker", "CircuitOpen", "CLOSED", "HALF_OPEN", "OPEN"]
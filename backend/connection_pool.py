@@ -0,0 +1,286 @@
+"""
+ComfyAI - Provider Connection Pools
+
+One long-lived HTTP transport per provider, owned by ProviderManager.
+
+Each pool lazily opens:
+  • an aiohttp.ClientSession (Ollama / Gemini native APIs)
+  • AsyncOpenAI clients (OpenAI-compatible APIs)
+
+and keeps them alive across chat turns so requests reuse TCP/TLS
+connections instead of paying a fresh handshake every time.
+
+Pool tuning lives in providers.json under the provider's options:
+
+    "options": {
+      "pool": {
+        "size": 100,            # max open connections (0 = unlimited)
+        "per_host": 0,          # max connections per host (0 = unlimited)
+        "keepalive": 30,        # idle keep-alive seconds
+        "dns_cache_ttl": 300    # seconds, null disables DNS caching
+      }
+    }
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import aiohttp
+from openai import AsyncOpenAI
+
+from .utils.logger import log
+
+
+# ============================================================
+# Pool settings
+# ============================================================
+
+@dataclass(frozen=True)
+class PoolSettings:
+    size: int = 100
+    per_host: int = 0
+    keepalive: float = 30.0
+    dns_cache_ttl: Optional[int] = 300
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]]) -> "PoolSettings":
+        """Build settings from ProviderConfig.options["pool"], ignoring junk."""
+        raw = (options or {}).get("pool") or {}
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] options.pool must be an object, using defaults")
+            raw = {}
+
+        defaults = cls()
+
+        def _num(key: str, default: Any, cast: Any) -> Any:
+            value = raw.get(key, default)
+            if value is None:
+                return None
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                log.warning(f"[ComfyAI] Invalid options.pool.{key}={value!r}, using {default!r}")
+                return default
+
+        return cls(
+            size=max(0, _num("size", defaults.size, int)),
+            per_host=max(0, _num("per_host", defaults.per_host, int)),
+            keepalive=max(0.0, _num("keepalive", defaults.keepalive, float)),
+            dns_cache_ttl=_num("dns_cache_ttl", defaults.dns_cache_ttl, int),
+        )
+
+
+# ============================================================
+# Connection pool
+# ============================================================
+
+class ConnectionPool:
+    """Long-lived HTTP transport shared by every request to one provider."""
+
+    def __init__(self, name: str, settings: Optional[PoolSettings] = None):
+        self.name = name
+        self.settings = settings or PoolSettings()
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._openai: Dict[Tuple[str, str], AsyncOpenAI] = {}
+        self._closed = False
+        self.draining = False
+
+        # Statistics
+        self.created_at = time.time()
+        self.sessions_opened = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.reserved = 0  # requests waiting for (or holding) an admission slot
+
+    # --------------------------------------------------------
+    # Transports
+    # --------------------------------------------------------
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _check_open(self) -> None:
+        if self._closed:
+            raise RuntimeError(f"Connection pool for '{self.name}' is closed")
+
+    def session(self) -> aiohttp.ClientSession:
+        """Return the shared aiohttp session, opening it on first use."""
+        self._check_open()
+        loop = asyncio.get_running_loop()
+
+        # A session is bound to the loop it was created on; scripts that call
+        # asyncio.run() repeatedly would otherwise get a dead session back.
+        if self._session is not None and (
+            self._session.closed or self._session_loop is not loop
+        ):
+            self._session = None
+
+        if self._session is None:
+            s = self.settings
+            connector = aiohttp.TCPConnector(
+                limit=s.size,
+                limit_per_host=s.per_host,
+                keepalive_timeout=s.keepalive,
+                use_dns_cache=s.dns_cache_ttl is not None,
+                ttl_dns_cache=s.dns_cache_ttl,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+            self.sessions_opened += 1
+            log.info(f"[ComfyAI] Opened connection pool for '{self.name}' (limit={s.size})")
+
+        return self._session
+
+    def openai_client(self, base_url: str, api_key: Optional[str]) -> AsyncOpenAI:
+        """Return a cached AsyncOpenAI client for this base_url/api_key pair."""
+        self._check_open()
+        key = (base_url or "", api_key or "")
+        client = self._openai.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                max_retries=0,  # retries are ChatClient's (resilience.py), under a budget
+                **self._openai_transport_kwargs(),
+            )
+            self._openai[key] = client
+        return client
+
+    def _openai_transport_kwargs(self) -> Dict[str, Any]:
+        # httpx ships with the openai SDK; if a future SDK drops it we simply
+        # fall back to the SDK's own default pooling.
+        try:
+            import httpx
+            from openai import DefaultAsyncHttpxClient
+        except ImportError:
+            return {}
+
+        s = self.settings
+        limits = httpx.Limits(
+            max_connections=s.size or None,
+            max_keepalive_connections=s.size or None,
+            keepalive_expiry=s.keepalive,
+        )
+        return {"http_client": DefaultAsyncHttpxClient(limits=limits)}
+
+    # --------------------------------------------------------
+    # Request tracking
+    # --------------------------------------------------------
+    @asynccontextmanager
+    async def track(self) -> AsyncIterator[None]:
+        """Count a request against this pool for the duration of the block."""
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    @asynccontextmanager
+    async def reserve(self) -> AsyncIterator[None]:
+        """
+        Keep the pool open for the duration of the block without counting a
+        request: held around admission, so requests queued for a provider
+        slot still find their transport when the slot comes.
+        """
+        self.reserved += 1
+        try:
+            yield
+        finally:
+            self.reserved -= 1
+
+    @property
+    def busy(self) -> bool:
+        return self.in_flight > 0 or self.reserved > 0
+
+    # --------------------------------------------------------
+    # Shutdown
+    # --------------------------------------------------------
+    async def drain(self, timeout: float = 300.0, poll: float = 0.1) -> None:
+        """
+        Close once in-flight and queued requests finish (or `timeout`
+        seconds pass).
+
+        Used when a provider is removed or replaced: streams already running
+        on this pool keep their connections until they complete, and
+        requests still waiting for admission can use it once admitted.
+        """
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        # Always wait one tick: a request may hold this client without
+        # having reached admission yet.
+        await asyncio.sleep(poll)
+        while self.busy and loop.time() < deadline:
+            await asyncio.sleep(poll)
+
+        if self.busy:
+            log.warning(
+                f"[ComfyAI] Pool '{self.name}' drain timed out with "
+                f"{self.in_flight} request(s) in flight, {self.reserved} queued"
+            )
+        await self.close()
+
+    async def close(self) -> None:
+        """Close every transport owned by this pool. Safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+
+        session, self._session = self._session, None
+        clients, self._openai = list(self._openai.values()), {}
+
+        if session is not None and not session.closed:
+            try:
+                await session.close()
+            except Exception:
+                log.warning(f"[ComfyAI] Error closing session for '{self.name}'", exc_info=True)
+
+        for client in clients:
+            try:
+                await client.close()
+            except Exception:
+                log.warning(f"[ComfyAI] Error closing OpenAI client for '{self.name}'", exc_info=True)
+
+        log.info(f"[ComfyAI] Closed connection pool for '{self.name}'")
+
+    # --------------------------------------------------------
+    # Statistics
+    # --------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        s = self.settings
+        open_connections = 0
+        if self._session is not None and not self._session.closed:
+            connector = self._session.connector
+            # Idle keep-alive connections waiting for reuse
+            conns = getattr(connector, "_conns", {}) or {}
+            open_connections = sum(len(v) for v in conns.values())
+
+        return {
+            "provider": self.name,
+            "closed": self._closed,
+            "draining": self.draining,
+            "size": s.size,
+            "per_host": s.per_host,
+            "keepalive": s.keepalive,
+            "dns_cache_ttl": s.dns_cache_ttl,
+            "session_open": self._session is not None and not self._session.closed,
+            "sessions_opened": self.sessions_opened,
+            "openai_clients": len(self._openai),
+            "idle_connections": open_connections,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "reserved": self.reserved,
+            "uptime_s": round(time.time() - self.created_at, 1),
+        }
+
+
+__all__ = ["ConnectionPool", "PoolSettings"]
@@ -0,0 +1,238 @@
+"""
+ComfyAI - Context Budgeting
+
+Keeps chat prompts inside the model's context window.
+
+Before a chat request is sent, the assembled messages are measured and,
+if they would not leave room for the reply, the oldest conversation turns
+are dropped until they fit:
+
+    window  = ModelConfig.context (providers.json) or context.default_window
+    budget  = window - max_tokens (reply) - context.reserve_tokens (slack)
+
+System messages (the resolved system prompt) and the newest turn are
+always kept. Token counts come from tiktoken when it is installed and knows
+the model, otherwise from a character heuristic; either way they are
+cached per (model, text digest), so the cache never pins prompt text.
+
+Tuning lives in settings.json:
+
+    "context": {
+      "default_window": 8192,    # for models without a "context" entry (null = no limit)
+      "reserve_tokens": 256      # slack for chat templates / estimate error
+    }
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from ..config.provider_config import ModelConfig
+from .utils import metrics
+from .utils.logger import log
+
+
+# Per-message framing (role markers, separators) in most chat templates
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Token counts remembered (history is re-measured on every turn)
+TOKEN_CACHE_SIZE = 4096
+
+
+# ============================================================
+# Config
+# ============================================================
+
+@dataclass(frozen=True)
+class ContextConfig:
+    default_window: Optional[int] = 8192
+    reserve_tokens: int = 256
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "ContextConfig":
+        raw = settings.get("context") or {}
+        defaults = cls()
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] Invalid 'context' settings, using defaults")
+            return defaults
+        try:
+            window = raw.get("default_window", defaults.default_window)
+            return cls(
+                default_window=max(1, int(window)) if window is not None else None,
+                reserve_tokens=max(0, int(raw.get("reserve_tokens", defaults.reserve_tokens))),
+            )
+        except (TypeError, ValueError):
+            log.warning("[ComfyAI] Invalid 'context' settings, using defaults")
+            return defaults
+
+
+# ============================================================
+# Token estimation
+# ============================================================
+
+@lru_cache(maxsize=64)
+def _tokenizer(model: str) -> Optional[Callable[[str], int]]:
+    """tiktoken counter for `model`, or None to use the heuristic."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except Exception:
+        # Unknown model name, or the encoding could not be fetched
+        return None
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _heuristic_tokens(text: str) -> int:
+    # ~4 characters per token for ASCII prose/code/JSON; non-ASCII scripts
+    # (CJK, emoji) run close to one token per character.
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return math.ceil((len(text) - non_ascii) / 4) + non_ascii
+
+
+# (digest, length, model) -> tokens; keyed on a digest so long prompts and
+# workflow dumps are not kept alive by the cache
+_token_counts: "OrderedDict[Tuple[bytes, int, str], int]" = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+def estimate_tokens(text: str, model: str = "") -> int:
+    """Estimated token count of `text` for `model`."""
+    if not text:
+        return 0
+    digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    key = (digest, len(text), model)
+    with _token_counts_lock:
+        tokens = _token_counts.get(key)
+        if tokens is not None:
+            _token_counts.move_to_end(key)
+            return tokens
+
+    count = _tokenizer(model)
+    tokens = count(text) if count is not None else _heuristic_tokens(text)
+    with _token_counts_lock:
+        _token_counts[key] = tokens
+        while len(_token_counts) > TOKEN_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return tokens
+
+
+def message_tokens(message: Dict[str, Any], model: str = "") -> int:
+    return estimate_tokens(str(message.get("content") or ""), model) + MESSAGE_OVERHEAD_TOKENS
+
+
+# ============================================================
+# Budgeting
+# ============================================================
+
+@dataclass
+class BudgetResult:
+    messages: List[Dict[str, Any]]
+    prompt_tokens: int
+    budget: Optional[int] = None
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.dropped)
+
+
+def context_window(model_cfg: Optional[ModelConfig], config: ContextConfig) -> Optional[int]:
+    if model_cfg is not None and model_cfg.context:
+        try:
+            return int(model_cfg.context)
+        except (TypeError, ValueError):
+            log.warning(f"[ComfyAI] Invalid context={model_cfg.context!r} for model {model_cfg.name}")
+    return config.default_window
+
+
+def fit_messages(
+    messages: Sequence[Dict[str, Any]],
+    model: str,
+    window: Optional[int],
+    max_tokens: Optional[int],
+    reserve_tokens: int = 0,
+) -> BudgetResult:
+    """
+    Drop the oldest non-system turns until the prompt fits the budget.
+
+    System messages and the final message are never dropped. A kept history
+    never starts with an assistant reply whose question was dropped.
+    """
+    messages = list(messages)
+    costs = [message_tokens(m, model) for m in messages]
+    total = sum(costs)
+
+    if window is None:
+        return BudgetResult(messages, total)
+
+    budget = max(0, window - (max_tokens or 0) - reserve_tokens)
+    if total <= budget:
+        return BudgetResult(messages, total, budget)
+
+    droppable = [
+        i for i, m in enumerate(messages[:-1])
+        if m.get("role") != "system"
+    ]
+    dropped_idx = set()
+    for i in droppable:
+        if total <= budget:
+            # Don't leave an orphaned assistant turn at the head of history
+            if messages[i].get("role") != "assistant":
+                break
+        dropped_idx.add(i)
+        total -= costs[i]
+
+    kept = [m for i, m in enumerate(messages) if i not in dropped_idx]
+    dropped = [m for i, m in enumerate(messages) if i in dropped_idx]
+    return BudgetResult(kept, total, budget, dropped)
+
+
+def budget_messages(
+    messages: Sequence[Dict[str, Any]],
+    provider: str,
+    model: str,
+    max_tokens: Optional[int],
+    model_cfg: Optional[ModelConfig],
+    config: ContextConfig,
+) -> BudgetResult:
+    """fit_messages() for one chat request, with logging and metrics."""
+    window = context_window(model_cfg, config)
+    result = fit_messages(messages, model, window, max_tokens, config.reserve_tokens)
+
+    metrics.observe("chat.prompt_tokens", result.prompt_tokens)
+    metrics.observe(f"chat.prompt_tokens.{provider}", result.prompt_tokens)
+
+    if result.truncated:
+        metrics.incr("context.truncated")
+        metrics.incr("context.dropped_messages", len(result.dropped))
+        log.info(
+            f"[ComfyAI] Context budget: dropped {len(result.dropped)} oldest message(s) "
+            f"for {provider}/{model} (~{result.prompt_tokens}/{result.budget} tokens)"
+        )
+    if result.budget is not None and result.prompt_tokens > result.budget:
+        metrics.incr("context.over_budget")
+        log.warning(
+            f"[ComfyAI] Prompt (~{result.prompt_tokens} tokens) exceeds the context budget "
+            f"({result.budget}) for {provider}/{model} even after truncation"
+        )
+    return result
+
+
+__all__ = [
+    "ContextConfig",
+    "BudgetResult",
+    "estimate_tokens",
+    "message_tokens",
+    "context_window",
+    "fit_messages",
+    "budget_messages",
+]
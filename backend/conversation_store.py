@@ -0,0 +1,330 @@
+"""
+ComfyAI - Conversation Store
+
+Server-side chat history, so the browser only sends the new message each
+turn and the backend assembles the context itself.
+
+Conversations are keyed by session id and kept in two places:
+  • memory  LRU of recently active sessions; sessions idle for longer than
+            `idle_ttl_s` (or beyond `max_sessions`) are dropped from memory
+  • disk    append-only JSONL log per session under CACHE_DIR/conversations,
+            one {"role", "content", "ts"} record per line
+
+An evicted session is reloaded from its log on next use.
+
+Long conversations are compacted in the background (see
+service/conversation_compaction.py): older turns are replaced by a rolling
+summary, recorded in the same log as {"type": "summary", "content", "upto"}.
+history() then returns the summary (as a system message) followed by the
+turns it does not cover.
+
+Configuration lives in settings.json:
+
+    "conversations": {
+      "max_sessions": 64,
+      "idle_ttl_s": 1800,
+      "compact_threshold_tokens": 6000,   # null disables compaction
+      "compact_keep_recent": 6,           # newest messages never summarized
+      "compact_provider": null,           # default: pick_provider("summarize")
+      "compact_model": null
+    }
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .utils import metrics
+from .utils.logger import log
+from .utils.paths import CACHE_DIR
+from .utils.persistence import run_io
+
+
+# Session ids become file names, so keep them boring
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def valid_session_id(session_id: Any) -> bool:
+    return isinstance(session_id, str) and bool(_SESSION_ID_RE.match(session_id))
+
+
+# ============================================================
+# Config
+# ============================================================
+
+@dataclass(frozen=True)
+class ConversationConfig:
+    max_sessions: int = 64
+    idle_ttl_s: float = 1800.0
+    compact_threshold_tokens: Optional[int] = 6000
+    compact_keep_recent: int = 6
+    compact_provider: Optional[str] = None
+    compact_model: Optional[str] = None
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "ConversationConfig":
+        raw = settings.get("conversations") or {}
+        defaults = cls()
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] Invalid 'conversations' settings, using defaults")
+            return defaults
+        try:
+            threshold = raw.get("compact_threshold_tokens", defaults.compact_threshold_tokens)
+            return cls(
+                max_sessions=max(1, int(raw.get("max_sessions", defaults.max_sessions))),
+                idle_ttl_s=max(1.0, float(raw.get("idle_ttl_s", defaults.idle_ttl_s))),
+                compact_threshold_tokens=max(1, int(threshold)) if threshold is not None else None,
+                compact_keep_recent=max(0, int(raw.get("compact_keep_recent", defaults.compact_keep_recent))),
+                compact_provider=raw.get("compact_provider") or None,
+                compact_model=raw.get("compact_model") or None,
+            )
+        except (TypeError, ValueError):
+            log.warning("[ComfyAI] Invalid 'conversations' settings, using defaults")
+            return defaults
+
+
+# ============================================================
+# Store
+# ============================================================
+
+# Prefix of the system message that carries a conversation summary
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+@dataclass
+class Conversation:
+    session_id: str
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    summary: Optional[str] = None
+    summarized: int = 0  # leading messages covered by `summary`
+    last_used: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class CompactionWindow:
+    """Turns a compaction job should fold into the running summary."""
+    session_id: str
+    previous_summary: Optional[str]
+    messages: List[Dict[str, str]]
+    upto: int
+    conversation: Conversation = field(repr=False)
+
+
+class ConversationStore:
+    """LRU of active conversations backed by per-session append-only logs."""
+
+    def __init__(self, config: Optional[ConversationConfig] = None, directory: Optional[Path] = None):
+        self.config = config or ConversationConfig()
+        self.directory = directory or (CACHE_DIR / "conversations")
+        self._sessions: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def configure(self, config: ConversationConfig) -> None:
+        self.config = config
+        self._evict()
+
+    # --------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------
+    async def history(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        Context for the next turn of `session_id` (a copy): the running
+        summary, if any, then every message it does not cover.
+        """
+        conv = await self._get(session_id)
+        messages = [dict(m) for m in conv.messages[conv.summarized:]]
+        if conv.summary:
+            messages.insert(0, {"role": "system", "content": SUMMARY_PREFIX + conv.summary})
+        return messages
+
+    async def compaction_window(self, session_id: str, keep_recent: int) -> Optional[CompactionWindow]:
+        """Unsummarized turns older than the newest `keep_recent` messages."""
+        conv = await self._get(session_id)
+        upto = len(conv.messages) - keep_recent
+        # Kept history should resume on a user turn
+        while (
+            conv.summarized < upto < len(conv.messages)
+            and conv.messages[upto]["role"] != "user"
+        ):
+            upto -= 1
+        if upto <= conv.summarized:
+            return None
+        return CompactionWindow(
+            session_id=session_id,
+            previous_summary=conv.summary,
+            messages=[dict(m) for m in conv.messages[conv.summarized:upto]],
+            upto=upto,
+            conversation=conv,
+        )
+
+    async def set_summary(self, window: CompactionWindow, summary: str) -> bool:
+        """
+        Install a summary produced for `window`. Returns False (and drops it)
+        if the conversation was reset, evicted or already compacted meanwhile.
+        """
+        async with self._lock(window.session_id):
+            conv = self._sessions.get(window.session_id)
+            if conv is not window.conversation or window.upto <= conv.summarized:
+                return False
+            conv.summary = summary
+            conv.summarized = window.upto
+            record = {"type": "summary", "content": summary, "upto": window.upto, "ts": time.time()}
+            await run_io(self._append_log, window.session_id, [record])
+        metrics.incr("conversations.compacted")
+        return True
+
+    async def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        """Record completed turns in memory and in the session's log."""
+        records = [
+            {"role": str(m.get("role") or "user"), "content": str(m.get("content") or "")}
+            for m in messages
+        ]
+        if not records:
+            return
+
+        async with self._lock(session_id):
+            conv = await self._get(session_id)
+            conv.messages.extend(records)
+            now = time.time()
+            await run_io(self._append_log, session_id, [{**r, "ts": now} for r in records])
+        metrics.incr("conversations.appended", len(records))
+
+    async def reset(self, session_id: str) -> None:
+        """Forget a conversation (memory and disk)."""
+        async with self._lock(session_id):
+            self._sessions.pop(session_id, None)
+            await run_io(self._delete_log, session_id)
+        self._publish()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_sessions": self.config.max_sessions,
+            "idle_ttl_s": self.config.idle_ttl_s,
+            "active_sessions": len(self._sessions),
+            "cached_messages": sum(len(c.messages) for c in self._sessions.values()),
+            "summarized_sessions": sum(1 for c in self._sessions.values() if c.summary),
+        }
+
+    # --------------------------------------------------------
+    # Memory tier
+    # --------------------------------------------------------
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def _get(self, session_id: str) -> Conversation:
+        if not valid_session_id(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+
+        self._evict()
+        conv = self._sessions.get(session_id)
+        if conv is None:
+            loaded = await run_io(self._read_log, session_id)
+            # Another request may have loaded it while we were reading
+            conv = self._sessions.get(session_id)
+            if conv is None:
+                conv = loaded
+                self._sessions[session_id] = conv
+                metrics.incr("conversations.loaded")
+        else:
+            metrics.incr("conversations.hits")
+
+        conv.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        self._evict()
+        self._publish()
+        return conv
+
+    def _evict(self) -> None:
+        """Drop idle sessions, then least-recently-used ones over the cap."""
+        cutoff = time.monotonic() - self.config.idle_ttl_s
+        while self._sessions:
+            session_id, conv = next(iter(self._sessions.items()))
+            if conv.last_used >= cutoff and len(self._sessions) <= self.config.max_sessions:
+                break
+            del self._sessions[session_id]
+            lock = self._locks.get(session_id)
+            if lock is not None and not lock.locked():
+                del self._locks[session_id]
+            metrics.incr("conversations.evicted")
+
+    def _publish(self) -> None:
+        metrics.set_gauge("conversations.active_sessions", len(self._sessions))
+
+    # --------------------------------------------------------
+    # Disk tier (runs on the I/O thread)
+    # --------------------------------------------------------
+    def _path(self, session_id: str) -> Path:
+        return self.directory / f"{session_id}.jsonl"
+
+    def _read_log(self, session_id: str) -> Conversation:
+        conv = Conversation(session_id)
+        try:
+            with open(self._path(session_id), "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                        if record.get("type") == "summary":
+                            conv.summary = str(record["content"])
+                            conv.summarized = min(int(record["upto"]), len(conv.messages))
+                        else:
+                            conv.messages.append({"role": record["role"], "content": record["content"]})
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        # A torn final line (crash mid-append) is skipped
+                        log.warning(f"[ComfyAI] Skipping bad record in conversation log {session_id}")
+        except FileNotFoundError:
+            pass
+        return conv
+
+    def _append_log(self, session_id: str, records: List[Dict[str, Any]]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with open(self._path(session_id), "a", encoding="utf-8") as f:
+            f.write(data)
+
+    def _delete_log(self, session_id: str) -> None:
+        try:
+            self._path(session_id).unlink()
+        except FileNotFoundError:
+            pass
+
+
+# ============================================================
+# Shared instance
+# ============================================================
+
+_store: Optional[ConversationStore] = None
+
+
+def get_conversation_store(settings: Optional[Dict[str, Any]] = None) -> ConversationStore:
+    """Return the shared store, applying the "conversations" settings if given."""
+    global _store
+    if _store is None:
+        _store = ConversationStore()
+    if settings is not None:
+        config = ConversationConfig.from_settings(settings)
+        if config != _store.config:
+            _store.configure(config)
+    return _store
+
+
+__all__ = [
+    "SUMMARY_PREFIX",
+    "ConversationConfig",
+    "CompactionWindow",
+    "ConversationStore",
+    "get_conversation_store",
+    "valid_session_id",
+]
@@ -0,0 +1,280 @@
+"""
+ComfyAI - Hedged Chat Streams
+
+For short interactive chats tail latency matters more than cost. A hedged
+stream sends the request to its primary provider and, if no first token
+has arrived after a delay, sends the same request to a secondary provider
+(the next candidate of the task's route). The first stream to produce
+tokens wins; the other is cancelled, which releases its connection,
+admission slot and circuit-breaker probe. A primary that fails before the
+delay is hedged at once.
+
+The delay follows the primary's observed time to first token: the
+`percentile` of its recent TTFTs (`deadline.<provider>.ttft_s`), clamped to
+[min_delay_s, max_delay_s] — so only its slowest few percent of calls are
+hedged. Providers without TTFT history wait `max_delay_s`.
+
+Hedging is opt-in per task, through the route object in providers.json
+"routing" (or per request with body "hedge": true / false), and tuned per
+provider under its options:
+
+    "routing": {"chat": {"strategy": "adaptive", "hedge": true}}
+
+    "options": {
+      "hedge": {
+        "percentile": 0.95,
+        "delay_s": null,        # fixed delay instead of the percentile
+        "min_delay_s": 0.25,
+        "max_delay_s": 5
+      }
+    }
+
+Hedge rate and win counts per provider are served at
+GET /api/comfyai/providers/health and under "hedging" in the metrics.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from .agent_factory import ChatClient, ChatMessage, is_error_text
+from .utils import metrics
+from .utils.logger import log
+
+
+# ============================================================
+# Settings
+# ============================================================
+
+@dataclass(frozen=True)
+class HedgeSettings:
+    percentile: float = 0.95
+    delay_s: Optional[float] = None
+    min_delay_s: float = 0.25
+    max_delay_s: float = 5.0
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]]) -> "HedgeSettings":
+        """Build settings from ProviderConfig.options["hedge"], ignoring junk."""
+        raw = (options or {}).get("hedge") or {}
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] options.hedge must be an object, using defaults")
+            raw = {}
+
+        defaults = cls()
+
+        def _num(key: str, default: Any) -> Any:
+            value = raw.get(key, default)
+            if value is None:
+                return None
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                log.warning(f"[ComfyAI] Invalid options.hedge.{key}={value!r}, using {default!r}")
+                return default
+
+        percentile = _num("percentile", defaults.percentile) or defaults.percentile
+        if percentile > 1:
+            percentile /= 100  # "95" means the 95th percentile
+        min_delay = max(0.0, _num("min_delay_s", defaults.min_delay_s) or 0.0)
+        fixed = _num("delay_s", None)
+        return cls(
+            percentile=min(1.0, max(0.0, percentile)),
+            delay_s=fixed if fixed is not None and fixed >= 0 else None,
+            min_delay_s=min_delay,
+            max_delay_s=max(min_delay, _num("max_delay_s", defaults.max_delay_s) or min_delay),
+        )
+
+    def delay(self, provider: str) -> float:
+        """Seconds to wait for the primary's first token before hedging."""
+        if self.delay_s is not None:
+            return self.delay_s
+        ttft = metrics.get_percentile(f"deadline.{provider}.ttft_s", self.percentile)
+        if ttft is None:
+            return self.max_delay_s
+        return min(self.max_delay_s, max(self.min_delay_s, ttft))
+
+
+# ============================================================
+# Statistics
+# ============================================================
+
+class HedgeStats:
+    """Per-provider hedge counts: how often it was hedged and who won."""
+
+    def __init__(self) -> None:
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _entry(self, provider: str) -> Dict[str, Any]:
+        entry = self._stats.get(provider)
+        if entry is None:
+            entry = self._stats[provider] = {
+                "requests": 0,      # hedge-enabled streams with this primary
+                "hedged": 0,        # ...that sent a second request
+                "primary_wins": 0,  # hedged, but the primary answered first
+                "hedge_wins": 0,    # hedged, and the secondary answered first
+                "rescues": 0,       # races this provider won as the secondary
+                "delay_s": None,    # last hedge delay used
+            }
+        return entry
+
+    def started(self, provider: str, delay: float) -> None:
+        entry = self._entry(provider)
+        entry["requests"] += 1
+        entry["delay_s"] = round(delay, 3)
+
+    def hedged(self, primary: str) -> None:
+        self._entry(primary)["hedged"] += 1
+        metrics.incr(f"hedge.{primary}.hedged")
+
+    def won(self, primary: str, winner: str, hedged: bool) -> None:
+        if not hedged:
+            return
+        if winner == primary:
+            self._entry(primary)["primary_wins"] += 1
+            metrics.incr(f"hedge.{primary}.primary_wins")
+        else:
+            self._entry(primary)["hedge_wins"] += 1
+            self._entry(winner)["rescues"] += 1
+            metrics.incr(f"hedge.{primary}.hedge_wins")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for provider, entry in sorted(self._stats.items()):
+            requests = entry["requests"]
+            out[provider] = {
+                **entry,
+                "hedge_rate": round(entry["hedged"] / requests, 3) if requests else 0.0,
+            }
+        return out
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+
+_stats = HedgeStats()
+
+
+def get_hedge_stats() -> HedgeStats:
+    return _stats
+
+
+# ============================================================
+# Hedged stream
+# ============================================================
+
+class _Racer:
+    """One provider's stream, waiting for its first chunk."""
+
+    def __init__(self, client: ChatClient, messages: Sequence[ChatMessage]):
+        self.client = client
+        self.stream = client.stream_chat(messages)
+        self.first: "asyncio.Task[str]" = asyncio.ensure_future(self.stream.__anext__())
+
+    def produced(self) -> bool:
+        """Whether the first chunk is real output (not an error or an empty stream)."""
+        if self.first.cancelled() or self.first.exception() is not None:
+            return False
+        return not is_error_text(self.first.result())
+
+    async def close(self) -> None:
+        if not self.first.done():
+            self.first.cancel()
+        with contextlib.suppress(BaseException):
+            await self.first
+        with contextlib.suppress(Exception):
+            await self.stream.aclose()
+
+
+class HedgedStream:
+    """
+    Async iterator over the chunks of whichever stream answers first.
+
+    `winner` is the ChatClient whose output is being yielded (None until the
+    first chunk); `hedged` tells whether the secondary was ever sent.
+    """
+
+    def __init__(
+        self,
+        primary: ChatClient,
+        secondary: ChatClient,
+        messages: Sequence[ChatMessage],
+        settings: Optional[HedgeSettings] = None,
+    ):
+        self.primary = primary
+        self.secondary = secondary
+        self.messages = messages
+        self.delay = (settings or HedgeSettings()).delay(primary.provider_name)
+        self.winner: Optional[ChatClient] = None
+        self.hedged = False
+        self._gen = self._run()
+
+    def __aiter__(self) -> "HedgedStream":
+        return self
+
+    async def __anext__(self) -> str:
+        return await self._gen.__anext__()
+
+    async def aclose(self) -> None:
+        await self._gen.aclose()
+
+    async def _race(self, racers: List[_Racer]) -> Optional[_Racer]:
+        """Start the secondary when due; return the first racer with output."""
+        stats = get_hedge_stats()
+        pending = {racers[0].first: racers[0]}
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, timeout=None if self.hedged else self.delay,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                racer = pending.pop(task)
+                if racer.produced():
+                    return racer
+            if not self.hedged:
+                # Primary is slow (timeout) or already failed: send the hedge
+                self.hedged = True
+                stats.hedged(self.primary.provider_name)
+                log.info(
+                    f"[ComfyAI] Hedging '{self.primary.provider_name}' with "
+                    f"'{self.secondary.provider_name}' after {self.delay:.2f}s"
+                )
+                racer = _Racer(self.secondary, self.messages)
+                racers.append(racer)
+                pending[racer.first] = racer
+        return None
+
+    async def _run(self) -> AsyncIterator[str]:
+        stats = get_hedge_stats()
+        primary_name = self.primary.provider_name
+        stats.started(primary_name, self.delay)
+
+        racers = [_Racer(self.primary, self.messages)]
+        try:
+            winner = await self._race(racers)
+            if winner is None:
+                # Nobody produced output: surface the primary's outcome
+                first = racers[0].first
+                if first.cancelled() or isinstance(first.exception(), StopAsyncIteration):
+                    return
+                yield first.result()  # raises the primary's exception, if any
+                return
+
+            self.winner = winner.client
+            stats.won(primary_name, winner.client.provider_name, self.hedged)
+            for racer in racers:
+                if racer is not winner:
+                    await racer.close()
+
+            yield winner.first.result()
+            async for chunk in winner.stream:
+                yield chunk
+        finally:
+            for racer in racers:
+                await racer.close()
+
+
+__all__ = ["HedgeSettings", "HedgeStats", "HedgedStream", "get_hedge_stats"]
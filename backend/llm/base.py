@@ -1,6 +1,10 @@
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List
 
+from aiohttp import ClientTimeout
+
+from ..resilience import ResiliencePolicy
+
 
 class BaseLLMProvider(ABC):
     """
@@ -11,6 +15,12 @@ class BaseLLMProvider(ABC):
 
     def __init__(self, cfg: Dict[str, Any]) -> None:
         self.cfg = cfg or {}
+        self.resilience = ResiliencePolicy.from_options(self.cfg.get("options"))
+
+    def client_timeout(self, task: str) -> ClientTimeout:
+        """connect / total deadlines for `task` from options.timeouts."""
+        t = self.resilience.for_task(task).timeouts
+        return ClientTimeout(total=t.total, sock_connect=t.connect)
 
     @abstractmethod
     async def list_models(self) -> List[Dict[str, Any]]:
@@ -2,7 +2,6 @@ import os
 from typing import Any, Dict, List
 
 import aiohttp
-from aiohttp import ClientTimeout
 from .base import BaseLLMProvider
 
 
@@ -68,7 +67,7 @@ class GeminiProvider(BaseLLMProvider):
 
         try:
             async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=body, timeout=ClientTimeout(total=60)) as resp:
+                async with session.post(url, json=body, timeout=self.client_timeout(task)) as resp:
                     data = await resp.json()
         except Exception as e:
             print(f"[ComfyAI] Gemini execute error: {e}")
@@ -57,7 +57,7 @@ class OllamaProvider(BaseLLMProvider):
 
         try:
             async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=body, timeout=ClientTimeout(total=60)) as resp:
+                async with session.post(url, json=body, timeout=self.client_timeout(task)) as resp:
                     data = await resp.json()
         except Exception as e:
             print(f"[ComfyAI] Ollama execute error: {e}")
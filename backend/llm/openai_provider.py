@@ -2,7 +2,6 @@ import os
 from typing import Any, Dict, List
 
 import aiohttp
-from aiohttp import ClientTimeout
 from .base import BaseLLMProvider
 
 
@@ -68,7 +67,7 @@ class OpenAIProvider(BaseLLMProvider):
                     url,
                     json=body,
                     headers={"Authorization": f"Bearer {api_key}"},
-                    timeout=ClientTimeout(total=60),
+                    timeout=self.client_timeout(task),
                 ) as resp:
                     data = await resp.json()
         except Exception as e:
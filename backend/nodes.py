@@ -0,0 +1,356 @@
+"""
+ComfyAI - LLM Nodes
+
+ComfyUI nodes that call a ComfyAI provider while a graph executes:
+
+  • ComfyAI LLM             system + prompt → text
+  • ComfyAI Expand Prompt   short idea → detailed image prompt
+  • ComfyAI Caption Image   image (batch) → one caption per image
+  • ComfyAI Batch Prompts   one prompt per line → one answer per line,
+                            processed concurrently
+
+Calls go through ProviderManager's ChatClients on the PromptServer event
+loop (utils/loop_bridge.py), so they share its connection pools and
+admission limits. Answers are cached on disk under CACHE_DIR/nodes, keyed
+by provider, model, system prompt, prompt (and image hash) and sampling
+params, so re-queuing a graph does not hit the model again. Change
+`variant` to ask for a different answer to the same input.
+
+Configuration lives in settings.json:
+
+    "nodes": {
+      "timeout_s": 300,        # per node execution
+      "concurrency": 4,        # parallel calls for batches / image batches
+      "cache": {
+        "enabled": true,
+        "ttl_s": 2592000,
+        "max_entries": 512,
+        "disk": true,
+        "max_disk_mb": 128
+      }
+    }
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import io
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .agent_factory import ChatClient, SamplingParams, is_error_text
+from .provider_manager import ProviderManager
+from .response_cache import ResponseCache, ResponseCacheConfig, cache_key
+from .utils import metrics
+from .utils.logger import log
+from .utils.loop_bridge import run_coroutine_sync
+from .utils.paths import CACHE_DIR
+from .utils.settings import load_settings_async
+
+
+CATEGORY = "ComfyAI"
+
+EXPAND_SYSTEM_PROMPT = (
+    "You expand short image ideas into detailed prompts for text-to-image "
+    "models. Describe subject, setting, composition, lighting, style and "
+    "mood in one paragraph of comma-separated phrases. Keep every detail the "
+    "user gave. Return only the prompt."
+)
+
+CAPTION_INSTRUCTION = (
+    "Describe this image in one detailed paragraph suitable as a "
+    "text-to-image prompt. Return only the description."
+)
+
+
+# ============================================================
+# Config
+# ============================================================
+
+_NODE_CACHE_DEFAULTS = ResponseCacheConfig(
+    enabled=True, ttl_s=30 * 86400.0, max_entries=512, disk=True, max_disk_mb=128.0
+)
+
+
+@dataclass(frozen=True)
+class NodeConfig:
+    timeout_s: float = 300.0
+    concurrency: int = 4
+    cache: ResponseCacheConfig = _NODE_CACHE_DEFAULTS
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "NodeConfig":
+        raw = settings.get("nodes") or {}
+        defaults = cls()
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] Invalid 'nodes' settings, using defaults")
+            return defaults
+        try:
+            return cls(
+                timeout_s=max(1.0, float(raw.get("timeout_s", defaults.timeout_s))),
+                concurrency=max(1, int(raw.get("concurrency", defaults.concurrency))),
+                cache=ResponseCacheConfig.from_dict(raw.get("cache"), "nodes.cache", _NODE_CACHE_DEFAULTS),
+            )
+        except (TypeError, ValueError):
+            log.warning("[ComfyAI] Invalid 'nodes' settings, using defaults")
+            return defaults
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def _node_cache(config: ResponseCacheConfig) -> Optional[ResponseCache]:
+    global _cache
+    if not config.enabled:
+        return None
+    if _cache is None:
+        _cache = ResponseCache(config, CACHE_DIR / "nodes")
+    elif _cache.config != config:
+        _cache.configure(config)
+    return _cache
+
+
+# ============================================================
+# Calls
+# ============================================================
+
+@dataclass(frozen=True)
+class NodeCall:
+    """What every item of one node execution shares."""
+    provider: str = ""
+    model: str = ""
+    system: str = ""
+    temperature: float = 0.7
+    max_tokens: int = 1024
+    variant: int = 0
+    use_cache: bool = True
+
+
+def _client(call: NodeCall, requires: Sequence[str] = ()) -> ChatClient:
+    mgr = ProviderManager.instance()
+    if call.provider:
+        client = mgr.get_provider(call.provider)
+        if client is None:
+            raise ValueError(f"Unknown ComfyAI provider '{call.provider}'")
+    else:
+        client = mgr.pick_provider("nodes", requires=requires)
+        if client is None:
+            raise RuntimeError("No ComfyAI provider configured")
+    return client.bind(
+        model=call.model or None,
+        params=SamplingParams(temperature=call.temperature, max_tokens=call.max_tokens),
+        task="nodes",
+    )
+
+
+async def complete_many(
+    call: NodeCall,
+    items: Sequence[Tuple[str, Sequence[str]]],
+    config: Optional[NodeConfig] = None,
+) -> List[str]:
+    """
+    Answer every (prompt, images) item concurrently (bounded by
+    nodes.concurrency), serving repeats from the node cache. Order is kept.
+    """
+    config = config or NodeConfig.from_settings(await load_settings_async())
+    llm = _client(call, ("vision",) if any(images for _, images in items) else ())
+    cache = _node_cache(config.cache) if call.use_cache else None
+    semaphore = asyncio.Semaphore(config.concurrency)
+
+    async def one(prompt: str, images: Sequence[str]) -> str:
+        user: Dict[str, Any] = {"role": "user", "content": prompt}
+        if images:
+            user["images"] = list(images)
+        messages = [{"role": "system", "content": call.system}] if call.system else []
+        messages.append(user)
+
+        key = cache_key(llm, messages, kind=f"node:{call.variant}") if cache else None
+        if cache:
+            cached = await cache.get(key)
+            if cached is not None:
+                metrics.incr("nodes.cache_hits")
+                return cached
+
+        async with semaphore:
+            text = (await llm.chat(messages)).strip()
+        if is_error_text(text):
+            raise RuntimeError(text)
+        metrics.incr("nodes.calls")
+        if cache:
+            cache.put(key, text)
+        return text
+
+    return list(await asyncio.gather(*(one(p, imgs) for p, imgs in items)))
+
+
+def run_node_call(call: NodeCall, items: Sequence[Tuple[str, Sequence[str]]]) -> List[str]:
+    """Blocking entry point for node functions (ComfyUI's executor thread)."""
+    return run_coroutine_sync(_run_with_timeout(call, items))
+
+
+async def _run_with_timeout(call: NodeCall, items: Sequence[Tuple[str, Sequence[str]]]) -> List[str]:
+    config = NodeConfig.from_settings(await load_settings_async())
+    try:
+        return await asyncio.wait_for(complete_many(call, items, config), config.timeout_s)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"ComfyAI node timed out after {config.timeout_s:g}s") from None
+
+
+def encode_images(image: Any) -> List[str]:
+    """ComfyUI IMAGE tensor (B, H, W, C floats in 0..1) → base64 PNGs."""
+    import numpy as np
+    from PIL import Image
+
+    array = image.cpu().numpy() if hasattr(image, "cpu") else np.asarray(image)
+    if array.ndim == 3:
+        array = array[None]
+    out = []
+    for frame in array:
+        pixels = np.clip(frame * 255.0, 0, 255).astype(np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(pixels).save(buf, format="PNG")
+        out.append(base64.b64encode(buf.getvalue()).decode("ascii"))
+    return out
+
+
+# ============================================================
+# Nodes
+# ============================================================
+
+def _common_inputs() -> Dict[str, Any]:
+    return {
+        "provider": ("STRING", {"default": "", "tooltip": "Provider id from providers.json (empty: the \"nodes\" route, else the default provider)"}),
+        "model": ("STRING", {"default": "", "tooltip": "Model name (empty: the provider's default model)"}),
+        "temperature": ("FLOAT", {"default": 0.7, "min": 0.0, "max": 2.0, "step": 0.05}),
+        "max_tokens": ("INT", {"default": 1024, "min": 1, "max": 32768}),
+        "variant": ("INT", {"default": 0, "min": 0, "max": 0xFFFFFFFF,
+                            "tooltip": "Change to get a different answer for the same input (part of the cache key)"}),
+        "use_cache": ("BOOLEAN", {"default": True}),
+    }
+
+
+def _call(system: str, provider: str, model: str, temperature: float, max_tokens: int,
+          variant: int, use_cache: bool) -> NodeCall:
+    return NodeCall(
+        provider=provider.strip(),
+        model=model.strip(),
+        system=system.strip(),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        variant=variant,
+        use_cache=use_cache,
+    )
+
+
+class ComfyAIGenerate:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "prompt": ("STRING", {"multiline": True, "default": ""}),
+                "system": ("STRING", {"multiline": True, "default": ""}),
+                **_common_inputs(),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("text",)
+    FUNCTION = "generate"
+    CATEGORY = CATEGORY
+
+    def generate(self, prompt, system, **options):
+        return tuple(run_node_call(_call(system, **options), [(prompt, ())]))
+
+
+class ComfyAIExpandPrompt:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "prompt": ("STRING", {"multiline": True, "default": ""}),
+                "style": ("STRING", {"default": "", "tooltip": "Optional style direction, e.g. 'cinematic photo'"}),
+                **_common_inputs(),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("prompt",)
+    FUNCTION = "expand"
+    CATEGORY = CATEGORY
+
+    def expand(self, prompt, style, **options):
+        text = prompt if not style.strip() else f"{prompt}\n\nStyle: {style.strip()}"
+        return tuple(run_node_call(_call(EXPAND_SYSTEM_PROMPT, **options), [(text, ())]))
+
+
+class ComfyAICaptionImage:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "instruction": ("STRING", {"multiline": True, "default": CAPTION_INSTRUCTION}),
+                **_common_inputs(),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("caption",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "caption"
+    CATEGORY = CATEGORY
+
+    def caption(self, image, instruction, **options):
+        items = [(instruction, (png,)) for png in encode_images(image)]
+        return (run_node_call(_call("", **options), items),)
+
+
+class ComfyAIBatchPrompts:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "prompts": ("STRING", {"multiline": True, "default": "", "tooltip": "One prompt per line"}),
+                "system": ("STRING", {"multiline": True, "default": EXPAND_SYSTEM_PROMPT}),
+                **_common_inputs(),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("texts",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "run_batch"
+    CATEGORY = CATEGORY
+
+    def run_batch(self, prompts, system, **options):
+        lines = [line.strip() for line in prompts.splitlines() if line.strip()]
+        if not lines:
+            return ([],)
+        return (run_node_call(_call(system, **options), [(line, ()) for line in lines]),)
+
+
+NODE_CLASS_MAPPINGS = {
+    "ComfyAIGenerate": ComfyAIGenerate,
+    "ComfyAIExpandPrompt": ComfyAIExpandPrompt,
+    "ComfyAICaptionImage": ComfyAICaptionImage,
+    "ComfyAIBatchPrompts": ComfyAIBatchPrompts,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "ComfyAIGenerate": "ComfyAI LLM",
+    "ComfyAIExpandPrompt": "ComfyAI Expand Prompt",
+    "ComfyAICaptionImage": "ComfyAI Caption Image",
+    "ComfyAIBatchPrompts": "ComfyAI Batch Prompts",
+}
+
+
+__all__ = [
+    "NODE_CLASS_MAPPINGS",
+    "NODE_DISPLAY_NAME_MAPPINGS",
+    "NodeCall",
+    "NodeConfig",
+    "complete_many",
+    "encode_images",
+    "run_node_call",
+]
@@ -0,0 +1,280 @@
+"""
+ComfyAI - Multi-endpoint Ollama Balancer
+
+One logical Ollama provider can list several hosts serving the same
+models; ComfyAI then spreads chat and rewrite traffic across them without
+the UI knowing:
+
+    "gpu_pool": {
+      "type": "ollama",
+      "endpoints": ["http://gpu1:11434", "http://gpu2:11434", "http://gpu3:11434"],
+      "default_model": "qwen2.5:14b",
+      "options": {
+        "balancer": {
+          "probe_interval_s": 10,   # background GET /api/ps per host
+          "probe_timeout_s": 2,
+          "fail_threshold": 2,      # consecutive failures before ejection
+          "eject_s": 30,            # minimum time an ejected host sits out
+          "affinity_slack": 2       # extra requests a warm host may carry
+        }
+      }
+    }
+
+Each attempt (retries included) goes to the healthy host with the fewest
+outstanding requests, preferring hosts that already have the model loaded
+(from /api/ps, or because they just served it): a warm host wins unless it
+carries more than `affinity_slack` requests more than a cold one, so a
+model is not loaded onto every GPU at once.
+
+Hosts are ejected after `fail_threshold` consecutive failures — failed
+probes, connect errors and 5xx answers alike — and readmitted by the first
+successful probe after `eject_s`. When every host is ejected the least
+loaded one is used anyway, so the caller sees the real error (and the
+provider's circuit breaker can react) instead of a silent stall.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import aiohttp
+
+from .connection_pool import ConnectionPool
+from .resilience import ProviderHTTPError
+from .utils import metrics
+from .utils.logger import log
+
+
+# ============================================================
+# Settings
+# ============================================================
+
+@dataclass(frozen=True)
+class BalancerSettings:
+    probe_interval_s: float = 10.0
+    probe_timeout_s: float = 2.0
+    fail_threshold: int = 2
+    eject_s: float = 30.0
+    affinity_slack: int = 2
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]]) -> "BalancerSettings":
+        """Build settings from ProviderConfig.options["balancer"], ignoring junk."""
+        raw = (options or {}).get("balancer") or {}
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] options.balancer must be an object, using defaults")
+            raw = {}
+
+        defaults = cls()
+
+        def _num(key: str, default: Any, cast: Any) -> Any:
+            value = raw.get(key, default)
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                log.warning(f"[ComfyAI] Invalid options.balancer.{key}={value!r}, using {default!r}")
+                return default
+
+        return cls(
+            probe_interval_s=max(0.1, _num("probe_interval_s", defaults.probe_interval_s, float)),
+            probe_timeout_s=max(0.1, _num("probe_timeout_s", defaults.probe_timeout_s, float)),
+            fail_threshold=max(1, _num("fail_threshold", defaults.fail_threshold, int)),
+            eject_s=max(0.0, _num("eject_s", defaults.eject_s, float)),
+            affinity_slack=max(0, _num("affinity_slack", defaults.affinity_slack, int)),
+        )
+
+
+def _model_key(name: str) -> str:
+    """Ollama reports "llama3.2:latest" for a model requested as "llama3.2"."""
+    return name if ":" in name else f"{name}:latest"
+
+
+def _host_failure(error: Optional[BaseException]) -> bool:
+    """Whether `error` says the host itself is unwell (not the request)."""
+    if isinstance(error, ProviderHTTPError):
+        return error.status >= 500
+    return isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ServerTimeoutError))
+
+
+# ============================================================
+# Endpoints
+# ============================================================
+
+class Endpoint:
+    """One Ollama host of a balanced provider."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        self.loaded: Set[str] = set()
+        self.failures = 0  # consecutive
+        self.ejected_at = 0.0
+
+        # Statistics
+        self.requests = 0
+        self.errors = 0
+        self.times_ejected = 0
+        self.last_error: Optional[str] = None
+        self.last_probe: Optional[float] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "loaded_models": sorted(self.loaded),
+            "requests": self.requests,
+            "errors": self.errors,
+            "times_ejected": self.times_ejected,
+            "last_error": self.last_error,
+            "last_probe": self.last_probe,
+        }
+
+
+class OllamaBalancer:
+    """Least-outstanding-requests balancing with model affinity and health probes."""
+
+    def __init__(
+        self,
+        name: str,
+        urls: Sequence[str],
+        pool: ConnectionPool,
+        settings: Optional[BalancerSettings] = None,
+    ):
+        self.name = name
+        self.endpoints: List[Endpoint] = [Endpoint(url) for url in urls]
+        self.settings = settings or BalancerSettings()
+        self.pool = pool  # the provider's transport, shared with its requests
+        self._probe_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    # --------------------------------------------------------
+    # Choosing a host
+    # --------------------------------------------------------
+    def acquire(self, model: str) -> Endpoint:
+        """Reserve the best host for one request; pair with release()."""
+        self._ensure_probing()
+        candidates = [e for e in self.endpoints if e.healthy] or self.endpoints
+        key = _model_key(model)
+        slack = self.settings.affinity_slack
+
+        def load(endpoint: Endpoint) -> "tuple[int, bool]":
+            # Cold hosts count as `slack` requests busier than they are; ties
+            # go to a warm host, then to the first listed one
+            cold = key not in endpoint.loaded
+            return endpoint.outstanding + (slack if cold else 0), cold
+
+        endpoint = min(candidates, key=load)
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def release(
+        self,
+        endpoint: Endpoint,
+        model: str,
+        served: bool = False,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """
+        End a request. `served`: the host answered it (so it has the model
+        loaded now); `error`: whatever the request raised, if anything.
+        """
+        endpoint.outstanding = max(0, endpoint.outstanding - 1)
+        if served:
+            endpoint.failures = 0
+            endpoint.loaded.add(_model_key(model))
+        elif _host_failure(error):
+            self._failed(endpoint, str(error))
+
+    def _failed(self, endpoint: Endpoint, error: str) -> None:
+        endpoint.errors += 1
+        endpoint.failures += 1
+        endpoint.last_error = error[:300]
+        if endpoint.healthy and endpoint.failures >= self.settings.fail_threshold:
+            endpoint.healthy = False
+            endpoint.ejected_at = time.monotonic()
+            endpoint.times_ejected += 1
+            metrics.incr(f"balancer.{self.name}.ejected")
+            log.warning(f"[ComfyAI] Ejecting {endpoint.url} from '{self.name}': {endpoint.last_error}")
+        metrics.set_gauge(f"balancer.{self.name}.healthy", sum(e.healthy for e in self.endpoints))
+
+    # --------------------------------------------------------
+    # Health probes
+    # --------------------------------------------------------
+    async def probe(self, endpoint: Endpoint) -> None:
+        """GET /api/ps: refresh the loaded models, eject or readmit the host."""
+        endpoint.last_probe = time.time()
+        timeout = aiohttp.ClientTimeout(total=self.settings.probe_timeout_s)
+        try:
+            async with self.pool.session().get(f"{endpoint.url}/api/ps", timeout=timeout) as resp:
+                if resp.status != 200:
+                    raise ProviderHTTPError(resp.status, (await resp.text())[:200])
+                data = await resp.json(content_type=None)
+        except Exception as e:
+            self._failed(endpoint, f"probe failed: {e or type(e).__name__}")
+            return
+
+        endpoint.loaded = {
+            str(m.get("model") or m.get("name"))
+            for m in (data or {}).get("models") or []
+            if isinstance(m, dict) and (m.get("model") or m.get("name"))
+        }
+        endpoint.failures = 0
+        if not endpoint.healthy and time.monotonic() - endpoint.ejected_at >= self.settings.eject_s:
+            endpoint.healthy = True
+            log.info(f"[ComfyAI] Readmitting {endpoint.url} to '{self.name}'")
+            metrics.set_gauge(f"balancer.{self.name}.healthy", sum(e.healthy for e in self.endpoints))
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self.probe(e) for e in self.endpoints))
+
+    def _ensure_probing(self) -> None:
+        """Start the background probe loop on the running event loop."""
+        if self._closed or (self._probe_task is not None and not self._probe_task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._probe_task = loop.create_task(self._probe_loop())
+
+    async def _probe_loop(self) -> None:
+        # Ends with the provider's pool (provider removed or app shutdown)
+        while not self._closed and not self.pool.closed:
+            await self.probe_all()
+            await asyncio.sleep(self.settings.probe_interval_s)
+
+    def stop(self) -> Optional[asyncio.Task]:
+        """Stop probing (provider removed or replaced); returns the cancelled task."""
+        self._closed = True
+        task, self._probe_task = self._probe_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            return task
+        return None
+
+    async def close(self) -> None:
+        task = self.stop()
+        if task is not None:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    # --------------------------------------------------------
+    # Statistics
+    # --------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "healthy": sum(e.healthy for e in self.endpoints),
+            "endpoints": [e.stats() for e in self.endpoints],
+        }
+
+
+__all__ = ["BalancerSettings", "Endpoint", "OllamaBalancer"]
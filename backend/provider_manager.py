@@ -2,19 +2,35 @@
 ComfyAI Provider Manager
 
 Loads providers from config and exposes ChatClient instances.
+Owns one long-lived ConnectionPool, AdmissionController and CircuitBreaker
+per provider (plus an OllamaBalancer for providers listing several
+endpoints), and routes each task along its TaskRoute: an ordered failover
+chain that skips providers whose circuit is open, or adaptive scoring from
+rolling latency statistics (see routing.py). Routes may hedge slow streams
+with a second provider (see hedging.py).
 """
 
 from __future__ import annotations
 
-import json
+import asyncio
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
 
 from .utils.logger import log
 from ..config.loader import load_config
-from .agent_factory import ChatClient
-from ..config.provider_config import ProviderConfig
+from .admission import AdmissionController, AdmissionSettings
+from .agent_factory import API_OLLAMA, ChatClient, ChatMessage, provider_api
+from .circuit_breaker import BreakerSettings, CircuitBreaker
+from .connection_pool import ConnectionPool, PoolSettings
+from .hedging import HedgedStream, HedgeSettings, get_hedge_stats
+from .ollama_balancer import BalancerSettings, OllamaBalancer
+from .resilience import ResiliencePolicy
+from .routing import ADAPTIVE, DEFAULT_CAPACITY, TaskRoute, constraint_tier, get_routing_stats
+from .utils import metrics
+from ..config.provider_config import ModelConfig, ProviderConfig
+from ..config.schema import ComfyAIConfig
 from .utils.paths import PROVIDERS_PATH
+from .utils.persistence import atomic_write_json, run_io
 
 
 # ============================================================
@@ -42,10 +58,7 @@ def ensure_providers_file() -> None:
     if PROVIDERS_PATH.exists():
         return
 
-    PROVIDERS_PATH.parent.mkdir(parents=True, exist_ok=True)
-
-    with PROVIDERS_PATH.open("w", encoding="utf-8") as f:
-        json.dump(DEFAULT_PROVIDERS_JSON, f, indent=2)
+    atomic_write_json(PROVIDERS_PATH, DEFAULT_PROVIDERS_JSON, indent=2)
 
     log.info(f"[ComfyAI] Created default providers.json at {PROVIDERS_PATH}")
 
@@ -54,6 +67,16 @@ def ensure_providers_file() -> None:
 # Provider Manager
 # ============================================================
 
+# Max seconds a removed provider's pool waits for in-flight streams
+POOL_DRAIN_TIMEOUT = 300.0
+
+# Failover chains used when providers.json has no "routing" entry for a task;
+# the default provider always ends the chain
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    "rewrite": ["cloud_workflow", "local_apply"],
+    "summarize": ["local_summarize", "local_chat"],
+}
+
 class ProviderManager:
     """Singleton manager for all LLM providers."""
 
@@ -75,64 +98,213 @@ class ProviderManager:
         # 🔑 MUST happen before load_config()
         ensure_providers_file()
 
-        self.config = load_config()
+        self.config = ComfyAIConfig()
         self.providers: Dict[str, ChatClient] = {}
+        self.pools: Dict[str, ConnectionPool] = {}
         self.default_provider: Optional[str] = None
+        self.routes: Dict[str, TaskRoute] = {}
+        self.hedge_settings: Dict[str, HedgeSettings] = {}
+
+        # Pools of removed/replaced providers still serving in-flight requests
+        self._draining: Set[ConnectionPool] = set()
 
-        self._load_providers()
+        self._apply_config(load_config())
 
     # ========================================================
     # Provider Loading
     # ========================================================
-    def _load_providers(self):
-        """Load ProviderConfig objects and build ChatClient instances."""
-        providers_cfg = getattr(self.config, "providers", {})
+    @staticmethod
+    def _build_client(
+        name: str, cfg: ProviderConfig, limiter: Optional[AdmissionController] = None
+    ) -> ChatClient:
+        """
+        Build a ChatClient (with its own pool, limiter, breaker and balancer)
+        for one provider. A rebuilt provider passes its current `limiter`,
+        which keeps its queue and in-flight count under the new limits.
+        """
+        model_name = (
+            cfg.default_model
+            or (cfg.models[0].name if cfg.models else None)
+            or ""
+        )
+        options = cfg.options or {}
+        structured = options.get("structured_output")
+        base_url = cfg.base_url or (cfg.endpoints[0] if cfg.endpoints else "")
+        api = provider_api(name, cfg.type or "", base_url, options.get("api"), balanced=len(cfg.endpoints) > 1)
+
+        pool = ConnectionPool(name, PoolSettings.from_options(cfg.options))
+        limits = AdmissionSettings.from_options(cfg.options)
+        if limiter is None:
+            limiter = AdmissionController(name, limits)
+        else:
+            limiter.reconfigure(limits)
+        balancer = None
+        if len(cfg.endpoints) > 1:
+            if api == API_OLLAMA:
+                balancer = OllamaBalancer(name, cfg.endpoints, pool, BalancerSettings.from_options(cfg.options))
+            else:
+                log.warning(f"[ComfyAI] '{name}': several endpoints are only balanced for Ollama, using {base_url}")
+
+        return ChatClient(
+            provider_name=name,
+            provider_type=cfg.type,
+            base_url=base_url,
+            api_key=cfg.api_key or "",
+            model=model_name or "",
+            structured_output=None if structured is None else bool(structured),
+            pool=pool,
+            limiter=limiter,
+            breaker=CircuitBreaker(name, BreakerSettings.from_options(cfg.options)),
+            resilience=ResiliencePolicy.from_options(cfg.options),
+            api=api,
+            balancer=balancer,
+        )
+
+    def _apply_config(self, config: ComfyAIConfig) -> None:
+        """
+        Diff `config` against the current one and swap in the result.
+
+        Providers whose ProviderConfig is unchanged keep their ChatClient and
+        connection pool; changed or new ones get fresh clients (a changed one
+        keeps its admission limiter); removed or replaced pools are drained
+        (closed once their in-flight and queued requests end).
+        """
+        old_cfgs = getattr(self.config, "providers", {})
+        providers_cfg = getattr(config, "providers", {})
+
+        providers: Dict[str, ChatClient] = {}
+        pools: Dict[str, ConnectionPool] = {}
+        default_provider: Optional[str] = None
+        reused: List[str] = []
 
         for name, cfg in providers_cfg.items():
             if not isinstance(cfg, ProviderConfig):
                 log.error(f"[ComfyAI] Invalid provider config for {name}, skipping.")
                 continue
 
-            model_name = (
-                cfg.default_model
-                or (cfg.models[0].name if cfg.models else None)
-                or ""
-            )
-
-            client = ChatClient(
-                provider_name=name,
-                provider_type=cfg.type,
-                base_url=cfg.base_url or "",
-                api_key=cfg.api_key or "",
-                model=model_name or "",
-            )
+            current = self.providers.get(name)
+            if current is not None and old_cfgs.get(name) == cfg:
+                client = current
+                reused.append(name)
+            else:
+                client = self._build_client(name, cfg, current.limiter if current is not None else None)
 
-            self.providers[name] = client
+            providers[name] = client
+            pools[name] = client.pool
 
             # Default provider: first valid provider
-            if self.default_provider is None:
-                self.default_provider = name
+            if default_provider is None:
+                default_provider = name
+
+        retired = [
+            pool for name, pool in self.pools.items()
+            if pools.get(name) is not pool
+        ]
+        for name, client in self.providers.items():
+            if client.balancer is not None and providers.get(name) is not client:
+                client.balancer.stop()
+
+        routes = {
+            str(task): TaskRoute.from_config(raw, str(task))
+            for task, raw in (getattr(config, "routing", {}) or {}).items()
+        }
+
+        hedge_settings = {
+            name: HedgeSettings.from_options(providers_cfg[name].options) for name in providers
+        }
 
-        if not self.default_provider and self.providers:
-            self.default_provider = next(iter(self.providers.keys()))
+        # Swap everything in one step (no awaits) so concurrent requests see
+        # either the old registry or the new one, never a half-built dict.
+        (
+            self.config, self.providers, self.pools, self.default_provider,
+            self.routes, self.hedge_settings,
+        ) = config, providers, pools, default_provider, routes, hedge_settings
+
+        self._drain_pools_soon(retired)
 
         log.info(f"[ComfyAI] Loaded providers: {list(self.providers.keys())}")
         log.info(f"[ComfyAI] Default provider: {self.default_provider}")
+        if reused:
+            log.info(f"[ComfyAI] Reused unchanged providers: {reused}")
 
     # ========================================================
     # Reload
     # ========================================================
     def reload(self):
-        """Reload providers.json and rebuild clients."""
+        """Reload providers.json, rebuilding only providers that changed."""
+        log.info("[ComfyAI] Reloading provider config…")
+        self._apply_config(load_config())
+        log.info(f"[ComfyAI] Reload complete → {list(self.providers.keys())}")
+
+    async def reload_async(self):
+        """reload(), reading providers.json on the I/O thread."""
         log.info("[ComfyAI] Reloading provider config…")
+        self._apply_config(await run_io(load_config))
+        log.info(f"[ComfyAI] Reload complete → {list(self.providers.keys())}")
 
-        self.config = load_config()
-        self.providers = {}
-        self.default_provider = None
+    # ========================================================
+    # Connection pools
+    # ========================================================
+    def _drain_pools_soon(self, pools: List[ConnectionPool]) -> None:
+        """Close retired pools once idle (reload itself is sync)."""
+        if not pools:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop → no session could have been opened on these pools
+            return
+        for pool in pools:
+            self._draining.add(pool)
+            loop.create_task(self._drain(pool))
+
+    async def _drain(self, pool: ConnectionPool) -> None:
+        try:
+            await pool.drain(timeout=POOL_DRAIN_TIMEOUT)
+        finally:
+            self._draining.discard(pool)
+
+    async def aclose(self) -> None:
+        """Stop health probes and close every provider connection pool (app shutdown)."""
+        for client in self.providers.values():
+            if client.balancer is not None:
+                await client.balancer.close()
+        pools = list(self.pools.values()) + list(self._draining)
+        self.pools = {}
+        self._draining.clear()
+        for pool in pools:
+            await pool.close()
+
+    def pool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-provider connection pool statistics (draining pools included)."""
+        stats = {name: pool.stats() for name, pool in self.pools.items()}
+        for pool in self._draining:
+            stats[f"{pool.name} (draining #{id(pool):x})"] = pool.stats()
+        return stats
+
+    def admission_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-provider admission (concurrency limit / queue) statistics."""
+        return {
+            name: client.limiter.stats()
+            for name, client in self.providers.items()
+            if client.limiter is not None
+        }
 
-        self._load_providers()
+    def balancer_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-host health and load of multi-endpoint (balanced) providers."""
+        return {
+            name: client.balancer.stats()
+            for name, client in self.providers.items()
+            if client.balancer is not None
+        }
 
-        log.info(f"[ComfyAI] Reload complete → {list(self.providers.keys())}")
+    def breaker_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-provider circuit breaker state."""
+        return {
+            name: client.breaker.stats()
+            for name, client in self.providers.items()
+            if client.breaker is not None
+        }
 
     # ========================================================
     # Accessors
@@ -148,19 +320,184 @@ class ProviderManager:
         """Return ChatClient for a named provider."""
         return self.providers.get(name)
 
-    def pick_provider(self, task: str) -> Optional[ChatClient]:
+    def get_model_config(self, provider: str, model: str) -> Optional[ModelConfig]:
+        """Return the ModelConfig declared for `model` under `provider`, if any."""
+        cfg = self.config.providers.get(provider)
+        if cfg is None:
+            return None
+        for m in cfg.models:
+            if m.name == model:
+                return m
+        return None
+
+    def task_route(self, task: str) -> TaskRoute:
+        """The configured TaskRoute for `task`, else its DEFAULT_ROUTES chain."""
+        route = self.routes.get(task)
+        if route is not None:
+            return route
+        return TaskRoute(providers=tuple(DEFAULT_ROUTES.get(task, [])))
+
+    def failover_chain(self, task: str) -> List[str]:
+        """
+        Provider ids to try for `task`, in order: the route's providers
+        (providers.json "routing"[task], or DEFAULT_ROUTES), then the default
+        provider. An adaptive route without providers considers them all.
+
+        Without configuration:
+          • "rewrite" prefers cloud_workflow, then local_apply.
+          • "summarize" prefers a cheap local model: local_summarize, then
+            local_chat.
+        """
+        route = self.task_route(task)
+        chain = list(route.providers)
+        if not chain and route.strategy == ADAPTIVE:
+            chain = list(self.providers)
+        if self.default_provider:
+            chain.append(self.default_provider)
+
+        seen: Set[str] = set()
+        out = []
+        for name in chain:
+            if name in self.providers and name not in seen:
+                seen.add(name)
+                out.append(name)
+        return out
+
+    def _route_model(
+        self,
+        name: str,
+        requires: Sequence[str],
+        min_context: Optional[int],
+    ) -> Tuple[int, str]:
         """
-        Simple routing based on task name.
+        The model of provider `name` that best fits the constraints, and its
+        constraint tier (see routing.constraint_tier). The default model wins
+        ties.
+        """
+        client = self.providers[name]
+        if not requires and not min_context:
+            return 0, client.model
+
+        def tier(model: str) -> int:
+            cfg = self.get_model_config(name, model)
+            if cfg is None:
+                return constraint_tier(None, None, requires, min_context)
+            return constraint_tier(cfg.capabilities, cfg.context, requires, min_context)
+
+        best = (tier(client.model), client.model)
+        cfg = self.config.providers.get(name)
+        for m in (cfg.models if cfg is not None else []):
+            candidate = (tier(m.name), m.name)
+            if candidate[0] < best[0]:
+                best = candidate
+        return best
+
+    def _score(self, name: str, model: str, route: TaskRoute) -> float:
+        limiter = self.providers[name].limiter
+        capacity = limiter.settings.max_in_flight if limiter is not None else 0
+        return get_routing_stats().score(
+            name, model, capacity or DEFAULT_CAPACITY, route.expected_tokens
+        )
+
+    def pick_provider(
+        self,
+        task: str,
+        requires: Sequence[str] = (),
+        min_context: Optional[int] = None,
+        pin: Optional[str] = None,
+        exclude: Sequence[str] = (),
+    ) -> Optional[ChatClient]:
+        """
+        Provider (bound to the chosen model) to serve `task`.
+
+        A pinned provider (`pin`, else the route's "pin") always wins.
+        Otherwise candidates come from the task's failover chain minus
+        `exclude`, filtered by the route's and the caller's constraints
+        (`requires` capabilities, `min_context` tokens) with declared matches
+        first, and skipping providers whose circuit is open:
 
-        For now:
-          • "rewrite" prefers cloud_workflow, then local_apply, then default.
+          • ordered routes take the first candidate
+          • adaptive routes take the best-scoring one (routing.RoutingStats)
+
+        When every circuit is open the best-fitting head of the chain is
+        returned; its calls fail fast with CircuitOpen (503 + Retry-After).
         """
-        if task == "rewrite":
-            for key in ("cloud_workflow", "local_apply", self.default_provider):
-                if key and key in self.providers:
-                    return self.providers[key]
+        route = self.task_route(task)
+        for name in (pin, route.pin):
+            if not name or name in exclude:
+                continue
+            client = self.providers.get(name)
+            if client is not None:
+                return client
+            log.warning(f"[ComfyAI] Pinned provider '{name}' for '{task}' is not configured, ignoring it")
+
+        requires = tuple(route.requires) + tuple(r for r in requires if r not in route.requires)
+        contexts = [c for c in (route.min_context, min_context) if c]
+        need_context = max(contexts) if contexts else None
+
+        chain = [name for name in self.failover_chain(task) if name not in exclude]
+        if not chain:
+            return None if exclude else self.get_default_llm()
+
+        # (tier, position, provider, model); declared mismatches only as a last resort
+        candidates = []
+        for position, name in enumerate(chain):
+            tier, model = self._route_model(name, requires, need_context)
+            candidates.append((tier, position, name, model))
+        fitting = [c for c in candidates if c[0] < 2]
+        if not fitting:
+            log.warning(f"[ComfyAI] No provider for '{task}' satisfies {list(requires)} / context {need_context}")
+            fitting = candidates
+        fitting.sort(key=lambda c: (c[0], c[1]))
+
+        available = [
+            c for c in fitting
+            if self.providers[c[2]].breaker is None or self.providers[c[2]].breaker.available()
+        ]
+        if not available:
+            choice = fitting[0]
+        elif route.strategy == ADAPTIVE:
+            choice = min(available, key=lambda c: (c[0], self._score(c[2], c[3], route), c[1]))
+        else:
+            choice = available[0]
+            if choice is not fitting[0]:
+                log.info(f"[ComfyAI] Routing '{task}' to '{choice[2]}': earlier providers are unavailable")
+
+        _, _, name, model = choice
+        metrics.incr(f"routing.{task}.{name}")
+        client = self.providers[name]
+        return client if model == client.model else client.bind(model=model)
+
+    def routing_stats(self) -> Dict[str, Any]:
+        """Rolling per-provider/model latency statistics behind adaptive routing."""
+        return get_routing_stats().snapshot()
 
-        return self.get_default_llm()
+    # ========================================================
+    # Hedging
+    # ========================================================
+    def stream_chat(
+        self,
+        client: ChatClient,
+        messages: Sequence[ChatMessage],
+        task: str = "chat",
+        hedge: Optional[bool] = None,
+    ) -> AsyncIterator[str]:
+        """
+        `client.stream_chat(messages)`, hedged with the task's next-best
+        provider when hedging is on (`hedge`, else the route's "hedge") and
+        another provider is configured. The result is a HedgedStream then.
+        """
+        if hedge is None:
+            hedge = self.task_route(task).hedge
+        secondary = self.pick_provider(task, exclude=(client.provider_name,)) if hedge else None
+        if secondary is None:
+            return client.stream_chat(messages)
+        secondary = secondary.bind(params=client.params, task=client.task or task)
+        return HedgedStream(client, secondary, messages, self.hedge_settings.get(client.provider_name))
+
+    def hedge_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-provider hedge rate and race outcomes."""
+        return get_hedge_stats().snapshot()
 
     # Alias for MCP compatibility
     def get_best_provider(self, task: str) -> Optional[ChatClient]:
@@ -0,0 +1,374 @@
+"""
+ComfyAI - Provider Deadlines and Retries
+
+Every provider call runs under four deadlines:
+
+  • connect   TCP/TLS connect (enforced by the transport)
+  • ttft      time to first token of a stream, retries included
+  • idle      longest gap between two stream chunks
+  • total     whole call, retries included
+
+A stuck Ollama therefore fails the request with DeadlineExceeded instead of
+hanging it, while a long rewrite is no longer cut off by a fixed 60s limit.
+Non-streaming calls only use `connect` and `total` (the answer arrives in
+one piece, so there is no first token or gap to time).
+
+Idempotent failures — connect errors, 429 and 5xx — are retried with
+exponential backoff and full jitter (honouring Retry-After). Each retry is
+drawn from a per-request RetryBudget, shared by every provider call made
+under one retry_scope() (e.g. all calls of one workflow rewrite), so a
+struggling provider sees at most `budget` extra requests per request
+instead of a retry storm.
+
+Tuning lives in providers.json under the provider's options; "tasks"
+overrides the defaults for one task ("chat", "rewrite", "summarize",
+"nodes"):
+
+    "options": {
+      "timeouts": {
+        "connect": 10,
+        "ttft": 120,
+        "idle": 60,
+        "total": 600,            # null disables a deadline
+        "tasks": {"rewrite": {"total": 1800}}
+      },
+      "retry": {
+        "attempts": 3,           # tries per call, first one included
+        "base_delay": 0.5,
+        "max_delay": 8,
+        "budget": 3,             # retries per request, across all calls
+        "tasks": {"chat": {"attempts": 2}}
+      }
+    }
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+import aiohttp
+
+from .utils import metrics
+from .utils.logger import log
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: rate limits and transient server failures
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+# ============================================================
+# Settings
+# ============================================================
+
+def _num(raw: Dict[str, Any], key: str, default: Any, cast: Any, where: str) -> Any:
+    if key not in raw:
+        return default
+    value = raw[key]
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        log.warning(f"[ComfyAI] Invalid options.{where}.{key}={value!r}, using {default!r}")
+        return default
+
+
+def _positive(value: Optional[float]) -> Optional[float]:
+    """0 / negative / None all mean "no deadline"."""
+    return value if value is not None and value > 0 else None
+
+
+@dataclass(frozen=True)
+class Timeouts:
+    connect: Optional[float] = 10.0
+    ttft: Optional[float] = 120.0
+    idle: Optional[float] = 60.0
+    total: Optional[float] = 600.0
+
+    def merge(self, raw: Dict[str, Any], where: str = "timeouts") -> "Timeouts":
+        return Timeouts(**{
+            name: _positive(_num(raw, name, getattr(self, name), float, where))
+            for name in ("connect", "ttft", "idle", "total")
+        })
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    budget: int = 3
+
+    def merge(self, raw: Dict[str, Any], where: str = "retry") -> "RetryPolicy":
+        return RetryPolicy(
+            attempts=max(1, _num(raw, "attempts", self.attempts, int, where) or 1),
+            base_delay=max(0.0, _num(raw, "base_delay", self.base_delay, float, where) or 0.0),
+            max_delay=max(0.0, _num(raw, "max_delay", self.max_delay, float, where) or 0.0),
+            budget=max(0, _num(raw, "budget", self.budget, int, where) or 0),
+        )
+
+    def backoff(self, retry: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number `retry` (1-based): full jitter, capped."""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (retry - 1)))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+@dataclass(frozen=True)
+class CallPolicy:
+    timeouts: Timeouts = Timeouts()
+    retry: RetryPolicy = RetryPolicy()
+
+
+@dataclass(frozen=True)
+class ResiliencePolicy:
+    """Provider-wide defaults plus per-task overrides."""
+    default: CallPolicy = CallPolicy()
+    tasks: Dict[str, CallPolicy] = field(default_factory=dict)
+
+    def for_task(self, task: Optional[str]) -> CallPolicy:
+        return self.tasks.get(task or "", self.default)
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]]) -> "ResiliencePolicy":
+        """Build from ProviderConfig.options["timeouts"] / ["retry"], ignoring junk."""
+        options = options or {}
+        sections = {}
+        for key in ("timeouts", "retry"):
+            raw = options.get(key) or {}
+            if not isinstance(raw, dict):
+                log.warning(f"[ComfyAI] options.{key} must be an object, using defaults")
+                raw = {}
+            tasks = raw.get("tasks") or {}
+            if not isinstance(tasks, dict):
+                log.warning(f"[ComfyAI] options.{key}.tasks must be an object, ignoring it")
+                tasks = {}
+            sections[key] = (raw, tasks)
+
+        (raw_t, tasks_t), (raw_r, tasks_r) = sections["timeouts"], sections["retry"]
+        default = CallPolicy(Timeouts().merge(raw_t), RetryPolicy().merge(raw_r))
+
+        tasks: Dict[str, CallPolicy] = {}
+        for task in set(tasks_t) | set(tasks_r):
+            over_t, over_r = tasks_t.get(task) or {}, tasks_r.get(task) or {}
+            if not isinstance(over_t, dict) or not isinstance(over_r, dict):
+                log.warning(f"[ComfyAI] Invalid timeout/retry overrides for task '{task}', ignoring them")
+                continue
+            tasks[str(task)] = replace(
+                default,
+                timeouts=default.timeouts.merge(over_t, f"timeouts.tasks.{task}"),
+                retry=default.retry.merge(over_r, f"retry.tasks.{task}"),
+            )
+        return cls(default=default, tasks=tasks)
+
+
+# ============================================================
+# Errors
+# ============================================================
+
+class DeadlineExceeded(TimeoutError):
+    """A provider call ran past one of its deadlines."""
+
+    def __init__(self, provider: str, phase: str, seconds: float):
+        super().__init__(f"Provider '{provider}' exceeded its {phase} deadline ({seconds:g}s)")
+        self.provider = provider
+        self.phase = phase
+        self.seconds = seconds
+
+
+class ProviderHTTPError(Exception):
+    """A retryable HTTP status from a provider (see RETRY_STATUSES)."""
+
+    def __init__(self, status: int, body: str, retry_after: Optional[str] = None):
+        super().__init__(f"HTTP {status}: {body}")
+        self.status = status
+        self.body = body
+        self.retry_after = _parse_retry_after(retry_after)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None  # HTTP-date form: fall back to our own backoff
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Connect failures, rate limits and 5xx: the request did no harm."""
+    if isinstance(exc, ProviderHTTPError):
+        return exc.status in RETRY_STATUSES
+    if isinstance(exc, (aiohttp.ClientConnectorError, aiohttp.ServerTimeoutError)):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    if isinstance(exc, openai.APIConnectionError):  # includes connect timeouts
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in RETRY_STATUSES
+    return False
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    if isinstance(exc, ProviderHTTPError):
+        return exc.retry_after
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    return _parse_retry_after(headers.get("retry-after")) if headers is not None else None
+
+
+# ============================================================
+# Retry budget
+# ============================================================
+
+class RetryBudget:
+    """Retries one request may still spend across all of its provider calls."""
+
+    def __init__(self, retries: Optional[int] = None):
+        # None: take the first caller's policy budget
+        self.remaining = retries
+        self.spent = 0
+
+    def try_spend(self, default: int) -> bool:
+        if self.remaining is None:
+            self.remaining = default
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        self.spent += 1
+        return True
+
+
+_budget: contextvars.ContextVar[Optional[RetryBudget]] = contextvars.ContextVar(
+    "comfyai_retry_budget", default=None
+)
+
+
+@contextmanager
+def retry_scope(retries: Optional[int] = None) -> Iterator[RetryBudget]:
+    """Share one RetryBudget between every provider call inside the block."""
+    budget = RetryBudget(retries)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+# ============================================================
+# Deadlines
+# ============================================================
+
+class Deadline:
+    """The deadlines of one provider call, measured from its start."""
+
+    def __init__(self, provider: str, timeouts: Timeouts, streaming: bool = False):
+        self.provider = provider
+        self.timeouts = timeouts
+        self.streaming = streaming
+        self.started = time.monotonic()
+        self.first_chunk: Optional[float] = None
+
+    def _next(self) -> "tuple[Optional[float], str]":
+        """Seconds left for whatever the call waits on next, and its phase."""
+        t = self.timeouts
+        now = time.monotonic()
+        limit, phase = None, "total"
+        if t.total is not None:
+            limit = self.started + t.total
+        if self.streaming:
+            if self.first_chunk is None and t.ttft is not None:
+                candidate, name = self.started + t.ttft, "ttft"
+            elif self.first_chunk is not None and t.idle is not None:
+                candidate, name = now + t.idle, "idle"
+            else:
+                candidate, name = None, phase
+            if candidate is not None and (limit is None or candidate < limit):
+                limit, phase = candidate, name
+        return (None if limit is None else max(0.0, limit - now)), phase
+
+    def remaining(self) -> Optional[float]:
+        return self._next()[0]
+
+    async def run(self, aw: Awaitable[T]) -> T:
+        """Await `aw` within the current deadline."""
+        timeout, phase = self._next()
+        if timeout is None:
+            return await aw
+        try:
+            return await asyncio.wait_for(aw, timeout)
+        except asyncio.TimeoutError:
+            metrics.incr(f"deadline.{self.provider}.{phase}")
+            raise DeadlineExceeded(self.provider, phase, getattr(self.timeouts, phase)) from None
+
+    async def iterate(self, source: AsyncIterable[T]) -> AsyncIterator[T]:
+        """Yield from `source`, enforcing ttft before the first chunk and idle after."""
+        it = source.__aiter__()
+        while True:
+            try:
+                item = await self.run(it.__anext__())
+            except StopAsyncIteration:
+                return
+            if self.first_chunk is None:
+                self.first_chunk = time.monotonic()
+                metrics.observe(f"deadline.{self.provider}.ttft_s", self.first_chunk - self.started)
+            yield item
+
+
+async def call_with_retries(
+    attempt: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    deadline: Deadline,
+) -> T:
+    """
+    Run `attempt()` under `deadline`, retrying idempotent failures with
+    backoff while the policy, the request's RetryBudget and the deadline
+    allow it. The last failure is re-raised.
+    """
+    budget = _budget.get() or RetryBudget()
+    provider = deadline.provider
+    tries = 0
+    while True:
+        tries += 1
+        try:
+            return await deadline.run(attempt())
+        except Exception as e:
+            if not _is_retryable(e) or tries >= policy.attempts:
+                raise
+            delay = policy.backoff(tries, _retry_after(e))
+            remaining = deadline.remaining()
+            if remaining is not None and delay >= remaining:
+                raise
+            if not budget.try_spend(policy.budget):
+                metrics.incr(f"retry.{provider}.budget_exhausted")
+                raise
+            metrics.incr(f"retry.{provider}.retries")
+            log.warning(
+                f"[ComfyAI] {provider} call failed ({e}), retry {tries}/{policy.attempts - 1} in {delay:.2f}s"
+            )
+        await asyncio.sleep(delay)
+
+
+__all__ = [
+    "CallPolicy",
+    "Deadline",
+    "DeadlineExceeded",
+    "ProviderHTTPError",
+    "RETRY_STATUSES",
+    "ResiliencePolicy",
+    "RetryBudget",
+    "RetryPolicy",
+    "Timeouts",
+    "call_with_retries",
+    "retry_scope",
+]
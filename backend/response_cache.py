@@ -0,0 +1,377 @@
+"""
+ComfyAI - Response Cache
+
+Opt-in cache for chat / workflow-rewrite completions, so identical questions
+and identical rewrites don't pay for a second model call.
+
+Entries are keyed by a SHA-256 over:
+  • provider + model
+  • the resolved system prompt
+  • the normalized conversation (role + content only)
+  • the sampling params
+
+and stored in two tiers:
+  • memory  LRU of recent entries (bounded by `max_entries`)
+  • disk    one JSON file per entry under CACHE_DIR/responses
+            (bounded by `max_disk_mb`, oldest-used evicted first)
+
+Both tiers honour `ttl_s`. Configuration lives in settings.json:
+
+    "cache": {
+      "enabled": false,
+      "ttl_s": 86400,
+      "max_entries": 256,
+      "disk": true,
+      "max_disk_mb": 64
+    }
+
+A request can bypass the cache with {"cache": false} in its body.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+
+from .agent_factory import ChatClient
+from .utils import metrics
+from .utils.logger import log
+from .utils.paths import CACHE_DIR
+from .utils.persistence import atomic_write_json, run_io
+
+
+# Bump when the key derivation or entry layout changes
+CACHE_VERSION = 1
+
+# Size of the pieces a cached reply is replayed in on the streaming endpoint
+REPLAY_CHUNK_CHARS = 64
+
+
+# ============================================================
+# Config
+# ============================================================
+
+@dataclass(frozen=True)
+class ResponseCacheConfig:
+    enabled: bool = False
+    ttl_s: float = 86400.0
+    max_entries: int = 256
+    disk: bool = True
+    max_disk_mb: float = 64.0
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "ResponseCacheConfig":
+        return cls.from_dict(settings.get("cache"))
+
+    @classmethod
+    def from_dict(
+        cls,
+        raw: Any,
+        where: str = "cache",
+        defaults: Optional["ResponseCacheConfig"] = None,
+    ) -> "ResponseCacheConfig":
+        """Parse a cache section (`where` names it in warnings)."""
+        raw = raw or {}
+        defaults = defaults or cls()
+        if not isinstance(raw, dict):
+            log.warning(f"[ComfyAI] Invalid '{where}' settings, using defaults")
+            return defaults
+        try:
+            return cls(
+                enabled=bool(raw.get("enabled", defaults.enabled)),
+                ttl_s=max(0.0, float(raw.get("ttl_s", defaults.ttl_s))),
+                max_entries=max(1, int(raw.get("max_entries", defaults.max_entries))),
+                disk=bool(raw.get("disk", defaults.disk)),
+                max_disk_mb=max(0.0, float(raw.get("max_disk_mb", defaults.max_disk_mb))),
+            )
+        except (TypeError, ValueError):
+            log.warning(f"[ComfyAI] Invalid '{where}' settings, using defaults")
+            return defaults
+
+
+# ============================================================
+# Key derivation
+# ============================================================
+
+def _normalize_messages(messages: Sequence[Dict[str, Any]]) -> Tuple[str, List[List[str]]]:
+    """Split out the system prompt and reduce turns to (role, content[, image digest])."""
+    system: List[str] = []
+    turns: List[List[str]] = []
+    for m in messages:
+        role = str(m.get("role") or "user")
+        content = str(m.get("content") or "").strip()
+        if role == "system":
+            if content:
+                system.append(content)
+        elif m.get("images"):
+            digest = hashlib.sha256("".join(m["images"]).encode("ascii")).hexdigest()
+            turns.append([role, content, digest])
+        else:
+            turns.append([role, content])
+    return "\n\n".join(system), turns
+
+
+def cache_key(client: ChatClient, messages: Sequence[Dict[str, Any]], kind: str = "chat") -> str:
+    """Stable key for one (provider, model, prompt, conversation, params) call."""
+    system, turns = _normalize_messages(messages)
+    material = {
+        "v": CACHE_VERSION,
+        "kind": kind,
+        "provider": client.provider_name,
+        "model": client.model,
+        "system": system,
+        "messages": turns,
+        "params": asdict(client.params),
+    }
+    blob = json.dumps(material, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+# ============================================================
+# Cache
+# ============================================================
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) TTL cache of completion text."""
+
+    def __init__(self, config: ResponseCacheConfig, directory: Optional[Path] = None):
+        self.config = config
+        self.directory = directory or (CACHE_DIR / "responses")
+
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._disk_bytes: Optional[int] = None  # unknown until first scan
+        self._pending: Set[asyncio.Task] = set()
+
+    def configure(self, config: ResponseCacheConfig) -> None:
+        self.config = config
+        self._trim_memory()
+
+    # --------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            created, text = entry
+            if self._fresh(created, now):
+                self._memory.move_to_end(key)
+                metrics.incr("response_cache.hits")
+                metrics.incr("response_cache.hits.memory")
+                return text
+            del self._memory[key]
+
+        if self.config.disk:
+            entry = await run_io(self._read_disk, key, now)
+            if entry is not None:
+                self._remember(key, *entry)
+                metrics.incr("response_cache.hits")
+                metrics.incr("response_cache.hits.disk")
+                return entry[1]
+
+        metrics.incr("response_cache.misses")
+        return None
+
+    def put(self, key: str, text: str) -> None:
+        """Store `text`; the disk write happens in the background."""
+        if not text:
+            return
+        created = time.time()
+        self._remember(key, created, text)
+        metrics.incr("response_cache.stores")
+
+        if self.config.disk:
+            task = asyncio.ensure_future(run_io(self._write_disk, key, created, text))
+            self._pending.add(task)
+            task.add_done_callback(self._write_done)
+
+    async def clear(self) -> None:
+        self._memory.clear()
+        await run_io(self._clear_disk)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **asdict(self.config),
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    # --------------------------------------------------------
+    # Memory tier
+    # --------------------------------------------------------
+    def _fresh(self, created: float, now: float) -> bool:
+        return now - created <= self.config.ttl_s
+
+    def _remember(self, key: str, created: float, text: str) -> None:
+        self._memory[key] = (created, text)
+        self._memory.move_to_end(key)
+        self._trim_memory()
+
+    def _trim_memory(self) -> None:
+        while len(self._memory) > self.config.max_entries:
+            self._memory.popitem(last=False)
+            metrics.incr("response_cache.evictions.memory")
+
+    def _write_done(self, task: "asyncio.Task") -> None:
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.warning(f"[ComfyAI] Response cache write failed: {task.exception()!r}")
+
+    # --------------------------------------------------------
+    # Disk tier (runs on the I/O thread)
+    # --------------------------------------------------------
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            created, text = float(data["created"]), str(data["text"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            self._unlink(path)
+            return None
+
+        if not self._fresh(created, now):
+            self._unlink(path)
+            return None
+
+        # mtime doubles as "last used" for size-bound eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return created, text
+
+    def _write_disk(self, key: str, created: float, text: str) -> None:
+        path = self._path(key)
+        atomic_write_json(path, {"key": key, "created": created, "text": text}, indent=None)
+        if self._disk_bytes is None:
+            self._scan_disk()
+        else:
+            self._disk_bytes += path.stat().st_size
+        if self._disk_bytes > self.config.max_disk_mb * 1024 * 1024:
+            self._sweep_disk()
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_disk(self) -> None:
+        self._disk_bytes = sum(size for _, size, _ in self._entries())
+
+    def _sweep_disk(self) -> None:
+        """Drop expired entries, then least-recently-used ones down to 90% of budget."""
+        budget = self.config.max_disk_mb * 1024 * 1024 * 0.9
+        cutoff = time.time() - self.config.ttl_s
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+
+        for mtime, size, path in entries:
+            if total <= budget and mtime >= cutoff:
+                continue
+            if self._unlink(path):
+                total -= size
+                metrics.incr("response_cache.evictions.disk")
+
+        self._disk_bytes = total
+
+    def _clear_disk(self) -> None:
+        for _, _, path in self._entries():
+            self._unlink(path)
+        self._disk_bytes = 0
+
+    @staticmethod
+    def _unlink(path: Path) -> bool:
+        try:
+            path.unlink()
+            return True
+        except OSError:
+            return False
+
+
+# ============================================================
+# Shared instance
+# ============================================================
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache(settings: Dict[str, Any], body: Optional[Dict[str, Any]] = None) -> Optional[ResponseCache]:
+    """
+    Return the shared cache if caching is enabled for this request, else None.
+
+    `settings` enables it globally; a request body can opt out with "cache": false.
+    """
+    global _cache
+    config = ResponseCacheConfig.from_settings(settings)
+    if not config.enabled or (body is not None and body.get("cache") is False):
+        return None
+
+    if _cache is None:
+        _cache = ResponseCache(config)
+    elif _cache.config != config:
+        _cache.configure(config)
+    return _cache
+
+
+# ============================================================
+# Streaming helpers
+# ============================================================
+
+async def replay_stream(text: str, chunk_chars: int = REPLAY_CHUNK_CHARS) -> AsyncIterator[str]:
+    """Yield a cached reply in pieces, as a provider stream would."""
+    for i in range(0, len(text), chunk_chars):
+        yield text[i:i + chunk_chars]
+
+
+class RecordingStream:
+    """Wrap a provider stream and keep a copy of everything it yields."""
+
+    def __init__(self, source: AsyncIterator[str]):
+        self.source = source
+        self.parts: List[str] = []
+
+    def __aiter__(self) -> "RecordingStream":
+        return self
+
+    async def __anext__(self) -> str:
+        chunk = await self.source.__anext__()
+        self.parts.append(chunk)
+        return chunk
+
+    async def aclose(self) -> None:
+        aclose = getattr(self.source, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+__all__ = [
+    "ResponseCacheConfig",
+    "ResponseCache",
+    "cache_key",
+    "get_response_cache",
+    "replay_stream",
+    "RecordingStream",
+]
@@ -1,7 +1,10 @@
 from aiohttp import web
 
+from .admission import AdmissionRejected
 from .provider_manager import ProviderManager
+from .resilience import DeadlineExceeded
 from .utils.logger import log
+from .utils.persistence import flush_pending_writes
 from .utils.request_context import (
     reset_request_context,
     set_session_id,
@@ -13,7 +16,11 @@ from .routes.chat import chat_handler, chat_stream_handler
 from .routes.providers import setup
 
 from .routes import chat
+from .routes import conversations
+from .routes import metrics
 from .routes import providers
+from .routes import rewrite_batch
+from .routes import rewrite_jobs
 from .routes import settings
 
 # ============================================================
@@ -27,7 +34,10 @@ async def workflow_rewrite_route(request: web.Request):
     Expected JSON:
         {
             "workflow": { ... },     # workflow graph dict
-            "prompt": "Rewrite this workflow..."
+            "prompt": "Rewrite this workflow...",
+            "mode": "patch",         # optional: "patch" (edit ops) or "full"
+            "cache": false,          # optional: bypass the response cache
+            "provider": "ollama"     # optional: pin a provider (default: routed)
         }
     """
     try:
@@ -53,12 +63,26 @@ async def workflow_rewrite_route(request: web.Request):
 
         log.info("[ROUTER] /workflow/rewrite received request")
 
-        result = await rewrite_workflow(
-            {"workflow": workflow, "prompt": prompt}
-        )
+        request_json = {"workflow": workflow, "prompt": prompt}
+        for key in ("mode", "cache", "provider"):
+            if key in body:
+                request_json[key] = body[key]
+
+        result = await rewrite_workflow(request_json)
+        if "error" in result:
+            return web.json_response(result, status=400)
 
         return web.json_response(result)
 
+    except AdmissionRejected as e:
+        return web.json_response(
+            e.to_dict(), status=e.status, headers={"Retry-After": str(e.retry_after)}
+        )
+
+    except DeadlineExceeded as e:
+        log.warning(f"[ROUTER] /workflow/rewrite timed out: {e}")
+        return web.json_response({"error": str(e)}, status=504)
+
     except Exception as e:
         log.exception("[ROUTER] Error in /workflow/rewrite")
         return web.json_response({"error": str(e)}, status=500)
@@ -79,6 +103,20 @@ def setup_routes(app: web.Application):
     log.info("[ROUTER] Registered /api/comfyai/chat")
     log.info("[ROUTER] Registered /api/comfyai/chat/stream")
 
+# ============================================================
+# SHUTDOWN
+# ============================================================
+
+async def _close_provider_pools(app: web.Application) -> None:
+    provider_manager = app.get("provider_manager")
+    if provider_manager is not None:
+        await provider_manager.aclose()
+        log.info("[ComfyAI] Provider connection pools closed")
+
+
+async def _flush_pending_writes(app: web.Application) -> None:
+    await flush_pending_writes()
+
 # ============================================================
 # MAIN ENTRYPOINT CALLED BY __init__.py
 # ============================================================
@@ -92,9 +130,16 @@ def setup(app: web.Application):
 
     log.info("[ComfyAI] ProviderManager loaded")
 
+    app.on_cleanup.append(_flush_pending_writes)
+    app.on_cleanup.append(_close_provider_pools)
+
     # Register all sub-route modules
     chat.setup(app)
+    conversations.setup(app)
     providers.setup(app)
     settings.setup(app)
+    metrics.setup(app)
+    rewrite_jobs.setup(app)
+    rewrite_batch.setup(app)
 
     log.info("[ComfyAI] Router setup complete")
@@ -1,19 +1,127 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+from typing import List, Optional, Tuple
+
 from aiohttp import web
 
+from ..admission import AdmissionRejected
+from ..agent_factory import SamplingParams, is_error_text
+from ..context_budget import ContextConfig, budget_messages
+from ..hedging import HedgedStream
+from ..conversation_store import get_conversation_store, valid_session_id
 from ..provider_manager import ProviderManager
+from ..service.conversation_compaction import schedule_compaction
+from ..resilience import DeadlineExceeded
+from ..response_cache import RecordingStream, cache_key, get_response_cache, replay_stream
+from ..utils.cancellation import (
+    REQUEST_ID_HEADER,
+    cancel_generation,
+    track_generation,
+    watch_disconnect,
+)
 from ..utils.logger import log
-from ..utils.settings import load_settings, get_resolved_system_prompt
+from ..utils.request_context import reset_request_context, set_session_id
+from ..utils.stream_writer import (
+    ChatStreamWriter,
+    StreamConfig,
+    negotiate_stream_format,
+    relay_stream,
+)
+from ..utils.settings import load_settings_async, get_resolved_system_prompt_async
 from ..utils.paths import SETTINGS_PATH
 
 log.warning(f"[ComfyAI][DEBUG] Using settings file: {SETTINGS_PATH}")
 log.error("[ComfyAI][LOAD] backend/routes/chat.py LOADED")
 
+CACHE_HEADER = "X-ComfyAI-Cache"
+
+
+def _sampling_params(body: dict, settings: dict) -> SamplingParams:
+    """
+    Sampling params for one request: settings "defaults" section, overridden
+    by any temperature / top_p / max_tokens sent in the request body.
+    """
+    defaults = SamplingParams.from_dict(settings.get("defaults"))
+    return defaults.override(SamplingParams.from_dict(body))
+
+
+async def _conversation_turns(
+    body: dict, settings: dict
+) -> Tuple[Optional[str], List[dict], List[dict]]:
+    """
+    Split a request into (session_id, stored history, new turns).
+
+    With a "session_id" the client sends only the new turn — "message" (text)
+    or "messages" holding just the new entries — and earlier turns come from
+    the conversation store. Without one, "messages" is the whole conversation.
+    """
+    session_id = body.get("session_id")
+    new_turns = body.get("messages")
+    if isinstance(body.get("message"), str):
+        new_turns = [{"role": "user", "content": body["message"]}]
+
+    if not isinstance(new_turns, list) or not all(isinstance(m, dict) for m in new_turns):
+        raise ValueError("'messages' must be a list of {role, content} objects")
+
+    if session_id is None:
+        return None, [], new_turns
+
+    if not valid_session_id(session_id):
+        raise ValueError("Invalid session_id (use 1-64 letters, digits, '-' or '_')")
+
+    history = await get_conversation_store(settings).history(session_id)
+    return session_id, history, new_turns
+
+
+async def _record_turns(
+    session_id: Optional[str], new_turns: List[dict], reply: str, settings: dict
+) -> None:
+    """Store a completed exchange, then let long sessions compact in the background."""
+    if session_id is None:
+        return
+    if is_error_text(reply):
+        # A failed turn is not part of the conversation; the user will retry it
+        return
+    try:
+        await get_conversation_store().append(
+            session_id, [*new_turns, {"role": "assistant", "content": reply}]
+        )
+    except Exception:
+        log.exception(f"[ComfyAI] Failed to record conversation {session_id}")
+        return
+    schedule_compaction(session_id, settings)
+
+
+def _fairness_key(request: web.Request, body: dict) -> str:
+    """Queue fairness is per browser session, falling back to client address."""
+    return str(body.get("session_id") or request.remote or "")
+
+
+def _busy_response(e: AdmissionRejected, headers: dict) -> web.Response:
+    """429 / 503 backpressure reply with a Retry-After hint."""
+    log.warning(f"[ComfyAI] {e}")
+    return web.json_response(
+        e.to_dict(),
+        status=e.status,
+        headers={**headers, "Retry-After": str(e.retry_after)},
+    )
+
+
+def _start_request(body: dict) -> str:
+    """Fresh request context; returns the (client-supplied or new) request id."""
+    reset_request_context()
+    return set_session_id(body.get("request_id") or body.get("session_id") or None)
+
+
 async def chat_handler(request: web.Request) -> web.Response:
     """
     POST /api/comfyai/chat
     Non-streaming chat, returns full reply as JSON.
+
+    Body: {provider, model, messages}                 (stateless)
+       or {provider, model, session_id, message}     (server-side history)
     """
     log.error("[ComfyAI][HIT] chat_handler ENTERED")
     try:
@@ -28,18 +136,23 @@ async def chat_handler(request: web.Request) -> web.Response:
     # -------------------------------------------------
     # Mode-aware system prompt injection
     # -------------------------------------------------
-    settings = load_settings()
+    settings = await load_settings_async()
     mode = settings.get("mode", "chat")
 
     log.warning(f"[ComfyAI][DEBUG] Loaded mode = {mode}")
 
     # Resolve layered system prompt (defaults + user settings)
-    final_system_prompt = get_resolved_system_prompt(mode)
+    final_system_prompt = await get_resolved_system_prompt_async(mode)
 
     log.warning(
         f"[ComfyAI][DEBUG] Final system_prompt (mode={mode}) = {final_system_prompt!r}"
     )
 
+    try:
+        session_id, history, new_turns = await _conversation_turns(body, settings)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
     final_messages = []
 
     if final_system_prompt:
@@ -48,38 +161,96 @@ async def chat_handler(request: web.Request) -> web.Response:
             "content": final_system_prompt,
         })
 
-    final_messages.extend(messages)
+    final_messages.extend(history)
+    final_messages.extend(new_turns)
 
     messages = final_messages
     
-    if not provider_id or not model_name or not messages:
+    if not provider_id or not model_name or not new_turns:
         return web.json_response(
             {"error": "Missing provider, model, or messages"}, status=400
         )
 
     mgr = ProviderManager.instance()
-    client = mgr.get_provider(provider_id)
+    provider = mgr.get_provider(provider_id)
 
-    if not client:
+    if not provider:
         return web.json_response({"error": f"Unknown provider '{provider_id}'"}, status=404)
 
-    client.model = model_name
+    # Per-request binding: never mutate the shared provider client
+    client = provider.bind(model=model_name, params=_sampling_params(body, settings), task="chat")
 
-    log.info(f"[ComfyAI] Chat request → provider={provider_id}, model={model_name}")
+    # Fit the prompt into the model's window (system prompt + newest turn always kept)
+    messages = budget_messages(
+        messages, provider_id, model_name, client.params.max_tokens,
+        mgr.get_model_config(provider_id, model_name), ContextConfig.from_settings(settings),
+    ).messages
 
-    try:
-        reply = await client.chat(messages)
-    except Exception as e:
-        log.exception("[ComfyAI] Chat failed")
-        return web.json_response({"error": str(e)}, status=500)
+    request_id = _start_request(body)
+    headers = {REQUEST_ID_HEADER: request_id}
 
-    return web.json_response({"reply": reply})
+    log.info(f"[ComfyAI] Chat request → provider={provider_id}, model={model_name}, id={request_id}")
+
+    cache = get_response_cache(settings, body)
+    cache_id = cache_key(client, messages) if cache else None
+    if cache:
+        cached = await cache.get(cache_id)
+        if cached is not None:
+            await _record_turns(session_id, new_turns, cached, settings)
+            return web.json_response(
+                {"reply": cached, "request_id": request_id, "cached": True},
+                headers={**headers, CACHE_HEADER: "hit"},
+            )
+        headers[CACHE_HEADER] = "miss"
+
+    try:
+        async with client.admission(_fairness_key(request, body)):
+            with track_generation(request_id, provider_id) as handle:
+                task = asyncio.ensure_future(client.chat(messages))
+                handle.on_cancel(task.cancel)
+                watcher = asyncio.ensure_future(watch_disconnect(request, handle))
+                try:
+                    reply = await task
+                except asyncio.CancelledError:
+                    if not handle.cancelled:
+                        # aiohttp cancelled the handler (client gone): count it
+                        handle.cancel("disconnect")
+                        raise
+                    return web.json_response(
+                        {"error": "Request cancelled", "cancelled": True, "request_id": request_id},
+                        status=499, reason="Client Closed Request", headers=headers,
+                    )
+                except AdmissionRejected:
+                    raise  # circuit open: 503 + Retry-After below
+                except DeadlineExceeded as e:
+                    log.warning(f"[ComfyAI] Chat failed: {e}")
+                    return web.json_response({"error": str(e)}, status=504, headers=headers)
+                except Exception as e:
+                    log.exception("[ComfyAI] Chat failed")
+                    return web.json_response({"error": str(e)}, status=500, headers=headers)
+                finally:
+                    watcher.cancel()
+    except AdmissionRejected as e:
+        return _busy_response(e, headers)
+
+    # Provider failures come back as reply text; never replay them
+    if cache and not is_error_text(reply):
+        cache.put(cache_id, reply)
+    await _record_turns(session_id, new_turns, reply, settings)
+
+    return web.json_response({"reply": reply, "request_id": request_id}, headers=headers)
 
 
 async def chat_stream_handler(request: web.Request) -> web.StreamResponse:
     """
     POST /api/comfyai/chat/stream
-    Streaming chat: returns plain text chunks.
+    Streaming chat. Wire format is chosen by body["transport"] or Accept:
+      • "text"   (default) plain text chunks
+      • "sse"    text/event-stream with delta/usage/error/done frames
+      • "ndjson" one typed JSON frame per line
+
+    Accepts the same bodies as /api/comfyai/chat, plus an optional
+    "hedge": true / false overriding the "chat" route's hedging.
     """
     log.error("[ComfyAI][HIT] chat_stream_handler ENTERED")
     try:
@@ -94,18 +265,23 @@ async def chat_stream_handler(request: web.Request) -> web.StreamResponse:
     # -------------------------------------------------
     # Mode-aware system prompt injection
     # -------------------------------------------------
-    settings = load_settings()
+    settings = await load_settings_async()
     mode = settings.get("mode", "chat")
 
     log.warning(f"[ComfyAI][DEBUG] Loaded mode = {mode}")
 
     # Resolve layered system prompt (defaults + user settings)
-    final_system_prompt = get_resolved_system_prompt(mode)
+    final_system_prompt = await get_resolved_system_prompt_async(mode)
 
     log.warning(
         f"[ComfyAI][DEBUG] Final system_prompt (mode={mode}) = {final_system_prompt!r}"
     )
 
+    try:
+        session_id, history, new_turns = await _conversation_turns(body, settings)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
     final_messages = []
 
     if final_system_prompt:
@@ -114,46 +290,125 @@ async def chat_stream_handler(request: web.Request) -> web.StreamResponse:
             "content": final_system_prompt,
         })
 
-    final_messages.extend(messages)
+    final_messages.extend(history)
+    final_messages.extend(new_turns)
 
     messages = final_messages
 
-    if not provider_id or not model_name or not messages:
+    if not provider_id or not model_name or not new_turns:
         return web.json_response(
             {"error": "Missing provider, model, or messages"}, status=400
         )
 
     mgr = ProviderManager.instance()
-    client = mgr.get_provider(provider_id)
+    provider = mgr.get_provider(provider_id)
 
-    if not client:
+    if not provider:
         return web.json_response({"error": f"Unknown provider '{provider_id}'"}, status=404)
 
-    client.model = model_name
+    # Per-request binding: never mutate the shared provider client
+    client = provider.bind(model=model_name, params=_sampling_params(body, settings), task="chat")
+
+    # Fit the prompt into the model's window (system prompt + newest turn always kept)
+    messages = budget_messages(
+        messages, provider_id, model_name, client.params.max_tokens,
+        mgr.get_model_config(provider_id, model_name), ContextConfig.from_settings(settings),
+    ).messages
 
-    log.info(f"[ComfyAI] STREAM chat request → provider={provider_id}, model={model_name}")
+    request_id = _start_request(body)
 
-    resp = web.StreamResponse(
-        status=200,
-        headers={
-            "Content-Type": "text/plain; charset=utf-8",
-        },
+    log.info(
+        f"[ComfyAI] STREAM chat request → provider={provider_id}, "
+        f"model={model_name}, id={request_id}"
     )
 
-    await resp.prepare(request)
+    fmt = negotiate_stream_format(request, body)
+    headers = {**ChatStreamWriter.headers_for(fmt), REQUEST_ID_HEADER: request_id}
+
+    # Cache hits are replayed through the same writer as live output
+    cache = get_response_cache(settings, body)
+    cache_id = cache_key(client, messages) if cache else None
+    cached = await cache.get(cache_id) if cache else None
+    recorder = None
+    if cached is not None:
+        source = replay_stream(cached)
+        headers[CACHE_HEADER] = "hit"
+    else:
+        # Hedged with a second provider when enabled for "chat" (or by body["hedge"])
+        hedge = body.get("hedge")
+        stream = mgr.stream_chat(client, messages, "chat", None if hedge is None else bool(hedge))
+        source = recorder = RecordingStream(stream)
+        if cache:
+            headers[CACHE_HEADER] = "miss"
+
+    async with contextlib.AsyncExitStack() as stack:
+        if recorder is not None:
+            # Live generations queue for a provider slot; cache replays don't.
+            # An open circuit is refused here, before the 200 goes out.
+            # Hedged racers take their own slots, so the hedge timer is not
+            # held up by the primary's queue and the loser's slot is freed.
+            try:
+                if client.breaker is not None:
+                    client.breaker.check()
+                if not isinstance(stream, HedgedStream):
+                    await stack.enter_async_context(client.admission(_fairness_key(request, body)))
+            except AdmissionRejected as e:
+                return _busy_response(e, {REQUEST_ID_HEADER: request_id})
+
+        resp = web.StreamResponse(status=200, headers=headers)
+
+        await resp.prepare(request)
+
+        writer = ChatStreamWriter(resp, fmt, StreamConfig.from_settings(settings))
+
+        with track_generation(request_id, provider_id) as handle:
+            watcher = asyncio.ensure_future(watch_disconnect(request, handle))
+            try:
+                reason = await relay_stream(source, writer, handle)
+                if reason == "stop":
+                    reply = cached if recorder is None else recorder.text
+                    # The cache key names the primary; a hedge's answer is not stored under it
+                    if cache and recorder is not None and not is_error_text(reply):
+                        if not (isinstance(stream, HedgedStream) and stream.winner is not client):
+                            cache.put(cache_id, reply)
+                    await _record_turns(session_id, new_turns, reply, settings)
+            except asyncio.CancelledError:
+                # aiohttp cancelled the handler (client gone): count it, stop upstream
+                handle.cancel("disconnect")
+                raise
+            except Exception:
+                log.exception("[ComfyAI] Streaming chat failed")
+            finally:
+                watcher.cancel()
+                with contextlib.suppress(ConnectionError):
+                    await resp.write_eof()
 
+    return resp
+
+async def chat_cancel_handler(request: web.Request) -> web.Response:
+    """
+    POST /api/comfyai/chat/cancel
+    Body: {"request_id": "..."}  (or "session_id")
+
+    Aborts the matching in-flight generation(s) and their upstream requests.
+    """
     try:
-        async for chunk in client.stream_chat(messages):
-            if not chunk:
-                continue
-            await resp.write(chunk.encode("utf-8"))
-            await resp.drain()
+        body = await request.json()
     except Exception:
-        log.exception("[ComfyAI] Streaming chat failed")
-    finally:
-        await resp.write_eof()
+        return web.json_response({"error": "Invalid JSON"}, status=400)
+
+    request_id = body.get("request_id") or body.get("session_id")
+    if not request_id:
+        return web.json_response({"error": "Missing request_id"}, status=400)
+
+    cancelled = cancel_generation(str(request_id), reason="client")
+    if not cancelled:
+        return web.json_response(
+            {"error": f"No active generation '{request_id}'", "cancelled": 0}, status=404
+        )
+
+    return web.json_response({"status": "ok", "cancelled": cancelled})
 
-    return resp
 
 def setup(app: web.Application) -> None:
     """
@@ -161,5 +416,6 @@ def setup(app: web.Application) -> None:
     """
     app.router.add_post("/api/comfyai/chat", chat_handler)
     app.router.add_post("/api/comfyai/chat/stream", chat_stream_handler)
+    app.router.add_post("/api/comfyai/chat/cancel", chat_cancel_handler)
 
     log.info("[ROUTER] Registered /api/comfyai/chat* routes")
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from aiohttp import web
+
+from ..conversation_store import get_conversation_store, valid_session_id
+from ..utils.logger import log
+from ..utils.settings import load_settings_async
+
+
+def _session_id(request: web.Request) -> str:
+    session_id = request.match_info["session_id"]
+    if not valid_session_id(session_id):
+        raise web.HTTPBadRequest(
+            text='{"error": "Invalid session_id"}', content_type="application/json"
+        )
+    return session_id
+
+
+# ------------------------------
+# GET /api/comfyai/conversations/{session_id}
+# ------------------------------
+async def get_conversation(request: web.Request) -> web.Response:
+    """
+    Messages the server holds for a chat session.
+    """
+    session_id = _session_id(request)
+    store = get_conversation_store(await load_settings_async())
+    messages = await store.history(session_id)
+    return web.json_response({"session_id": session_id, "messages": messages})
+
+
+# ------------------------------
+# DELETE /api/comfyai/conversations/{session_id}
+# ------------------------------
+async def delete_conversation(request: web.Request) -> web.Response:
+    """
+    Forget a chat session (memory and on-disk log).
+    """
+    session_id = _session_id(request)
+    await get_conversation_store().reset(session_id)
+    return web.json_response({"status": "ok", "session_id": session_id})
+
+
+# ------------------------------
+# ROUTE REGISTRATION
+# ------------------------------
+def setup(app: web.Application) -> None:
+    """
+    Registers /api/comfyai/conversations endpoints.
+    """
+    app.router.add_get("/api/comfyai/conversations/{session_id}", get_conversation)
+    app.router.add_delete("/api/comfyai/conversations/{session_id}", delete_conversation)
+
+    log.info("[ROUTER] Registered /api/comfyai/conversations routes")
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from aiohttp import web
+
+from ..provider_manager import ProviderManager
+from ..service.rewrite_jobs import get_rewrite_jobs
+from ..utils import metrics
+from ..utils.logger import log
+
+
+# ------------------------------
+# GET /api/comfyai/metrics
+# ------------------------------
+async def get_metrics(request: web.Request) -> web.Response:
+    """
+    Runtime counters, gauges and summaries plus connection pool,
+    admission queue, circuit breaker, hedging, balancer and rewrite job stats.
+    """
+    mgr = request.app.get("provider_manager") or ProviderManager.instance()
+
+    data = metrics.snapshot()
+    data["pools"] = mgr.pool_stats()
+    data["admission"] = mgr.admission_stats()
+    data["breakers"] = mgr.breaker_stats()
+    data["hedging"] = mgr.hedge_stats()
+    data["balancers"] = mgr.balancer_stats()
+    data["rewrite_jobs"] = get_rewrite_jobs().stats()
+    return web.json_response(data)
+
+
+# ------------------------------
+# ROUTE REGISTRATION
+# ------------------------------
+def setup(app: web.Application) -> None:
+    """
+    Registers /api/comfyai/metrics endpoint.
+    """
+    app.router.add_get("/api/comfyai/metrics", get_metrics)
+
+    log.info("[ROUTER] Registered /api/comfyai/metrics route")
@@ -7,13 +7,17 @@ from typing import Any, Dict, List, Tuple
 
 from aiohttp import web
 
-from ..provider_manager import ProviderManager
+from ..provider_manager import DEFAULT_ROUTES, ProviderManager
 from ..utils.logger import log
 from ..utils.paths import PROVIDERS_PATH
+from ..utils.persistence import atomic_write_json, providers_lock, run_io
 
 
 # ---------------------------------------------------------------------------
 # Low-level helpers to read/write providers.json
+#
+# These are blocking; handlers run them on the I/O thread via run_io() while
+# holding providers_lock() so concurrent add/save/delete calls never race.
 # ---------------------------------------------------------------------------
 
 def _load_providers_file() -> Tuple[Dict[str, Any], Dict[str, Any]]:
@@ -51,20 +55,18 @@ def _save_providers_file(root: Dict[str, Any]) -> None:
     """
     Persist the updated providers.json to disk.
     """
-    PROVIDERS_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with PROVIDERS_PATH.open("w", encoding="utf-8") as f:
-        json.dump(root, f, indent=2)
+    atomic_write_json(PROVIDERS_PATH, root, indent=2)
     log.info(f"[ComfyAI] Saved providers.json at {PROVIDERS_PATH}")
 
 
-def _reload_provider_manager(request: web.Request) -> None:
+async def _reload_provider_manager(request: web.Request) -> None:
     """
-    Reinitialize the existing ProviderManager instance in-place so that
+    Reload the existing ProviderManager instance in-place so that
     all ChatClient instances and config reflect the latest providers.json.
     """
     mgr = request.app.get("provider_manager") or ProviderManager.instance()
-    # Re-run __init__ on the same instance to refresh config/providers.
-    mgr.__init__()  # type: ignore[misc]
+    # reload() (unlike re-running __init__) closes the old connection pools.
+    await mgr.reload_async()
     log.info("[ComfyAI] ProviderManager reloaded after config change")
 
 
@@ -141,6 +143,66 @@ async def list_models(request: web.Request) -> web.Response:
     return web.json_response(models_out)
 
 
+# ---------------------------------------------------------------------------
+# GET /api/comfyai/providers/pools
+# ---------------------------------------------------------------------------
+
+async def list_pools(request: web.Request) -> web.Response:
+    """
+    Connection pool statistics per provider.
+
+    Response:
+    {
+      "pools": {
+        "ollama": { "requests": 12, "in_flight": 1, "idle_connections": 2, ... }
+      }
+    }
+    """
+    mgr = request.app.get("provider_manager") or ProviderManager.instance()
+    return web.json_response({"pools": mgr.pool_stats()})
+
+
+# ---------------------------------------------------------------------------
+# GET /api/comfyai/providers/health
+# ---------------------------------------------------------------------------
+
+async def provider_health(request: web.Request) -> web.Response:
+    """
+    Circuit breaker state per provider, the failover chain per task, the
+    latency statistics adaptive routing scores with, hedge outcomes and the
+    hosts of balanced providers, so the UI can grey out providers that are
+    currently refusing calls.
+
+    Response:
+    {
+      "providers": {
+        "ollama": { "state": "open", "available": false, "retry_after": 17, ... }
+      },
+      "routing": {
+        "rewrite": ["cloud_workflow", "ollama"]
+      },
+      "stats": {
+        "ollama": { "llama3.2": { "ttft_s": 0.41, "tokens_per_s": 38.2, "in_flight": 1, ... } }
+      },
+      "hedging": {
+        "ollama": { "requests": 40, "hedged": 3, "hedge_rate": 0.075, "hedge_wins": 2, ... }
+      },
+      "balancers": {
+        "gpu_pool": { "healthy": 2, "endpoints": [{ "url": "http://gpu1:11434", "outstanding": 1, ... }] }
+      }
+    }
+    """
+    mgr = request.app.get("provider_manager") or ProviderManager.instance()
+    tasks = set(DEFAULT_ROUTES) | set(mgr.routes)
+    return web.json_response({
+        "providers": mgr.breaker_stats(),
+        "routing": {task: mgr.failover_chain(task) for task in sorted(tasks)},
+        "stats": mgr.routing_stats(),
+        "hedging": mgr.hedge_stats(),
+        "balancers": mgr.balancer_stats(),
+    })
+
+
 # ---------------------------------------------------------------------------
 # POST /api/comfyai/providers/add
 # ---------------------------------------------------------------------------
@@ -175,24 +237,26 @@ async def add_provider(request: web.Request) -> web.Response:
     provider_cfg_dict = dict(body)
     provider_cfg_dict.pop("id", None)
 
-    try:
-        root, providers_raw = _load_providers_file()
-    except Exception as e:
-        log.exception("[ComfyAI] Failed to load providers.json in add_provider")
-        return web.json_response({"error": str(e)}, status=500)
+    # Serialize read-modify-write + reload across concurrent requests
+    async with providers_lock():
+        try:
+            root, providers_raw = await run_io(_load_providers_file)
+        except Exception as e:
+            log.exception("[ComfyAI] Failed to load providers.json in add_provider")
+            return web.json_response({"error": str(e)}, status=500)
 
-    if provider_id in providers_raw:
-        return web.json_response({"error": f"Provider '{provider_id}' already exists"}, status=400)
+        if provider_id in providers_raw:
+            return web.json_response({"error": f"Provider '{provider_id}' already exists"}, status=400)
 
-    providers_raw[provider_id] = provider_cfg_dict
+        providers_raw[provider_id] = provider_cfg_dict
 
-    try:
-        _save_providers_file(root)
-    except Exception as e:
-        log.exception("[ComfyAI] Failed to save providers.json in add_provider")
-        return web.json_response({"error": str(e)}, status=500)
+        try:
+            await run_io(_save_providers_file, root)
+        except Exception as e:
+            log.exception("[ComfyAI] Failed to save providers.json in add_provider")
+            return web.json_response({"error": str(e)}, status=500)
 
-    _reload_provider_manager(request)
+        await _reload_provider_manager(request)
 
     return web.json_response({"status": "ok", "id": provider_id})
 
@@ -227,27 +291,28 @@ async def save_provider(request: web.Request) -> web.Response:
     if not provider_id:
         return web.json_response({"error": "Missing 'id' field"}, status=400)
 
-    try:
-        root, providers_raw = _load_providers_file()
-    except Exception as e:
-        log.exception("[ComfyAI] Failed to load providers.json in save_provider")
-        return web.json_response({"error": str(e)}, status=500)
+    async with providers_lock():
+        try:
+            root, providers_raw = await run_io(_load_providers_file)
+        except Exception as e:
+            log.exception("[ComfyAI] Failed to load providers.json in save_provider")
+            return web.json_response({"error": str(e)}, status=500)
 
-    cfg = providers_raw.get(provider_id)
-    if not isinstance(cfg, dict):
-        return web.json_response({"error": f"Provider '{provider_id}' not found"}, status=404)
+        cfg = providers_raw.get(provider_id)
+        if not isinstance(cfg, dict):
+            return web.json_response({"error": f"Provider '{provider_id}' not found"}, status=404)
 
-    # Shallow merge updates into existing provider dict
-    for k, v in updates.items():
-        cfg[k] = v
+        # Shallow merge updates into existing provider dict
+        for k, v in updates.items():
+            cfg[k] = v
 
-    try:
-        _save_providers_file(root)
-    except Exception as e:
-        log.exception("[ComfyAI] Failed to save providers.json in save_provider")
-        return web.json_response({"error": str(e)}, status=500)
+        try:
+            await run_io(_save_providers_file, root)
+        except Exception as e:
+            log.exception("[ComfyAI] Failed to save providers.json in save_provider")
+            return web.json_response({"error": str(e)}, status=500)
 
-    _reload_provider_manager(request)
+        await _reload_provider_manager(request)
 
     return web.json_response({"status": "ok"})
 
@@ -266,24 +331,25 @@ async def delete_provider(request: web.Request) -> web.Response:
     if not provider_id:
         return web.json_response({"error": "Missing provider id in URL"}, status=400)
 
-    try:
-        root, providers_raw = _load_providers_file()
-    except Exception as e:
-        log.exception("[ComfyAI] Failed to load providers.json in delete_provider")
-        return web.json_response({"error": str(e)}, status=500)
+    async with providers_lock():
+        try:
+            root, providers_raw = await run_io(_load_providers_file)
+        except Exception as e:
+            log.exception("[ComfyAI] Failed to load providers.json in delete_provider")
+            return web.json_response({"error": str(e)}, status=500)
 
-    if provider_id not in providers_raw:
-        return web.json_response({"error": f"Provider '{provider_id}' not found"}, status=404)
+        if provider_id not in providers_raw:
+            return web.json_response({"error": f"Provider '{provider_id}' not found"}, status=404)
 
-    del providers_raw[provider_id]
+        del providers_raw[provider_id]
 
-    try:
-        _save_providers_file(root)
-    except Exception as e:
-        log.exception("[ComfyAI] Failed to save providers.json in delete_provider")
-        return web.json_response({"error": str(e)}, status=500)
+        try:
+            await run_io(_save_providers_file, root)
+        except Exception as e:
+            log.exception("[ComfyAI] Failed to save providers.json in delete_provider")
+            return web.json_response({"error": str(e)}, status=500)
 
-    _reload_provider_manager(request)
+        await _reload_provider_manager(request)
 
     return web.json_response({"status": "ok"})
 
@@ -298,6 +364,8 @@ def setup(app: web.Application) -> None:
     """
     app.router.add_get("/api/comfyai/providers", list_providers)
     app.router.add_get("/api/comfyai/models", list_models)
+    app.router.add_get("/api/comfyai/providers/pools", list_pools)
+    app.router.add_get("/api/comfyai/providers/health", provider_health)
     app.router.add_post("/api/comfyai/providers/add", add_provider)
     app.router.add_post("/api/comfyai/providers/save", save_provider)
     app.router.add_delete("/api/comfyai/providers/{provider_id}", delete_provider)
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+
+from aiohttp import web
+
+from ..provider_manager import ProviderManager
+from ..service.rewrite_batch import BatchConfig, parse_batch_items, rewrite_batch
+from ..service.workflow_rewrite_agent import REWRITE_MODES
+from ..utils.logger import log
+from ..utils.settings import load_settings_async
+from ..utils.stream_writer import (
+    STREAM_NDJSON,
+    STREAM_TEXT,
+    ChatStreamWriter,
+    StreamConfig,
+    negotiate_stream_format,
+)
+
+
+def _clients(body: dict, config: BatchConfig) -> list:
+    """Providers named in the request (or settings), else the rewrite provider."""
+    mgr = ProviderManager.instance()
+    names = body.get("providers") or config.providers
+    if not names:
+        client = mgr.pick_provider("rewrite")
+        return [client] if client is not None else []
+    if not isinstance(names, (list, tuple)):
+        raise ValueError("`providers` must be a list of provider ids")
+
+    clients = []
+    for name in names:
+        client = mgr.get_provider(str(name))
+        if client is None:
+            raise ValueError(f"Unknown provider '{name}'")
+        clients.append(client)
+    return clients
+
+
+# ------------------------------
+# POST /api/workflow/rewrite/batch
+# ------------------------------
+async def rewrite_batch_handler(request: web.Request) -> web.StreamResponse:
+    """
+    Apply one instruction to many workflows, streaming results as they finish.
+
+    Body:
+        {
+            "workflows": [{ ... }, ...],   # graphs, or {"id", "workflow", "prompt"?}
+            "prompt": "Swap every sampler to dpmpp_2m",
+            "mode": "patch",               # optional, as /api/workflow/rewrite
+            "cache": false,                # optional
+            "providers": ["ollama", ...],  # optional, spread items over these
+            "concurrency": 4               # optional, capped by settings
+        }
+
+    Response: NDJSON (or SSE with "transport": "sse" / Accept header) frames
+    "start", one "item" per workflow in completion order, then "done".
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return web.json_response({"error": "Invalid JSON"}, status=400)
+    if not isinstance(body, dict):
+        return web.json_response({"error": "Expected a JSON object"}, status=400)
+
+    settings = await load_settings_async()
+    config = BatchConfig.from_settings(settings)
+
+    prompt = body.get("prompt")
+    mode = body.get("mode")
+    try:
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("Missing `prompt`")
+        if mode is not None and mode not in REWRITE_MODES:
+            raise ValueError(f"Invalid mode {mode!r} (expected one of: {', '.join(REWRITE_MODES)})")
+        items = parse_batch_items(body.get("workflows"), config.max_items)
+        clients = _clients(body, config)
+        concurrency = min(config.concurrency, max(1, int(body.get("concurrency") or config.concurrency)))
+    except (TypeError, ValueError) as e:
+        return web.json_response({"error": str(e)}, status=400)
+    if not clients:
+        return web.json_response({"error": "No LLM provider configured"}, status=503)
+
+    fmt = negotiate_stream_format(request, body)
+    if fmt == STREAM_TEXT:
+        fmt = STREAM_NDJSON  # results need typed frames
+
+    resp = web.StreamResponse(status=200, headers=ChatStreamWriter.headers_for(fmt))
+    await resp.prepare(request)
+    writer = ChatStreamWriter(resp, fmt, StreamConfig.from_settings(settings))
+
+    log.info(
+        f"[ComfyAI] Batch rewrite of {len(items)} workflow(s) on "
+        f"{', '.join(c.provider_name for c in clients)} (concurrency {concurrency})"
+    )
+    started = time.monotonic()
+    counts = {"ok": 0, "error": 0}
+    results = rewrite_batch(
+        items, prompt, clients, concurrency,
+        mode=mode, use_cache=body.get("cache") is not False,
+    )
+    pending = None
+    try:
+        await writer.event("start", {
+            "total": len(items),
+            "providers": [c.provider_name for c in clients],
+            "concurrency": concurrency,
+        })
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(results.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=writer.config.heartbeat_s)
+            if not done:
+                await writer.heartbeat()
+                continue
+            try:
+                entry = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+            counts[entry["status"]] += 1
+            await writer.event("item", entry)
+
+        await writer.event("done", {
+            "total": len(items),
+            "ok": counts["ok"],
+            "failed": counts["error"],
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+        })
+    except ConnectionError:
+        log.info("[ComfyAI] Batch rewrite client went away; cancelling remaining items")
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        await results.aclose()
+        with contextlib.suppress(ConnectionError):
+            await resp.write_eof()
+
+    return resp
+
+
+# ------------------------------
+# ROUTE REGISTRATION
+# ------------------------------
+def setup(app: web.Application) -> None:
+    """
+    Registers /api/workflow/rewrite/batch endpoint.
+    """
+    app.router.add_post("/api/workflow/rewrite/batch", rewrite_batch_handler)
+
+    log.info("[ROUTER] Registered /api/workflow/rewrite/batch route")
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from aiohttp import web
+
+from ..service.rewrite_jobs import JobQueueFull, RewriteJob, get_rewrite_jobs, valid_job_id
+from ..utils.logger import log
+from ..utils.settings import load_settings_async
+
+
+async def _job(request: web.Request) -> RewriteJob:
+    job_id = request.match_info["job_id"]
+    job = await get_rewrite_jobs().get(job_id) if valid_job_id(job_id) else None
+    if job is None:
+        raise web.HTTPNotFound(
+            text=f'{{"error": "Unknown or expired job {job_id}"}}', content_type="application/json"
+        )
+    return job
+
+
+def _status(job: RewriteJob) -> dict:
+    data = job.info()
+    data["position"] = get_rewrite_jobs().position(job)
+    return data
+
+
+# ------------------------------
+# POST /api/workflow/rewrite/jobs
+# ------------------------------
+async def submit_job(request: web.Request) -> web.Response:
+    """
+    Queue a workflow rewrite; returns 202 with the job id.
+
+    Body: the /api/workflow/rewrite fields ("workflow", "prompt", "mode",
+    "cache") plus optional "priority" ("high" / "normal" / "low") and
+    "client_id" (ComfyUI websocket client to send progress events to).
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return web.json_response({"error": "Invalid JSON"}, status=400)
+    if not isinstance(body, dict):
+        return web.json_response({"error": "Expected a JSON object"}, status=400)
+
+    jobs = get_rewrite_jobs(await load_settings_async())
+    try:
+        job = await jobs.submit(body, priority=body.get("priority"), client_id=body.get("client_id"))
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    except JobQueueFull as e:
+        return web.json_response({"error": str(e)}, status=429, headers={"Retry-After": "30"})
+
+    return web.json_response(_status(job), status=202)
+
+
+# ------------------------------
+# GET /api/workflow/rewrite/jobs/{job_id}
+# ------------------------------
+async def job_status(request: web.Request) -> web.Response:
+    """
+    Job status and queue position.
+    """
+    return web.json_response(_status(await _job(request)))
+
+
+# ------------------------------
+# GET /api/workflow/rewrite/jobs/{job_id}/result
+# ------------------------------
+async def job_result(request: web.Request) -> web.Response:
+    """
+    The rewrite result (200) once the job is done; 202 while it is queued or
+    running, 409 if it failed or was cancelled.
+    """
+    job = await _job(request)
+    data = _status(job)
+    if job.status == "done":
+        data["result"] = job.result
+        return web.json_response(data)
+    return web.json_response(data, status=409 if job.done else 202)
+
+
+# ------------------------------
+# DELETE /api/workflow/rewrite/jobs/{job_id}
+# ------------------------------
+async def cancel_job(request: web.Request) -> web.Response:
+    """
+    Cancel a queued or running job.
+    """
+    job = await _job(request)
+    if job.done:
+        return web.json_response({**_status(job), "error": f"Job already {job.status}"}, status=409)
+    await get_rewrite_jobs().cancel(job.job_id)
+    return web.json_response(_status(job))
+
+
+# ------------------------------
+# LIFECYCLE
+# ------------------------------
+async def _start_jobs(app: web.Application) -> None:
+    await get_rewrite_jobs(await load_settings_async()).start()
+
+
+async def _stop_jobs(app: web.Application) -> None:
+    await get_rewrite_jobs().stop()
+
+
+# ------------------------------
+# ROUTE REGISTRATION
+# ------------------------------
+def setup(app: web.Application) -> None:
+    """
+    Registers /api/workflow/rewrite/jobs endpoints; persisted jobs resume when
+    the server starts.
+    """
+    app.router.add_post("/api/workflow/rewrite/jobs", submit_job)
+    app.router.add_get("/api/workflow/rewrite/jobs/{job_id}", job_status)
+    app.router.add_get("/api/workflow/rewrite/jobs/{job_id}/result", job_result)
+    app.router.add_delete("/api/workflow/rewrite/jobs/{job_id}", cancel_job)
+
+    app.on_startup.append(_start_jobs)
+    # Before the provider pools close: running jobs are saved for the next start
+    app.on_cleanup.insert(0, _stop_jobs)
+
+    log.info("[ROUTER] Registered /api/workflow/rewrite/jobs routes")
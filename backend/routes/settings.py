@@ -2,13 +2,14 @@ from __future__ import annotations
 from aiohttp import web
 
 from ..utils.logger import log
-from ..utils.settings import load_settings, save_settings as save_settings_to_disk
+from ..utils.persistence import settings_lock
+from ..utils.settings import load_settings_async, stage_settings_async
 
 # ------------------------------
 # GET /api/comfyai/settings
 # ------------------------------
 async def get_settings(request: web.Request) -> web.Response:
-    settings = load_settings()
+    settings = await load_settings_async()
     return web.json_response(settings)
 
 def deep_merge(base: dict, incoming: dict) -> dict:
@@ -38,9 +39,15 @@ async def save_settings(request: web.Request) -> web.Response:
         body.pop("defaults", None)
 
     try:
-        settings = load_settings()
-        merged = deep_merge(settings, body)
-        save_settings_to_disk(merged)
+        # Serialized like providers.json edits so concurrent saves never
+        # merge into the same stale copy. The lock only covers the cache
+        # update: a burst of saves still shares one disk write, and each
+        # reply waits for the write that covers it.
+        async with settings_lock():
+            settings = await load_settings_async()
+            merged = deep_merge(settings, body)
+            written = await stage_settings_async(merged)
+        await written
         return web.json_response(merged)
     except Exception as e:
         log.exception("[ComfyAI] Failed to save settings")
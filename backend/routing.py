@@ -0,0 +1,297 @@
+"""
+ComfyAI - Adaptive Provider Routing
+
+ProviderManager.pick_provider(task) routes each task along a TaskRoute:
+
+  • ordered    the first provider of the failover chain whose circuit is not
+               open (the behaviour without configuration)
+  • adaptive   the best-scoring (provider, model) among the route's
+               candidates, from rolling statistics every ChatClient call
+               feeds into the RoutingStats registry
+
+Statistics are kept per provider and model: EWMA time to first token,
+tokens/sec and error rate, plus calls in flight (queued ones included). A
+candidate's score is its expected latency for a typical answer, inflated by
+load and errors — lower is better:
+
+    (ttft + expected_tokens / tps) * (1 + in_flight / capacity)
+                                   / (1 - error_rate)
+
+where `in_flight` counts every call on the provider (a saturated GPU box is
+slow for all of its models) and `capacity` is the provider's admission
+`max_in_flight` (4 when unlimited). Models without samples yet use
+optimistic priors so they get tried, and the error rate decays towards 0
+while a model is idle so one bad minute is not held against it forever.
+
+Candidates must satisfy the route's constraints, read from the provider's
+`models[]` entries: `requires` against `capabilities` and `min_context`
+against `context`. Models that declare a match are preferred, models that
+declare nothing come next, and declared mismatches are only used when
+nothing else is left.
+
+Routes live in providers.json "routing"; a list keeps the ordered failover
+chain, an object selects the strategy:
+
+    "routing": {
+      "rewrite": ["cloud_workflow", "local_apply"],
+      "chat": {
+        "strategy": "adaptive",        # default for object routes
+        "providers": [],               # candidates; empty = all providers
+        "requires": ["tools"],         # ModelConfig.capabilities
+        "min_context": 16384,          # ModelConfig.context
+        "pin": null,                   # provider id that always wins
+        "expected_tokens": 256,        # answer size the score assumes
+        "hedge": false                 # hedge slow streams (see hedging.py)
+      }
+    }
+
+Callers may also pin a provider per request (pick_provider(task, pin=...)).
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .utils import metrics
+from .utils.logger import log
+
+
+ORDERED = "ordered"
+ADAPTIVE = "adaptive"
+
+# EWMA weight of the newest sample
+EWMA_ALPHA = 0.2
+
+# Priors for models without samples (optimistic, so new models get traffic)
+PRIOR_TTFT_S = 1.0
+PRIOR_TPS = 30.0
+
+# Idle models' error rate halves every ERROR_HALF_LIFE_S seconds
+ERROR_HALF_LIFE_S = 60.0
+
+# Load normaliser for providers without an admission limit
+DEFAULT_CAPACITY = 4
+
+
+# ============================================================
+# Route settings
+# ============================================================
+
+def _names(value: Any) -> Tuple[str, ...]:
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple)):
+        return ()
+    return tuple(str(v) for v in value if v)
+
+
+@dataclass(frozen=True)
+class TaskRoute:
+    strategy: str = ORDERED
+    providers: Tuple[str, ...] = ()
+    requires: Tuple[str, ...] = ()
+    min_context: Optional[int] = None
+    pin: Optional[str] = None
+    expected_tokens: int = 256
+    hedge: bool = False
+
+    @classmethod
+    def from_config(cls, raw: Any, task: str = "") -> "TaskRoute":
+        """Build from a providers.json "routing" value, ignoring junk."""
+        if raw is None:
+            return cls()
+        if isinstance(raw, (str, list, tuple)):
+            return cls(providers=_names(raw))
+        if not isinstance(raw, dict):
+            log.warning(f"[ComfyAI] routing.{task} must be a list or an object, ignoring it")
+            return cls()
+
+        defaults = cls()
+
+        def _num(key: str, default: Any) -> Any:
+            value = raw.get(key, default)
+            if value is None:
+                return None
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                log.warning(f"[ComfyAI] Invalid routing.{task}.{key}={value!r}, using {default!r}")
+                return default
+
+        strategy = str(raw.get("strategy") or ADAPTIVE).lower()
+        if strategy not in (ORDERED, ADAPTIVE):
+            log.warning(f"[ComfyAI] Unknown routing.{task}.strategy={strategy!r}, using '{ADAPTIVE}'")
+            strategy = ADAPTIVE
+        min_context = _num("min_context", None)
+        return cls(
+            strategy=strategy,
+            providers=_names(raw.get("providers")),
+            requires=_names(raw.get("requires")),
+            min_context=min_context if min_context and min_context > 0 else None,
+            pin=str(raw["pin"]) if raw.get("pin") else None,
+            expected_tokens=max(1, _num("expected_tokens", defaults.expected_tokens) or 1),
+            hedge=bool(raw.get("hedge", False)),
+        )
+
+
+def constraint_tier(
+    capabilities: Optional[Iterable[str]],
+    context: Optional[int],
+    requires: Iterable[str] = (),
+    min_context: Optional[int] = None,
+) -> int:
+    """
+    0 when the model declares everything asked for, 1 when it declares too
+    little to tell, 2 when it declares a mismatch.
+    """
+    tier = 0
+    requires = [r.lower() for r in requires]
+    if requires:
+        declared = {c.lower() for c in capabilities or ()}
+        if not declared:
+            tier = 1
+        elif not all(r in declared for r in requires):
+            return 2
+    if min_context:
+        if context is None:
+            tier = 1
+        elif context < min_context:
+            return 2
+    return tier
+
+
+# ============================================================
+# Statistics
+# ============================================================
+
+def _ewma(current: Optional[float], sample: float) -> float:
+    return sample if current is None else current + EWMA_ALPHA * (sample - current)
+
+
+class ModelStats:
+    """Rolling latency / throughput / error statistics of one provider model."""
+
+    def __init__(self) -> None:
+        self.ttft: Optional[float] = None  # seconds
+        self.tps: Optional[float] = None  # output tokens per second
+        self._error_rate = 0.0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.last_update = time.monotonic()
+
+    def error_rate(self, now: Optional[float] = None) -> float:
+        idle = (now or time.monotonic()) - self.last_update
+        return self._error_rate * math.pow(0.5, max(0.0, idle) / ERROR_HALF_LIFE_S)
+
+    def record(
+        self,
+        ok: bool,
+        ttft: Optional[float] = None,
+        tokens: int = 0,
+        seconds: Optional[float] = None,
+    ) -> None:
+        now = time.monotonic()
+        self._error_rate = _ewma(self.error_rate(now), 0.0 if ok else 1.0)
+        self.last_update = now
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+            return
+        if ttft is not None:
+            self.ttft = _ewma(self.ttft, ttft)
+        if tokens > 0 and seconds is not None and seconds > 0:
+            self.tps = _ewma(self.tps, tokens / seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ttft_s": None if self.ttft is None else round(self.ttft, 3),
+            "tokens_per_s": None if self.tps is None else round(self.tps, 1),
+            "error_rate": round(self.error_rate(), 3),
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+        }
+
+
+class RoutingStats:
+    """Per-(provider, model) ModelStats, fed by every ChatClient call."""
+
+    def __init__(self) -> None:
+        self._models: Dict[Tuple[str, str], ModelStats] = {}
+
+    def model(self, provider: str, model: str) -> ModelStats:
+        key = (provider, model)
+        stats = self._models.get(key)
+        if stats is None:
+            stats = self._models[key] = ModelStats()
+        return stats
+
+    def start(self, provider: str, model: str) -> None:
+        self.model(provider, model).in_flight += 1
+
+    def finish(
+        self,
+        provider: str,
+        model: str,
+        ok: Optional[bool],
+        ttft: Optional[float] = None,
+        tokens: int = 0,
+        seconds: Optional[float] = None,
+    ) -> None:
+        """End a call started with start(); ok=None records no outcome (cancelled)."""
+        stats = self.model(provider, model)
+        stats.in_flight = max(0, stats.in_flight - 1)
+        if ok is None:
+            return
+        stats.record(ok, ttft, tokens, seconds)
+        if ttft is not None and ok:
+            metrics.observe(f"routing.{provider}.ttft_s", ttft)
+
+    def provider_in_flight(self, provider: str) -> int:
+        return sum(s.in_flight for (p, _), s in self._models.items() if p == provider)
+
+    def score(
+        self,
+        provider: str,
+        model: str,
+        capacity: int = DEFAULT_CAPACITY,
+        expected_tokens: int = 256,
+    ) -> float:
+        """Expected seconds for a typical answer, inflated by load and errors."""
+        stats = self._models.get((provider, model)) or ModelStats()
+        ttft = stats.ttft if stats.ttft is not None else PRIOR_TTFT_S
+        tps = stats.tps if stats.tps is not None else PRIOR_TPS
+        latency = ttft + expected_tokens / max(tps, 0.1)
+        load = 1.0 + self.provider_in_flight(provider) / max(1, capacity)
+        return latency * load / max(0.05, 1.0 - stats.error_rate())
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (provider, model), stats in sorted(self._models.items()):
+            out.setdefault(provider, {})[model] = stats.snapshot()
+        return out
+
+    def reset(self) -> None:
+        self._models.clear()
+
+
+_stats = RoutingStats()
+
+
+def get_routing_stats() -> RoutingStats:
+    return _stats
+
+
+__all__ = [
+    "ADAPTIVE",
+    "ModelStats",
+    "ORDERED",
+    "RoutingStats",
+    "TaskRoute",
+    "constraint_tier",
+    "get_routing_stats",
+]
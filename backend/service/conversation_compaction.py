@@ -0,0 +1,129 @@
+"""
+ComfyAI - Conversation Compaction
+
+Background job that folds the older turns of a long chat session into a
+rolling summary, so each new turn's prompt stays small.
+
+After a turn is recorded, schedule_compaction() checks (off the request
+path) whether the session's context has grown past
+conversations.compact_threshold_tokens. If so, a cheap model —
+conversations.compact_provider / compact_model, or
+ProviderManager.pick_provider("summarize") — summarizes the previous summary
+plus every turn except the newest `compact_keep_recent` messages, and the
+result replaces those turns in ConversationStore.history().
+
+At most one job runs per session; the user never waits for it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import time
+from typing import Any, Dict, Optional
+
+from ..agent_factory import ChatClient, SamplingParams, is_error_text
+from ..context_budget import message_tokens
+from ..conversation_store import ConversationConfig, CompactionWindow, get_conversation_store
+from ..provider_manager import ProviderManager
+from ..utils import metrics
+from ..utils.logger import log
+
+
+SUMMARY_MAX_TOKENS = 512
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and "
+    "ComfyAI, an assistant for ComfyUI. Merge the previous summary (if any) "
+    "with the new turns into one concise summary. Keep facts, decisions, "
+    "node names, model names, settings and open questions; drop pleasantries. "
+    "Write plain prose or short bullet points, no preamble."
+)
+
+# session_id -> running job
+_jobs: Dict[str, asyncio.Task] = {}
+
+
+def schedule_compaction(session_id: str, settings: Dict[str, Any]) -> Optional[asyncio.Task]:
+    """Start a compaction check for `session_id` unless one is already running."""
+    config = ConversationConfig.from_settings(settings)
+    if config.compact_threshold_tokens is None or session_id in _jobs:
+        return None
+
+    # Run in a fresh context: the job must not inherit the request's
+    # admission slot or request context.
+    loop = asyncio.get_running_loop()
+    task = contextvars.Context().run(loop.create_task, _compact(session_id, config))
+    _jobs[session_id] = task
+    task.add_done_callback(lambda _: _jobs.pop(session_id, None))
+    return task
+
+
+def _summarizer(config: ConversationConfig) -> Optional[ChatClient]:
+    mgr = ProviderManager.instance()
+    client = mgr.get_provider(config.compact_provider) if config.compact_provider else None
+    if client is None:
+        client = mgr.pick_provider("summarize")
+    if client is None:
+        return None
+    return client.bind(
+        model=config.compact_model,
+        params=SamplingParams(temperature=0.2, max_tokens=SUMMARY_MAX_TOKENS),
+        task="summarize",
+    )
+
+
+def _summary_request(window: CompactionWindow) -> list:
+    transcript = "\n\n".join(
+        f"{m['role'].upper()}: {m['content']}" for m in window.messages
+    )
+    parts = []
+    if window.previous_summary:
+        parts.append(f"Previous summary:\n{window.previous_summary}")
+    parts.append(f"New turns:\n{transcript}")
+    parts.append("Return the updated summary only.")
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": "\n\n".join(parts)},
+    ]
+
+
+async def _compact(session_id: str, config: ConversationConfig) -> None:
+    store = get_conversation_store()
+    try:
+        history = await store.history(session_id)
+        tokens = sum(message_tokens(m) for m in history)
+        if tokens < config.compact_threshold_tokens:
+            return
+
+        window = await store.compaction_window(session_id, config.compact_keep_recent)
+        if window is None:
+            return
+
+        llm = _summarizer(config)
+        if llm is None:
+            log.warning("[ComfyAI] No provider available for conversation compaction")
+            return
+
+        started = time.monotonic()
+        async with llm.admission(f"compaction:{session_id}"):
+            summary = (await llm.chat(_summary_request(window))).strip()
+        metrics.observe("conversations.compaction_ms", (time.monotonic() - started) * 1000)
+
+        if not summary or is_error_text(summary):
+            # Providers report failures as reply text; keep the turns as they are
+            metrics.incr("conversations.compaction_failed")
+            log.warning(f"[ComfyAI] Conversation compaction failed for {session_id}: {summary[:200]!r}")
+            return
+
+        if await store.set_summary(window, summary):
+            log.info(
+                f"[ComfyAI] Compacted conversation {session_id}: {len(window.messages)} "
+                f"message(s) (~{tokens} tokens) summarized with {llm.provider_name}/{llm.model}"
+            )
+    except Exception:
+        metrics.incr("conversations.compaction_failed")
+        log.exception(f"[ComfyAI] Conversation compaction failed for {session_id}")
+
+
+__all__ = ["schedule_compaction"]
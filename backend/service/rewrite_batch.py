@@ -0,0 +1,212 @@
+"""
+ComfyAI - Batch Workflow Rewrites
+
+Applies one instruction to many workflows ("swap every sampler to
+dpmpp_2m and set steps to 25") without N sequential round trips.
+
+rewrite_batch() runs rewrite_workflow() for every item concurrently, at
+most `concurrency` at a time, and yields each item's result as soon as it
+finishes (completion order, tagged with the item's index and id). Items
+are spread over the given providers, each new item going to the provider
+with the fewest batch items in flight; per-provider admission control
+still applies on top. Every item of one kind shares the same system prompt
+(see workflow_rewrite_tools.system_prompt), so providers that cache prompt
+prefixes only process it once.
+
+Configuration lives in settings.json:
+
+    "workflow": {
+      "rewrite": {
+        "batch": {
+          "concurrency": 4,    # items in flight at once
+          "max_items": 100,    # largest accepted batch
+          "providers": null    # provider ids to spread over; default: the rewrite provider
+        }
+      }
+    }
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from ..admission import AdmissionRejected
+from ..agent_factory import ChatClient
+from ..utils import metrics
+from ..utils.logger import log
+from ..utils.request_context import reset_request_context
+from .workflow_rewrite_agent import rewrite_workflow
+
+
+# ============================================================
+# Config
+# ============================================================
+
+@dataclass(frozen=True)
+class BatchConfig:
+    concurrency: int = 4
+    max_items: int = 100
+    providers: Optional[Tuple[str, ...]] = None
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "BatchConfig":
+        raw = ((settings.get("workflow") or {}).get("rewrite") or {}).get("batch") or {}
+        defaults = cls()
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] Invalid 'workflow.rewrite.batch' settings, using defaults")
+            return defaults
+        try:
+            providers = raw.get("providers")
+            return cls(
+                concurrency=max(1, int(raw.get("concurrency", defaults.concurrency))),
+                max_items=max(1, int(raw.get("max_items", defaults.max_items))),
+                providers=tuple(str(p) for p in providers) if providers else None,
+            )
+        except (TypeError, ValueError):
+            log.warning("[ComfyAI] Invalid 'workflow.rewrite.batch' settings, using defaults")
+            return defaults
+
+
+# ============================================================
+# Items
+# ============================================================
+
+@dataclass
+class BatchItem:
+    index: int
+    id: Any
+    workflow: Dict[str, Any]
+    prompt: Optional[str] = None  # per-item instruction overriding the batch prompt
+
+
+def parse_batch_items(raw: Any, max_items: int) -> List[BatchItem]:
+    """
+    Accept a list of workflow graphs, or of {"id", "workflow", "prompt"?}
+    entries (ids are echoed back with each result). Raises ValueError.
+    """
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("`workflows` must be a non-empty list")
+    if len(raw) > max_items:
+        raise ValueError(f"Too many workflows ({len(raw)}, max {max_items})")
+
+    items = []
+    for index, entry in enumerate(raw):
+        if isinstance(entry, dict) and isinstance(entry.get("workflow"), dict):
+            prompt = entry.get("prompt")
+            if prompt is not None and not isinstance(prompt, str):
+                raise ValueError(f"workflows[{index}].prompt must be a string")
+            items.append(BatchItem(index, entry.get("id", index), entry["workflow"], prompt))
+        elif isinstance(entry, dict):
+            items.append(BatchItem(index, index, entry))
+        else:
+            raise ValueError(f"workflows[{index}] is not a workflow object")
+    return items
+
+
+# ============================================================
+# Fan-out
+# ============================================================
+
+class _ProviderSpread:
+    """Least-busy choice among the batch's providers (ties rotate)."""
+
+    def __init__(self, count: int):
+        self.in_flight = [0] * count
+        self._next = 0
+
+    def acquire(self) -> int:
+        count = len(self.in_flight)
+        order = [(self._next + i) % count for i in range(count)]
+        slot = min(order, key=lambda i: self.in_flight[i])
+        self.in_flight[slot] += 1
+        self._next = (slot + 1) % count
+        return slot
+
+    def release(self, slot: int) -> None:
+        self.in_flight[slot] -= 1
+
+
+Runner = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+async def rewrite_batch(
+    items: Sequence[BatchItem],
+    prompt: str,
+    clients: Sequence[ChatClient],
+    concurrency: int,
+    mode: Optional[str] = None,
+    use_cache: bool = True,
+    runner: Runner = rewrite_workflow,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Rewrite every item; yields one result per item in completion order:
+
+        {"index", "id", "provider", "elapsed_ms", "status": "ok",
+         "workflow", "notes", "mode", "ops"?}
+        {"index", "id", "provider", "elapsed_ms", "status": "error", "error"}
+
+    Closing the iterator early cancels the items still running.
+    """
+    if not clients:
+        raise ValueError("No providers to run the batch on")
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    spread = _ProviderSpread(len(clients))
+    finished: asyncio.Queue = asyncio.Queue()
+
+    async def run(item: BatchItem) -> None:
+        async with semaphore:
+            slot = spread.acquire()
+            client = clients[slot]
+            started = time.monotonic()
+            request: Dict[str, Any] = {"workflow": item.workflow, "prompt": item.prompt or prompt}
+            if mode is not None:
+                request["mode"] = mode
+            if not use_cache:
+                request["cache"] = False
+
+            reset_request_context()
+            try:
+                result = await runner(request, llm=client)
+            except AdmissionRejected as e:
+                result = {"error": str(e), "retry_after": e.retry_after}
+            except Exception as e:
+                log.exception(f"[ComfyAI] Batch rewrite of item {item.id!r} failed")
+                result = {"error": str(e) or type(e).__name__}
+            finally:
+                spread.release(slot)
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        metrics.observe("rewrite.batch.item_ms", elapsed_ms)
+        entry = {
+            "index": item.index,
+            "id": item.id,
+            "provider": client.provider_name,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "status": "error" if "error" in result else "ok",
+            **result,
+        }
+        metrics.incr("rewrite.batch.failed" if "error" in result else "rewrite.batch.ok")
+        finished.put_nowait(entry)
+
+    metrics.incr("rewrite.batch.requests")
+    metrics.incr("rewrite.batch.items", len(items))
+    tasks = [asyncio.ensure_future(run(item)) for item in items]
+    try:
+        for _ in tasks:
+            yield await finished.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+__all__ = [
+    "BatchConfig",
+    "BatchItem",
+    "parse_batch_items",
+    "rewrite_batch",
+]
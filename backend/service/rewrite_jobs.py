@@ -0,0 +1,535 @@
+"""
+ComfyAI - Workflow Rewrite Jobs
+
+Background queue for workflow rewrites, so a long LLM call does not hold an
+HTTP request open (and hit proxy timeouts):
+
+    POST   /api/workflow/rewrite/jobs               submit → {"job_id", ...}
+    GET    /api/workflow/rewrite/jobs/{id}          status / queue position
+    GET    /api/workflow/rewrite/jobs/{id}/result   rewrite result once done
+    DELETE /api/workflow/rewrite/jobs/{id}          cancel
+
+Jobs run rewrite_workflow() on a fixed pool of workers, highest priority
+first ("high", "normal", "low"; FIFO within a priority). Every state change
+is pushed to the browser over ComfyUI's websocket as a "comfyai.rewrite.job"
+event (to the submitting client when it sent its ComfyUI `client_id`).
+
+Each job is kept as one JSON file under CACHE_DIR/jobs. On restart, queued
+and interrupted jobs are queued again; finished jobs are kept for
+`result_ttl_s` and then deleted. A provider that refuses a job with 429 /
+503 (admission control, open circuit) gets it back after its Retry-After
+delay, until the job has been tried `max_attempts` times; then it fails.
+
+Configuration lives in settings.json:
+
+    "workflow": {
+      "rewrite": {
+        "jobs": {
+          "workers": 2,          # jobs running at once
+          "max_queued": 64,      # waiting jobs before submit answers 429
+          "result_ttl_s": 3600,  # how long finished jobs can be fetched
+          "max_attempts": 5      # runs refused by a busy provider before failing
+        }
+      }
+    }
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import itertools
+import json
+import re
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..admission import AdmissionRejected
+from ..utils import metrics
+from ..utils.logger import log
+from ..utils.paths import CACHE_DIR
+from ..utils.persistence import atomic_write_json, run_io
+from .workflow_rewrite_agent import rewrite_workflow
+
+
+JOB_EVENT = "comfyai.rewrite.job"
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# Statuses a job can end in
+FINISHED = ("done", "failed", "cancelled")
+
+# Request fields a job passes on to rewrite_workflow()
+_REQUEST_KEYS = ("workflow", "prompt", "mode", "cache", "provider")
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def valid_job_id(job_id: Any) -> bool:
+    return isinstance(job_id, str) and bool(_JOB_ID_RE.match(job_id))
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting."""
+
+    def __init__(self, max_queued: int):
+        super().__init__(f"Rewrite queue is full ({max_queued} jobs waiting)")
+        self.max_queued = max_queued
+
+
+# ============================================================
+# Config
+# ============================================================
+
+@dataclass(frozen=True)
+class RewriteJobConfig:
+    workers: int = 2
+    max_queued: int = 64
+    result_ttl_s: float = 3600.0
+    max_attempts: int = 5
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "RewriteJobConfig":
+        raw = ((settings.get("workflow") or {}).get("rewrite") or {}).get("jobs") or {}
+        defaults = cls()
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] Invalid 'workflow.rewrite.jobs' settings, using defaults")
+            return defaults
+        try:
+            return cls(
+                workers=max(1, int(raw.get("workers", defaults.workers))),
+                max_queued=max(0, int(raw.get("max_queued", defaults.max_queued))),
+                result_ttl_s=max(0.0, float(raw.get("result_ttl_s", defaults.result_ttl_s))),
+                max_attempts=max(1, int(raw.get("max_attempts", defaults.max_attempts))),
+            )
+        except (TypeError, ValueError):
+            log.warning("[ComfyAI] Invalid 'workflow.rewrite.jobs' settings, using defaults")
+            return defaults
+
+
+def parse_priority(value: Any) -> int:
+    """'high' / 'normal' / 'low' (or 0-2) → queue priority; lower runs first."""
+    if value is None:
+        return PRIORITIES["normal"]
+    if isinstance(value, str) and value.lower() in PRIORITIES:
+        return PRIORITIES[value.lower()]
+    if isinstance(value, int) and not isinstance(value, bool) and value in PRIORITIES.values():
+        return value
+    raise ValueError(f"Invalid priority {value!r} (expected one of: {', '.join(PRIORITIES)})")
+
+
+# ============================================================
+# Job
+# ============================================================
+
+@dataclass
+class RewriteJob:
+    job_id: str
+    request: Dict[str, Any]
+    priority: int = PRIORITIES["normal"]
+    client_id: Optional[str] = None
+    status: str = "queued"  # queued | running | done | failed | cancelled
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    attempts: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    seq: int = 0  # submission order within a priority
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    def info(self) -> Dict[str, Any]:
+        """Status without the workflow or the result (for polling / events)."""
+        data = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": next((k for k, v in PRIORITIES.items() if v == self.priority), self.priority),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "attempts": self.attempts,
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RewriteJob":
+        known = {k: data[k] for k in cls.__dataclass_fields__ if k in data}
+        return cls(**known)
+
+
+def _send_to_websocket(event: str, data: Dict[str, Any], client_id: Optional[str]) -> None:
+    """Push an event through ComfyUI's PromptServer (no-op outside ComfyUI)."""
+    try:
+        from server import PromptServer
+    except ImportError:
+        return
+    instance = getattr(PromptServer, "instance", None)
+    if instance is not None:
+        instance.send_sync(event, data, client_id)
+
+
+# ============================================================
+# Queue
+# ============================================================
+
+Runner = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+Notifier = Callable[[str, Dict[str, Any], Optional[str]], None]
+
+
+class RewriteJobQueue:
+    """Priority queue of rewrite jobs, a worker pool and the on-disk job store."""
+
+    def __init__(
+        self,
+        config: Optional[RewriteJobConfig] = None,
+        directory: Optional[Path] = None,
+        runner: Runner = rewrite_workflow,
+        notify: Notifier = _send_to_websocket,
+    ):
+        self.config = config or RewriteJobConfig()
+        self.directory = directory or (CACHE_DIR / "jobs")
+        self.runner = runner
+        self.notify = notify
+
+        self._jobs: Dict[str, RewriteJob] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._retries: Dict[str, asyncio.TimerHandle] = {}
+        self._seq = itertools.count()
+        self._start_lock: Optional[asyncio.Lock] = None
+
+    def configure(self, config: RewriteJobConfig) -> None:
+        """Apply new settings; a larger worker pool takes effect immediately."""
+        self.config = config
+        if self._queue is not None:
+            self._spawn_workers()
+
+    # --------------------------------------------------------
+    # Lifecycle
+    # --------------------------------------------------------
+    @property
+    def started(self) -> bool:
+        return self._queue is not None
+
+    async def start(self) -> None:
+        """Reload persisted jobs and start the workers (idempotent)."""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._queue is not None:
+                return
+            self._queue = asyncio.PriorityQueue()
+
+            loaded = await run_io(self._load_all)
+            for job in sorted(loaded, key=lambda j: (j.created, j.seq)):
+                job.seq = next(self._seq)
+                if not job.done:
+                    # Interrupted by a restart: run it again
+                    job.status = "queued"
+                self._jobs[job.job_id] = job
+                if job.status == "queued":
+                    self._enqueue(job)
+            if loaded:
+                log.info(f"[ComfyAI] Restored {len(loaded)} rewrite job(s), {self._queued_count()} queued")
+            await self._purge()
+
+            self._spawn_workers()
+
+    async def stop(self) -> None:
+        """Stop the workers; running jobs are saved as queued for the next start."""
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        for job in self._jobs.values():
+            if job.status == "running":
+                job.status = "queued"
+                job.started = None
+                await self._save(job)
+        self._queue = None
+        self._publish()
+
+    def _spawn_workers(self) -> None:
+        loop = asyncio.get_running_loop()
+        while len(self._workers) < self.config.workers:
+            # Fresh context: jobs must not inherit the submitting request's
+            # request context or admission slot.
+            name = f"comfyai-rewrite-worker-{len(self._workers)}"
+            self._workers.append(contextvars.Context().run(loop.create_task, self._worker(), name=name))
+
+    # --------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------
+    async def submit(
+        self,
+        request: Dict[str, Any],
+        priority: Any = None,
+        client_id: Optional[str] = None,
+    ) -> RewriteJob:
+        """Queue a rewrite. Raises ValueError (bad request) or JobQueueFull."""
+        if request.get("workflow") is None:
+            raise ValueError("Missing `workflow`")
+        if request.get("prompt") is None:
+            raise ValueError("Missing `prompt`")
+        level = parse_priority(priority)
+
+        await self.start()
+        await self._purge()
+        if self._queued_count() >= self.config.max_queued:
+            metrics.incr("rewrite_jobs.rejected")
+            raise JobQueueFull(self.config.max_queued)
+
+        job = RewriteJob(
+            job_id=uuid.uuid4().hex,
+            request={k: request[k] for k in _REQUEST_KEYS if k in request},
+            priority=level,
+            client_id=client_id if isinstance(client_id, str) and client_id else None,
+            seq=next(self._seq),
+        )
+        self._jobs[job.job_id] = job
+        await self._save(job)
+        self._enqueue(job)
+        metrics.incr("rewrite_jobs.submitted")
+        self._emit(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[RewriteJob]:
+        await self._purge()
+        return self._jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[RewriteJob]:
+        """Cancel a queued or running job; finished jobs are returned unchanged."""
+        job = self._jobs.get(job_id)
+        if job is None or job.done:
+            return job
+
+        handle = self._retries.pop(job_id, None)
+        if handle is not None:
+            handle.cancel()
+        task = self._running.get(job_id)
+        await self._finish(job, "cancelled", error="Cancelled")
+        if task is not None:
+            task.cancel()
+        return job
+
+    def position(self, job: RewriteJob) -> Optional[int]:
+        """Number of queued jobs that will run before `job` (None unless queued)."""
+        if job.status != "queued":
+            return None
+        key = (job.priority, job.seq)
+        return sum(
+            1 for other in self._jobs.values()
+            if other.status == "queued" and (other.priority, other.seq) < key
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        counts = {status: 0 for status in ("queued", "running", *FINISHED)}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.config.workers, "max_queued": self.config.max_queued, **counts}
+
+    # --------------------------------------------------------
+    # Workers
+    # --------------------------------------------------------
+    def _enqueue(self, job: RewriteJob) -> None:
+        self._queue.put_nowait((job.priority, job.seq, job.job_id))
+        self._publish()
+
+    def _queued_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == "queued")
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            # Entries of cancelled / purged / retried jobs are skipped lazily
+            if job is None or job.status != "queued" or job_id in self._running or job_id in self._retries:
+                continue
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception(f"[ComfyAI] Rewrite job {job_id} crashed")
+
+    async def _run(self, job: RewriteJob) -> None:
+        job.status = "running"
+        job.started = time.time()
+        job.attempts += 1
+        metrics.observe("rewrite_jobs.wait_ms", (job.started - job.created) * 1000)
+        await self._save(job)
+        self._emit(job)
+        # Everyone behind this job moved up one place
+        for other in self._jobs.values():
+            if other.status == "queued":
+                self._emit(other)
+
+        task = asyncio.get_running_loop().create_task(self.runner(dict(job.request)))
+        self._running[job.job_id] = task
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if job.status == "cancelled":
+                return  # cancel() already recorded it
+            raise  # worker is stopping
+        except AdmissionRejected as e:
+            if job.attempts >= self.config.max_attempts:
+                # e.g. a pinned provider whose circuit stays open
+                log.warning(f"[ComfyAI] Rewrite job {job.job_id} gave up after {job.attempts} attempt(s): {e}")
+                await self._finish(job, "failed", error=str(e))
+            else:
+                await self._retry_later(job, e.retry_after)
+            return
+        except Exception as e:
+            log.exception(f"[ComfyAI] Rewrite job {job.job_id} failed")
+            await self._finish(job, "failed", error=str(e) or type(e).__name__)
+            return
+        finally:
+            self._running.pop(job.job_id, None)
+
+        if job.status == "cancelled":
+            return
+        metrics.observe("rewrite_jobs.run_ms", (time.time() - job.started) * 1000)
+        if "error" in result:
+            await self._finish(job, "failed", error=str(result["error"]))
+        else:
+            await self._finish(job, "done", result=result)
+
+    async def _retry_later(self, job: RewriteJob, delay: float) -> None:
+        """Provider is saturated: give the job back to the queue after `delay`."""
+        job.status = "queued"
+        job.started = None
+        await self._save(job)
+        metrics.incr("rewrite_jobs.requeued")
+        self._emit(job)
+
+        def _requeue() -> None:
+            self._retries.pop(job.job_id, None)
+            if job.status == "queued" and self._queue is not None:
+                self._enqueue(job)
+
+        self._retries[job.job_id] = asyncio.get_running_loop().call_later(max(0.0, delay), _requeue)
+
+    async def _finish(
+        self,
+        job: RewriteJob,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        job.status = status
+        job.finished = time.time()
+        job.result = result
+        job.error = error
+        metrics.incr(f"rewrite_jobs.{status}")
+        await self._save(job)
+        self._emit(job)
+        log.info(f"[ComfyAI] Rewrite job {job.job_id} {status}")
+
+    def _emit(self, job: RewriteJob) -> None:
+        data = job.info()
+        data["position"] = self.position(job)
+        self._publish()
+        try:
+            self.notify(JOB_EVENT, data, job.client_id)
+        except Exception:
+            log.warning("[ComfyAI] Failed to send rewrite job event", exc_info=True)
+
+    def _publish(self) -> None:
+        metrics.set_gauge("rewrite_jobs.queued", self._queued_count())
+        metrics.set_gauge("rewrite_jobs.running", len(self._running))
+
+    # --------------------------------------------------------
+    # Result store
+    # --------------------------------------------------------
+    async def _purge(self) -> None:
+        """Forget finished jobs older than result_ttl_s (memory and disk)."""
+        cutoff = time.time() - self.config.result_ttl_s
+        expired = [j for j in self._jobs.values() if j.done and (j.finished or 0) < cutoff]
+        for job in expired:
+            del self._jobs[job.job_id]
+            metrics.incr("rewrite_jobs.expired")
+        if expired:
+            await run_io(self._delete_files, [j.job_id for j in expired])
+
+    # --------------------------------------------------------
+    # Disk (runs on the I/O thread)
+    # --------------------------------------------------------
+    def _path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    async def _save(self, job: RewriteJob) -> None:
+        try:
+            await run_io(atomic_write_json, self._path(job.job_id), asdict(job), indent=None)
+        except OSError:
+            log.exception(f"[ComfyAI] Could not persist rewrite job {job.job_id}")
+
+    def _load_all(self) -> List[RewriteJob]:
+        jobs = []
+        if not self.directory.is_dir():
+            return jobs
+        for path in self.directory.glob("*.json"):
+            if not valid_job_id(path.stem):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = RewriteJob.from_dict(json.load(f))
+            except (OSError, ValueError, TypeError):
+                log.warning(f"[ComfyAI] Skipping unreadable rewrite job {path.name}")
+                continue
+            if job.job_id == path.stem:
+                jobs.append(job)
+        return jobs
+
+    def _delete_files(self, job_ids: List[str]) -> None:
+        for job_id in job_ids:
+            try:
+                self._path(job_id).unlink()
+            except FileNotFoundError:
+                pass
+
+
+# ============================================================
+# Shared instance
+# ============================================================
+
+_queue: Optional[RewriteJobQueue] = None
+
+
+def get_rewrite_jobs(settings: Optional[Dict[str, Any]] = None) -> RewriteJobQueue:
+    """Return the shared job queue, applying "workflow.rewrite.jobs" if given."""
+    global _queue
+    if _queue is None:
+        _queue = RewriteJobQueue()
+    if settings is not None:
+        config = RewriteJobConfig.from_settings(settings)
+        if config != _queue.config:
+            _queue.configure(config)
+    return _queue
+
+
+__all__ = [
+    "JOB_EVENT",
+    "PRIORITIES",
+    "JobQueueFull",
+    "RewriteJob",
+    "RewriteJobConfig",
+    "RewriteJobQueue",
+    "get_rewrite_jobs",
+    "parse_priority",
+    "valid_job_id",
+]
@@ -0,0 +1,437 @@
+"""
+ComfyAI - Compact Workflow Codec
+
+Token-efficient encoding of ComfyUI workflows for rewrite prompts.
+
+The UI workflow format (what the browser saves) is mostly layout: node
+positions, sizes, colors, draw order, groups, canvas offset, per-slot
+metadata and a separate link table. None of that helps a model edit the
+graph. encode_workflow() keeps only what matters for editing:
+
+    {"nodes": [
+        {"id": 1, "type": "CheckpointLoaderSimple",
+         "widgets": ["v1-5-pruned-emaonly.safetensors"],
+         "out": ["MODEL", "CLIP", "VAE"]},
+        {"id": 2, "type": "CLIPTextEncode", "title": "Positive",
+         "widgets": ["a cat"], "in": {"clip": [1, 1]}, "out": ["CONDITIONING"]}
+    ]}
+
+  • ids are renumbered 1..N in node order
+  • links become "in": {input_name: [source_id, source_slot]} on the target
+  • "mode" appears only when not 0 (2 = muted, 4 = bypassed)
+
+Everything else is kept server-side in EncodedWorkflow.stash, and
+decode_workflow() merges it back: unchanged nodes come back byte-for-byte,
+existing links keep their ids, new nodes and links get fresh ids.
+
+API-format prompts ({"3": {"class_type", "inputs"}}) are already compact;
+only their "_meta" blocks are stashed.
+"""
+
+from __future__ import annotations
+
+import copy
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..context_budget import estimate_tokens
+from ..utils.logger import log
+
+
+FORMAT_UI = "ui"
+FORMAT_API = "api"
+
+# Link table columns in the UI format
+_LINK_FIELDS = ("id", "origin_id", "origin_slot", "target_id", "target_slot", "type")
+
+# Default footprint / spacing for nodes the model adds
+_NEW_NODE_SIZE = [315, 130]
+_NEW_NODE_OFFSET = 380
+
+
+# JSON schema of the compact UI form (for structured-output requests)
+COMPACT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "type": {"type": "string"},
+                    "title": {"type": "string"},
+                    "mode": {"type": "integer"},
+                    "widgets": {"type": "array"},
+                    "in": {"type": "object"},
+                    "out": {"type": "array", "items": {"type": "string"}},
+                    "stub": {"type": "boolean"},
+                },
+                "required": ["id", "type"],
+            },
+        },
+    },
+    "required": ["nodes"],
+}
+
+
+class WorkflowCodecError(ValueError):
+    """The model's compact graph could not be merged back."""
+
+
+@dataclass
+class EncodedWorkflow:
+    format: str
+    compact: Dict[str, Any]   # sent to the model
+    stash: Dict[str, Any]     # kept server-side for decode
+
+    def dumps(self) -> str:
+        return dumps_compact(self.compact)
+
+
+def dumps_compact(data: Any) -> str:
+    """Whitespace-free JSON, the cheapest form to put in a prompt."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def detect_format(graph: Dict[str, Any]) -> str:
+    if isinstance(graph.get("nodes"), list):
+        return FORMAT_UI
+    if graph and all(isinstance(v, dict) and "class_type" in v for v in graph.values()):
+        return FORMAT_API
+    raise WorkflowCodecError("Unrecognized workflow format (expected UI or API JSON)")
+
+
+# ============================================================
+# Public API
+# ============================================================
+
+def encode_workflow(graph: Dict[str, Any]) -> EncodedWorkflow:
+    """Split `graph` into a compact model-facing form and a restore stash."""
+    fmt = detect_format(graph)
+    if fmt == FORMAT_API:
+        return _encode_api(graph)
+    return _encode_ui(graph)
+
+
+def decode_workflow(compact: Dict[str, Any], encoded: EncodedWorkflow) -> Dict[str, Any]:
+    """Merge an (edited) compact graph back into a full workflow."""
+    if not isinstance(compact, dict):
+        raise WorkflowCodecError("Compact workflow must be a JSON object")
+    if encoded.format == FORMAT_API:
+        return _decode_api(compact, encoded.stash)
+    return _decode_ui(compact, encoded.stash)
+
+
+def token_report(graph: Dict[str, Any], encoded: Optional[EncodedWorkflow] = None) -> Dict[str, Any]:
+    """Estimated prompt tokens of the old indent=2 dump vs the compact encoding."""
+    encoded = encoded or encode_workflow(graph)
+    original = estimate_tokens(json.dumps(graph, indent=2))
+    compact = estimate_tokens(encoded.dumps())
+    return {
+        "format": encoded.format,
+        "nodes": len(encoded.compact.get("nodes", encoded.compact)),
+        "original_tokens": original,
+        "compact_tokens": compact,
+        "saved_tokens": original - compact,
+        "saved_pct": round(100.0 * (original - compact) / original, 1) if original else 0.0,
+    }
+
+
+# ============================================================
+# UI format
+# ============================================================
+
+def _link_tuple(link: Any) -> Optional[Tuple[Any, ...]]:
+    if isinstance(link, list) and len(link) >= 6:
+        return tuple(link[:6])
+    if isinstance(link, dict) and all(k in link for k in _LINK_FIELDS):
+        return tuple(link[k] for k in _LINK_FIELDS)
+    return None
+
+
+def _encode_ui(graph: Dict[str, Any]) -> EncodedWorkflow:
+    nodes = [n for n in graph.get("nodes") or [] if isinstance(n, dict) and "id" in n]
+    raw_links = graph.get("links") or []
+
+    links: Dict[Any, Tuple[Any, ...]] = {}
+    for raw in raw_links:
+        t = _link_tuple(raw)
+        if t is not None:
+            links[t[0]] = t
+
+    to_compact = {n["id"]: i for i, n in enumerate(nodes, start=1)}
+
+    compact_nodes = []
+    for node in nodes:
+        c: Dict[str, Any] = {"id": to_compact[node["id"]], "type": node.get("type")}
+        if node.get("title"):
+            c["title"] = node["title"]
+        if node.get("mode"):
+            c["mode"] = node["mode"]
+        if "widgets_values" in node:
+            c["widgets"] = node["widgets_values"]
+
+        ins = {}
+        for inp in node.get("inputs") or []:
+            link = links.get(inp.get("link"))
+            if link is not None and link[1] in to_compact:
+                ins[inp.get("name")] = [to_compact[link[1]], link[2]]
+        if ins:
+            c["in"] = ins
+
+        outs = [o.get("name") for o in node.get("outputs") or []]
+        if outs:
+            c["out"] = outs
+
+        compact_nodes.append(c)
+
+    stash = {
+        "graph": copy.deepcopy(graph),
+        "ids": {to_compact[n["id"]]: n["id"] for n in nodes},
+    }
+    return EncodedWorkflow(FORMAT_UI, {"nodes": compact_nodes}, stash)
+
+
+def _decode_ui(compact: Dict[str, Any], stash: Dict[str, Any]) -> Dict[str, Any]:
+    original = stash["graph"]
+    graph = copy.deepcopy(original)
+    originals = {n["id"]: n for n in graph.get("nodes") or [] if isinstance(n, dict) and "id" in n}
+    from_compact: Dict[int, Any] = stash["ids"]
+
+    compact_nodes = compact.get("nodes")
+    if not isinstance(compact_nodes, list):
+        raise WorkflowCodecError("Compact workflow is missing its 'nodes' list")
+
+    raw_links = graph.get("links") or []
+    links_as_dicts = any(isinstance(l, dict) for l in raw_links)
+    old_links: Dict[Any, Tuple[Any, ...]] = {}
+    old_link_raw: Dict[Any, Any] = {}
+    for raw in raw_links:
+        t = _link_tuple(raw)
+        if t is not None:
+            old_links[t[0]] = t
+            old_link_raw[t[0]] = raw
+    by_endpoints = {(t[1], t[2], t[3], t[4]): t for t in old_links.values()}
+
+    # ---------------- Nodes ----------------
+    next_node_id = max([graph.get("last_node_id") or 0, *[i for i in originals if isinstance(i, int)]]) + 1
+    real_ids: Dict[Any, Any] = {}
+    out_nodes: List[Dict[str, Any]] = []
+
+    for cn in compact_nodes:
+        if not isinstance(cn, dict) or "id" not in cn or not cn.get("type"):
+            raise WorkflowCodecError(f"Invalid compact node: {cn!r}")
+        cid = _compact_id(cn["id"])
+        if cid in real_ids:
+            raise WorkflowCodecError(f"Duplicate node id {cid}")
+
+        real = from_compact.get(cid)
+        node = originals.get(real) if real is not None else None
+        if node is not None and node.get("type") != cn["type"]:
+            node = None  # same id reused for a different node type: treat as new
+
+        if node is None:
+            real = next_node_id
+            next_node_id += 1
+            node = _new_node(real, cn)
+        else:
+            _apply_node_fields(node, cn)
+
+        real_ids[cid] = real
+        out_nodes.append(node)
+
+    nodes_by_real = {n["id"]: n for n in out_nodes}
+
+    # ---------------- Links ----------------
+    next_link_id = max([graph.get("last_link_id") or 0, *[i for i in old_links if isinstance(i, int)]]) + 1
+    kept_link_ids = set()
+    new_links: List[Tuple[Any, ...]] = []
+
+    for cn in compact_nodes:
+        node = nodes_by_real[real_ids[_compact_id(cn["id"])]]
+        wanted: Dict[str, Any] = {}
+        for name, ref in (cn.get("in") or {}).items():
+            if not (isinstance(ref, list) and len(ref) == 2) or _compact_id(ref[0]) not in real_ids:
+                log.warning(f"[ComfyAI] Dropping invalid connection {name}={ref!r} on node {cn['id']}")
+                continue
+            src = real_ids[_compact_id(ref[0])]
+            try:
+                slot = int(ref[1])
+            except (TypeError, ValueError):
+                log.warning(f"[ComfyAI] Dropping invalid connection {name}={ref!r} on node {cn['id']}")
+                continue
+            target_slot = _input_slot(node, name)
+            existing = by_endpoints.get((src, slot, node["id"], target_slot))
+            if existing is not None and existing[0] not in kept_link_ids:
+                link_id = existing[0]
+                kept_link_ids.add(link_id)
+            else:
+                link_id = next_link_id
+                next_link_id += 1
+                link_type = _link_type(nodes_by_real.get(src), slot, node, target_slot)
+                new_links.append((link_id, src, slot, node["id"], target_slot, link_type))
+            wanted[name] = link_id
+
+        for inp in node.get("inputs") or []:
+            name = inp.get("name")
+            if name in wanted:
+                inp["link"] = wanted.pop(name)
+            elif inp.get("link") in old_links:
+                inp["link"] = None
+            # (dangling link ids from the source file are left untouched)
+
+    final_links = [t for t in old_links.values() if t[0] in kept_link_ids] + new_links
+
+    # Output slots list the links leaving them, in their original order
+    for node in out_nodes:
+        if node["id"] not in originals:
+            _place_new_node(node, final_links, nodes_by_real)
+        outputs = node.get("outputs") or []
+        for slot, out in enumerate(outputs):
+            leaving = [t[0] for t in final_links if t[1] == node["id"] and t[2] == slot]
+            previous = [i for i in (out.get("links") or []) if i in leaving]
+            merged = previous + [i for i in leaving if i not in previous]
+            if merged or out.get("links"):
+                out["links"] = merged
+            # (an unconnected slot keeps its original None / [] as-is)
+
+    graph["nodes"] = out_nodes
+    graph["links"] = [
+        _link_out(t, old_link_raw.get(t[0]), links_as_dicts) for t in final_links
+    ]
+    if "last_node_id" in graph:
+        graph["last_node_id"] = max([graph["last_node_id"] or 0, *[n["id"] for n in out_nodes if isinstance(n["id"], int)]])
+    if "last_link_id" in graph:
+        graph["last_link_id"] = max([graph.get("last_link_id") or 0, *[t[0] for t in final_links if isinstance(t[0], int)]])
+    return graph
+
+
+def _compact_id(value: Any) -> Any:
+    """Models sometimes quote ids ("3"); treat them as the numbers they were."""
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+def _place_new_node(node: Dict[str, Any], links: List[Tuple[Any, ...]], nodes: Dict[Any, Dict[str, Any]]) -> None:
+    """Put an added node to the right of its first input, and size its outputs."""
+    for t in links:
+        if t[3] == node["id"]:
+            src_pos = (nodes.get(t[1]) or {}).get("pos")
+            if isinstance(src_pos, (list, tuple)) and len(src_pos) >= 2:
+                node["pos"] = [src_pos[0] + _NEW_NODE_OFFSET, src_pos[1]]
+                break
+    outputs = node.setdefault("outputs", [])
+    for t in links:
+        if t[1] == node["id"]:
+            while len(outputs) <= t[2]:
+                outputs.append({"name": t[5], "type": t[5], "links": None})
+
+
+def _apply_node_fields(node: Dict[str, Any], cn: Dict[str, Any]) -> None:
+    """Copy the model-editable fields of compact node `cn` onto `node`."""
+    if cn.get("title"):
+        node["title"] = cn["title"]
+    elif node.get("title"):
+        node.pop("title")
+
+    mode = cn.get("mode") or 0
+    if mode or "mode" in node:
+        node["mode"] = mode
+
+    if "widgets" in cn:
+        node["widgets_values"] = cn["widgets"]
+
+
+def _new_node(real_id: int, cn: Dict[str, Any]) -> Dict[str, Any]:
+    node: Dict[str, Any] = {
+        "id": real_id,
+        "type": cn["type"],
+        "pos": [0, 0],
+        "size": list(_NEW_NODE_SIZE),
+        "flags": {},
+        "order": 0,
+        "mode": cn.get("mode") or 0,
+        "inputs": [],
+        "outputs": [
+            {"name": name, "type": name, "links": None}
+            for name in cn.get("out") or []
+        ],
+        "properties": {"Node name for S&R": cn["type"]},
+    }
+    if cn.get("title"):
+        node["title"] = cn["title"]
+    if "widgets" in cn:
+        node["widgets_values"] = cn["widgets"]
+    return node
+
+
+def _input_slot(node: Dict[str, Any], name: str) -> int:
+    inputs = node.setdefault("inputs", [])
+    for i, inp in enumerate(inputs):
+        if inp.get("name") == name:
+            return i
+    inputs.append({"name": name, "type": "*", "link": None})
+    return len(inputs) - 1
+
+
+def _link_type(src: Optional[Dict[str, Any]], slot: int, dst: Dict[str, Any], dst_slot: int) -> str:
+    outputs = (src or {}).get("outputs") or []
+    if 0 <= slot < len(outputs) and outputs[slot].get("type"):
+        return outputs[slot]["type"]
+    inp = (dst.get("inputs") or [])[dst_slot]
+    if inp.get("type") and inp["type"] != "*":
+        return inp["type"]
+    return "*"
+
+
+def _link_out(t: Tuple[Any, ...], raw: Any, as_dict: bool) -> Any:
+    if raw is not None:
+        return raw  # untouched original entry (keeps extra fields)
+    if as_dict:
+        return dict(zip(_LINK_FIELDS, t))
+    return list(t)
+
+
+# ============================================================
+# API format
+# ============================================================
+
+def _encode_api(graph: Dict[str, Any]) -> EncodedWorkflow:
+    compact = {}
+    meta = {}
+    for node_id, node in graph.items():
+        node = copy.deepcopy(node)
+        if "_meta" in node:
+            meta[node_id] = node.pop("_meta")
+        compact[node_id] = node
+    return EncodedWorkflow(FORMAT_API, compact, {"meta": meta})
+
+
+def _decode_api(compact: Dict[str, Any], stash: Dict[str, Any]) -> Dict[str, Any]:
+    graph = {}
+    for node_id, node in compact.items():
+        if not isinstance(node, dict) or "class_type" not in node:
+            raise WorkflowCodecError(f"Invalid API node {node_id!r}")
+        node = copy.deepcopy(node)
+        meta = stash["meta"].get(str(node_id))
+        if meta is not None and "_meta" not in node:
+            node["_meta"] = meta
+        graph[str(node_id)] = node
+    return graph
+
+
+__all__ = [
+    "COMPACT_SCHEMA",
+    "FORMAT_UI",
+    "FORMAT_API",
+    "EncodedWorkflow",
+    "WorkflowCodecError",
+    "detect_format",
+    "dumps_compact",
+    "encode_workflow",
+    "decode_workflow",
+    "token_report",
+]
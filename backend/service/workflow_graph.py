@@ -0,0 +1,333 @@
+"""
+ComfyAI - Workflow Graph Index & Subgraph Selection
+
+Keeps rewrite prompts bounded on very large workflows.
+
+GraphIndex indexes a compact workflow (see workflow_codec.py): node-type
+index plus upstream / downstream adjacency, with closure queries.
+
+select_subgraph() picks the part of the graph an instruction is about:
+
+  1. seeds    nodes whose type, title or widget text best matches the
+              instruction's keywords (plus a few ComfyUI aliases, e.g.
+              "steps" / "cfg" → samplers, "negative" → CLIPTextEncode)
+  2. expand   breadth-first to neighbours until `max_nodes`
+  3. stubs    nodes just outside the selection that feed into or read from
+              it, shown as {"id", "type", "stub": true} so the model sees
+              the wiring without their contents
+
+Only that neighbourhood goes to the model. splice_subgraph() (full rewrites)
+and check_ops_scope() (patch rewrites) put the answer back into the full
+graph: nodes outside the selection are never touched.
+
+Configuration lives in settings.json:
+
+    "workflow": {
+      "rewrite": {
+        "subgraph": {
+          "min_nodes": 40,    # smaller workflows are sent whole; null disables
+          "max_nodes": 30     # size of the selected neighbourhood
+        }
+      }
+    }
+"""
+
+from __future__ import annotations
+
+import copy
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from ..utils.logger import log
+from .workflow_ops import WorkflowOpError, _int_id
+
+
+# ============================================================
+# Config
+# ============================================================
+
+@dataclass(frozen=True)
+class SubgraphConfig:
+    min_nodes: Optional[int] = 40
+    max_nodes: int = 30
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "SubgraphConfig":
+        raw = ((settings.get("workflow") or {}).get("rewrite") or {}).get("subgraph") or {}
+        defaults = cls()
+        if not isinstance(raw, dict):
+            log.warning("[ComfyAI] Invalid 'workflow.rewrite.subgraph' settings, using defaults")
+            return defaults
+        try:
+            min_nodes = raw.get("min_nodes", defaults.min_nodes)
+            return cls(
+                min_nodes=max(1, int(min_nodes)) if min_nodes is not None else None,
+                max_nodes=max(1, int(raw.get("max_nodes", defaults.max_nodes))),
+            )
+        except (TypeError, ValueError):
+            log.warning("[ComfyAI] Invalid 'workflow.rewrite.subgraph' settings, using defaults")
+            return defaults
+
+
+# ============================================================
+# Index
+# ============================================================
+
+class GraphIndex:
+    """Adjacency and type index over a compact workflow graph."""
+
+    def __init__(self, compact: Dict[str, Any]):
+        self.nodes: Dict[Any, Dict[str, Any]] = {n["id"]: n for n in compact.get("nodes") or []}
+        self.by_type: Dict[str, List[Any]] = {}
+        self.upstream: Dict[Any, Set[Any]] = {node_id: set() for node_id in self.nodes}
+        self.downstream: Dict[Any, Set[Any]] = {node_id: set() for node_id in self.nodes}
+
+        for node_id, node in self.nodes.items():
+            self.by_type.setdefault(str(node.get("type")).lower(), []).append(node_id)
+            for ref in (node.get("in") or {}).values():
+                src = ref[0]
+                if src in self.nodes:
+                    self.upstream[node_id].add(src)
+                    self.downstream[src].add(node_id)
+
+    def of_type(self, node_type: str) -> List[Any]:
+        return list(self.by_type.get(node_type.lower(), []))
+
+    def neighbors(self, node_id: Any) -> Set[Any]:
+        return self.upstream.get(node_id, set()) | self.downstream.get(node_id, set())
+
+    def upstream_closure(self, ids: Iterable[Any], depth: Optional[int] = None) -> Set[Any]:
+        """`ids` plus everything feeding into them (up to `depth` hops)."""
+        return self._closure(ids, self.upstream, depth)
+
+    def downstream_closure(self, ids: Iterable[Any], depth: Optional[int] = None) -> Set[Any]:
+        """`ids` plus everything reading from them (up to `depth` hops)."""
+        return self._closure(ids, self.downstream, depth)
+
+    @staticmethod
+    def _closure(ids: Iterable[Any], edges: Dict[Any, Set[Any]], depth: Optional[int]) -> Set[Any]:
+        seen = set(ids)
+        frontier = deque((i, 0) for i in seen)
+        while frontier:
+            node_id, hops = frontier.popleft()
+            if depth is not None and hops >= depth:
+                continue
+            for nxt in edges.get(node_id, ()):
+                if nxt not in seen:
+                    seen.add(nxt)
+                    frontier.append((nxt, hops + 1))
+        return seen
+
+
+# ============================================================
+# Selection
+# ============================================================
+
+# Instruction words that point at node types they don't literally name
+_ALIASES = {
+    "steps": "sampler", "cfg": "sampler", "seed": "sampler", "scheduler": "sampler",
+    "denoise": "sampler", "sampling": "sampler",
+    "prompt": "cliptextencode", "positive": "cliptextencode", "negative": "cliptextencode",
+    "resolution": "emptylatent", "width": "emptylatent", "height": "emptylatent",
+    "batch": "emptylatent", "aspect": "emptylatent",
+    "hires": "upscale", "upscaler": "upscale", "upscaling": "upscale",
+    "ckpt": "checkpoint", "output": "save",
+}
+
+# Too common in type names to say anything on their own
+_GENERIC = {"image", "images", "simple", "loader", "load", "advanced", "node", "nodes",
+            "text", "model", "models", "encode", "with", "from", "into", "the", "and"}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+@dataclass
+class Subgraph:
+    """The part of a compact graph shown to the model."""
+    selected: List[Any]
+    stubs: List[Any]
+    compact: Dict[str, Any]
+    seeds: List[Any] = field(default_factory=list)
+    next_id: int = 1  # first id the model may use for new nodes
+
+
+def _words(text: str) -> Set[str]:
+    return set(_WORD_RE.findall(text.lower()))
+
+
+def _score(node: Dict[str, Any], words: Set[str], hints: Set[str]) -> int:
+    node_type = str(node.get("type") or "")
+    type_lower = node_type.lower()
+    type_words = {w.lower() for w in _CAMEL_RE.findall(node_type)} - _GENERIC
+
+    score = 0
+    if type_lower in words:
+        score += 5
+    score += 2 * len(type_words & words)
+    score += 2 * sum(1 for w in words if len(w) >= 4 and w not in _GENERIC and w in type_lower and w not in type_words)
+    score += 2 * sum(1 for h in hints if h in type_lower)
+    if node.get("title"):
+        score += 3 * len((_words(str(node["title"])) - _GENERIC) & words)
+
+    widgets = node.get("widgets")
+    values = widgets.values() if isinstance(widgets, dict) else widgets or []
+    widget_words: Set[str] = set()
+    for value in values:
+        if isinstance(value, str):
+            widget_words |= _words(value)
+    score += len({w for w in widget_words & words if len(w) >= 4} - _GENERIC)
+    return score
+
+
+def select_subgraph(index: GraphIndex, instruction: str, max_nodes: int) -> Optional[Subgraph]:
+    """
+    Neighbourhood of the nodes `instruction` refers to, or None when nothing
+    matches (the caller then sends the whole graph).
+    """
+    words = _words(instruction)
+    hints = {_ALIASES[w] for w in words if w in _ALIASES}
+
+    scores = {node_id: _score(node, words, hints) for node_id, node in index.nodes.items()}
+    best = max(scores.values(), default=0)
+    if best < 2:
+        return None
+
+    # Keep strong matches only, and leave half the budget for their neighbours
+    threshold = max(2, (best + 1) // 2)
+    ranked = sorted((i for i, s in scores.items() if s >= threshold), key=lambda i: -scores[i])
+    seeds = ranked[: max(1, max_nodes // 2)]
+    selected = list(seeds)
+    chosen = set(selected)
+
+    # Grow ring by ring; within a ring, stronger matches and closer ids first
+    frontier = list(seeds)
+    while frontier and len(selected) < max_nodes:
+        ring = sorted(
+            {n for node_id in frontier for n in index.neighbors(node_id)} - chosen,
+            key=lambda i: (-scores[i], i if isinstance(i, int) else 0),
+        )
+        ring = ring[: max_nodes - len(selected)]
+        selected.extend(ring)
+        chosen.update(ring)
+        frontier = ring
+
+    stubs = sorted(
+        ({n for node_id in selected for n in index.neighbors(node_id)} - chosen),
+        key=lambda i: i if isinstance(i, int) else 0,
+    )
+
+    nodes = []
+    for node_id, node in index.nodes.items():  # keep graph order
+        if node_id in chosen:
+            nodes.append(copy.deepcopy(node))
+        elif node_id in stubs:
+            nodes.append({"id": node_id, "type": node.get("type"), "stub": True})
+
+    next_id = max([i for i in index.nodes if isinstance(i, int)], default=0) + 1
+    return Subgraph(
+        selected=selected,
+        stubs=stubs,
+        compact={"nodes": nodes},
+        seeds=seeds,
+        next_id=next_id,
+    )
+
+
+# ============================================================
+# Splicing results back
+# ============================================================
+
+def splice_subgraph(full: Dict[str, Any], sub: Subgraph, returned: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replace the selected nodes of the compact graph `full` with the model's
+    version of them. Stubs and everything else outside the selection are kept
+    as they were; selected nodes missing from `returned` are removed.
+
+    Stubs are recognized by id as well as by their "stub" flag (constrained
+    output often drops it), and links to them are kept as they are.
+    """
+    returned_nodes = returned.get("nodes") if isinstance(returned, dict) else None
+    if not isinstance(returned_nodes, list):
+        raise ValueError("Compact workflow is missing its 'nodes' list")
+
+    selected = set(sub.selected)
+    stubs = set(sub.stubs)
+    hidden = {n["id"] for n in full.get("nodes") or []} - selected - stubs
+
+    # New nodes must not take the id of a node the model could not see
+    remap: Dict[Any, Any] = {}
+    next_id = sub.next_id
+    edited = []
+    for node in returned_nodes:
+        if not isinstance(node, dict) or node.get("stub") or node.get("id") in stubs:
+            continue
+        node_id = node.get("id")
+        if node_id in hidden:
+            remap[node_id] = next_id
+            next_id += 1
+        edited.append(copy.deepcopy(node))
+
+    for node in edited:
+        node["id"] = remap.get(node["id"], node["id"])
+        for name, ref in (node.get("in") or {}).items():
+            if isinstance(ref, list) and ref and ref[0] in remap:
+                ref[0] = remap[ref[0]]
+
+    # Kept nodes stay in place, added nodes go last
+    by_id = {node["id"]: node for node in edited}
+    nodes = []
+    for node in full.get("nodes") or []:
+        if node["id"] not in selected:
+            nodes.append(copy.deepcopy(node))
+        elif node["id"] in by_id:
+            nodes.append(by_id.pop(node["id"]))
+    nodes.extend(by_id.values())
+    return {**full, "nodes": nodes}
+
+
+def check_ops_scope(ops: List[Dict[str, Any]], sub: Subgraph) -> None:
+    """
+    Patch ops may edit selected nodes (and nodes they add), touch stubs only
+    through their connections, and reference nothing the model was not shown.
+    Ids are normalized like apply_ops does ("7" is node 7).
+    """
+    editable = set(sub.selected)
+    visible = editable | set(sub.stubs)
+    for index, op in enumerate(ops):
+        kind = op.get("op") if isinstance(op, dict) else None
+        if kind == "add_node":
+            editable.add(_int_id(op.get("id")))
+            visible.add(_int_id(op.get("id")))
+            refs = [ref[0] for ref in (op.get("in") or {}).values() if isinstance(ref, list) and ref]
+            targets: List[Any] = []
+        elif kind in ("remove_node", "set_widget"):
+            refs, targets = [], [op.get("id")]
+        elif kind == "connect":
+            refs = [op.get("from", [None])[0]]
+            targets = [op.get("to", [None])[0]]
+        elif kind == "disconnect":
+            refs, targets = [], [op.get("to", [None])[0]]
+        else:
+            continue  # apply_ops reports unknown ops
+
+        for ref in map(_int_id, refs):
+            if ref not in visible:
+                raise WorkflowOpError(index, op, f"node {ref!r} is not part of the shown subgraph")
+        for target in map(_int_id, targets):
+            if target in sub.stubs and kind in ("remove_node", "set_widget"):
+                raise WorkflowOpError(index, op, f"node {target!r} is a stub and cannot be edited")
+            if target not in visible:
+                raise WorkflowOpError(index, op, f"node {target!r} is not part of the shown subgraph")
+
+
+__all__ = [
+    "GraphIndex",
+    "Subgraph",
+    "SubgraphConfig",
+    "check_ops_scope",
+    "select_subgraph",
+    "splice_subgraph",
+]
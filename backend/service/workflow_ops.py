@@ -0,0 +1,259 @@
+"""
+ComfyAI - Workflow Graph Ops
+
+Edit operations for patch-mode rewrites. Instead of regenerating the whole
+graph, the model returns a short list of operations against the compact
+encoding from workflow_codec.py (same node ids it was shown):
+
+    {"op": "add_node",    "id": 12, "type": "ImageScaleBy",
+                          "widgets": ["lanczos", 2.0], "in": {"image": [8, 0]}}
+    {"op": "remove_node", "id": 7}
+    {"op": "set_widget",  "id": 3, "index": 2, "value": 30}
+    {"op": "connect",     "from": [12, 0], "to": [9, "images"]}
+    {"op": "disconnect",  "to": [9, "images"]}
+
+apply_ops() validates every operation in order (later ops may refer to
+nodes added earlier) and applies them to a copy of the compact graph. A
+single invalid op rejects the whole patch, so the graph is never left
+half-edited. decode_workflow() then merges the result onto the original
+layout.
+"""
+
+from __future__ import annotations
+
+import copy
+from typing import Any, Callable, Dict, List
+
+
+OP_TYPES = ("add_node", "remove_node", "set_widget", "connect", "disconnect")
+
+# Shown to the model in patch mode
+OPS_SCHEMA = (
+    '{"ops": [\n'
+    '  {"op": "add_node", "id": <new id>, "type": "<NodeType>", "title": "<optional>", '
+    '"widgets": [<values in order>], "in": {"<input>": [<source id>, <output index>]}, '
+    '"out": ["<output name>", ...]},\n'
+    '  {"op": "remove_node", "id": <id>},\n'
+    '  {"op": "set_widget", "id": <id>, "index": <widget index>, "value": <new value>},\n'
+    '  {"op": "connect", "from": [<source id>, <output index>], "to": [<target id>, "<input name>"]},\n'
+    '  {"op": "disconnect", "to": [<target id>, "<input name>"]}\n'
+    "]}"
+)
+
+
+# JSON schema of a patch (for structured-output requests)
+OPS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ops": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "op": {"type": "string", "enum": list(OP_TYPES)},
+                    "id": {"type": "integer"},
+                    "type": {"type": "string"},
+                    "title": {"type": "string"},
+                    "widgets": {"type": "array"},
+                    "in": {"type": "object"},
+                    "out": {"type": "array", "items": {"type": "string"}},
+                    "index": {"type": ["integer", "string"]},
+                    "value": {},
+                    "from": {"type": "array", "minItems": 2, "maxItems": 2},
+                    "to": {"type": "array", "minItems": 2, "maxItems": 2},
+                },
+                "required": ["op"],
+            },
+        },
+    },
+    "required": ["ops"],
+}
+
+
+class WorkflowOpError(ValueError):
+    """An operation could not be validated against the graph."""
+
+    def __init__(self, index: int, op: Any, message: str):
+        super().__init__(f"op #{index} {op!r}: {message}")
+        self.index = index
+        self.op = op
+        self.message = message
+
+
+# ============================================================
+# Public API
+# ============================================================
+
+def parse_ops(output: Any) -> List[Dict[str, Any]]:
+    """Accept {"ops": [...]} or a bare list from the model."""
+    ops = output.get("ops") if isinstance(output, dict) else output
+    if not isinstance(ops, list):
+        raise WorkflowOpError(0, output, 'expected {"ops": [...]}')
+    return ops
+
+
+def apply_ops(compact: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Return a copy of the compact graph with `ops` applied, or raise WorkflowOpError."""
+    graph = copy.deepcopy(compact)
+    nodes: Dict[Any, Dict[str, Any]] = {n["id"]: n for n in graph.get("nodes") or []}
+
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict) or op.get("op") not in _HANDLERS:
+            raise WorkflowOpError(index, op, f"unknown op (expected one of {', '.join(OP_TYPES)})")
+        try:
+            _HANDLERS[op["op"]](nodes, op)
+        except _Invalid as e:
+            raise WorkflowOpError(index, op, str(e)) from None
+
+    graph["nodes"] = list(nodes.values())
+    return graph
+
+
+def summarize_ops(ops: List[Dict[str, Any]]) -> str:
+    """Short human-readable description, e.g. '1 add_node, 2 set_widget'."""
+    counts: Dict[str, int] = {}
+    for op in ops:
+        counts[op["op"]] = counts.get(op["op"], 0) + 1
+    return ", ".join(f"{n} {name}" for name, n in counts.items()) or "no changes"
+
+
+# ============================================================
+# Handlers
+# ============================================================
+
+class _Invalid(Exception):
+    pass
+
+
+def _node(nodes: Dict[Any, Dict[str, Any]], node_id: Any) -> Dict[str, Any]:
+    node = nodes.get(_int_id(node_id))
+    if node is None:
+        raise _Invalid(f"no node with id {node_id!r}")
+    return node
+
+
+def _int_id(value: Any) -> Any:
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+def _source(nodes: Dict[Any, Dict[str, Any]], ref: Any) -> List[Any]:
+    if not (isinstance(ref, list) and len(ref) == 2):
+        raise _Invalid(f"expected [source id, output index], got {ref!r}")
+    src = _node(nodes, ref[0])
+    slot = ref[1]
+    if not isinstance(slot, int) or isinstance(slot, bool) or slot < 0:
+        raise _Invalid(f"invalid output index {slot!r}")
+    outs = src.get("out")
+    if outs is not None and slot >= len(outs):
+        raise _Invalid(f"node {src['id']} ({src['type']}) has no output {slot}")
+    return [src["id"], slot]
+
+
+def _target(nodes: Dict[Any, Dict[str, Any]], ref: Any):
+    if not (isinstance(ref, list) and len(ref) == 2 and isinstance(ref[1], str) and ref[1]):
+        raise _Invalid(f"expected [target id, input name], got {ref!r}")
+    return _node(nodes, ref[0]), ref[1]
+
+
+def _add_node(nodes, op):
+    node_type = op.get("type")
+    if not isinstance(node_type, str) or not node_type:
+        raise _Invalid("missing node type")
+
+    node_id = _int_id(op.get("id"))
+    if node_id is None:
+        node_id = max([n for n in nodes if isinstance(n, int)], default=0) + 1
+    elif node_id in nodes:
+        raise _Invalid(f"node id {node_id} already exists")
+
+    node: Dict[str, Any] = {"id": node_id, "type": node_type}
+    if op.get("title"):
+        node["title"] = str(op["title"])
+    if op.get("mode"):
+        node["mode"] = op["mode"]
+    if "widgets" in op:
+        if not isinstance(op["widgets"], (list, dict)):
+            raise _Invalid("widgets must be a list")
+        node["widgets"] = op["widgets"]
+    if op.get("out") is not None:
+        if not isinstance(op["out"], list):
+            raise _Invalid("out must be a list of output names")
+        node["out"] = op["out"]
+
+    connections = op.get("in") or {}
+    if not isinstance(connections, dict):
+        raise _Invalid('"in" must map input names to [source id, output index]')
+    nodes[node_id] = node
+    if connections:
+        node["in"] = {name: _source(nodes, ref) for name, ref in connections.items()}
+
+
+def _remove_node(nodes, op):
+    node = _node(nodes, op.get("id"))
+    del nodes[node["id"]]
+    for other in nodes.values():
+        ins = other.get("in")
+        if not ins:
+            continue
+        for name in [n for n, ref in ins.items() if ref[0] == node["id"]]:
+            del ins[name]
+        if not ins:
+            del other["in"]
+
+
+def _set_widget(nodes, op):
+    node = _node(nodes, op.get("id"))
+    if "value" not in op:
+        raise _Invalid("missing value")
+    widgets = node.get("widgets")
+    index = op.get("index")
+    if isinstance(widgets, list):
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(widgets):
+            raise _Invalid(f"node {node['id']} ({node['type']}) has {len(widgets)} widget(s), no index {index!r}")
+        widgets[index] = op["value"]
+    elif isinstance(widgets, dict):
+        if not isinstance(index, str) or index not in widgets:
+            raise _Invalid(f"node {node['id']} ({node['type']}) has no widget {index!r}")
+        widgets[index] = op["value"]
+    else:
+        raise _Invalid(f"node {node['id']} ({node['type']}) has no widgets")
+
+
+def _connect(nodes, op):
+    src = _source(nodes, op.get("from"))
+    dst, name = _target(nodes, op.get("to"))
+    if src[0] == dst["id"]:
+        raise _Invalid("cannot connect a node to itself")
+    dst.setdefault("in", {})[name] = src  # an input takes one link; replaces any existing
+
+
+def _disconnect(nodes, op):
+    dst, name = _target(nodes, op.get("to"))
+    ins = dst.get("in") or {}
+    if name not in ins:
+        raise _Invalid(f"input {name!r} of node {dst['id']} is not connected")
+    del ins[name]
+    if not ins:
+        dst.pop("in", None)
+
+
+_HANDLERS: Dict[str, Callable[[Dict[Any, Dict[str, Any]], Dict[str, Any]], None]] = {
+    "add_node": _add_node,
+    "remove_node": _remove_node,
+    "set_widget": _set_widget,
+    "connect": _connect,
+    "disconnect": _disconnect,
+}
+
+
+__all__ = [
+    "OP_TYPES",
+    "OPS_JSON_SCHEMA",
+    "OPS_SCHEMA",
+    "WorkflowOpError",
+    "apply_ops",
+    "parse_ops",
+    "summarize_ops",
+]
@@ -4,35 +4,52 @@ Provides the rewrite_workflow() function used by router.py.
 """
 
 from __future__ import annotations
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
+from ..agent_factory import ChatClient
+from ..provider_manager import ProviderManager
+from ..resilience import retry_scope
 from ..utils.logger import log
 from ..utils.request_context import (
     get_rewrite_context,
     reset_request_context,
     WorkflowRewriteContext,
 )
-from .workflow_rewrite_tools import rewrite_graph_with_llm
+from ..utils.settings import load_settings_async
+from .workflow_rewrite_tools import rewrite_graph_with_llm, rewrite_graph_with_ops
+
+
+REWRITE_MODES = ("patch", "full")
 
 
 # ============================================================
 # PUBLIC ENTRYPOINT (used by router.py)
 # ============================================================
 
-async def rewrite_workflow(request_json: Dict[str, Any]) -> Dict[str, Any]:
+async def rewrite_workflow(
+    request_json: Dict[str, Any],
+    llm: Optional[ChatClient] = None,
+) -> Dict[str, Any]:
     """
-    Top-level function called by router.py.
+    Top-level function called by router.py. `llm` overrides the provider
+    picked for the "rewrite" task (batch rewrites spread items over several);
+    so does a "provider" pinned in the request.
 
     Expects:
         {
             "workflow": { ... },
-            "prompt": "Rewrite this workflow..."
+            "prompt": "Rewrite this workflow...",
+            "mode": "patch" | "full", # optional, default workflow.rewrite.mode
+            "provider": "ollama",     # optional: pin a provider
+            "cache": false            # optional: bypass the response cache
         }
 
     Returns:
         {
             "workflow": <rewritten graph>,
-            "notes": <llm commentary>
+            "notes": <llm commentary>,
+            "mode": "patch" | "full",
+            "ops": [...]              # patch mode: the applied operations
         }
     """
 
@@ -50,6 +67,19 @@ async def rewrite_workflow(request_json: Dict[str, Any]) -> Dict[str, Any]:
     original_graph = request_json["workflow"]
     user_prompt = request_json["prompt"]
 
+    mode = request_json.get("mode")
+    if mode is None:
+        settings = await load_settings_async()
+        mode = ((settings.get("workflow") or {}).get("rewrite") or {}).get("mode", "patch")
+    if mode not in REWRITE_MODES:
+        return {"error": f"Invalid mode {mode!r} (expected one of: {', '.join(REWRITE_MODES)})"}
+
+    provider = request_json.get("provider")
+    if llm is None and provider:
+        llm = ProviderManager.instance().get_provider(str(provider))
+        if llm is None:
+            return {"error": f"Unknown provider {provider!r}"}
+
     # -------------------------------
     # Acquire per-request context
     # -------------------------------
@@ -61,10 +91,26 @@ async def rewrite_workflow(request_json: Dict[str, Any]) -> Dict[str, Any]:
         # -------------------------------------------------------
         # Core LLM rewrite logic
         # -------------------------------------------------------
-        rewritten_graph, notes = await rewrite_graph_with_llm(
-            graph=original_graph,
-            user_prompt=user_prompt,
-        )
+        use_cache = request_json.get("cache") is not False
+        ops = None
+        # Every provider call of this rewrite draws retries from one budget
+        with retry_scope():
+            if mode == "patch":
+                rewritten_graph, ops, notes = await rewrite_graph_with_ops(
+                    graph=original_graph,
+                    user_prompt=user_prompt,
+                    use_cache=use_cache,
+                    llm=llm,
+                )
+                if ops is None:
+                    mode = "full"  # workflow could not be patched; it was rewritten whole
+            else:
+                rewritten_graph, notes = await rewrite_graph_with_llm(
+                    graph=original_graph,
+                    user_prompt=user_prompt,
+                    use_cache=use_cache,
+                    llm=llm,
+                )
 
         # Stash notes into the context object for downstream use
         try:
@@ -78,10 +124,14 @@ async def rewrite_workflow(request_json: Dict[str, Any]) -> Dict[str, Any]:
 
         log.info("[ComfyAI] Workflow rewrite completed successfully")
 
-        return {
+        result = {
             "workflow": rewritten_graph,
             "notes": notes,
+            "mode": mode,
         }
+        if ops is not None:
+            result["ops"] = ops
+        return result
 
     finally:
         # Always clear context between requests
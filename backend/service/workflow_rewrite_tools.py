@@ -1,7 +1,7 @@
 """
 ComfyAI - Workflow Rewrite Tools
 
-Core rewrite_graph_with_llm() used by workflow_rewrite_agent.py.
+Core rewrite functions used by workflow_rewrite_agent.py.
 
 Takes:
     • workflow graph (dict)
@@ -9,15 +9,77 @@ Takes:
 Returns:
     • rewritten graph (dict)
     • notes (str)
+
+Two modes:
+    • rewrite_graph_with_llm()  the model returns the whole (compact) graph
+    • rewrite_graph_with_ops()  the model returns edit operations
+                                (workflow_ops.py), applied server-side, so
+                                output length scales with the change
+
+The graph is sent in the compact encoding from workflow_codec.py (no layout,
+renumbered ids, links folded into node inputs) and the model's answer is
+merged back onto the original layout. Large workflows are cut down to the
+neighbourhood the instruction is about (workflow_graph.py) and the answer is
+spliced back into the full graph.
 """
 
 from __future__ import annotations
-from typing import Dict, Any, Tuple
-
-import json
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from ..agent_factory import ChatClient, is_error_text
 from ..provider_manager import ProviderManager
+from ..response_cache import cache_key, get_response_cache
+from ..structured_output import ResponseFormat, parse_json, record_failure, structured_chat
+from ..utils import metrics
 from ..utils.logger import log
+from ..utils.settings import load_settings_async
+from .workflow_codec import (
+    COMPACT_SCHEMA,
+    FORMAT_UI,
+    EncodedWorkflow,
+    WorkflowCodecError,
+    decode_workflow,
+    dumps_compact,
+    encode_workflow,
+    token_report,
+)
+from .workflow_graph import (
+    GraphIndex,
+    Subgraph,
+    SubgraphConfig,
+    check_ops_scope,
+    select_subgraph,
+    splice_subgraph,
+)
+from .workflow_ops import OPS_JSON_SCHEMA, OPS_SCHEMA, apply_ops, parse_ops, summarize_ops
+
+
+BASE_SYSTEM_PROMPT = (
+    "You are ComfyAI, an expert workflow architect for ComfyUI. "
+    "You rewrite graph JSON safely."
+)
+
+COMPACT_FORMAT_PROMPT = (
+    " The graph is in a compact form: each node has an integer id, its type, "
+    "an optional title, widget values in order (\"widgets\"), its output names "
+    "(\"out\") and its connected inputs (\"in\": {input_name: [source_id, "
+    "output_index]}). \"mode\" 2 means muted, 4 means bypassed."
+)
+
+SUBGRAPH_PROMPT = (
+    " Only the part of the workflow relevant to the instructions is shown. "
+    "Nodes marked \"stub\" belong to the rest of the graph and are shown only "
+    "so you can see how this part is wired; do not edit or remove them."
+)
+
+# Per-workflow part of the subgraph instructions (kept out of the system
+# prompt so every rewrite of the same kind shares one system prompt)
+SUBGRAPH_IDS_PROMPT = "Give nodes you add ids starting at {next_id}.\n\n"
+
+
+class RewriteOutputError(ValueError):
+    """The model's answer could not be parsed or applied."""
 
 
 # ============================================================
@@ -27,70 +89,268 @@ from ..utils.logger import log
 async def rewrite_graph_with_llm(
     graph: Dict[str, Any],
     user_prompt: str,
+    use_cache: bool = True,
+    llm: Optional[ChatClient] = None,
 ) -> Tuple[Dict[str, Any], str]:
     """
     Main workflow rewrite function.
 
     Sends the workflow + prompt to the active LLM and expects a rewritten graph.
-    The LLM returns JSON which we parse back into a graph.
+    The LLM returns JSON which we parse back into a graph. Successful rewrites
+    are stored in the response cache (when enabled in settings). `llm`
+    overrides the provider picked for the "rewrite" task.
+
+    Returns (graph, notes). If the answer cannot be parsed (even after a
+    repair attempt) the original graph is returned with the reason in notes.
     """
 
     log.info("[ComfyAI] rewrite_graph_with_llm(): starting rewrite")
 
-    provider_mgr = ProviderManager.instance()
-
-    # Prefer a provider suitable for "rewrite" task
-    llm = provider_mgr.pick_provider(task="rewrite") or provider_mgr.get_default_llm()
-
-    if llm is None:
-        raise RuntimeError("No LLM provider configured")
+    llm = (llm or _rewrite_llm()).bind(task="rewrite")
+    settings = await load_settings_async()
+    encoded, focus, graph_json = _encode_for_prompt(graph, user_prompt, settings)
+    ui = encoded is not None and encoded.format == FORMAT_UI
 
     # --------------------------------------------------------
     # Construct LLM messages
     # --------------------------------------------------------
-    system_msg = (
-        "You are ComfyAI, an expert workflow architect for ComfyUI. "
-        "You rewrite graph JSON safely. "
-        "Always return valid JSON with the same structure as the input graph."
-    )
-
     user_msg = (
         f"User instructions:\n{user_prompt}\n\n"
-        f"Original workflow graph JSON:\n{json.dumps(graph, indent=2)}\n\n"
+        f"{_subgraph_ids(focus)}"
+        f"Original workflow graph JSON:\n{graph_json}\n\n"
         "Return ONLY JSON. No explanation."
     )
 
-    log.info("[ComfyAI] Sending rewrite request to LLM provider…")
-
     messages = [
-        {"role": "system", "content": system_msg},
+        {"role": "system", "content": system_prompt("full", ui, focus is not None)},
         {"role": "user", "content": user_msg},
     ]
 
     # --------------------------------------------------------
-    # Query the model
+    # Query the model and parse the rewritten graph
     # --------------------------------------------------------
-    response = await llm.chat(messages)
+    response_format = ResponseFormat("workflow", COMPACT_SCHEMA if ui else None)
+
+    def _rewritten(raw: str) -> Dict[str, Any]:
+        output = parse_json(raw, "rewrite")
+        if focus is not None:
+            output = splice_subgraph(encoded.compact, focus, output)
+        return _decode(output, encoded)
+
+    try:
+        new_graph, cached = await _complete(
+            llm, messages, "rewrite", response_format, use_cache, settings, _rewritten
+        )
+    except RewriteOutputError as e:
+        metrics.incr("rewrite.rejected")
+        log.error(f"[ComfyAI] ERROR parsing rewritten JSON: {e}")
+        # Fall back to original graph
+        return graph, f"Rewrite failed: {e}"
+
+    return new_graph, "Rewrite completed by LLM (cached)" if cached else "Rewrite completed by LLM"
+
+
+async def rewrite_graph_with_ops(
+    graph: Dict[str, Any],
+    user_prompt: str,
+    use_cache: bool = True,
+    llm: Optional[ChatClient] = None,
+) -> Tuple[Dict[str, Any], Optional[List[Dict[str, Any]]], str]:
+    """
+    Patch-mode rewrite: the model returns edit operations, which are
+    validated and applied to the original graph.
+
+    Returns (graph, ops, notes). On an invalid patch the original graph is
+    returned with ops=[] and the reason in notes. Workflows the codec cannot
+    encode as UI graphs (ops address compact node ids) fall back to a full
+    rewrite, with ops=None.
+    """
+
+    log.info("[ComfyAI] rewrite_graph_with_ops(): starting patch rewrite")
+
+    llm = (llm or _rewrite_llm()).bind(task="rewrite")
+    settings = await load_settings_async()
+    encoded, focus, graph_json = _encode_for_prompt(graph, user_prompt, settings)
+    if encoded is None or encoded.format != FORMAT_UI:
+        log.info("[ComfyAI] Patch mode needs a UI-format workflow; doing a full rewrite")
+        new_graph, notes = await rewrite_graph_with_llm(graph, user_prompt, use_cache, llm)
+        return new_graph, None, notes
+
+    user_msg = (
+        f"User instructions:\n{user_prompt}\n\n"
+        f"{_subgraph_ids(focus)}"
+        f"Workflow graph JSON:\n{graph_json}\n\n"
+        "Return ONLY the JSON operations. No explanation."
+    )
+
+    messages = [
+        {"role": "system", "content": system_prompt("patch", True, focus is not None)},
+        {"role": "user", "content": user_msg},
+    ]
+
+    def _patch(raw: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        ops = parse_ops(parse_json(raw, "rewrite_ops"))
+        if focus is not None:
+            check_ops_scope(ops, focus)
+        return decode_workflow(apply_ops(encoded.compact, ops), encoded), ops
 
+    try:
+        (new_graph, ops), cached = await _complete(
+            llm, messages, "rewrite_ops", ResponseFormat("workflow_ops", OPS_JSON_SCHEMA),
+            use_cache, settings, _patch,
+        )
+    except RewriteOutputError as e:
+        metrics.incr("rewrite.ops_rejected")
+        log.error(f"[ComfyAI] Rejected rewrite patch: {e}")
+        return graph, [], f"Rewrite patch rejected: {e}"
+
+    metrics.incr("rewrite.ops_applied", len(ops))
+    notes = f"Rewrite applied: {summarize_ops(ops)}"
+    return new_graph, ops, notes + " (cached)" if cached else notes
+
+
+# ============================================================
+# HELPERS
+# ============================================================
+
+@lru_cache(maxsize=None)
+def system_prompt(mode: str, compact_ui: bool, subgraph: bool) -> str:
+    """
+    System prompt for a rewrite. It depends only on the kind of rewrite, so
+    batches (and providers with prompt-prefix caching) reuse one string.
+    """
+    if mode == "patch":
+        prompt = BASE_SYSTEM_PROMPT + COMPACT_FORMAT_PROMPT + (
+            " Do not repeat the graph. Describe the change as a list of operations "
+            "using the node ids shown, and give nodes you add new ids. "
+            "Return JSON of this form:\n" + OPS_SCHEMA
+        )
+        if subgraph:
+            prompt += SUBGRAPH_PROMPT + " You may connect to and from stubs."
+        return prompt
+
+    prompt = BASE_SYSTEM_PROMPT + (
+        " Always return valid JSON with the same structure as the input graph."
+    )
+    if compact_ui:
+        prompt += COMPACT_FORMAT_PROMPT + (
+            " Keep the ids of nodes you keep, use new ids for nodes you add, "
+            "and omit nodes you remove."
+        )
+    if subgraph:
+        prompt += SUBGRAPH_PROMPT
+    return prompt
+
+
+def _subgraph_ids(focus: Optional[Subgraph]) -> str:
+    return SUBGRAPH_IDS_PROMPT.format(next_id=focus.next_id) if focus is not None else ""
+
+
+def _rewrite_llm() -> ChatClient:
+    provider_mgr = ProviderManager.instance()
+
+    # Prefer a provider suitable for "rewrite" task
+    llm = provider_mgr.pick_provider(task="rewrite") or provider_mgr.get_default_llm()
+
+    if llm is None:
+        raise RuntimeError("No LLM provider configured")
+    return llm
+
+
+def _encode_for_prompt(
+    graph: Dict[str, Any],
+    user_prompt: str,
+    settings: Dict[str, Any],
+) -> Tuple[Optional[EncodedWorkflow], Optional[Subgraph], str]:
+    """Compact encoding of `graph`, cut down to the relevant subgraph if it is large."""
+    try:
+        encoded = encode_workflow(graph)
+    except WorkflowCodecError as e:
+        log.warning(f"[ComfyAI] Sending workflow unencoded: {e}")
+        return None, None, dumps_compact(graph)
+
+    report = token_report(graph, encoded)
+    metrics.observe("rewrite.prompt_tokens_saved", report["saved_tokens"])
+    log.info(
+        f"[ComfyAI] Compact workflow encoding: ~{report['original_tokens']} -> "
+        f"~{report['compact_tokens']} tokens ({report['saved_pct']}% saved)"
+    )
+
+    config = SubgraphConfig.from_settings(settings)
+    nodes = encoded.compact.get("nodes") if encoded.format == FORMAT_UI else None
+    if nodes is None or config.min_nodes is None or len(nodes) < config.min_nodes:
+        return encoded, None, encoded.dumps()
+
+    focus = select_subgraph(GraphIndex(encoded.compact), user_prompt, config.max_nodes)
+    if focus is None:
+        log.info("[ComfyAI] No nodes match the instructions; sending the whole workflow")
+        return encoded, None, encoded.dumps()
+
+    metrics.incr("rewrite.subgraph_used")
+    metrics.observe("rewrite.subgraph_nodes", len(focus.selected))
+    log.info(
+        f"[ComfyAI] Rewriting a {len(focus.selected)}-node subgraph "
+        f"(+{len(focus.stubs)} stubs) of {len(nodes)} nodes"
+    )
+    return encoded, focus, dumps_compact(focus.compact)
+
+
+async def _complete(
+    llm: ChatClient,
+    messages: List[Dict[str, str]],
+    kind: str,
+    response_format: ResponseFormat,
+    use_cache: bool,
+    settings: Dict[str, Any],
+    parse: Callable[[str], Any],
+) -> Tuple[Any, bool]:
+    """
+    Run the model in JSON mode (or hit the response cache) and parse its
+    output. Only outputs that parse are cached; provider error replies raise
+    RewriteOutputError. Returns (parsed, served_from_cache).
+    """
+    cache = get_response_cache(settings) if use_cache else None
+    cache_id = cache_key(llm, messages, kind=kind) if cache else None
+
+    cached = await cache.get(cache_id) if cache else None
+    if cached is not None:
+        log.info("[ComfyAI] Rewrite served from response cache")
+        return _parse(parse, cached), True
+
+    log.info("[ComfyAI] Sending rewrite request to LLM provider…")
+    raw_output = await structured_chat(llm, messages, response_format)
     log.info("[ComfyAI] Received LLM rewrite response")
 
-    # ChatClient returns raw string content
-    raw_output = response
+    # Provider failures come back as text, and repair_json() would dig the
+    # JSON error body out of them; never parse or cache those
+    if is_error_text(raw_output):
+        record_failure(kind)
+        raise RewriteOutputError(raw_output.strip()[:300])
 
+    result = _parse(parse, raw_output)
+    if cache:
+        cache.put(cache_id, raw_output)
+    return result, False
 
-    # --------------------------------------------------------
-    # Parse rewritten graph
-    # --------------------------------------------------------
+
+def _parse(parse: Callable[[str], Any], raw: str) -> Any:
+    # Bad JSON, an invalid op, or a graph the codec cannot merge back
     try:
-        new_graph = json.loads(raw_output)
+        return parse(raw)
     except Exception as e:
-        log.error(f"[ComfyAI] ERROR parsing rewritten JSON: {e}")
-        # Fall back to original graph
-        new_graph = graph
+        raise RewriteOutputError(str(e)) from e
 
-    notes = "Rewrite completed by LLM"
 
-    return new_graph, notes
+def _decode(output: Any, encoded: Optional[EncodedWorkflow]) -> Dict[str, Any]:
+    """Merge the model's compact graph back onto the original workflow."""
+    if encoded is None:
+        return output
+    return decode_workflow(output, encoded)
 
 
-__all__ = ["rewrite_graph_with_llm"]
+__all__ = [
+    "RewriteOutputError",
+    "rewrite_graph_with_llm",
+    "rewrite_graph_with_ops",
+    "system_prompt",
+]
@@ -0,0 +1,344 @@
+"""
+ComfyAI - Structured Output
+
+JSON-mode requests and tolerant JSON parsing for calls whose answer must be
+machine-readable (workflow rewrites).
+
+  • ResponseFormat    bound onto a ChatClient (client.bind(response_format=...))
+                      and translated per provider:
+                        Ollama   "format": <JSON schema> (or "json")
+                        OpenAI   response_format json_schema / json_object
+                        Gemini   responseMimeType + responseSchema
+  • structured_chat() uses that when the provider supports it; otherwise it
+                      streams the answer through JSONStreamExtractor and
+                      stops as soon as the top-level JSON value is complete
+  • parse_json()      strips markdown fences and surrounding prose, repairs
+                      the usual slips (trailing commas, comments, Python
+                      literals, single quotes, truncated output) and records
+                      ok / repaired / failed counts per kind in metrics
+
+Provider support can be forced in providers.json with
+"options": {"structured_output": true | false}.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+from .utils import metrics
+from .utils.logger import log
+
+if TYPE_CHECKING:
+    from .agent_factory import ChatClient
+
+
+class StructuredOutputError(ValueError):
+    """Model output could not be turned into JSON."""
+
+
+@dataclass(frozen=True)
+class ResponseFormat:
+    """Requested shape of a JSON answer. schema=None asks for any JSON object."""
+    name: str = "response"
+    schema: Optional[Dict[str, Any]] = None
+
+    # --------------------------------------------------------
+    # Provider payloads
+    # --------------------------------------------------------
+    def ollama(self) -> Any:
+        return self.schema if self.schema is not None else "json"
+
+    def openai(self) -> Dict[str, Any]:
+        if self.schema is None:
+            return {"type": "json_object"}
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": self.name, "schema": self.schema, "strict": False},
+        }
+
+    def gemini(self) -> Dict[str, Any]:
+        config: Dict[str, Any] = {"responseMimeType": "application/json"}
+        if self.schema is not None and _gemini_expressible(self.schema):
+            config["responseSchema"] = gemini_schema(self.schema)
+        return config
+
+
+# Gemini accepts an OpenAPI subset of JSON schema
+_GEMINI_SCHEMA_KEYS = {
+    "type", "format", "description", "nullable", "enum", "properties",
+    "required", "items", "minItems", "maxItems", "anyOf", "propertyOrdering",
+}
+
+
+def _gemini_expressible(schema: Any) -> bool:
+    """
+    Gemini schemas cannot say "any value": every node needs a type, arrays
+    need items and objects need properties. Anything looser is sent as plain
+    JSON mode rather than a schema that would drop those fields.
+    """
+    if not isinstance(schema, dict) or "type" not in schema:
+        return False
+    if schema["type"] == "array":
+        return _gemini_expressible(schema.get("items"))
+    if schema["type"] == "object":
+        props = schema.get("properties")
+        return bool(props) and all(_gemini_expressible(s) for s in props.values())
+    return True
+
+
+def gemini_schema(schema: Any) -> Any:
+    """Drop JSON-schema keywords Gemini rejects (additionalProperties, $schema, ...)."""
+    if isinstance(schema, list):
+        return [gemini_schema(s) for s in schema]
+    if not isinstance(schema, dict):
+        return schema
+    out: Dict[str, Any] = {}
+    for key, value in schema.items():
+        if key not in _GEMINI_SCHEMA_KEYS:
+            continue
+        if key == "properties":
+            out[key] = {name: gemini_schema(s) for name, s in value.items()}
+        elif key == "type" and isinstance(value, list):
+            # ["string", "null"] → "string" + nullable
+            types = [t for t in value if t != "null"]
+            out["type"] = types[0] if len(types) == 1 else "string"
+            if "null" in value:
+                out["nullable"] = True
+        else:
+            out[key] = gemini_schema(value)
+    return out
+
+
+# ============================================================
+# Streaming extraction
+# ============================================================
+
+class JSONStreamExtractor:
+    """
+    Finds the first top-level JSON object / array in streamed text.
+
+    feed() returns the JSON text once its closing bracket arrives, so the
+    caller can stop generation instead of paying for trailing prose.
+    """
+
+    def __init__(self) -> None:
+        self._buf: List[str] = []
+        self._started = False
+        self._depth = 0
+        self._in_string: Optional[str] = None
+        self._escape = False
+        self.done = False
+        self.text = ""  # everything fed so far
+
+    def feed(self, chunk: str) -> Optional[str]:
+        self.text += chunk
+        if self.done:
+            return None
+        for ch in chunk:
+            if not self._started:
+                if ch in "{[":
+                    self._started = True
+                else:
+                    continue
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == self._in_string:
+                    self._in_string = None
+            elif ch in "\"'":
+                self._in_string = ch
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                    return "".join(self._buf)
+        return None
+
+    @property
+    def partial(self) -> str:
+        """Text from the opening bracket on (complete or not)."""
+        return "".join(self._buf)
+
+    def result(self) -> str:
+        """The JSON text if complete, else everything received (for repair)."""
+        return self.partial if self.done else self.text
+
+
+async def structured_chat(
+    llm: "ChatClient",
+    messages: Sequence[Dict[str, Any]],
+    response_format: ResponseFormat,
+) -> str:
+    """Run `messages` asking for JSON; returns the raw JSON text (unparsed)."""
+    if llm.supports_structured_output():
+        return await llm.bind(response_format=response_format).chat(messages)
+
+    extractor = JSONStreamExtractor()
+    stream = llm.stream_chat(messages)
+    try:
+        async for chunk in stream:
+            if extractor.feed(chunk) is not None:
+                metrics.incr("structured.stream_stopped_early")
+                break
+    finally:
+        await stream.aclose()
+    return extractor.result()
+
+
+# ============================================================
+# Parsing & repair
+# ============================================================
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)```", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_MAX_STARTS = 8
+
+
+def parse_json(text: str, kind: str = "response") -> Any:
+    """
+    Parse model output as JSON, repairing it if needed.
+
+    Counts structured.<kind>.ok / .repaired / .failed in metrics and keeps
+    structured.<kind>.failure_rate up to date. Raises StructuredOutputError.
+    """
+    try:
+        value = json.loads(text)
+        _record(kind, "ok")
+        return value
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        value = repair_json(text)
+    except StructuredOutputError:
+        _record(kind, "failed")
+        raise
+    _record(kind, "repaired")
+    log.info(f"[ComfyAI] Repaired malformed JSON from model ({kind})")
+    return value
+
+
+def repair_json(text: Any) -> Any:
+    if not isinstance(text, str):
+        raise StructuredOutputError("Model output is not text")
+
+    candidates = [m.group(1) for m in _FENCE_RE.finditer(text)] + [text]
+    for candidate in candidates:
+        # Prose may contain brackets before the JSON starts: try a few openings
+        starts = [m.start() for m in re.finditer(r"[{\[]", candidate)][:_MAX_STARTS]
+        for start in starts:
+            extractor = JSONStreamExtractor()
+            extractor.feed(candidate[start:])
+            body = extractor.partial
+            for attempt in (body, _fix(body), _fix(_close(body))):
+                try:
+                    return json.loads(attempt)
+                except ValueError:
+                    continue
+    raise StructuredOutputError(f"No valid JSON in model output: {text[:120]!r}")
+
+
+def _fix(text: str) -> str:
+    """Token-level cleanup outside strings: comments, quotes, literals, commas."""
+    out: List[str] = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch in "\"'":
+            # Copy a string, normalizing single quotes to double quotes
+            j = i + 1
+            buf = []
+            while j < n and text[j] != ch:
+                if text[j] == "\\" and j + 1 < n:
+                    # \' is not a JSON escape
+                    buf.append("'" if text[j + 1] == "'" else text[j:j + 2])
+                    j += 2
+                    continue
+                if ch == "'" and text[j] == '"':
+                    buf.append('\\"')
+                else:
+                    buf.append(text[j])
+                j += 1
+            out.append('"' + "".join(buf) + '"')
+            i = j + 1
+        elif text.startswith("//", i):
+            while i < n and text[i] != "\n":
+                i += 1
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+        elif ch.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            if re.match(r"\s*:", text[j:]):
+                out.append(f'"{word}"')  # bare object key
+            else:
+                out.append(_PY_LITERALS.get(word, word))
+            i = j
+        else:
+            out.append(ch)
+            i += 1
+    return _TRAILING_COMMA_RE.sub(r"\1", "".join(out))
+
+
+def _close(text: str) -> str:
+    """Close a truncated value: open string, dangling separator, open brackets."""
+    stack: List[str] = []
+    in_string: Optional[str] = None
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == in_string:
+                in_string = None
+        elif ch in "\"'":
+            in_string = ch
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+
+    closed = text + (in_string or "")
+    closed = re.sub(r"[,:]\s*$", "", closed.rstrip())
+    # A dangling key ({"a": 1, "b") cannot be completed; drop it
+    closed = re.sub(r",\s*\"[^\"]*\"\s*$", "", closed)
+    return closed + "".join(reversed(stack))
+
+
+def record_failure(kind: str) -> None:
+    """Count an output of `kind` that was unusable before it reached parse_json()."""
+    _record(kind, "failed")
+
+
+def _record(kind: str, outcome: str) -> None:
+    metrics.incr(f"structured.{kind}.{outcome}")
+    failed = metrics.get_counter(f"structured.{kind}.failed")
+    total = failed + sum(metrics.get_counter(f"structured.{kind}.{o}") for o in ("ok", "repaired"))
+    if total:
+        metrics.set_gauge(f"structured.{kind}.failure_rate", round(failed / total, 4))
+
+
+__all__ = [
+    "JSONStreamExtractor",
+    "ResponseFormat",
+    "StructuredOutputError",
+    "gemini_schema",
+    "parse_json",
+    "record_failure",
+    "repair_json",
+    "structured_chat",
+]
@@ -0,0 +1,135 @@
+"""
+ComfyAI - Generation Cancellation
+
+Tracks in-flight chat generations so they can be aborted:
+  • automatically, when the HTTP client disconnects
+  • explicitly, via POST /api/comfyai/chat/cancel {"request_id": ...}
+
+Generations are keyed by the request id issued through
+request_context.set_session_id() (returned to the browser in the
+X-ComfyAI-Request-Id header). Cancelling one closes the upstream provider
+connection, which makes Ollama / OpenAI-compatible servers stop generating.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from aiohttp import web
+
+from .logger import log
+from . import metrics
+
+
+REQUEST_ID_HEADER = "X-ComfyAI-Request-Id"
+
+# How often an idle request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 1.0
+
+
+class GenerationHandle:
+    """One cancellable generation."""
+
+    def __init__(self, request_id: str, provider: str = ""):
+        self.request_id = request_id
+        self.provider = provider
+        self.cancelled = False
+        self.reason: Optional[str] = None
+        self._callbacks: List[Callable[[], None]] = []
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Run `callback` on cancel (immediately if already cancelled)."""
+        if self.cancelled:
+            callback()
+        else:
+            self._callbacks.append(callback)
+
+    def cancel(self, reason: str = "client") -> bool:
+        if self.cancelled:
+            return False
+        self.cancelled = True
+        self.reason = reason
+
+        metrics.incr("chat.cancelled")
+        metrics.incr(f"chat.cancelled.{reason}")
+        if self.provider:
+            metrics.incr(f"chat.cancelled.provider.{self.provider}")
+        log.info(f"[ComfyAI] Generation {self.request_id} cancelled ({reason})")
+
+        callbacks, self._callbacks = self._callbacks, []
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception:
+                log.exception("[ComfyAI] Cancel callback failed")
+        return True
+
+
+# ============================================================
+# Registry
+# ============================================================
+
+_active: Dict[str, List[GenerationHandle]] = {}
+
+
+@contextmanager
+def track_generation(request_id: str, provider: str = "") -> Iterator[GenerationHandle]:
+    """Register a generation for the duration of the block."""
+    handle = GenerationHandle(request_id, provider)
+    _active.setdefault(request_id, []).append(handle)
+    metrics.set_gauge("chat.active_generations", sum(len(h) for h in _active.values()))
+    try:
+        yield handle
+    finally:
+        handles = _active.get(request_id)
+        if handles is not None:
+            if handle in handles:
+                handles.remove(handle)
+            if not handles:
+                _active.pop(request_id, None)
+        metrics.set_gauge("chat.active_generations", sum(len(h) for h in _active.values()))
+
+
+def cancel_generation(request_id: str, reason: str = "client") -> int:
+    """Cancel every generation registered under `request_id`; returns count."""
+    return sum(1 for h in list(_active.get(request_id, [])) if h.cancel(reason))
+
+
+def active_generations() -> Dict[str, int]:
+    return {rid: len(handles) for rid, handles in _active.items()}
+
+
+# ============================================================
+# Disconnect detection
+# ============================================================
+
+def client_disconnected(request: web.Request) -> bool:
+    transport = request.transport
+    return transport is None or transport.is_closing()
+
+
+async def watch_disconnect(request: web.Request, handle: GenerationHandle) -> None:
+    """
+    Poll the client connection and cancel `handle` once it goes away.
+
+    aiohttp only notices a vanished client on the next write; while a model
+    is still thinking nothing is written, so we have to look ourselves.
+    """
+    while not handle.cancelled:
+        if client_disconnected(request):
+            handle.cancel("disconnect")
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+__all__ = [
+    "REQUEST_ID_HEADER",
+    "GenerationHandle",
+    "track_generation",
+    "cancel_generation",
+    "active_generations",
+    "client_disconnected",
+    "watch_disconnect",
+]
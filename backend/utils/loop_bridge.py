@@ -0,0 +1,108 @@
+"""
+ComfyAI - Event Loop Bridge
+
+ComfyUI executes nodes on its prompt-worker thread, while provider clients
+(pooled aiohttp sessions, admission queues) live on the PromptServer event
+loop. run_coroutine_sync() submits a coroutine to that loop with
+asyncio.run_coroutine_threadsafe() and blocks the calling thread until it
+finishes, so nodes share the server's pools and limits instead of spinning
+up an event loop (and fresh connections) per execution.
+
+Outside ComfyUI (scripts, tests) a single background loop thread stands in
+for the server loop.
+
+While waiting, an "Interrupt" in the ComfyUI queue cancels the coroutine.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+from typing import Awaitable, Optional, TypeVar
+
+from .logger import log
+
+T = TypeVar("T")
+
+# How often a waiting node checks for a ComfyUI interrupt
+_POLL_INTERVAL = 0.25
+
+_fallback_loop: Optional[asyncio.AbstractEventLoop] = None
+_fallback_lock = threading.Lock()
+
+
+def _server_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        from server import PromptServer
+    except ImportError:
+        return None
+    loop = getattr(getattr(PromptServer, "instance", None), "loop", None)
+    if loop is None or loop.is_closed():
+        return None
+    return loop
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _fallback_loop
+    with _fallback_lock:
+        if _fallback_loop is None or _fallback_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="comfyai-loop", daemon=True)
+            thread.start()
+            _fallback_loop = loop
+            log.info("[ComfyAI] Started background event loop (no PromptServer loop found)")
+        return _fallback_loop
+
+
+def shared_loop() -> asyncio.AbstractEventLoop:
+    """The PromptServer loop, or the shared background loop outside ComfyUI."""
+    return _server_loop() or _background_loop()
+
+
+def _check_interrupted() -> None:
+    """Raise ComfyUI's InterruptProcessingException if the user hit Cancel."""
+    try:
+        import comfy.model_management as mm
+    except ImportError:
+        return
+    mm.throw_exception_if_processing_interrupted()
+
+
+def run_coroutine_sync(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    Run `coro` on the shared loop from a worker thread and return its result.
+
+    Raises TimeoutError after `timeout` seconds (the coroutine is cancelled).
+    Must not be called from the loop's own thread: that would deadlock.
+    """
+    loop = shared_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()  # type: ignore[attr-defined]
+        raise RuntimeError("run_coroutine_sync() called from the event loop thread; await instead")
+
+    future = asyncio.run_coroutine_threadsafe(coro, loop)  # type: ignore[arg-type]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = _POLL_INTERVAL
+        if deadline is not None:
+            wait = min(wait, max(0.0, deadline - time.monotonic()))
+        try:
+            return future.result(wait)
+        except concurrent.futures.TimeoutError:
+            if deadline is not None and time.monotonic() >= deadline:
+                future.cancel()
+                raise TimeoutError(f"Timed out after {timeout:g}s") from None
+        try:
+            _check_interrupted()
+        except BaseException:
+            future.cancel()
+            raise
+
+
+__all__ = ["run_coroutine_sync", "shared_loop"]
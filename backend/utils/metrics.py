@@ -0,0 +1,132 @@
+"""
+ComfyAI - Runtime Metrics
+
+Tiny in-process metrics registry:
+  • counters   (monotonic, e.g. cache hits)
+  • gauges     (point-in-time values, e.g. queue depth)
+  • summaries  (count/sum/min/max + recent-window percentiles)
+
+Names are dotted strings, e.g. "settings_cache.hits" or
+"chat.cancelled.ollama". Served by GET /api/comfyai/metrics.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+
+# Recent observations kept per summary for percentile estimates
+_WINDOW = 512
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_summaries: Dict[str, "_Summary"] = {}
+
+
+class _Summary:
+    __slots__ = ("count", "total", "min", "max", "recent")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.recent: Deque[float] = deque(maxlen=_WINDOW)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[idx]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "min": self.min,
+            "max": self.max,
+            "avg": round(self.total / self.count, 4) if self.count else None,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+        }
+
+
+# ============================================================
+# Recording
+# ============================================================
+
+def incr(name: str, value: float = 1) -> None:
+    """Increment a counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Set a gauge to an absolute value."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Record one observation in a summary."""
+    with _lock:
+        summary = _summaries.get(name)
+        if summary is None:
+            summary = _summaries[name] = _Summary()
+        summary.add(float(value))
+
+
+# ============================================================
+# Reading
+# ============================================================
+
+def get_counter(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def get_percentile(name: str, q: float) -> Optional[float]:
+    """Percentile (0..1) over the recent window of a summary, or None."""
+    with _lock:
+        summary = _summaries.get(name)
+        return summary.percentile(q) if summary else None
+
+
+def snapshot() -> Dict[str, Any]:
+    """JSON-friendly copy of every metric."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "summaries": {k: v.to_dict() for k, v in _summaries.items()},
+        }
+
+
+def reset() -> None:
+    """Drop all metrics (tests / manual reset)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _summaries.clear()
+
+
+__all__ = [
+    "incr",
+    "set_gauge",
+    "observe",
+    "get_counter",
+    "get_percentile",
+    "snapshot",
+    "reset",
+]
@@ -0,0 +1,194 @@
+"""
+ComfyAI - Async Persistence
+
+Keeps config/settings file I/O off ComfyUI's PromptServer event loop.
+
+Provides:
+  • run_io()            run a blocking call on the dedicated I/O executor
+  • atomic_write_json() temp-file + fsync + rename, never a torn file
+  • CoalescingWriter    debounce bursts of writes into a single flush
+  • providers_lock()    serializes read-modify-write of providers.json
+  • settings_lock()     serializes read-modify-write of settings.json
+
+The executor has a single worker, so every write it performs happens in
+submission order.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, List, Optional, TypeVar, Union
+
+from .logger import log
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="comfyai-io")
+
+
+# ============================================================
+# Executor
+# ============================================================
+
+async def run_io(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking file operation on the ComfyAI I/O thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+
+# ============================================================
+# Atomic JSON write
+# ============================================================
+
+def atomic_write_json(path: Union[str, Path], data: Any, **dump_kwargs: Any) -> None:
+    """
+    Write JSON to `path` atomically.
+
+    Data goes to a temp file in the same directory, is fsync'd, then
+    renamed over the target, so readers see either the old or the new file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    dump_kwargs.setdefault("indent", 2)
+
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+# ============================================================
+# Coalescing writer
+# ============================================================
+
+_writers: List["CoalescingWriter"] = []
+
+
+class CoalescingWriter:
+    """
+    Debounced writer: schedule() many times, write once.
+
+    Each schedule() replaces the pending payload; `delay` seconds after the
+    first one, the latest payload is handed to `write_fn` on the I/O thread.
+    schedule() returns a future that resolves once the write covering its
+    payload is on disk, or carries that write's exception.
+    """
+
+    def __init__(self, name: str, write_fn: Callable[[Any], None], delay: float = 0.25):
+        self.name = name
+        self.write_fn = write_fn
+        self.delay = delay
+
+        self._pending: Any = None
+        self._has_pending = False
+        self._task: Optional[asyncio.Task] = None
+        self._waiters: List["asyncio.Future[None]"] = []
+
+        self.flushes = 0
+        self.coalesced = 0
+
+        _writers.append(self)
+
+    @property
+    def has_pending(self) -> bool:
+        return self._has_pending
+
+    def schedule(self, data: Any) -> "asyncio.Future[None]":
+        if self._has_pending:
+            self.coalesced += 1
+        self._pending = deepcopy(data)
+        self._has_pending = True
+
+        loop = asyncio.get_running_loop()
+        waiter: "asyncio.Future[None]" = loop.create_future()
+        self._waiters.append(waiter)
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._delayed_flush())
+        return waiter
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.delay)
+        try:
+            await self.flush()
+        except Exception:
+            log.exception(f"[ComfyAI] Deferred write of {self.name} failed")
+
+    async def flush(self) -> None:
+        """Write the pending payload now (no-op if nothing is pending)."""
+        if not self._has_pending:
+            return
+        data, self._pending, self._has_pending = self._pending, None, False
+        waiters, self._waiters = self._waiters, []
+        try:
+            await run_io(self.write_fn, data)
+        except BaseException as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+                    waiter.exception()  # logged here; callers may not await it
+            raise
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.flushes += 1
+
+
+async def flush_pending_writes() -> None:
+    """Flush every CoalescingWriter (app shutdown)."""
+    for writer in _writers:
+        try:
+            await writer.flush()
+        except Exception:
+            log.exception(f"[ComfyAI] Final flush of {writer.name} failed")
+
+
+# ============================================================
+# providers.json / settings.json serialization
+# ============================================================
+
+_providers_lock: Optional[asyncio.Lock] = None
+
+
+def providers_lock() -> asyncio.Lock:
+    """Lock held around every read-modify-write of providers.json."""
+    global _providers_lock
+    if _providers_lock is None:
+        _providers_lock = asyncio.Lock()
+    return _providers_lock
+
+
+_settings_lock: Optional[asyncio.Lock] = None
+
+
+def settings_lock() -> asyncio.Lock:
+    """Lock held around every read-modify-write of settings.json."""
+    global _settings_lock
+    if _settings_lock is None:
+        _settings_lock = asyncio.Lock()
+    return _settings_lock
+
+
+__all__ = [
+    "run_io",
+    "atomic_write_json",
+    "CoalescingWriter",
+    "flush_pending_writes",
+    "providers_lock",
+    "settings_lock",
+]
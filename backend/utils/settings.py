@@ -1,9 +1,15 @@
+import asyncio
 import json
+import threading
+import time
 from copy import deepcopy
-from typing import Any, Dict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
 
 from .paths import SETTINGS_PATH, DEFAULTS_PATH, ensure_user_config_dir
 from .logger import log
+from . import metrics
+from .persistence import CoalescingWriter, atomic_write_json, run_io
 
 # -----------------------------------------------------------
 # Default settings schema (Only for version, actual defaults loaded from defaults.json)
@@ -34,6 +40,92 @@ def _deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any
             result[k] = v
     return result
 
+# -----------------------------------------------------------
+# In-memory cache
+# -----------------------------------------------------------
+
+# How often (seconds) a cached entry re-checks file mtime/inode. Between
+# checks the chat hot path does no file I/O at all.
+SETTINGS_REVALIDATE_INTERVAL = 1.0
+
+FileSignature = Optional[Tuple[int, int, int]]
+
+
+def _file_signature(path: Path) -> FileSignature:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+class _SettingsCache:
+    """Merged settings + raw layers + resolved prompts, keyed by file signatures."""
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.signature: Optional[Tuple[FileSignature, FileSignature]] = None
+        self.checked_at = 0.0
+        self.merged: Optional[Dict[str, Any]] = None
+        self.raw_defaults: Dict[str, Any] = {}
+        self.raw_user: Dict[str, Any] = {}
+        self.prompts: Dict[str, str] = {}
+
+    def current_signature(self) -> Tuple[FileSignature, FileSignature]:
+        return (_file_signature(DEFAULTS_PATH), _file_signature(SETTINGS_PATH))
+
+    def is_recent(self) -> bool:
+        """Fresh without touching disk (inside the revalidation window)."""
+        return (
+            self.merged is not None
+            and time.monotonic() - self.checked_at < SETTINGS_REVALIDATE_INTERVAL
+        )
+
+    def is_fresh(self) -> bool:
+        if self.merged is None:
+            return False
+        now = time.monotonic()
+        if now - self.checked_at < SETTINGS_REVALIDATE_INTERVAL:
+            return True
+        self.checked_at = now
+        if self.current_signature() != self.signature:
+            metrics.incr("settings_cache.invalidations")
+            return False
+        return True
+
+    def store(self, merged: Dict[str, Any], raw_defaults: Dict[str, Any], raw_user: Dict[str, Any]) -> None:
+        self.merged = deepcopy(merged)
+        self.raw_defaults = raw_defaults
+        self.raw_user = deepcopy(raw_user)
+        self.prompts = {}
+        self.signature = self.current_signature()
+        self.checked_at = time.monotonic()
+
+    def clear(self) -> None:
+        self.merged = None
+        self.signature = None
+        self.prompts = {}
+
+
+_cache = _SettingsCache()
+
+
+def invalidate_settings_cache() -> None:
+    """Force the next load_settings() / prompt lookup to re-read disk."""
+    with _cache.lock:
+        _cache.clear()
+
+
+def settings_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters for the settings cache."""
+    return {
+        "hits": metrics.get_counter("settings_cache.hits"),
+        "misses": metrics.get_counter("settings_cache.misses"),
+        "invalidations": metrics.get_counter("settings_cache.invalidations"),
+        "prompt_hits": metrics.get_counter("settings_cache.prompt_hits"),
+        "prompt_misses": metrics.get_counter("settings_cache.prompt_misses"),
+    }
+
 # -----------------------------------------------------------
 # Load / Save settings.json
 # -----------------------------------------------------------
@@ -42,16 +134,31 @@ def load_settings() -> Dict[str, Any]:
     """
     Load settings, merging defaults.json and then settings.json.
     Persist repaired settings back to disk if needed.
+
+    Served from memory while defaults.json / settings.json are unchanged.
+    Callers get their own copy and may mutate it freely.
     """
+    with _cache.lock:
+        if _cache.is_fresh():
+            metrics.incr("settings_cache.hits")
+            return deepcopy(_cache.merged)
+
+        metrics.incr("settings_cache.misses")
+        return deepcopy(_load_settings_from_disk())
+
+
+def _load_settings_from_disk() -> Dict[str, Any]:
     ensure_user_config_dir()
 
     # 1. Load defaults from config/defaults.json
     defaults = deepcopy(DEFAULT_SETTINGS) # Start with minimal defaults
+    file_defaults: Dict[str, Any] = {}
     if DEFAULTS_PATH.exists():
         try:
             with DEFAULTS_PATH.open("r", encoding="utf-8") as f:
-                file_defaults = json.load(f)
-            if isinstance(file_defaults, dict):
+                loaded = json.load(f)
+            if isinstance(loaded, dict):
+                file_defaults = loaded
                 defaults = _deep_merge(defaults, file_defaults)
             else:
                 log.error(f"[ComfyAI] defaults.json root must be an object, using minimal defaults.")
@@ -82,7 +189,9 @@ def load_settings() -> Dict[str, Any]:
     if merged_settings != user_settings or not SETTINGS_PATH.exists():
         log.warning("[ComfyAI][SETTINGS] Repaired or created settings.json — saving")
         save_settings(merged_settings)
+        user_settings = merged_settings
 
+    _cache.store(merged_settings, file_defaults, user_settings)
     return merged_settings
 
 def save_settings(settings: Dict[str, Any]) -> None:
@@ -92,13 +201,103 @@ def save_settings(settings: Dict[str, Any]) -> None:
     """
     ensure_user_config_dir()
     try:
-        with SETTINGS_PATH.open("w", encoding="utf-8") as f:
-            json.dump(settings, f, indent=2, ensure_ascii=False)
+        atomic_write_json(SETTINGS_PATH, settings, indent=2, ensure_ascii=False)
         log.info("[ComfyAI] settings.json saved")
     except Exception as e:
+        invalidate_settings_cache()
         log.error(f"[ComfyAI] Error saving settings.json: {e}")
         raise
 
+    with _cache.lock:
+        _write_through(settings)
+
+
+def _write_through(settings: Dict[str, Any]) -> None:
+    # The saved dict *is* the new user layer. Merging it over the cached
+    # defaults keeps the cache valid without a re-read.
+    if _cache.merged is not None:
+        merged = _deep_merge(
+            _deep_merge(DEFAULT_SETTINGS, _cache.raw_defaults), settings
+        )
+        _cache.store(merged, _cache.raw_defaults, settings)
+
+# -----------------------------------------------------------
+# Async variants (for aiohttp handlers)
+# -----------------------------------------------------------
+
+# Delay before a burst of settings saves is flushed to disk as one write.
+SETTINGS_FLUSH_DELAY = 0.25
+
+
+def _apply_in_memory(settings: Dict[str, Any]) -> None:
+    with _cache.lock:
+        if _cache.merged is None:
+            _load_settings_from_disk()
+        _write_through(settings)
+
+
+def _flush_to_disk(settings: Dict[str, Any]) -> None:
+    ensure_user_config_dir()
+    try:
+        atomic_write_json(SETTINGS_PATH, settings, indent=2, ensure_ascii=False)
+    except Exception as e:
+        # Memory is ahead of a file we could not write: fall back to disk
+        invalidate_settings_cache()
+        log.error(f"[ComfyAI] Error saving settings.json: {e}")
+        raise
+    log.info("[ComfyAI] settings.json saved")
+
+    with _cache.lock:
+        if not _settings_writer.has_pending:
+            _write_through(settings)
+        elif _cache.merged is not None:
+            # Memory is already ahead of this payload (a newer save is
+            # pending), so only record that the file changed because of us.
+            _cache.signature = _cache.current_signature()
+            _cache.checked_at = time.monotonic()
+
+
+_settings_writer = CoalescingWriter("settings.json", _flush_to_disk, delay=SETTINGS_FLUSH_DELAY)
+
+
+async def load_settings_async() -> Dict[str, Any]:
+    """
+    load_settings() for the event loop: served from memory when recent,
+    otherwise re-validated / re-read on the I/O thread.
+    """
+    # Never wait on the lock here: the I/O thread may hold it while reading.
+    if _cache.lock.acquire(blocking=False):
+        try:
+            if _cache.is_recent():
+                metrics.incr("settings_cache.hits")
+                return deepcopy(_cache.merged)
+        finally:
+            _cache.lock.release()
+    return await run_io(load_settings)
+
+
+async def stage_settings_async(settings: Dict[str, Any]) -> "asyncio.Future[None]":
+    """
+    Update the in-memory cache and schedule the disk write.
+
+    Readers see the new values as soon as this returns; the write is
+    coalesced with other saves arriving within SETTINGS_FLUSH_DELAY and
+    performed atomically on the I/O thread. The returned future resolves
+    once it is on disk, or raises the write's error.
+    """
+    await run_io(_apply_in_memory, settings)
+    return _settings_writer.schedule(settings)
+
+
+async def save_settings_async(settings: Dict[str, Any]) -> None:
+    """save_settings() for the event loop; returns once the (coalesced) write is on disk."""
+    await (await stage_settings_async(settings))
+
+
+async def flush_settings() -> None:
+    """Write any pending coalesced settings save now."""
+    await _settings_writer.flush()
+
 # -----------------------------------------------------------
 # System Prompt Resolution (Layered Merge)
 # -----------------------------------------------------------
@@ -162,8 +361,32 @@ def resolve_system_prompt(mode: str, defaults: Dict[str, Any], settings: Dict[st
 def get_resolved_system_prompt(mode: str) -> str:
     """
     High-level convenience function to get the resolved system prompt for a mode.
-    Loads raw defaults and user settings from disk.
+    Resolved once per mode and served from the settings cache until
+    defaults.json or settings.json change.
     """
-    defaults = load_raw_defaults()
-    settings = load_raw_user_settings()
-    return resolve_system_prompt(mode, defaults, settings)
+    with _cache.lock:
+        if not _cache.is_fresh():
+            _load_settings_from_disk()
+            metrics.incr("settings_cache.misses")
+
+        prompt = _cache.prompts.get(mode)
+        if prompt is not None:
+            metrics.incr("settings_cache.prompt_hits")
+            return prompt
+
+        metrics.incr("settings_cache.prompt_misses")
+        prompt = resolve_system_prompt(mode, _cache.raw_defaults, _cache.raw_user)
+        _cache.prompts[mode] = prompt
+        return prompt
+
+
+async def get_resolved_system_prompt_async(mode: str) -> str:
+    """get_resolved_system_prompt() without blocking the event loop."""
+    if _cache.lock.acquire(blocking=False):
+        try:
+            if _cache.is_recent() and mode in _cache.prompts:
+                metrics.incr("settings_cache.prompt_hits")
+                return _cache.prompts[mode]
+        finally:
+            _cache.lock.release()
+    return await run_io(get_resolved_system_prompt, mode)
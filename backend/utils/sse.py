@@ -0,0 +1,103 @@
+"""
+ComfyAI - Server-Sent Events helpers
+
+Incremental SSE decoding for upstream streaming APIs (Gemini
+streamGenerateContent?alt=sse, etc.).
+
+SSEDecoder accepts raw bytes in arbitrary pieces — frames split across
+network reads, CRLF pairs split in half, multi-byte UTF-8 characters cut
+mid-sequence — and returns complete events only.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass
+class SSEEvent:
+    event: str = "message"
+    data: str = ""
+    id: Optional[str] = None
+
+
+class SSEDecoder:
+    """Stateful, incremental SSE parser (per the WHATWG event-stream format)."""
+
+    def __init__(self) -> None:
+        self._buffer = b""
+        self._event = ""
+        self._data: List[str] = []
+        self._id: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """Consume a chunk of bytes, returning every event it completed."""
+        self._buffer += chunk
+        events: List[SSEEvent] = []
+
+        while True:
+            nl = self._buffer.find(b"\n")
+            if nl < 0:
+                break
+            raw_line, self._buffer = self._buffer[:nl], self._buffer[nl + 1:]
+            if raw_line.endswith(b"\r"):
+                raw_line = raw_line[:-1]
+
+            event = self._process_line(raw_line.decode("utf-8", errors="replace"))
+            if event is not None:
+                events.append(event)
+
+        return events
+
+    def close(self) -> List[SSEEvent]:
+        """End of stream: flush a final event that lacked its blank line."""
+        events: List[SSEEvent] = []
+        if self._buffer:
+            tail, self._buffer = self._buffer, b""
+            event = self._process_line(tail.rstrip(b"\r").decode("utf-8", errors="replace"))
+            if event is not None:
+                events.append(event)
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    # --------------------------------------------------------
+    # Internals
+    # --------------------------------------------------------
+    def _process_line(self, line: str) -> Optional[SSEEvent]:
+        if line == "":
+            return self._dispatch()
+
+        if line.startswith(":"):
+            return None  # comment / heartbeat
+
+        field, sep, value = line.partition(":")
+        if sep and value.startswith(" "):
+            value = value[1:]
+
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+        elif field == "id":
+            self._id = value
+        # "retry" and unknown fields are ignored
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        if not self._data:
+            self._event = ""
+            return None
+        event = SSEEvent(
+            event=self._event or "message",
+            data="\n".join(self._data),
+            id=self._id,
+        )
+        self._event = ""
+        self._data = []
+        return event
+
+
+__all__ = ["SSEEvent", "SSEDecoder"]
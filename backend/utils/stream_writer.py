@@ -0,0 +1,323 @@
+"""
+ComfyAI - Chat Stream Transport
+
+Writes a chat token stream to an aiohttp StreamResponse in one of three
+wire formats:
+
+  • "text"    raw UTF-8 text (legacy /chat/stream behaviour)
+  • "sse"     text/event-stream with typed frames
+  • "ndjson"  one JSON object per line with a "type" field
+
+Typed frames:
+  delta   {"text": "..."}
+  usage   {"chunks": n, "chars": n, "frames": n, "ttft_ms": x, "elapsed_ms": x}
+  error   {"message": "..."}
+  done    {"reason": "stop" | "error" | "cancelled"}
+
+plus periodic heartbeats while the model is silent. Small deltas are
+coalesced within a time/byte window to cut syscalls and frontend reflows.
+Tuning lives in settings.json under "stream".
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from aiohttp import web
+
+from .cancellation import GenerationHandle
+from .logger import log
+from . import metrics
+
+
+STREAM_TEXT = "text"
+STREAM_SSE = "sse"
+STREAM_NDJSON = "ndjson"
+
+_CONTENT_TYPES = {
+    STREAM_TEXT: "text/plain; charset=utf-8",
+    STREAM_SSE: "text/event-stream; charset=utf-8",
+    STREAM_NDJSON: "application/x-ndjson; charset=utf-8",
+}
+
+
+def negotiate_stream_format(request: web.Request, body: Dict[str, Any]) -> str:
+    """
+    Pick the wire format: explicit body["transport"] wins, then the Accept
+    header; anything else keeps the legacy plain-text stream.
+    """
+    requested = str(body.get("transport") or "").lower()
+    if requested in _CONTENT_TYPES:
+        return requested
+
+    accept = request.headers.get("Accept", "")
+    if "text/event-stream" in accept:
+        return STREAM_SSE
+    if "application/x-ndjson" in accept:
+        return STREAM_NDJSON
+    return STREAM_TEXT
+
+
+# ============================================================
+# Config
+# ============================================================
+
+@dataclass(frozen=True)
+class StreamConfig:
+    coalesce_ms: float = 30.0      # max time a delta may wait for company
+    coalesce_bytes: int = 1024     # flush as soon as this much is buffered
+    heartbeat_s: float = 15.0      # idle interval before a heartbeat frame
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "StreamConfig":
+        raw = settings.get("stream") or {}
+        defaults = cls()
+        try:
+            return cls(
+                coalesce_ms=max(0.0, float(raw.get("coalesce_ms", defaults.coalesce_ms))),
+                coalesce_bytes=max(1, int(raw.get("coalesce_bytes", defaults.coalesce_bytes))),
+                heartbeat_s=max(1.0, float(raw.get("heartbeat_s", defaults.heartbeat_s))),
+            )
+        except (TypeError, ValueError):
+            log.warning("[ComfyAI] Invalid 'stream' settings, using defaults")
+            return defaults
+
+
+# ============================================================
+# Writer
+# ============================================================
+
+class ChatStreamWriter:
+    """Formats and coalesces frames onto a prepared StreamResponse."""
+
+    def __init__(self, resp: web.StreamResponse, fmt: str, config: StreamConfig):
+        self.resp = resp
+        self.fmt = fmt
+        self.config = config
+
+        self._buffer: List[str] = []
+        self._buffer_bytes = 0
+        self.pending_since: Optional[float] = None
+
+        self.started = time.monotonic()
+        self.last_write = self.started
+        self.first_delta_at: Optional[float] = None
+        self.chunks = 0
+        self.chars = 0
+        self.frames = 0
+
+    @staticmethod
+    def headers_for(fmt: str) -> Dict[str, str]:
+        headers = {"Content-Type": _CONTENT_TYPES[fmt]}
+        if fmt != STREAM_TEXT:
+            headers["Cache-Control"] = "no-cache"
+            headers["X-Accel-Buffering"] = "no"  # disable proxy buffering
+        return headers
+
+    # --------------------------------------------------------
+    # Frames
+    # --------------------------------------------------------
+    async def delta(self, text: str) -> None:
+        self.chunks += 1
+        self.chars += len(text)
+        self._buffer.append(text)
+        self._buffer_bytes += len(text.encode("utf-8"))
+
+        if self.first_delta_at is None:
+            # Never delay the first token
+            self.first_delta_at = time.monotonic()
+            await self.flush()
+            return
+
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if self._buffer_bytes >= self.config.coalesce_bytes:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer, self._buffer_bytes, self.pending_since = [], 0, None
+
+        if self.fmt == STREAM_TEXT:
+            await self._write(text.encode("utf-8"))
+        else:
+            await self._frame("delta", {"text": text})
+
+    async def heartbeat(self) -> None:
+        if self.fmt == STREAM_SSE:
+            await self._write(b": heartbeat\n\n")
+        elif self.fmt == STREAM_NDJSON:
+            await self._frame("heartbeat", {})
+        else:
+            # Plain text has no out-of-band channel; still restart the idle
+            # timer, or relay_stream() would spin on a zero timeout
+            self.last_write = time.monotonic()
+
+    async def usage(self) -> None:
+        await self._frame("usage", self.usage_stats())
+
+    async def error(self, message: str) -> None:
+        await self.flush()
+        await self._frame("error", {"message": message})
+
+    async def done(self, reason: str = "stop") -> None:
+        await self.flush()
+        await self._frame("done", {"reason": reason})
+
+    async def event(self, kind: str, data: Dict[str, Any]) -> None:
+        """Any other typed frame (SSE / NDJSON only), e.g. batch results."""
+        await self.flush()
+        await self._frame(kind, data)
+
+    def usage_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "chunks": self.chunks,
+            "chars": self.chars,
+            "frames": self.frames,
+            "ttft_ms": (
+                round((self.first_delta_at - self.started) * 1000, 1)
+                if self.first_delta_at is not None else None
+            ),
+            "elapsed_ms": round((now - self.started) * 1000, 1),
+        }
+
+    # --------------------------------------------------------
+    # Internals
+    # --------------------------------------------------------
+    async def _frame(self, kind: str, data: Dict[str, Any]) -> None:
+        if self.fmt == STREAM_SSE:
+            payload = json.dumps(data, ensure_ascii=False)
+            await self._write(f"event: {kind}\ndata: {payload}\n\n".encode("utf-8"))
+        elif self.fmt == STREAM_NDJSON:
+            line = json.dumps({"type": kind, **data}, ensure_ascii=False)
+            await self._write((line + "\n").encode("utf-8"))
+
+    async def _write(self, data: bytes) -> None:
+        # StreamResponse.write() drains when its buffer fills; coalescing is
+        # what keeps the number of writes (and syscalls) down.
+        await self.resp.write(data)
+        self.frames += 1
+        self.last_write = time.monotonic()
+
+
+# ============================================================
+# Relay loop
+# ============================================================
+
+_END = object()
+_CANCELLED = object()
+
+
+async def relay_stream(
+    source: AsyncIterator[str],
+    writer: ChatStreamWriter,
+    handle: Optional[GenerationHandle] = None,
+) -> str:
+    """
+    Pump `source` into `writer`, handling coalescing deadlines and heartbeats.
+
+    The upstream generator runs in its own task so heartbeats keep flowing
+    while the model is thinking. Cancelling `handle` (explicit cancel or
+    client disconnect) stops the producer, which closes the upstream
+    connection. Returns the finish reason ("stop" / "error" / "cancelled").
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce() -> None:
+        try:
+            async for chunk in source:
+                if chunk:
+                    await queue.put(chunk)
+            await queue.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            # Close the upstream generator right away (releases its connection)
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    producer = asyncio.create_task(produce())
+    if handle is not None:
+        def _on_cancel() -> None:
+            producer.cancel()
+            queue.put_nowait(_CANCELLED)
+        handle.on_cancel(_on_cancel)
+
+    cfg = writer.config
+    reason = "stop"
+
+    try:
+        while True:
+            now = time.monotonic()
+            if writer.pending_since is not None:
+                timeout = writer.pending_since + cfg.coalesce_ms / 1000 - now
+            else:
+                timeout = writer.last_write + cfg.heartbeat_s - now
+
+            try:
+                item = await asyncio.wait_for(queue.get(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                if writer.pending_since is not None:
+                    await writer.flush()
+                else:
+                    await writer.heartbeat()
+                continue
+
+            if item is _END:
+                break
+
+            if item is _CANCELLED:
+                reason = "cancelled"
+                break
+
+            if isinstance(item, Exception):
+                log.error(f"[ComfyAI] Upstream stream failed: {item!r}")
+                metrics.incr("chat.stream.errors")
+                reason = "error"
+                await writer.error(str(item) or type(item).__name__)
+                break
+
+            await writer.delta(item)
+
+        await writer.flush()
+        if reason == "stop":
+            await writer.usage()
+        await writer.done(reason)
+
+    except ConnectionError:
+        # Client vanished mid-write
+        reason = "cancelled"
+        if handle is not None:
+            handle.cancel("disconnect")
+
+    finally:
+        if not producer.done():
+            producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+    stats = writer.usage_stats()
+    if stats["ttft_ms"] is not None:
+        metrics.observe("chat.stream.ttft_ms", stats["ttft_ms"])
+    metrics.observe("chat.stream.frames", stats["frames"])
+    return reason
+
+
+__all__ = [
+    "STREAM_TEXT",
+    "STREAM_SSE",
+    "STREAM_NDJSON",
+    "negotiate_stream_format",
+    "StreamConfig",
+    "ChatStreamWriter",
+    "relay_stream",
+]
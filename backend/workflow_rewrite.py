@@ -46,7 +46,8 @@ async def rewrite_handler(request: web.Request):
     # -----------------------------------------
     request_json = {
         "workflow": workflow,
-        "prompt": rewrite_ctx.rewrite_expert if hasattr(rewrite_ctx, "rewrite_expert") else ""
+        "prompt": rewrite_ctx.rewrite_expert if hasattr(rewrite_ctx, "rewrite_expert") else "",
+        "provider": provider,
     }
 
     # Run rewrite
@@ -54,6 +54,15 @@ def _load_json(path: str) -> Dict[str, Any]:
 
     return walk_dict(data)
 
+def _endpoints(raw: Any) -> List[str]:
+    """Normalize a provider's "endpoints" (a URL or a list of URLs)."""
+    if isinstance(raw, str):
+        raw = [raw]
+    if not isinstance(raw, list):
+        return []
+    return [str(url).rstrip("/") for url in raw if url]
+
+
 # ================================
 # MAIN LOADER — NEW FORMAT
 # ================================
@@ -92,6 +101,11 @@ def load_config() -> ComfyAIConfig:
         # Extra flags
         options = cfg.get("options", {})
 
+        # Several hosts for one provider (Ollama): "endpoints": ["http://gpu1:11434", ...]
+        endpoints = _endpoints(cfg.get("endpoints"))
+        if not base_url and endpoints:
+            base_url = endpoints[0]
+
         providers[provider_name] = ProviderConfig(
             name=provider_name,
             type=p_type,
@@ -100,6 +114,20 @@ def load_config() -> ComfyAIConfig:
             models=model_list,
             default_model=default_model,
             options=options,
+            endpoints=endpoints,
         )
 
-    return ComfyAIConfig(providers=providers)
+    # Per-task routes: a failover chain {"rewrite": ["cloud_workflow", "local_apply"]}
+    # or an object {"chat": {"strategy": "adaptive", ...}} (see backend/routing.py)
+    routing: Dict[str, Any] = {}
+    raw_routing = raw.get("routing", {})
+    if isinstance(raw_routing, dict):
+        for task, route in raw_routing.items():
+            if isinstance(route, str):
+                route = [route]
+            if isinstance(route, list):
+                routing[task] = [str(name) for name in route if name]
+            elif isinstance(route, dict):
+                routing[task] = dict(route)
+
+    return ComfyAIConfig(providers=providers, routing=routing)
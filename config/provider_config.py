@@ -42,6 +42,10 @@ class ProviderConfig:
     # For future extension: arbitrary flags
     options: Dict[str, Any] = field(default_factory=dict)
 
+    # Optional: several Ollama hosts serving the same models, balanced as one
+    # provider (base_url defaults to the first)
+    endpoints: List[str] = field(default_factory=list)
+
     # ---------- Backwards compatibility ----------
 
     @property
@@ -66,6 +70,7 @@ class ProviderConfig:
             "name": self.name,
             "type": self.type,
             "base_url": self.base_url,
+            "endpoints": list(self.endpoints),
             "api_key": None,  # NEVER expose keys to the browser
             "default_model": self.model,
             "models": [m.name for m in self.models] if self.models else [],
@@ -5,6 +5,7 @@ from functools import lru_cache
 from typing import Dict, Any, List
 
 from ..backend.utils.paths import PROVIDERS_PATH
+from .loader import _endpoints
 from .provider_config import ProviderConfig, ModelConfig
 
 
@@ -61,6 +62,11 @@ def _normalize_provider(name: str, data: Dict[str, Any]) -> ProviderConfig:
     base_url = data.get("base_url")
     api_key = data.get("api_key")
 
+    # "endpoints": a URL or a list of URLs (same rules as loader.load_config)
+    endpoints = _endpoints(data.get("endpoints"))
+    if not base_url and endpoints:
+        base_url = endpoints[0]
+
     # Legacy: single "model" string
     legacy_model = data.get("model")
 
@@ -92,6 +98,7 @@ def _normalize_provider(name: str, data: Dict[str, Any]) -> ProviderConfig:
         models=models,
         default_model=default_model,
         options=data.get("options", {}),
+        endpoints=endpoints,
     )
 
 
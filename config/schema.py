@@ -6,7 +6,7 @@ Defines:
 """
 
 from dataclasses import dataclass, field
-from typing import Dict
+from typing import Any, Dict
 
 from .provider_config import ProviderConfig
 
@@ -24,9 +24,17 @@ class ComfyAIConfig:
              "ollama": {...},
              "google": {...},
              "openai": {...}
+          },
+          "routing": {
+             "rewrite": ["cloud_workflow", "local_apply"],
+             "chat": {"strategy": "adaptive", "requires": ["tools"]}
           }
         }
+
+    `routing` maps a task to its failover chain of provider ids, or to a
+    route object (see backend/routing.py TaskRoute).
     """
 
     version: int = 1
     providers: Dict[str, ProviderConfig] = field(default_factory=dict)
+    routing: Dict[str, Any] = field(default_factory=dict)
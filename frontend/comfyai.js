@@ -260,6 +260,27 @@ function loadHistory() {
     });
 }
 
+// ========================================================
+// Chat session id (server keeps the conversation history)
+// ========================================================
+function newSessionId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID().replace(/-/g, "");
+    }
+    return Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+}
+
+function getChatSessionId() {
+    let id = localStorage.getItem("comfyai-session-id");
+
+    // No local transcript → start a fresh server-side conversation as well
+    if (!id || !localStorage.getItem("comfyai-chat-history")) {
+        id = newSessionId();
+        localStorage.setItem("comfyai-session-id", id);
+    }
+    return id;
+}
+
 // ========================================================
 // Send message + streaming + typing indicator
 // ========================================================
@@ -285,10 +306,13 @@ async function sendMessage() {
     const modeSelect = document.getElementById("comfyai-mode-select");
     const currentMode = modeSelect ? modeSelect.value : "chat";
 
+    // Only the new message is sent; the backend appends it to the
+    // session's stored history before calling the model.
     const payload = {
         provider: provider_id,
         model: model_name,
-        messages: [{ role: "user", content: text }],
+        session_id: getChatSessionId(),
+        message: text,
     };
 
     // Typing indicator (three dots, no text)
@@ -328,6 +352,7 @@ async function sendMessage() {
                 currentMode
             );
 
+            saveHistory();
             return;
         }
 
@@ -576,6 +601,22 @@ async function fetchProviders() {
     }
 }
 
+// --------------------------------------------------------
+// Fetch circuit breaker state (providers refusing calls)
+// --------------------------------------------------------
+async function fetchProviderHealth() {
+    try {
+        const res = await fetch("/api/comfyai/providers/health");
+        if (!res.ok) throw new Error("HTTP " + res.status);
+
+        const data = await res.json();
+        return data.providers || {};
+    } catch (err) {
+        console.error("[ComfyAI] Error loading provider health:", err);
+        return {};
+    }
+}
+
 // --------------------------------------------------------
 // Populate model dropdown
 // --------------------------------------------------------
@@ -584,10 +625,19 @@ async function populateModelDropdown() {
 
     modelDropdown.innerHTML = "";
 
+    const health = await fetchProviderHealth();
+
     for (const [provider_id, prov] of Object.entries(comfyAIProviders)) {
         const optgroup = document.createElement("optgroup");
         optgroup.label = prov.name || provider_id;
 
+        // Grey out providers whose circuit is open
+        const state = health[provider_id];
+        if (state && !state.available) {
+            optgroup.label += " (unavailable)";
+            optgroup.disabled = true;
+        }
+
         try {
             const res = await fetch(`/api/comfyai/models?provider=${provider_id}`);
             if (!res.ok) throw new Error("HTTP " + res.status);
@@ -0,0 +1,114 @@
+"""
+Admission controller tests.
+
+Checks the in-flight limit, round-robin fairness between sessions, and the
+429 (queue full) / 503 (queue timeout) rejections.
+
+    python scripts/test_admission.py
+"""
+
+import asyncio
+import importlib
+import sys
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+admission = importlib.import_module(f"{plugin_root.name}.backend.admission")
+
+
+def _controller(**settings):
+    return admission.AdmissionController("test", admission.AdmissionSettings(**settings))
+
+
+def test_settings_from_options():
+    s = admission.AdmissionSettings.from_options(
+        {"limits": {"max_in_flight": "2", "max_queue": "bad", "queue_timeout": 5}}
+    )
+    assert (s.max_in_flight, s.max_queue, s.queue_timeout) == (2, 32, 5.0)
+    assert admission.AdmissionSettings.from_options({}).unlimited
+
+
+async def _fairness():
+    limiter = _controller(max_in_flight=1, max_queue=10)
+    order = []
+    gate = asyncio.Event()
+
+    async def job(session, tag):
+        async with limiter.slot(session):
+            order.append(tag)
+            await gate.wait()
+
+    tasks = []
+    for session, tag in [("A", "a0"), ("A", "a1"), ("A", "a2"), ("B", "b0"), ("C", "c0")]:
+        tasks.append(asyncio.ensure_future(job(session, tag)))
+        await asyncio.sleep(0)
+
+    assert limiter.stats()["in_flight"] == 1
+    assert limiter.stats()["queued"] == 4
+
+    gate.set()
+    await asyncio.gather(*tasks)
+    assert order == ["a0", "a1", "b0", "c0", "a2"]
+    assert limiter.in_flight == 0
+
+
+def test_round_robin_between_sessions():
+    asyncio.run(_fairness())
+
+
+async def _rejections():
+    limiter = _controller(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+    gate = asyncio.Event()
+
+    async def hold():
+        async with limiter.slot("a"):
+            await gate.wait()
+
+    holder = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+
+    waiter = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+
+    try:
+        await hold()
+        raise AssertionError("expected 429")
+    except admission.AdmissionRejected as e:
+        assert e.status == 429 and e.retry_after >= 1
+
+    try:
+        await waiter
+        raise AssertionError("expected 503")
+    except admission.AdmissionRejected as e:
+        assert e.status == 503
+
+    gate.set()
+    await holder
+    assert limiter.in_flight == 0 and limiter.stats()["queued"] == 0
+
+
+def test_queue_full_and_timeout():
+    asyncio.run(_rejections())
+
+
+async def _reentrant():
+    limiter = _controller(max_in_flight=1, queue_timeout=0.05)
+    async with limiter.slot("a"):
+        async with limiter.slot("a"):
+            assert limiter.in_flight == 1
+    assert limiter.in_flight == 0
+
+
+def test_slot_is_reentrant():
+    asyncio.run(_reentrant())
+
+
+if __name__ == "__main__":
+    test_settings_from_options()
+    test_round_robin_between_sessions()
+    test_queue_full_and_timeout()
+    test_slot_is_reentrant()
+    print("All tests passed!")
@@ -0,0 +1,328 @@
+"""
+Chat route tests.
+
+Drives /api/comfyai/chat, /chat/stream and /chat/cancel against a fake
+Ollama provider, with settings, the response cache and the conversation
+store in a temp directory. Checks that an explicit cancel and a client
+disconnect both abort the upstream generation, that provider failures
+are never served from the response cache or recorded in the session, that
+cached replies are recorded like live ones, and that a hedged stream does
+not hold the losing primary's slot.
+
+    python scripts/test_chat_routes.py
+"""
+
+import asyncio
+import contextlib
+import importlib
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+cancellation = importlib.import_module(f"{plugin_root.name}.backend.utils.cancellation")
+chat_routes = importlib.import_module(f"{plugin_root.name}.backend.routes.chat")
+conversation_store = importlib.import_module(f"{plugin_root.name}.backend.conversation_store")
+metrics = importlib.import_module(f"{plugin_root.name}.backend.utils.metrics")
+paths = importlib.import_module(f"{plugin_root.name}.backend.utils.paths")
+provider_config = importlib.import_module(f"{plugin_root.name}.config.provider_config")
+provider_manager = importlib.import_module(f"{plugin_root.name}.backend.provider_manager")
+response_cache = importlib.import_module(f"{plugin_root.name}.backend.response_cache")
+schema = importlib.import_module(f"{plugin_root.name}.config.schema")
+settings = importlib.import_module(f"{plugin_root.name}.backend.utils.settings")
+
+SETTINGS = {
+    "version": 1,
+    "mode": "chat",
+    "defaults": {},
+    "conversations": {"compact_threshold_tokens": None},
+}
+
+
+class FakeOllama:
+    """
+    /api/chat streaming `words`, or replying with them joined. With
+    `forever`, it keeps the response open (streams repeat, plain replies
+    send keep-alive whitespace) until the caller goes away; any other
+    `status` fails the request. `first_delay` holds back the first token.
+    """
+
+    def __init__(self, words=("Hello", " there"), forever=False, reply=None, status=200, first_delay=0.0):
+        self.words = list(words)
+        self.forever = forever
+        self.reply = reply
+        self.status = status
+        self.first_delay = first_delay
+        self.requests = []
+        self.aborted = 0
+
+    async def chat(self, request):
+        payload = await request.json()
+        self.requests.append(payload)
+        if self.status != 200:
+            return web.Response(status=self.status, text="gpu on fire")
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        try:
+            await asyncio.sleep(self.first_delay)
+            if payload.get("stream"):
+                while True:
+                    for word in self.words:
+                        await asyncio.sleep(0.02)
+                        await resp.write(json.dumps({"message": {"content": word}}).encode() + b"\n")
+                    if not self.forever:
+                        break
+                await resp.write(json.dumps({"message": {"content": ""}, "done": True}).encode() + b"\n")
+            else:
+                while self.forever:
+                    await resp.write(b" ")  # JSON allows leading whitespace
+                    await asyncio.sleep(0.02)
+                content = self.reply if self.reply is not None else "".join(self.words)
+                await resp.write(json.dumps({"message": {"content": content}, "done": True}).encode())
+        except (ConnectionError, asyncio.CancelledError):
+            self.aborted += 1
+            raise
+        return resp
+
+
+class ComfyServer(TestServer):
+    """TestServer without handler cancellation, like ComfyUI's PromptServer."""
+
+    async def _make_runner(self, **kwargs):
+        kwargs["handler_cancellation"] = False
+        return await super()._make_runner(**kwargs)
+
+
+@contextlib.asynccontextmanager
+async def chat_app(fake, overrides=None, handler_cancellation=False, options=None, spare=None):
+    """
+    Chat routes wired to `fake` as provider "box" (plus `spare` as provider
+    "spare" when given), state in a temp dir.
+    """
+    saved = (settings.DEFAULTS_PATH, settings.SETTINGS_PATH, paths.USER_CONFIG_DIR, paths.CACHE_DIR,
+             response_cache._cache, conversation_store._store, provider_manager.ProviderManager._instance)
+    servers = {}
+    for name, upstream_fake in (("box", fake), ("spare", spare)):
+        if upstream_fake is None:
+            continue
+        upstream = web.Application()
+        upstream.router.add_post("/api/chat", upstream_fake.chat)
+        servers[name] = TestServer(upstream)
+        await servers[name].start_server()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        user_settings = {**SETTINGS, **(overrides or {})}
+        settings.DEFAULTS_PATH = root / "defaults.json"
+        settings.SETTINGS_PATH = root / "user" / "settings.json"
+        paths.USER_CONFIG_DIR, paths.CACHE_DIR = root / "user", root / "user" / "cache"
+        settings.DEFAULTS_PATH.write_text(json.dumps({"version": 1}))
+        settings.SETTINGS_PATH.parent.mkdir()
+        settings.SETTINGS_PATH.write_text(json.dumps(user_settings))
+        settings.invalidate_settings_cache()
+
+        response_cache._cache = response_cache.ResponseCache(
+            response_cache.ResponseCacheConfig.from_settings(user_settings), root / "responses"
+        )
+        conversation_store._store = conversation_store.ConversationStore(directory=root / "conversations")
+
+        mgr = object.__new__(provider_manager.ProviderManager)
+        mgr.config = schema.ComfyAIConfig()
+        mgr.providers, mgr.pools, mgr.default_provider, mgr._draining = {}, {}, None, set()
+        mgr._apply_config(schema.ComfyAIConfig(providers={
+            name: provider_config.ProviderConfig(
+                name=name, type="ollama", base_url=str(server.make_url("")).rstrip("/"),
+                default_model="m", options={"retry": {"attempts": 1}, **(options or {})},
+            )
+            for name, server in servers.items()
+        }, routing={"chat": {"providers": list(servers)}}))
+        provider_manager.ProviderManager._instance = mgr
+
+        app = web.Application()
+        chat_routes.setup(app)
+        client = TestClient(TestServer(app) if handler_cancellation else ComfyServer(app))
+        await client.start_server()
+        try:
+            yield client
+        finally:
+            await client.close()
+            await mgr.aclose()
+            for server in servers.values():
+                await server.close()
+            (settings.DEFAULTS_PATH, settings.SETTINGS_PATH, paths.USER_CONFIG_DIR, paths.CACHE_DIR,
+             response_cache._cache, conversation_store._store,
+             provider_manager.ProviderManager._instance) = saved
+            settings.invalidate_settings_cache()
+
+
+def _body(**extra):
+    return {"provider": "box", "model": "m", "messages": [{"role": "user", "content": "hi"}], **extra}
+
+
+async def _until(predicate, timeout=2.0):
+    for _ in range(int(timeout / 0.02)):
+        if predicate():
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError("condition not reached")
+
+
+async def _explicit_cancel():
+    fake = FakeOllama(forever=True)
+    async with chat_app(fake) as client:
+        resp = await client.post("/api/comfyai/chat/stream", json=_body(request_id="r1", transport="ndjson"))
+        assert resp.status == 200 and resp.headers["X-ComfyAI-Request-Id"] == "r1"
+        first = json.loads(await resp.content.readline())
+        assert first == {"type": "delta", "text": "Hello"}
+
+        cancel = await client.post("/api/comfyai/chat/cancel", json={"request_id": "r1"})
+        assert cancel.status == 200 and (await cancel.json())["cancelled"] == 1
+
+        frames = [json.loads(line) for line in (await resp.read()).splitlines()]
+        assert frames[-1] == {"type": "done", "reason": "cancelled"}
+        await _until(lambda: fake.aborted == 1)  # upstream connection closed
+        assert cancellation.active_generations() == {}
+
+        missing = await client.post("/api/comfyai/chat/cancel", json={"request_id": "r1"})
+        assert missing.status == 404
+        bad = await client.post("/api/comfyai/chat/cancel", json={})
+        assert bad.status == 400
+
+
+def test_explicit_cancel_stops_upstream():
+    asyncio.run(_explicit_cancel())
+
+
+async def _disconnect(handler_cancellation):
+    fake = FakeOllama(forever=True)
+    metrics.reset()
+    saved_interval = cancellation.DISCONNECT_POLL_INTERVAL
+    cancellation.DISCONNECT_POLL_INTERVAL = 0.02
+    try:
+        async with chat_app(fake, handler_cancellation=handler_cancellation) as client:
+            # Non-streaming: nothing is written while the model thinks
+            try:
+                await client.post("/api/comfyai/chat", json=_body(), timeout=aiohttp.ClientTimeout(total=0.2))
+            except asyncio.TimeoutError:
+                pass
+            else:
+                raise AssertionError("the reply should never have arrived")
+            await _until(lambda: fake.aborted == 1)
+            await _until(lambda: metrics.get_counter("chat.cancelled.disconnect") == 1)
+
+            # Streaming: the client drops the connection mid-stream
+            resp = await client.post("/api/comfyai/chat/stream", json=_body(transport="sse"))
+            await resp.content.readline()
+            resp.close()
+            await _until(lambda: fake.aborted == 2)
+            await _until(lambda: metrics.get_counter("chat.cancelled.disconnect") == 2)
+            assert cancellation.active_generations() == {}
+    finally:
+        cancellation.DISCONNECT_POLL_INTERVAL = saved_interval
+
+
+def test_disconnect_stops_upstream():
+    # Detected by watch_disconnect() (ComfyUI) or by aiohttp cancelling the handler
+    asyncio.run(_disconnect(handler_cancellation=False))
+    asyncio.run(_disconnect(handler_cancellation=True))
+
+
+async def _errors_not_cached():
+    fake = FakeOllama(status=500)
+    async with chat_app(fake, {"cache": {"enabled": True, "disk": False}}) as client:
+        for path, transport in (("/api/comfyai/chat", None), ("/api/comfyai/chat/stream", "text")):
+            body = _body(transport=transport, messages=[{"role": "user", "content": path}])
+            fake.status, fake.requests = 500, []
+
+            resp = await client.post(path, json=body)
+            text = (await resp.json())["reply"] if transport is None else await resp.text()
+            assert text.startswith("[Ollama ERROR]") and resp.headers["X-ComfyAI-Cache"] == "miss"
+
+            # The provider recovered: the next identical request reaches it
+            fake.status = 200
+            resp = await client.post(path, json=body)
+            text = (await resp.json())["reply"] if transport is None else await resp.text()
+            assert text == "Hello there" and resp.headers["X-ComfyAI-Cache"] == "miss"
+
+            resp = await client.post(path, json=body)
+            assert resp.headers["X-ComfyAI-Cache"] == "hit" and len(fake.requests) == 2
+
+
+def test_provider_errors_are_not_cached():
+    asyncio.run(_errors_not_cached())
+
+
+async def _cached_stream_recorded():
+    fake = FakeOllama()
+    async with chat_app(fake, {"cache": {"enabled": True, "disk": False}}) as client:
+        store = conversation_store._store
+        for session_id, state in (("live", "miss"), ("replayed", "hit")):
+            resp = await client.post("/api/comfyai/chat/stream", json=_body(session_id=session_id))
+            assert await resp.text() == "Hello there" and resp.headers["X-ComfyAI-Cache"] == state
+            assert await store.history(session_id) == [
+                {"role": "user", "content": "hi"},
+                {"role": "assistant", "content": "Hello there"},
+            ]
+        assert len(fake.requests) == 1
+
+
+def test_cached_stream_is_recorded():
+    asyncio.run(_cached_stream_recorded())
+
+
+async def _errors_not_recorded():
+    fake = FakeOllama(status=500)
+    async with chat_app(fake) as client:
+        store = conversation_store._store
+        for path in ("/api/comfyai/chat", "/api/comfyai/chat/stream"):
+            resp = await client.post(path, json=_body(session_id="s1"))
+            text = (await resp.json())["reply"] if path.endswith("chat") else await resp.text()
+            assert text.startswith("[Ollama ERROR]")
+            assert await store.history("s1") == []
+
+        # The retry after recovery starts from a clean history
+        fake.status = 200
+        resp = await client.post("/api/comfyai/chat", json=_body(session_id="s1"))
+        assert (await resp.json())["reply"] == "Hello there"
+        assert [m["role"] for m in await store.history("s1")] == ["user", "assistant"]
+
+
+def test_provider_errors_are_not_recorded():
+    asyncio.run(_errors_not_recorded())
+
+
+async def _hedge_frees_primary():
+    primary, secondary = FakeOllama(first_delay=5.0), FakeOllama(forever=True)
+    options = {"limits": {"max_in_flight": 1}, "hedge": {"delay_s": 0.05}}
+    async with chat_app(primary, options=options, spare=secondary) as client:
+        box = provider_manager.ProviderManager._instance.providers["box"]
+        resp = await client.post("/api/comfyai/chat/stream", json=_body(hedge=True, transport="ndjson"))
+        assert json.loads(await resp.content.readline()) == {"type": "delta", "text": "Hello"}
+
+        # The secondary is still streaming; the losing primary holds nothing
+        await _until(lambda: primary.aborted == 1)
+        assert len(secondary.requests) == 1
+        assert box.limiter.stats()["in_flight"] == 0
+        resp.close()
+
+
+def test_hedge_winner_frees_primary_slot():
+    asyncio.run(_hedge_frees_primary())
+
+
+if __name__ == "__main__":
+    test_explicit_cancel_stops_upstream()
+    test_disconnect_stops_upstream()
+    test_provider_errors_are_not_cached()
+    test_cached_stream_is_recorded()
+    test_provider_errors_are_not_recorded()
+    test_hedge_winner_frees_primary_slot()
+    print("All tests passed!")
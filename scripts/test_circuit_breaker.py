@@ -0,0 +1,168 @@
+"""
+Circuit breaker / failover tests.
+
+Drives CircuitBreaker through closed → open → half-open → closed, checks
+that a ChatClient with an open circuit fails fast without touching the
+provider, and that pick_provider() walks the task's failover chain past
+providers whose circuit is open.
+
+    python scripts/test_circuit_breaker.py
+"""
+
+import asyncio
+import importlib
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+circuit_breaker = importlib.import_module(f"{plugin_root.name}.backend.circuit_breaker")
+provider_manager = importlib.import_module(f"{plugin_root.name}.backend.provider_manager")
+provider_config = importlib.import_module(f"{plugin_root.name}.config.provider_config")
+schema = importlib.import_module(f"{plugin_root.name}.config.schema")
+
+FAST = {"min_calls": 3, "window": 5, "open_s": 0.1}
+
+
+def _breaker(**overrides):
+    settings = circuit_breaker.BreakerSettings.from_options({"breaker": {**FAST, **overrides}})
+    return circuit_breaker.CircuitBreaker("test", settings)
+
+
+def test_state_machine():
+    breaker = _breaker()
+    for ok in (True, False, False):
+        breaker.acquire()
+        breaker.record(ok)
+    assert breaker.state == circuit_breaker.OPEN
+    try:
+        breaker.acquire()
+    except circuit_breaker.CircuitOpen as e:
+        assert e.status == 503 and e.retry_after >= 1
+    else:
+        raise AssertionError("open circuit let a call through")
+
+    time.sleep(0.12)
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    breaker.acquire()  # the probe
+    assert not breaker.available()  # one probe at a time
+    breaker.record(False)
+    assert breaker.state == circuit_breaker.OPEN and breaker.times_opened == 2
+
+    time.sleep(0.12)
+    breaker.acquire()
+    breaker.release()  # cancelled probe: no verdict, slot freed
+    breaker.acquire()
+    breaker.record(True)
+    assert breaker.state == circuit_breaker.CLOSED
+    assert breaker.stats()["recent_calls"] == 0
+
+
+def test_slow_calls_trip():
+    breaker = _breaker(slow_call_s=0.5, slow_rate=0.6)
+    for latency in (1.0, 0.1, 2.0):
+        breaker.record(True, latency)
+    assert breaker.state == circuit_breaker.OPEN
+
+    breaker = _breaker()  # latency ignored by default
+    for _ in range(5):
+        breaker.record(True, 100.0)
+    assert breaker.state == circuit_breaker.CLOSED
+
+
+class DownProvider:
+    def __init__(self, status):
+        self.status = status
+        self.requests = 0
+
+    async def chat(self, request):
+        self.requests += 1
+        return web.Response(status=self.status, text="nope")
+
+
+async def _hammer(status, calls=5):
+    fake = DownProvider(status)
+    app = web.Application()
+    app.router.add_post("/api/chat", fake.chat)
+    server = TestServer(app)
+    await server.start_server()
+    client = agent_factory.ChatClient(
+        provider_name="ollama",
+        base_url=str(server.make_url("")).rstrip("/"),
+        api_key=None,
+        model="llama3.2",
+        provider_type="local",
+        breaker=_breaker(open_s=30),
+        resilience=agent_factory.ResiliencePolicy.from_options({"retry": {"attempts": 1}}),
+    )
+    refused = 0
+    try:
+        for _ in range(calls):
+            try:
+                await client.chat([{"role": "user", "content": "hi"}])
+            except circuit_breaker.CircuitOpen:
+                refused += 1
+    finally:
+        await client.pool.close()
+        await server.close()
+    return fake.requests, refused, client.breaker
+
+
+def test_client_fails_fast():
+    requests, refused, breaker = asyncio.run(_hammer(503))
+    assert (requests, refused) == (3, 2)
+    assert breaker.last_error.startswith("[Ollama ERROR] HTTP 503")
+
+    # Client errors say nothing about provider health
+    requests, refused, breaker = asyncio.run(_hammer(404))
+    assert (requests, refused) == (5, 0) and breaker.state == circuit_breaker.CLOSED
+
+
+def _manager(routing):
+    mgr = object.__new__(provider_manager.ProviderManager)
+    mgr.config = schema.ComfyAIConfig()
+    mgr.providers, mgr.pools, mgr.default_provider, mgr._draining = {}, {}, None, set()
+    providers = {
+        name: provider_config.ProviderConfig(name=name, type="local", base_url=f"http://{name}:11434",
+                                             default_model="m", options={"breaker": FAST})
+        for name in ("main", "cloud_workflow", "local_apply")
+    }
+    mgr._apply_config(schema.ComfyAIConfig(providers=providers, routing=routing))
+    return mgr
+
+
+def test_failover_chain():
+    mgr = _manager({})
+    assert mgr.failover_chain("rewrite") == ["cloud_workflow", "local_apply", "main"]
+    assert mgr.failover_chain("chat") == ["main"]
+    assert mgr.pick_provider("rewrite").provider_name == "cloud_workflow"
+
+    for _ in range(3):
+        mgr.providers["cloud_workflow"].breaker.record(False)
+    assert mgr.pick_provider("rewrite").provider_name == "local_apply"
+    for _ in range(3):
+        mgr.providers["local_apply"].breaker.record(False)
+    assert mgr.pick_provider("rewrite").provider_name == "main"
+    for _ in range(3):
+        mgr.providers["main"].breaker.record(False)
+    assert mgr.pick_provider("rewrite").provider_name == "cloud_workflow"  # all open: head of chain
+
+    mgr = _manager({"rewrite": ["local_apply", "missing"], "chat": ["cloud_workflow"]})
+    assert mgr.failover_chain("rewrite") == ["local_apply", "main"]
+    assert mgr.failover_chain("chat") == ["cloud_workflow", "main"]
+    assert set(mgr.breaker_stats()) == {"main", "cloud_workflow", "local_apply"}
+
+
+if __name__ == "__main__":
+    test_state_machine()
+    test_slow_calls_trip()
+    test_client_fails_fast()
+    test_failover_chain()
+    print("All tests passed!")
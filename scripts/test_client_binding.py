@@ -0,0 +1,119 @@
+"""
+Per-request ChatClient binding tests.
+
+Runs concurrent requests with different models and sampling params through
+one provider client and checks that each upstream request carries its own
+values, that the shared client is never mutated, and that bound copies
+share the provider's pool, limiter and breaker.
+
+    python scripts/test_client_binding.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from dataclasses import replace
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+provider_manager = importlib.import_module(f"{plugin_root.name}.backend.provider_manager")
+provider_config = importlib.import_module(f"{plugin_root.name}.config.provider_config")
+
+SamplingParams = agent_factory.SamplingParams
+
+
+def test_bind_returns_isolated_copy():
+    cfg = provider_config.ProviderConfig(
+        name="box", type="ollama", base_url="http://box:11434", default_model="base",
+        options={"limits": {"max_in_flight": 2}},
+    )
+    provider = provider_manager.ProviderManager._build_client("box", cfg)
+    provider = replace(provider, params=SamplingParams(temperature=0.2, top_p=0.9))
+
+    bound = provider.bind(model="other", params=SamplingParams(temperature=0.8), task="chat")
+    assert (bound.model, bound.params, bound.task) == ("other", SamplingParams(0.8, 0.9, None), "chat")
+    assert (provider.model, provider.params.temperature, provider.task) == ("base", 0.2, None)
+    assert bound.pool is provider.pool and bound.limiter is provider.limiter
+    assert bound.breaker is provider.breaker and bound.api == provider.api
+
+    # Unset fields keep the parent's values
+    again = bound.bind()
+    assert (again.model, again.params, again.task) == (bound.model, bound.params, "chat")
+
+
+class EchoOllama:
+    """Streams back the model and options each request asked for, slowly."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def chat(self, request):
+        payload = await request.json()
+        self.requests.append(payload)
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for part in (payload["model"], "|", json.dumps(payload.get("options", {}), sort_keys=True)):
+            await asyncio.sleep(0.02)  # interleave the concurrent streams
+            await resp.write(json.dumps({"message": {"content": part}, "done": False}).encode() + b"\n")
+        await resp.write(json.dumps({"message": {"content": ""}, "done": True}).encode() + b"\n")
+        return resp
+
+
+async def _concurrent(jobs):
+    fake = EchoOllama()
+    app = web.Application()
+    app.router.add_post("/api/chat", fake.chat)
+    server = TestServer(app)
+    await server.start_server()
+    provider = agent_factory.ChatClient(
+        provider_name="box",
+        base_url=str(server.make_url("")).rstrip("/"),
+        api_key=None,
+        model="base",
+        provider_type="ollama",
+    )
+    try:
+        async def run(model, params):
+            client = provider.bind(model=model, params=params)
+            return "".join([c async for c in client.stream_chat([{"role": "user", "content": "hi"}])])
+
+        replies = await asyncio.gather(*(run(model, params) for model, params in jobs))
+        return replies, provider, fake.requests
+    finally:
+        await provider.pool.close()
+        await server.close()
+
+
+def test_concurrent_requests_keep_their_model_and_params():
+    jobs = [
+        ("llama3.2", SamplingParams(temperature=0.1)),
+        ("qwen2.5:7b", SamplingParams(temperature=0.9, max_tokens=64)),
+        ("mistral", SamplingParams(top_p=0.5)),
+        ("llama3.2", None),
+    ]
+    replies, provider, requests = asyncio.run(_concurrent(jobs))
+
+    expected = [
+        'llama3.2|{"temperature": 0.1}',
+        'qwen2.5:7b|{"num_predict": 64, "temperature": 0.9}',
+        'mistral|{"top_p": 0.5}',
+        "llama3.2|{}",
+    ]
+    assert replies == expected
+    assert sorted(r["model"] for r in requests) == ["llama3.2", "llama3.2", "mistral", "qwen2.5:7b"]
+    assert provider.model == "base" and provider.params == SamplingParams()
+    assert provider.pool.stats()["sessions_opened"] == 1
+
+
+if __name__ == "__main__":
+    test_bind_returns_isolated_copy()
+    test_concurrent_requests_keep_their_model_and_params()
+    print("All tests passed!")
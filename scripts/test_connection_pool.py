@@ -0,0 +1,134 @@
+"""
+Connection pool tests.
+
+Checks that a ChatClient reuses its provider's pooled session (and its
+keep-alive connection) across calls, that OpenAI clients are cached per
+base_url / api_key, and that a closed pool refuses new requests.
+
+    python scripts/test_connection_pool.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+connection_pool = importlib.import_module(f"{plugin_root.name}.backend.connection_pool")
+
+
+def test_settings_from_options():
+    s = connection_pool.PoolSettings.from_options(
+        {"pool": {"size": "10", "per_host": -3, "keepalive": "bad", "dns_cache_ttl": None}}
+    )
+    assert (s.size, s.per_host, s.keepalive, s.dns_cache_ttl) == (10, 0, 30.0, None)
+    assert connection_pool.PoolSettings.from_options({"pool": "junk"}) == connection_pool.PoolSettings()
+
+
+class FakeOllama:
+    """Answers /api/chat and remembers which client sockets it saw."""
+
+    def __init__(self):
+        self.peers = []
+
+    async def chat(self, request):
+        await request.json()
+        self.peers.append(request.transport.get_extra_info("peername"))
+        return web.json_response({"message": {"content": "ok"}, "done": True})
+
+
+async def _calls(n):
+    fake = FakeOllama()
+    app = web.Application()
+    app.router.add_post("/api/chat", fake.chat)
+    server = TestServer(app)
+    await server.start_server()
+
+    pool = connection_pool.ConnectionPool("box")
+    client = agent_factory.ChatClient(
+        provider_name="box",
+        base_url=str(server.make_url("")).rstrip("/"),
+        api_key=None,
+        model="m",
+        provider_type="ollama",
+        pool=pool,
+    )
+    try:
+        replies = []
+        for _ in range(n):
+            # Bound copies share the provider's transport
+            replies.append(await client.bind(model="m2").chat([{"role": "user", "content": "hi"}]))
+        return replies, fake.peers, pool.stats()
+    finally:
+        await pool.close()
+        await server.close()
+
+
+def test_session_and_connection_reused():
+    replies, peers, stats = asyncio.run(_calls(3))
+    assert replies == ["ok"] * 3
+    assert stats["sessions_opened"] == 1 and stats["requests"] == 3 and stats["in_flight"] == 0
+    assert len(set(peers)) == 1  # one keep-alive connection for every call
+
+
+def test_new_event_loop_gets_new_session():
+    pool = connection_pool.ConnectionPool("box")
+
+    async def open_session():
+        session = pool.session()
+        assert pool.session() is session
+        await session.close()  # the loop ends with this asyncio.run()
+        return session
+
+    first = asyncio.run(open_session())
+    second = asyncio.run(open_session())
+    assert first is not second and pool.sessions_opened == 2
+    asyncio.run(pool.close())
+
+
+def test_openai_clients_cached_per_key():
+    async def run():
+        pool = connection_pool.ConnectionPool("cloud")
+        a = pool.openai_client("http://x/v1", "k1")
+        assert pool.openai_client("http://x/v1", "k1") is a
+        assert pool.openai_client("http://x/v1", "k2") is not a
+        assert pool.stats()["openai_clients"] == 2
+        await pool.close()
+        return pool
+
+    pool = asyncio.run(run())
+    assert pool.closed and pool.stats()["openai_clients"] == 0
+
+
+def test_closed_pool_refuses_requests():
+    async def run():
+        pool = connection_pool.ConnectionPool("box")
+        pool.session()
+        await pool.close()
+        await pool.close()  # safe to call twice
+        for open_transport in (pool.session, lambda: pool.openai_client("http://x/v1", "k")):
+            try:
+                open_transport()
+            except RuntimeError as e:
+                assert "closed" in str(e)
+            else:
+                raise AssertionError("closed pool handed out a transport")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_settings_from_options()
+    test_session_and_connection_reused()
+    test_new_event_loop_gets_new_session()
+    test_openai_clients_cached_per_key()
+    test_closed_pool_refuses_requests()
+    print("All tests passed!")
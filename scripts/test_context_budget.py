@@ -0,0 +1,99 @@
+"""
+Context budgeting tests.
+
+Checks that the oldest turns are dropped to fit the window while the system
+prompt and the newest message survive.
+
+    python scripts/test_context_budget.py
+"""
+
+import importlib
+import sys
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+context_budget = importlib.import_module(f"{plugin_root.name}.backend.context_budget")
+provider_config = importlib.import_module(f"{plugin_root.name}.config.provider_config")
+
+
+def _conversation(turns: int, size: int = 400):
+    messages = [{"role": "system", "content": "You are ComfyAI."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"q{i} " + "x" * size})
+        messages.append({"role": "assistant", "content": f"a{i} " + "y" * size})
+    messages.append({"role": "user", "content": "latest question"})
+    return messages
+
+
+def test_fits_without_truncation():
+    messages = _conversation(2)
+    result = context_budget.fit_messages(messages, "m", window=8192, max_tokens=1024)
+    assert result.messages == messages and not result.truncated
+
+
+def test_drops_oldest_turns_first():
+    messages = _conversation(10)
+    result = context_budget.fit_messages(messages, "m", window=1500, max_tokens=512, reserve_tokens=64)
+
+    assert result.truncated
+    assert result.prompt_tokens <= result.budget == 1500 - 512 - 64
+    assert result.messages[0]["role"] == "system"
+    assert result.messages[-1]["content"] == "latest question"
+    # History resumes at a user turn, and the newest turns are the ones kept
+    assert result.messages[1]["role"] == "user"
+    assert result.messages[-2]["content"].startswith("a9")
+    assert result.dropped[0]["content"].startswith("q0")
+
+
+def test_never_drops_system_or_latest():
+    messages = _conversation(3)
+    result = context_budget.fit_messages(messages, "m", window=10, max_tokens=0)
+    assert [m["role"] for m in result.messages] == ["system", "user"]
+    assert result.prompt_tokens > result.budget
+
+
+def test_window_resolution():
+    config = context_budget.ContextConfig.from_settings({"context": {"default_window": 4096}})
+    declared = provider_config.ModelConfig(name="qwen", context=32768)
+    assert context_budget.context_window(declared, config) == 32768
+    assert context_budget.context_window(provider_config.ModelConfig(name="x"), config) == 4096
+    unlimited = context_budget.ContextConfig.from_settings({"context": {"default_window": None}})
+    assert context_budget.context_window(None, unlimited) is None
+
+
+def test_heuristic_estimate():
+    assert context_budget.estimate_tokens("") == 0
+    assert context_budget._heuristic_tokens("a" * 400) == 100
+    assert context_budget._heuristic_tokens("图像生成") == 4
+
+
+def test_token_cache_is_bounded_and_text_free():
+    counts = context_budget._token_counts
+    counts.clear()
+    text = "long workflow dump " * 500
+    first = context_budget.estimate_tokens(text, "m")
+    assert context_budget.estimate_tokens(text, "m") == first and len(counts) == 1
+    assert all(not isinstance(part, str) or part == "m" for key in counts for part in key)
+
+    saved = context_budget.TOKEN_CACHE_SIZE
+    context_budget.TOKEN_CACHE_SIZE = 3
+    try:
+        for i in range(10):
+            context_budget.estimate_tokens(f"turn {i}")
+        assert len(counts) == 3
+    finally:
+        context_budget.TOKEN_CACHE_SIZE = saved
+        counts.clear()
+
+
+if __name__ == "__main__":
+    test_fits_without_truncation()
+    test_drops_oldest_turns_first()
+    test_never_drops_system_or_latest()
+    test_window_resolution()
+    test_heuristic_estimate()
+    test_token_cache_is_bounded_and_text_free()
+    print("All tests passed!")
@@ -0,0 +1,145 @@
+"""
+Conversation store tests.
+
+Checks history assembly, reload from the append-only log, LRU / idle
+eviction, rolling summaries, recovery from a torn final log line, and
+that a failed compaction leaves the turns untouched.
+
+    python scripts/test_conversation_store.py
+"""
+
+import asyncio
+import contextlib
+import importlib
+import sys
+import tempfile
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+compaction = importlib.import_module(f"{plugin_root.name}.backend.service.conversation_compaction")
+conversation_store = importlib.import_module(f"{plugin_root.name}.backend.conversation_store")
+metrics = importlib.import_module(f"{plugin_root.name}.backend.utils.metrics")
+
+
+async def _round_trip(directory: Path):
+    config = conversation_store.ConversationConfig(max_sessions=1, idle_ttl_s=60)
+    store = conversation_store.ConversationStore(config, directory)
+
+    await store.append("a", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])
+    await store.append("b", [{"role": "user", "content": "other"}])
+
+    # max_sessions=1: "a" was evicted from memory but reloads from its log
+    assert list(store._sessions) == ["b"]
+    assert await store.history("a") == [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+    ]
+
+    # A crash mid-append leaves a partial line; it is skipped on reload
+    with open(directory / "a.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"role": "user", "cont')
+    restarted = conversation_store.ConversationStore(config, directory)
+    assert len(await restarted.history("a")) == 2
+
+    await restarted.reset("a")
+    assert await restarted.history("a") == []
+    assert not (directory / "a.jsonl").exists()
+
+
+def test_history_survives_eviction_and_restart():
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_round_trip(Path(tmp)))
+
+
+async def _summaries(directory: Path):
+    store = conversation_store.ConversationStore(directory=directory)
+    for i in range(4):
+        await store.append("s", [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}])
+
+    # Keep 3 → cut moves back so kept history starts at a user turn
+    window = await store.compaction_window("s", keep_recent=3)
+    assert window.upto == 4 and [m["content"] for m in window.messages] == ["q0", "a0", "q1", "a1"]
+    assert await store.set_summary(window, "asked q0 and q1")
+    assert not await store.set_summary(window, "stale")
+
+    expected = [
+        {"role": "system", "content": conversation_store.SUMMARY_PREFIX + "asked q0 and q1"},
+        {"role": "user", "content": "q2"},
+        {"role": "assistant", "content": "a2"},
+        {"role": "user", "content": "q3"},
+        {"role": "assistant", "content": "a3"},
+    ]
+    assert await store.history("s") == expected
+
+    # The summary is part of the log and survives a restart
+    restarted = conversation_store.ConversationStore(directory=directory)
+    assert await restarted.history("s") == expected
+    assert await restarted.compaction_window("s", keep_recent=4) is None
+
+
+def test_rolling_summary():
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_summaries(Path(tmp)))
+
+
+def test_session_id_validation():
+    assert conversation_store.valid_session_id("3f2a_b-9")
+    assert not conversation_store.valid_session_id("../etc/passwd")
+    assert not conversation_store.valid_session_id("")
+    assert not conversation_store.valid_session_id(None)
+
+
+class FakeSummarizer:
+    """Stands in for the bound ChatClient; replies with `summary`."""
+
+    provider_name, model = "box", "m"
+
+    def __init__(self, summary):
+        self.summary = summary
+
+    @contextlib.asynccontextmanager
+    async def admission(self, key):
+        yield
+
+    async def chat(self, messages):
+        return self.summary
+
+
+async def _compact_with(directory: Path, summary: str):
+    saved = conversation_store._store, compaction._summarizer
+    conversation_store._store = store = conversation_store.ConversationStore(directory=directory)
+    compaction._summarizer = lambda config: FakeSummarizer(summary)
+    try:
+        for i in range(4):
+            await store.append("s", [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}])
+        settings = {"conversations": {"compact_threshold_tokens": 1, "compact_keep_recent": 2}}
+        await compaction.schedule_compaction("s", settings)
+        return await store.history("s")
+    finally:
+        conversation_store._store, compaction._summarizer = saved
+
+
+def test_failed_compaction_keeps_turns():
+    metrics.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Providers report failures as reply text, not exceptions
+        history = asyncio.run(_compact_with(Path(tmp), "[Ollama ERROR] HTTP 500: gpu on fire"))
+    assert [m["content"] for m in history] == ["q0", "a0", "q1", "a1", "q2", "a2", "q3", "a3"]
+    assert metrics.get_counter("conversations.compaction_failed") == 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        history = asyncio.run(_compact_with(Path(tmp), "asked q0 to q2"))
+    assert history[0]["content"] == conversation_store.SUMMARY_PREFIX + "asked q0 to q2"
+    assert [m["content"] for m in history[1:]] == ["q3", "a3"]
+    assert metrics.get_counter("conversations.compaction_failed") == 1
+
+
+if __name__ == "__main__":
+    test_history_survives_eviction_and_restart()
+    test_rolling_summary()
+    test_session_id_validation()
+    test_failed_compaction_keeps_turns()
+    print("All tests passed!")
@@ -0,0 +1,116 @@
+"""
+Gemini streaming tests.
+
+Replays a recorded streamGenerateContent?alt=sse response from a local
+fake server, cut into awkward chunks (split CRLFs, split UTF-8 sequences),
+and checks that ChatClient.stream_chat yields it incrementally.
+
+    python scripts/test_gemini_stream.py
+"""
+
+import asyncio
+import importlib
+import sys
+from pathlib import Path
+
+from aiohttp import web
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+sse = importlib.import_module(f"{plugin_root.name}.backend.utils.sse")
+
+RECORDED = (Path(__file__).parent / "fixtures" / "gemini_stream.sse").read_bytes()
+EXPECTED_TEXT = "Hello from Gemini — streaming ✨ works."
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_sse_decoder_handles_partial_frames():
+    for size in (1, 2, 3, 7, 64, len(RECORDED)):
+        decoder = sse.SSEDecoder()
+        events = []
+        for chunk in _chunks(RECORDED, size):
+            events.extend(decoder.feed(chunk))
+        events.extend(decoder.close())
+
+        assert len(events) == 4, size
+        assert all(e.event == "message" for e in events)
+
+
+def test_sse_decoder_fields_and_comments():
+    decoder = sse.SSEDecoder()
+    events = decoder.feed(b": ping\nevent: delta\nid: 7\ndata: a\ndata: b\n\ndata: tail")
+    events += decoder.close()
+
+    assert [(e.event, e.data, e.id) for e in events] == [("delta", "a\nb", "7"), ("message", "tail", "7")]
+
+
+async def _run_stream(chunk_size: int):
+    seen_bodies = []
+
+    async def stream_generate(request: web.Request) -> web.StreamResponse:
+        seen_bodies.append((request.match_info["model"], dict(request.query), await request.json()))
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for chunk in _chunks(RECORDED, chunk_size):
+            await resp.write(chunk)
+            await asyncio.sleep(0.001)
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_post("/v1beta/models/{model}:streamGenerateContent", stream_generate)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    client = agent_factory.ChatClient(
+        provider_name="google",
+        base_url=f"http://127.0.0.1:{port}/v1beta",
+        api_key="test-key",
+        model="gemini-2.0-flash",
+        provider_type="cloud",
+    )
+
+    try:
+        chunks = [
+            c async for c in client.stream_chat([
+                {"role": "system", "content": "Be brief."},
+                {"role": "user", "content": "Hi"},
+                {"role": "assistant", "content": "Hello!"},
+                {"role": "user", "content": "Stream something"},
+            ])
+        ]
+    finally:
+        await client.pool.close()
+        await runner.cleanup()
+
+    return chunks, seen_bodies
+
+
+def test_stream_chat_yields_incrementally():
+    for size in (5, 41, 4096):
+        chunks, bodies = asyncio.run(_run_stream(size))
+
+        assert "".join(chunks) == EXPECTED_TEXT
+        assert len(chunks) == 4
+
+        model, query, body = bodies[0]
+        assert model == "gemini-2.0-flash"
+        assert query == {"key": "test-key", "alt": "sse"}
+        assert body["systemInstruction"] == {"parts": [{"text": "Be brief."}]}
+        assert [c["role"] for c in body["contents"]] == ["user", "model", "user"]
+
+
+if __name__ == "__main__":
+    test_sse_decoder_handles_partial_frames()
+    test_sse_decoder_fields_and_comments()
+    test_stream_chat_yields_incrementally()
+    print("All tests passed!")
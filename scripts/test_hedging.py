@@ -0,0 +1,173 @@
+"""
+Hedged stream tests.
+
+Races two fake OpenAI-compatible servers: a primary that is slow (or
+failing) past the hedge delay loses to the secondary and is cancelled, a
+healthy primary never triggers the hedge, and the hedge delay follows the
+primary's TTFT percentile.
+
+    python scripts/test_hedging.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+hedging = importlib.import_module(f"{plugin_root.name}.backend.hedging")
+provider_manager = importlib.import_module(f"{plugin_root.name}.backend.provider_manager")
+routing = importlib.import_module(f"{plugin_root.name}.backend.routing")
+metrics = importlib.import_module(f"{plugin_root.name}.backend.utils.metrics")
+provider_config = importlib.import_module(f"{plugin_root.name}.config.provider_config")
+schema = importlib.import_module(f"{plugin_root.name}.config.schema")
+
+FIXED = hedging.HedgeSettings(delay_s=0.1)
+
+
+class FakeProvider:
+    """OpenAI-compatible server streaming `words` after `delay` seconds, or answering `status`."""
+
+    def __init__(self, words, delay=0.0, status=200):
+        self.words = words
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+        self.finished = 0
+
+    async def chat(self, request):
+        await request.json()
+        self.requests += 1
+        if self.status != 200:
+            return web.json_response({"error": {"message": "down"}}, status=self.status)
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        await asyncio.sleep(self.delay)
+        for word in self.words:
+            event = {"id": "1", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                     "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            await resp.write(f"data: {json.dumps(event)}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        self.finished += 1
+        return resp
+
+
+async def _client(name, fake, stack):
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", fake.chat)
+    server = TestServer(app)
+    await server.start_server()
+    client = agent_factory.ChatClient(
+        provider_name=name,
+        base_url=str(server.make_url("/v1")),
+        api_key="test",
+        model="m",
+        provider_type="cloud",
+        resilience=agent_factory.ResiliencePolicy.from_options({"retry": {"attempts": 1}}),
+    )
+    stack.append((client, server))
+    return client
+
+
+async def _race(primary_fake, secondary_fake, settings=FIXED):
+    stack = []
+    try:
+        primary = await _client("primary", primary_fake, stack)
+        secondary = await _client("secondary", secondary_fake, stack)
+        stream = hedging.HedgedStream(primary, secondary, [{"role": "user", "content": "hi"}], settings)
+        text = "".join([chunk async for chunk in stream])
+        await asyncio.sleep(0.05)  # let the loser's server notice the disconnect
+        return text, stream
+    finally:
+        for client, server in stack:
+            await client.pool.close()
+            await server.close()
+
+
+def test_slow_primary_loses():
+    stats = hedging.get_hedge_stats()
+    stats.reset()
+    routing.get_routing_stats().reset()
+    slow, fast = FakeProvider(["slow"], delay=2.0), FakeProvider(["fa", "st"])
+    text, stream = asyncio.run(_race(slow, fast))
+    assert text == "fast" and stream.hedged and stream.winner.provider_name == "secondary"
+    assert slow.finished == 0  # cancelled before it answered
+    assert routing.get_routing_stats().model("primary", "m").in_flight == 0
+
+    snap = stats.snapshot()
+    assert snap["primary"]["hedged"] == 1 and snap["primary"]["hedge_wins"] == 1
+    assert snap["primary"]["hedge_rate"] == 1.0 and snap["secondary"]["rescues"] == 1
+
+
+def test_fast_primary_is_not_hedged():
+    hedging.get_hedge_stats().reset()
+    primary, secondary = FakeProvider(["quick"]), FakeProvider(["unused"])
+    text, stream = asyncio.run(_race(primary, secondary))
+    assert text == "quick" and not stream.hedged and secondary.requests == 0
+    assert hedging.get_hedge_stats().snapshot()["primary"]["hedge_rate"] == 0.0
+
+
+def test_failing_primary_hedges_at_once():
+    down, up = FakeProvider([], status=503), FakeProvider(["ok"])
+    settings = hedging.HedgeSettings(delay_s=30)
+    text, stream = asyncio.run(asyncio.wait_for(_race(down, up, settings), 5))
+    assert text == "ok" and stream.winner.provider_name == "secondary"
+
+    # Both down: the primary's error is what the caller sees
+    try:
+        asyncio.run(_race(FakeProvider([], status=503), FakeProvider([], status=502)))
+    except Exception as e:
+        assert getattr(e, "status_code", None) == 503
+    else:
+        raise AssertionError("both providers failed but the stream succeeded")
+
+
+def test_delay_from_percentile():
+    metrics.reset()
+    settings = hedging.HedgeSettings.from_options({"hedge": {"percentile": 90, "max_delay_s": 3}})
+    assert settings.percentile == 0.9
+    assert settings.delay("box") == 3  # no history yet
+    for ttft in (0.1,) * 9 + (1.5,):
+        metrics.observe("deadline.box.ttft_s", ttft)
+    assert 0.25 <= settings.delay("box") <= 1.5
+    assert hedging.HedgeSettings.from_options({"hedge": {"delay_s": "x"}}).delay_s is None
+
+
+def test_manager_opt_in():
+    mgr = object.__new__(provider_manager.ProviderManager)
+    mgr.config = schema.ComfyAIConfig()
+    mgr.providers, mgr.pools, mgr.default_provider, mgr._draining = {}, {}, None, set()
+    providers = {
+        name: provider_config.ProviderConfig(name=name, type="local", base_url=f"http://{name}:11434",
+                                             default_model="m")
+        for name in ("gpu", "cloud")
+    }
+    mgr._apply_config(schema.ComfyAIConfig(
+        providers=providers, routing={"chat": {"providers": ["gpu", "cloud"], "hedge": True}},
+    ))
+    gpu = mgr.providers["gpu"].bind(task="chat")
+    messages = [{"role": "user", "content": "hi"}]
+
+    stream = mgr.stream_chat(gpu, messages)
+    assert isinstance(stream, hedging.HedgedStream) and stream.secondary.provider_name == "cloud"
+    assert stream.secondary.task == "chat"
+    assert not isinstance(mgr.stream_chat(gpu, messages, hedge=False), hedging.HedgedStream)
+    assert not isinstance(mgr.stream_chat(gpu, messages, task="rewrite"), hedging.HedgedStream)
+    assert mgr.pick_provider("chat", exclude=["gpu", "cloud"]) is None
+
+
+if __name__ == "__main__":
+    test_slow_primary_loses()
+    test_fast_primary_is_not_hedged()
+    test_failing_primary_hedges_at_once()
+    test_delay_from_percentile()
+    test_manager_opt_in()
+    print("All tests passed!")
@@ -0,0 +1,188 @@
+"""
+ComfyAI node tests.
+
+Runs the LLM nodes from a plain thread (standing in for ComfyUI's executor)
+against a fake Ollama server: calls are bridged onto the shared event loop,
+repeated inputs come from the node cache, batches run concurrently within
+`nodes.concurrency`, images reach the model and provider errors fail the
+node instead of being cached.
+
+    python scripts/test_nodes.py
+"""
+
+import asyncio
+import importlib
+import sys
+import tempfile
+from pathlib import Path
+
+from aiohttp import web
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+nodes = importlib.import_module(f"{plugin_root.name}.backend.nodes")
+provider_manager = importlib.import_module(f"{plugin_root.name}.backend.provider_manager")
+response_cache = importlib.import_module(f"{plugin_root.name}.backend.response_cache")
+loop_bridge = importlib.import_module(f"{plugin_root.name}.backend.utils.loop_bridge")
+
+
+class FakeOllama:
+    def __init__(self):
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+        self.url = None
+
+    async def chat(self, request):
+        body = await request.json()
+        self.requests.append(body)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            self.active -= 1
+        user = body["messages"][-1]
+        if user["content"] == "fail":
+            return web.Response(status=404, text="model not found")
+        images = len(user.get("images") or [])
+        reply = f"{user['content'].upper()} ({body['options']['temperature']}, {images} image(s))"
+        return web.json_response({"message": {"content": reply}, "done": True})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/chat", self.chat)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+_server = None
+_tmp = tempfile.TemporaryDirectory()
+
+
+def _setup():
+    """Fake provider "nodes_test" + a node cache in a temp directory."""
+    global _server
+    if _server is None:
+        _server = FakeOllama()
+        asyncio.run_coroutine_threadsafe(_server.start(), loop_bridge.shared_loop()).result(5)
+        mgr = provider_manager.ProviderManager.instance()
+        mgr.providers["nodes_test"] = agent_factory.ChatClient(
+            provider_name="ollama",
+            base_url=_server.url,
+            api_key=None,
+            model="llama3.2",
+            provider_type="local",
+        )
+    nodes._cache = response_cache.ResponseCache(nodes._NODE_CACHE_DEFAULTS, Path(_tmp.name))
+    _server.requests.clear()
+    _server.peak = 0
+    return _server
+
+
+def _options(**overrides):
+    options = dict(provider="nodes_test", model="", temperature=0.5, max_tokens=64, variant=0, use_cache=True)
+    options.update(overrides)
+    return options
+
+
+def test_expand_is_cached():
+    server = _setup()
+    node = nodes.ComfyAIExpandPrompt()
+    first = node.expand("a cat", "watercolor", **_options())
+    again = node.expand("a cat", "watercolor", **_options())
+    assert first == again == ("A CAT\n\nSTYLE: WATERCOLOR (0.5, 0 image(s))",)
+    assert len(server.requests) == 1
+    assert server.requests[0]["messages"][0]["content"] == nodes.EXPAND_SYSTEM_PROMPT
+
+    # Different params / variant / cache off all reach the model
+    node.expand("a cat", "watercolor", **_options(temperature=0.9))
+    node.expand("a cat", "watercolor", **_options(variant=1))
+    node.expand("a cat", "watercolor", **_options(use_cache=False))
+    assert len(server.requests) == 4
+
+
+def test_batch_runs_concurrently_in_order():
+    server = _setup()
+    prompts = "\n".join(f"prompt {i}" for i in range(8)) + "\n\n"
+    (texts,) = nodes.ComfyAIBatchPrompts().run_batch(prompts, "", **_options())
+    assert [t.split(" (")[0] for t in texts] == [f"PROMPT {i}" for i in range(8)]
+    assert 1 < server.peak <= nodes.NodeConfig().concurrency
+
+
+def test_images_reach_the_model():
+    server = _setup()
+    call = nodes.NodeCall(provider="nodes_test")
+    items = [("describe", ("aW1hZ2Ux",)), ("describe", ("aW1hZ2Uy",))]
+    texts = loop_bridge.run_coroutine_sync(nodes.complete_many(call, items))
+    assert texts == ["DESCRIBE (0.7, 1 image(s))"] * 2
+    assert len(server.requests) == 2  # same prompt, different image: not a cache hit
+    assert sorted(r["messages"][-1]["images"][0] for r in server.requests) == ["aW1hZ2Ux", "aW1hZ2Uy"]
+
+
+def test_errors_fail_the_node():
+    server = _setup()
+    for _ in range(2):
+        try:
+            nodes.ComfyAIGenerate().generate("fail", "", **_options())
+        except RuntimeError as e:
+            assert "HTTP 404" in str(e)
+        else:
+            raise AssertionError("provider error was returned as text")
+    assert len(server.requests) == 2  # not cached
+
+    try:
+        nodes.ComfyAIGenerate().generate("hi", "", **_options(provider="missing"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown provider accepted")
+
+
+def test_vision_payloads():
+    messages = [{"role": "system", "content": "be brief"},
+                {"role": "user", "content": "what is this?", "images": ["aW1n"]}]
+    openai = agent_factory.ChatClient._openai_messages(messages)
+    assert openai[0] == {"role": "system", "content": "be brief"}
+    assert openai[1]["content"] == [
+        {"type": "text", "text": "what is this?"},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64,aW1n"}},
+    ]
+
+    client = agent_factory.ChatClient("google", "https://generativelanguage.googleapis.com", "k", "gemini-2.0-flash", "cloud")
+    parts = client._gemini_payload(messages)["contents"][0]["parts"]
+    assert parts == [{"inlineData": {"mimeType": "image/png", "data": "aW1n"}}, {"text": "what is this?"}]
+
+
+def test_bridge_refuses_loop_thread():
+    async def nested():
+        try:
+            loop_bridge.run_coroutine_sync(asyncio.sleep(0))
+        except RuntimeError:
+            return True
+        return False
+
+    assert asyncio.run_coroutine_threadsafe(nested(), loop_bridge.shared_loop()).result(5)
+
+
+def test_mappings():
+    assert set(nodes.NODE_CLASS_MAPPINGS) == set(nodes.NODE_DISPLAY_NAME_MAPPINGS)
+    for cls in nodes.NODE_CLASS_MAPPINGS.values():
+        assert hasattr(cls, cls.FUNCTION) and "required" in cls.INPUT_TYPES()
+
+
+if __name__ == "__main__":
+    test_expand_is_cached()
+    test_batch_runs_concurrently_in_order()
+    test_images_reach_the_model()
+    test_errors_fail_the_node()
+    test_vision_payloads()
+    test_bridge_refuses_loop_thread()
+    test_mappings()
+    print("All tests passed!")
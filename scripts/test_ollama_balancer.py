@@ -0,0 +1,219 @@
+"""
+Multi-endpoint Ollama tests.
+
+Checks least-outstanding-requests balancing with model affinity, passive
+and probe-driven ejection / readmission, and that a ChatClient built for a
+provider with several endpoints spreads requests over fake Ollama hosts
+and retries a failing host's request on another one. Also checks that
+both config loaders accept "endpoints" as a single URL or a list.
+
+    python scripts/test_ollama_balancer.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+balancer_mod = importlib.import_module(f"{plugin_root.name}.backend.ollama_balancer")
+connection_pool = importlib.import_module(f"{plugin_root.name}.backend.connection_pool")
+provider_manager = importlib.import_module(f"{plugin_root.name}.backend.provider_manager")
+resilience = importlib.import_module(f"{plugin_root.name}.backend.resilience")
+provider_config = importlib.import_module(f"{plugin_root.name}.config.provider_config")
+providers_loader = importlib.import_module(f"{plugin_root.name}.config.providers_loader")
+
+
+def _balancer(urls, **settings):
+    pool = connection_pool.ConnectionPool("gpus")
+    return balancer_mod.OllamaBalancer(
+        "gpus", urls, pool, balancer_mod.BalancerSettings.from_options({"balancer": settings})
+    )
+
+
+def test_least_outstanding_with_affinity():
+    b = _balancer(["http://a", "http://b", "http://c"], affinity_slack=2)
+    held = [b.acquire("llama3.2") for _ in range(3)]
+    assert [e.url for e in held] == ["http://a", "http://b", "http://c"]
+    for e in held:
+        b.release(e, "llama3.2")
+
+    # "b" has the model loaded: it takes requests until it carries `slack` more
+    b.endpoints[1].loaded.add("llama3.2:latest")
+    picks = [b.acquire("llama3.2").url for _ in range(4)]
+    assert picks == ["http://b", "http://b", "http://b", "http://a"]
+
+    # A host that served the model becomes warm
+    e = b.acquire("qwen2.5:7b")
+    b.release(e, "qwen2.5:7b", served=True)
+    assert "qwen2.5:7b" in e.loaded
+
+
+def test_ejection():
+    b = _balancer(["http://a", "http://b"], fail_threshold=2, eject_s=0)
+    for _ in range(2):
+        e = b.acquire("m")
+        assert e.url == "http://a"
+        b.release(e, "m", error=resilience.ProviderHTTPError(503, "busy"))
+    assert not b.endpoints[0].healthy and b.stats()["healthy"] == 1
+    assert b.acquire("m").url == "http://b"
+
+    # Client errors say nothing about the host
+    b.release(b.endpoints[1], "m", error=resilience.ProviderHTTPError(404, "no model"))
+    b.release(b.endpoints[1], "m", error=resilience.ProviderHTTPError(404, "no model"))
+    assert b.endpoints[1].healthy
+
+    # Every host ejected: still answer with the least loaded one
+    b.endpoints[1].healthy = False
+    assert b.acquire("m").url in ("http://a", "http://b")
+
+
+class FakeOllama:
+    def __init__(self, status=200, loaded=(), chat_status=None):
+        self.status = status
+        self.chat_status = chat_status or status
+        self.loaded = list(loaded)
+        self.chats = 0
+
+    async def chat(self, request):
+        await request.json()
+        self.chats += 1
+        if self.chat_status != 200:
+            return web.Response(status=self.chat_status, text="gpu on fire")
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        await asyncio.sleep(0.05)
+        await resp.write(json.dumps({"message": {"content": "ok"}, "done": True}).encode() + b"\n")
+        return resp
+
+    async def ps(self, request):
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response({"models": [{"name": m, "model": m} for m in self.loaded]})
+
+
+async def _hosts(fakes):
+    servers = []
+    for fake in fakes:
+        app = web.Application()
+        app.router.add_post("/api/chat", fake.chat)
+        app.router.add_get("/api/ps", fake.ps)
+        server = TestServer(app)
+        await server.start_server()
+        servers.append(server)
+    return servers
+
+
+async def _run(fakes, calls, options=None):
+    servers = await _hosts(fakes)
+    cfg = provider_config.ProviderConfig(
+        name="gpu_pool", type="ollama", default_model="llama3.2",
+        endpoints=[str(s.make_url("")).rstrip("/") for s in servers],
+        options=options or {},
+    )
+    client = provider_manager.ProviderManager._build_client("gpu_pool", cfg)
+    try:
+        assert client.balancer is not None and client._is_ollama()
+        await client.balancer.probe_all()
+
+        async def one():
+            return "".join([c async for c in client.stream_chat([{"role": "user", "content": "hi"}])])
+
+        replies = await asyncio.gather(*(one() for _ in range(calls)))
+        return replies, client.balancer.stats()
+    finally:
+        await client.balancer.close()
+        await client.pool.close()
+        for server in servers:
+            await server.close()
+
+
+def test_client_spreads_requests():
+    fakes = [FakeOllama(), FakeOllama()]
+    replies, stats = asyncio.run(_run(fakes, 4))
+    assert replies == ["ok"] * 4
+    assert [f.chats for f in fakes] == [2, 2]
+    assert all(e["outstanding"] == 0 for e in stats["endpoints"])
+    assert all("llama3.2:latest" in e["loaded_models"] for e in stats["endpoints"])
+
+    # Probes report where the model is loaded: the warm host gets the traffic
+    fakes = [FakeOllama(), FakeOllama(loaded=["llama3.2:latest"])]
+    asyncio.run(_run(fakes, 2))
+    assert [f.chats for f in fakes] == [0, 2]
+
+
+def test_failing_host_is_retried_elsewhere():
+    options = {"retry": {"attempts": 3, "base_delay": 0.01}, "balancer": {"fail_threshold": 1}}
+
+    # Probes pass but chats fail: the 503s eject the host, retries go elsewhere
+    fakes = [FakeOllama(chat_status=503), FakeOllama()]
+    replies, stats = asyncio.run(_run(fakes, 3, options))
+    assert replies == ["ok"] * 3
+    assert not stats["endpoints"][0]["healthy"] and stats["endpoints"][0]["errors"] >= 1
+    assert fakes[1].chats == 3
+
+    # A host failing its probe never sees a request
+    fakes = [FakeOllama(status=503), FakeOllama()]
+    replies, stats = asyncio.run(_run(fakes, 3, options))
+    assert replies == ["ok"] * 3 and fakes[0].chats == 0
+    assert stats["healthy"] == 1
+
+
+def test_probe_readmits():
+    async def run():
+        fake = FakeOllama(status=503)
+        servers = await _hosts([fake])
+        b = _balancer([str(servers[0].make_url("")).rstrip("/")], fail_threshold=1, eject_s=0)
+        try:
+            await b.probe_all()
+            assert not b.endpoints[0].healthy
+            fake.status, fake.loaded = 200, ["llama3.2:latest"]
+            await b.probe_all()
+            return b.endpoints[0]
+        finally:
+            await b.pool.close()
+            await servers[0].close()
+
+    endpoint = asyncio.run(run())
+    assert endpoint.healthy and endpoint.loaded == {"llama3.2:latest"} and endpoint.times_ejected == 1
+
+
+def test_provider_api_detection():
+    api = agent_factory.provider_api
+    assert api("gpus", "ollama", "http://gpu1:8080") == "ollama"
+    assert api("ollama", "local", "http://box:9999") == "ollama"
+    assert api("lmstudio", "local", "http://localhost:1234/v1") == "openai"
+    assert api("local_chat", "local", "http://localhost:11434/v1", explicit="openai") == "openai"
+    assert api("local_chat", "local", "http://localhost:11434") == "ollama"  # legacy port fallback
+    assert api("google", "cloud", "https://generativelanguage.googleapis.com/v1beta") == "gemini"
+
+
+def test_endpoints_config_forms():
+    single = providers_loader._normalize_provider("gpu", {"type": "ollama", "endpoints": "http://gpu1:11434/"})
+    assert single.endpoints == ["http://gpu1:11434"] and single.base_url == "http://gpu1:11434"
+
+    many = providers_loader._normalize_provider("gpu", {
+        "type": "ollama", "base_url": "http://lb:11434",
+        "endpoints": ["http://gpu1:11434", "", "http://gpu2:11434/"],
+    })
+    assert many.endpoints == ["http://gpu1:11434", "http://gpu2:11434"] and many.base_url == "http://lb:11434"
+    assert providers_loader._normalize_provider("gpu", {"endpoints": 11434}).endpoints == []
+
+
+if __name__ == "__main__":
+    test_least_outstanding_with_affinity()
+    test_ejection()
+    test_probe_readmits()
+    test_client_spreads_requests()
+    test_failing_host_is_retried_elsewhere()
+    test_provider_api_detection()
+    test_endpoints_config_forms()
+    print("All tests passed!")
@@ -0,0 +1,152 @@
+"""
+Persistence tests.
+
+Checks atomic JSON writes, write coalescing (one flush per burst, every
+caller told when its payload is on disk or why it is not), and that
+concurrent settings saves are serialized so none of them is lost.
+
+    python scripts/test_persistence.py
+"""
+
+import asyncio
+import contextlib
+import importlib
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+paths = importlib.import_module(f"{plugin_root.name}.backend.utils.paths")
+persistence = importlib.import_module(f"{plugin_root.name}.backend.utils.persistence")
+settings = importlib.import_module(f"{plugin_root.name}.backend.utils.settings")
+settings_routes = importlib.import_module(f"{plugin_root.name}.backend.routes.settings")
+
+
+def test_atomic_write_json():
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / "nested" / "data.json"
+        persistence.atomic_write_json(target, {"a": 1})
+        assert json.loads(target.read_text()) == {"a": 1}
+
+        # A failed write leaves the previous file and no temp file behind
+        try:
+            persistence.atomic_write_json(target, {"bad": object()})
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("unserializable data was written")
+        assert json.loads(target.read_text()) == {"a": 1}
+        assert [p.name for p in target.parent.iterdir()] == ["data.json"]
+
+
+async def _coalescing():
+    written = []
+    writer = persistence.CoalescingWriter("test", written.append, delay=0.05)
+    waiters = [writer.schedule({"n": n}) for n in range(3)]
+    assert writer.has_pending and not any(w.done() for w in waiters)
+    await asyncio.gather(*waiters)
+    assert written == [{"n": 2}] and writer.flushes == 1 and writer.coalesced == 2
+
+    # Payloads are copied when scheduled
+    payload = {"n": 3}
+    waiter = writer.schedule(payload)
+    payload["n"] = 4
+    await writer.flush()
+    assert waiter.done() and written[-1] == {"n": 3}
+
+    def broken(data):
+        raise OSError("disk full")
+
+    failing = persistence.CoalescingWriter("broken", broken, delay=0.01)
+    waiter = failing.schedule({})
+    try:
+        await waiter
+    except OSError as e:
+        assert "disk full" in str(e)
+    else:
+        raise AssertionError("failed write reported success")
+
+
+def test_coalescing_writer():
+    asyncio.run(_coalescing())
+
+
+@contextlib.contextmanager
+def settings_dir():
+    """Point settings.py at a temp defaults.json / settings.json."""
+    saved = (settings.DEFAULTS_PATH, settings.SETTINGS_PATH, settings.SETTINGS_REVALIDATE_INTERVAL,
+             paths.USER_CONFIG_DIR, paths.CACHE_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        settings.DEFAULTS_PATH = root / "defaults.json"
+        settings.SETTINGS_PATH = root / "user" / "settings.json"
+        settings.SETTINGS_REVALIDATE_INTERVAL = 0.0  # every load goes to the I/O thread
+        paths.USER_CONFIG_DIR, paths.CACHE_DIR = root / "user", root / "user" / "cache"
+        settings.DEFAULTS_PATH.write_text(json.dumps({"version": 1, "defaults": {"temperature": 0.2}}))
+        settings.invalidate_settings_cache()
+        try:
+            yield root
+        finally:
+            (settings.DEFAULTS_PATH, settings.SETTINGS_PATH, settings.SETTINGS_REVALIDATE_INTERVAL,
+             paths.USER_CONFIG_DIR, paths.CACHE_DIR) = saved
+            settings.invalidate_settings_cache()
+
+
+async def _post_settings(bodies):
+    app = web.Application()
+    settings_routes.setup(app)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        async def post(body):
+            resp = await client.post("/api/comfyai/settings", json=body)
+            return resp.status, await resp.json()
+
+        return await asyncio.gather(*(post(body) for body in bodies))
+    finally:
+        await client.close()
+
+
+def test_concurrent_saves_are_serialized():
+    with settings_dir():
+        bodies = [{"defaults": {f"key_{n}": n}} for n in range(5)]
+        results = asyncio.run(_post_settings(bodies))
+        assert all(status == 200 for status, _ in results)
+
+        # Replies come after the write: every key is on disk, in one file
+        on_disk = json.loads(settings.SETTINGS_PATH.read_text())["defaults"]
+        assert all(on_disk[f"key_{n}"] == n for n in range(5)) and on_disk["temperature"] == 0.2
+
+
+def test_failed_write_is_reported():
+    with settings_dir():
+        settings.load_settings()
+        original = settings.atomic_write_json
+
+        def broken(*args, **kwargs):
+            raise OSError("read-only file system")
+
+        settings.atomic_write_json = broken
+        try:
+            [(status, body)] = asyncio.run(_post_settings([{"defaults": {"temperature": 0.9}}]))
+        finally:
+            settings.atomic_write_json = original
+        assert status == 500 and "read-only" in body["error"]
+
+        # The cache falls back to what is on disk
+        assert settings.load_settings()["defaults"]["temperature"] == 0.2
+
+
+if __name__ == "__main__":
+    test_atomic_write_json()
+    test_coalescing_writer()
+    test_concurrent_saves_are_serialized()
+    test_failed_write_is_reported()
+    print("All tests passed!")
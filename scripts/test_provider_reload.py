@@ -0,0 +1,152 @@
+"""
+Provider reload tests.
+
+Checks that a reload keeps unchanged providers' clients, and that a request
+queued for a provider slot when its provider is rebuilt still completes on
+the retired client's pool — with the provider's concurrency limit carried
+over to the new client instead of doubling.
+
+    python scripts/test_provider_reload.py
+"""
+
+import asyncio
+import importlib
+import sys
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+admission = importlib.import_module(f"{plugin_root.name}.backend.admission")
+provider_manager = importlib.import_module(f"{plugin_root.name}.backend.provider_manager")
+provider_config = importlib.import_module(f"{plugin_root.name}.config.provider_config")
+schema = importlib.import_module(f"{plugin_root.name}.config.schema")
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def _manager():
+    mgr = object.__new__(provider_manager.ProviderManager)
+    mgr.config = schema.ComfyAIConfig()
+    mgr.providers, mgr.pools, mgr.default_provider, mgr._draining = {}, {}, None, set()
+    return mgr
+
+
+def _config(base_url, model="m", max_in_flight=1, extra=None):
+    providers = {
+        "gpu": provider_config.ProviderConfig(
+            name="gpu", type="ollama", base_url=base_url, default_model=model,
+            options={"limits": {"max_in_flight": max_in_flight, "queue_timeout": 10}},
+        ),
+        **(extra or {}),
+    }
+    return schema.ComfyAIConfig(providers=providers)
+
+
+def test_unchanged_providers_are_reused():
+    mgr = _manager()
+    other = {"cloud": provider_config.ProviderConfig(name="cloud", type="cloud", base_url="http://c/v1")}
+    mgr._apply_config(_config("http://gpu:11434", extra=other))
+    gpu, cloud = mgr.providers["gpu"], mgr.providers["cloud"]
+
+    mgr._apply_config(_config("http://gpu:11434", model="m2", extra=other))
+    assert mgr.providers["cloud"] is cloud
+    assert mgr.providers["gpu"] is not gpu and mgr.providers["gpu"].model == "m2"
+    assert mgr.providers["gpu"].limiter is gpu.limiter  # same queue, same in-flight count
+
+
+class SlowOllama:
+    """Answers /api/chat once `gate` is set."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.served = 0
+
+    async def chat(self, request):
+        await request.json()
+        await self.gate.wait()
+        self.served += 1
+        return web.json_response({"message": {"content": "ok"}, "done": True})
+
+
+async def _reload_during_queue():
+    fake = SlowOllama()
+    app = web.Application()
+    app.router.add_post("/api/chat", fake.chat)
+    server = TestServer(app)
+    await server.start_server()
+    base_url = str(server.make_url("")).rstrip("/")
+
+    mgr = _manager()
+    mgr._apply_config(_config(base_url))
+    old = mgr.providers["gpu"]
+    try:
+        # A request picked the provider, then the provider was rebuilt
+        mgr._apply_config(_config(base_url, model="m2"))
+        new = mgr.providers["gpu"]
+        assert new.pool is not old.pool and old.pool in mgr._draining
+
+        # The limit is shared: the old client's request queues behind the new one's
+        running = asyncio.ensure_future(new.chat(MESSAGES))
+        await asyncio.sleep(0.05)
+        queued = asyncio.ensure_future(old.chat(MESSAGES))
+        await asyncio.sleep(0.05)
+        assert new.limiter.stats()["in_flight"] == 1 and new.limiter.stats()["queued"] == 1
+
+        # Nothing runs on the old pool, but it stays open for the queued request
+        await asyncio.sleep(0.3)  # well past the drain's first tick
+        assert not old.pool.closed and old.pool.stats()["reserved"] == 1
+
+        fake.gate.set()
+        replies = await asyncio.wait_for(asyncio.gather(running, queued), 5)
+        assert replies == ["ok"] * 2 and fake.served == 2
+
+        # Idle now: the retired pool closes, the live one stays open
+        for _ in range(20):
+            if old.pool.closed:
+                break
+            await asyncio.sleep(0.05)
+        assert old.pool.closed and not new.pool.closed and not mgr._draining
+    finally:
+        await mgr.aclose()
+        await server.close()
+
+
+def test_reload_during_queue():
+    asyncio.run(_reload_during_queue())
+
+
+async def _raised_limit():
+    limiter = admission.AdmissionController("gpu", admission.AdmissionSettings(max_in_flight=1))
+    gate = asyncio.Event()
+
+    async def hold():
+        async with limiter.slot("s"):
+            await gate.wait()
+
+    tasks = [asyncio.ensure_future(hold()) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    assert (limiter.in_flight, limiter.stats()["queued"]) == (1, 2)
+
+    limiter.reconfigure(admission.AdmissionSettings(max_in_flight=2))
+    await asyncio.sleep(0.01)
+    assert (limiter.in_flight, limiter.stats()["queued"]) == (2, 1)
+
+    gate.set()
+    await asyncio.gather(*tasks)
+    assert limiter.in_flight == 0
+
+
+def test_reconfigure_admits_waiters():
+    asyncio.run(_raised_limit())
+
+
+if __name__ == "__main__":
+    test_unchanged_providers_are_reused()
+    test_reload_during_queue()
+    test_reconfigure_admits_waiters()
+    print("All tests passed!")
@@ -0,0 +1,165 @@
+"""
+Provider deadline / retry tests.
+
+Points a ChatClient at a fake Ollama server that fails or stalls on
+demand: 429 / 5xx are retried with backoff within the request's retry
+budget, other errors are not, and stalled calls fail on the ttft, idle or
+total deadline instead of hanging.
+
+    python scripts/test_resilience.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+resilience = importlib.import_module(f"{plugin_root.name}.backend.resilience")
+metrics = importlib.import_module(f"{plugin_root.name}.backend.utils.metrics")
+
+
+class FlakyOllama:
+    """Answers /api/chat after `failures` error responses, or stalls."""
+
+    def __init__(self, failures=0, status=503, stall=None):
+        self.failures = failures
+        self.status = status
+        self.stall = stall  # None | "headers" | "body" | "mid-stream"
+        self.requests = 0
+
+    async def chat(self, request):
+        body = await request.json()
+        self.requests += 1
+        if self.requests <= self.failures:
+            return web.Response(status=self.status, text="busy", headers={"Retry-After": "0"})
+        if self.stall == "headers":
+            await asyncio.sleep(10)
+        if not body.get("stream"):
+            return web.json_response({"message": {"content": "ok"}, "done": True})
+
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        if self.stall == "body":
+            await asyncio.sleep(10)
+        await resp.write(json.dumps({"message": {"content": "o"}}).encode() + b"\n")
+        if self.stall == "mid-stream":
+            await asyncio.sleep(10)
+        await resp.write(json.dumps({"message": {"content": "k"}, "done": True}).encode() + b"\n")
+        return resp
+
+
+async def _run(fake, call, options=None):
+    app = web.Application()
+    app.router.add_post("/api/chat", fake.chat)
+    server = TestServer(app)
+    await server.start_server()
+    client = agent_factory.ChatClient(
+        provider_name="ollama",
+        base_url=str(server.make_url("")).rstrip("/"),
+        api_key=None,
+        model="llama3.2",
+        provider_type="local",
+        resilience=resilience.ResiliencePolicy.from_options(options or {"retry": {"base_delay": 0.01}}),
+    )
+    try:
+        return await call(client)
+    finally:
+        await client.pool.close()
+        await server.close()
+
+
+async def _stream(client):
+    return "".join([chunk async for chunk in client.stream_chat([{"role": "user", "content": "hi"}])])
+
+
+def _chat(client):
+    return client.chat([{"role": "user", "content": "hi"}])
+
+
+def test_retries_transient_failures():
+    metrics.reset()
+    fake = FlakyOllama(failures=2)
+    assert asyncio.run(_run(fake, _chat)) == "ok"
+    assert fake.requests == 3
+    assert metrics.get_counter("retry.ollama.retries") == 2
+
+    fake = FlakyOllama(failures=1, status=429)
+    assert asyncio.run(_run(fake, _stream)) == "ok"
+    assert fake.requests == 2
+
+
+def test_gives_up_after_attempts():
+    fake = FlakyOllama(failures=5)
+    assert asyncio.run(_run(fake, _chat)) == "[Ollama ERROR] HTTP 503: busy"
+    assert fake.requests == 3  # default attempts
+
+
+def test_client_errors_are_not_retried():
+    fake = FlakyOllama(failures=1, status=404)
+    assert asyncio.run(_run(fake, _chat)).startswith("[Ollama ERROR] HTTP 404")
+    assert fake.requests == 1
+
+
+def test_budget_is_shared_per_request():
+    fakes = [FlakyOllama(failures=1), FlakyOllama(failures=1)]
+
+    async def two_calls():
+        with resilience.retry_scope(1) as budget:
+            first = await _run(fakes[0], _chat)
+            second = await _run(fakes[1], _chat)
+        return first, second, budget.spent
+
+    first, second, spent = asyncio.run(two_calls())
+    assert first == "ok" and second.startswith("[Ollama ERROR] HTTP 503")
+    assert spent == 1 and [f.requests for f in fakes] == [2, 1]
+
+
+def test_deadlines():
+    options = {"timeouts": {"ttft": 0.3, "idle": 0.3, "total": 0.5}, "retry": {"attempts": 1}}
+    for stall, call, phase in (
+        ("headers", _chat, "total"),
+        ("body", _stream, "ttft"),
+        ("mid-stream", _stream, "idle"),
+    ):
+        try:
+            asyncio.run(_run(FlakyOllama(stall=stall), call, options))
+        except resilience.DeadlineExceeded as e:
+            assert e.phase == phase, (stall, e.phase)
+        else:
+            raise AssertionError(f"{stall} stall did not time out")
+
+
+def test_policy_from_options():
+    policy = resilience.ResiliencePolicy.from_options({
+        "timeouts": {"ttft": 30, "total": None, "tasks": {"rewrite": {"total": 1800}}},
+        "retry": {"attempts": "x", "tasks": {"chat": {"attempts": 1}}},
+    })
+    assert policy.default.timeouts == resilience.Timeouts(connect=10.0, ttft=30.0, idle=60.0, total=None)
+    assert policy.default.retry.attempts == 3  # junk ignored
+    assert policy.for_task("rewrite").timeouts.total == 1800
+    assert policy.for_task("rewrite").timeouts.ttft == 30
+    assert policy.for_task("chat").retry.attempts == 1
+    assert policy.for_task("nodes") == policy.default
+
+    retry = resilience.RetryPolicy(base_delay=1, max_delay=4)
+    assert all(0 <= retry.backoff(n) <= min(4, 2 ** (n - 1)) for n in range(1, 6) for _ in range(20))
+    assert retry.backoff(1, retry_after=3) >= 3
+
+
+if __name__ == "__main__":
+    test_retries_transient_failures()
+    test_gives_up_after_attempts()
+    test_client_errors_are_not_retried()
+    test_budget_is_shared_per_request()
+    test_deadlines()
+    test_policy_from_options()
+    print("All tests passed!")
@@ -0,0 +1,87 @@
+"""
+Response cache tests.
+
+Checks key derivation, the memory LRU, the disk tier and TTL expiry.
+
+    python scripts/test_response_cache.py
+"""
+
+import asyncio
+import importlib
+import sys
+import tempfile
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+response_cache = importlib.import_module(f"{plugin_root.name}.backend.response_cache")
+
+CLIENT = agent_factory.ChatClient(
+    provider_name="ollama",
+    base_url="http://127.0.0.1:11434",
+    api_key=None,
+    model="qwen2.5",
+    provider_type="local",
+)
+
+
+def test_cache_key_normalization():
+    base = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+    key = response_cache.cache_key(CLIENT, base)
+
+    # Whitespace and extra message fields don't matter
+    same = [{"role": "system", "content": "Be brief.\n"}, {"role": "user", "content": " Hi", "name": "x"}]
+    assert response_cache.cache_key(CLIENT, same) == key
+
+    # Model, params, system prompt and kind do
+    assert response_cache.cache_key(CLIENT.bind(model="llama3"), base) != key
+    params = agent_factory.SamplingParams(temperature=0.0)
+    assert response_cache.cache_key(CLIENT.bind(params=params), base) != key
+    assert response_cache.cache_key(CLIENT, [base[1]]) != key
+    assert response_cache.cache_key(CLIENT, base, kind="rewrite") != key
+
+
+async def _tiers(directory: Path):
+    config = response_cache.ResponseCacheConfig(enabled=True, max_entries=2, ttl_s=60)
+    cache = response_cache.ResponseCache(config, directory)
+
+    for i in range(3):
+        cache.put(f"k{i}", f"reply {i}")
+    await asyncio.gather(*cache._pending)
+
+    # Memory keeps the two most recent; the disk tier still has the first
+    assert list(cache._memory) == ["k1", "k2"]
+    assert await cache.get("k0") == "reply 0"
+
+    # A fresh instance (restart) is served from disk
+    restarted = response_cache.ResponseCache(config, directory)
+    assert await restarted.get("k2") == "reply 2"
+    assert await restarted.get("missing") is None
+
+    # Expired entries are dropped from both tiers
+    expired = response_cache.ResponseCache(
+        response_cache.ResponseCacheConfig(enabled=True, ttl_s=0.0), directory
+    )
+    assert await expired.get("k1") is None
+    assert not (directory / "k1"[:2] / "k1.json").exists()
+
+
+def test_memory_and_disk_tiers():
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_tiers(Path(tmp)))
+
+
+def test_disabled_by_default():
+    assert response_cache.get_response_cache({}) is None
+    enabled = {"cache": {"enabled": True}}
+    assert response_cache.get_response_cache(enabled, {"cache": False}) is None
+
+
+if __name__ == "__main__":
+    test_cache_key_normalization()
+    test_memory_and_disk_tiers()
+    test_disabled_by_default()
+    print("All tests passed!")
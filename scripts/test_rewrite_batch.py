@@ -0,0 +1,114 @@
+"""
+Batch workflow rewrite tests.
+
+Runs rewrite_batch() with a fake rewrite function and fake providers:
+results stream back in completion order, the concurrency cap holds, items
+are spread over providers, failures stay per item, and every item of one
+kind gets the same system prompt.
+
+    python scripts/test_rewrite_batch.py
+"""
+
+import asyncio
+import importlib
+import sys
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+rewrite_batch = importlib.import_module(f"{plugin_root.name}.backend.service.rewrite_batch")
+rewrite_tools = importlib.import_module(f"{plugin_root.name}.backend.service.workflow_rewrite_tools")
+
+
+class FakeClient:
+    def __init__(self, name):
+        self.provider_name = name
+
+
+class FakeRewriter:
+    """Sleeps per workflow["delay"], tracking how many run at once."""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.providers = {}
+
+    async def __call__(self, request, llm=None):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.providers[llm.provider_name] = self.providers.get(llm.provider_name, 0) + 1
+        try:
+            await asyncio.sleep(request["workflow"]["delay"])
+            if request["workflow"].get("fail"):
+                raise RuntimeError("model unavailable")
+            return {"workflow": request["workflow"], "notes": request["prompt"], "mode": "patch"}
+        finally:
+            self.active -= 1
+
+
+async def _collect(items, clients, concurrency, rewriter):
+    return [
+        entry async for entry in rewrite_batch.rewrite_batch(
+            items, "set steps to 25", clients, concurrency, runner=rewriter
+        )
+    ]
+
+
+def test_parse_items():
+    items = rewrite_batch.parse_batch_items(
+        [{"nodes": []}, {"id": "portrait.json", "workflow": {"nodes": []}, "prompt": "only this one"}],
+        max_items=10,
+    )
+    assert [(i.index, i.id, i.prompt) for i in items] == [(0, 0, None), (1, "portrait.json", "only this one")]
+    for bad in ([], "x", [1], [{}] * 11):
+        try:
+            rewrite_batch.parse_batch_items(bad, max_items=10)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"accepted {bad!r}")
+
+
+def test_fan_out():
+    delays = [0.05, 0.01, 0.03, 0.01, 0.02, 0.04, 0.01, 0.02]
+    items = rewrite_batch.parse_batch_items([{"delay": d} for d in delays], max_items=100)
+    items[3].workflow["fail"] = True
+    rewriter = FakeRewriter()
+    clients = [FakeClient("local_a"), FakeClient("local_b")]
+
+    results = asyncio.run(_collect(items, clients, 3, rewriter))
+
+    assert sorted(r["index"] for r in results) == list(range(len(delays)))
+    assert results[0]["index"] != 0  # the slow first item does not hold up the others
+    assert rewriter.peak == 3
+    assert set(rewriter.providers) == {"local_a", "local_b"}
+    assert abs(rewriter.providers["local_a"] - rewriter.providers["local_b"]) <= 2
+
+    failed = [r for r in results if r["status"] == "error"]
+    assert [r["index"] for r in failed] == [3] and failed[0]["error"] == "model unavailable"
+    ok = next(r for r in results if r["index"] == 0)
+    assert ok["status"] == "ok" and ok["notes"] == "set steps to 25" and "elapsed_ms" in ok
+
+
+def test_shared_system_prompt():
+    a = rewrite_tools.system_prompt("patch", True, True)
+    assert a is rewrite_tools.system_prompt("patch", True, True)
+    assert "{next_id}" not in a
+    assert rewrite_tools.system_prompt("full", True, False) != rewrite_tools.system_prompt("full", False, False)
+
+
+def test_config():
+    config = rewrite_batch.BatchConfig.from_settings(
+        {"workflow": {"rewrite": {"batch": {"concurrency": 8, "providers": ["a", "b"]}}}}
+    )
+    assert config.concurrency == 8 and config.max_items == 100 and config.providers == ("a", "b")
+
+
+if __name__ == "__main__":
+    test_parse_items()
+    test_fan_out()
+    test_shared_system_prompt()
+    test_config()
+    print("All tests passed!")
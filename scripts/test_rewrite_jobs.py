@@ -0,0 +1,232 @@
+"""
+Rewrite job queue tests.
+
+Runs the queue with a fake rewrite function: priority order, websocket
+events, cancellation, requeue after an admission rejection (up to
+max_attempts), result expiry and resuming persisted jobs after a restart.
+
+    python scripts/test_rewrite_jobs.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+admission = importlib.import_module(f"{plugin_root.name}.backend.admission")
+circuit_breaker = importlib.import_module(f"{plugin_root.name}.backend.circuit_breaker")
+rewrite_jobs = importlib.import_module(f"{plugin_root.name}.backend.service.rewrite_jobs")
+
+
+class FakeRewriter:
+    """Records the prompts it runs; blocks while `gate` is clear."""
+
+    def __init__(self):
+        self.ran = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self, request):
+        await self.gate.wait()
+        self.ran.append(request["prompt"])
+        if request["prompt"] == "bad":
+            return {"error": "Invalid mode"}
+        return {"workflow": request["workflow"], "notes": request["prompt"], "mode": "patch"}
+
+
+async def _wait(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.01)
+
+
+def _queue(directory, runner, events=None, **config):
+    return rewrite_jobs.RewriteJobQueue(
+        config=rewrite_jobs.RewriteJobConfig(**config),
+        directory=Path(directory),
+        runner=runner,
+        notify=lambda event, data, client: events.append((data["job_id"], data["status"], client))
+        if events is not None else None,
+    )
+
+
+async def _priorities_and_events():
+    with tempfile.TemporaryDirectory() as tmp:
+        rewriter, events = FakeRewriter(), []
+        queue = _queue(tmp, rewriter, events, workers=1)
+        rewriter.gate.clear()
+
+        first = await queue.submit({"workflow": {}, "prompt": "first"})
+        await _wait(lambda: first.status == "running")
+        low = await queue.submit({"workflow": {}, "prompt": "low"}, priority="low")
+        normal = await queue.submit({"workflow": {}, "prompt": "normal"}, client_id="tab-1")
+        high = await queue.submit({"workflow": {}, "prompt": "high"}, priority="high")
+        assert [queue.position(j) for j in (high, normal, low)] == [0, 1, 2]
+
+        rewriter.gate.set()
+        await _wait(lambda: low.done)
+        assert rewriter.ran == ["first", "high", "normal", "low"]
+        assert high.result["notes"] == "high" and high.status == "done"
+
+        assert (normal.job_id, "queued", "tab-1") in events
+        assert (normal.job_id, "done", "tab-1") in events
+        assert [s for j, s, _ in events if j == first.job_id] == ["queued", "running", "done"]
+
+        bad = await queue.submit({"workflow": {}, "prompt": "bad"})
+        await _wait(lambda: bad.done)
+        assert bad.status == "failed" and bad.error == "Invalid mode"
+        await queue.stop()
+
+
+def test_priorities_and_events():
+    asyncio.run(_priorities_and_events())
+
+
+async def _cancel_and_limits():
+    with tempfile.TemporaryDirectory() as tmp:
+        rewriter = FakeRewriter()
+        queue = _queue(tmp, rewriter, workers=1, max_queued=1)
+        rewriter.gate.clear()
+
+        running = await queue.submit({"workflow": {}, "prompt": "running"})
+        await _wait(lambda: running.status == "running")
+        waiting = await queue.submit({"workflow": {}, "prompt": "waiting"})
+        try:
+            await queue.submit({"workflow": {}, "prompt": "overflow"})
+        except rewrite_jobs.JobQueueFull:
+            pass
+        else:
+            raise AssertionError("queue accepted more than max_queued")
+
+        await queue.cancel(waiting.job_id)
+        await queue.cancel(running.job_id)
+        assert running.status == waiting.status == "cancelled"
+
+        rewriter.gate.set()
+        after = await queue.submit({"workflow": {}, "prompt": "after"})
+        await _wait(lambda: after.done)
+        assert rewriter.ran == ["after"]
+
+        for bad in ({"prompt": "x"}, {"workflow": {}}):
+            try:
+                await queue.submit(bad)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"accepted {bad!r}")
+        await queue.stop()
+
+
+def test_cancel_and_limits():
+    asyncio.run(_cancel_and_limits())
+
+
+async def _requeue_when_provider_busy():
+    calls = []
+
+    async def busy_once(request):
+        calls.append(request["prompt"])
+        if len(calls) == 1:
+            raise admission.AdmissionRejected("ollama", 429, 0, "queue_full")
+        return {"workflow": {}, "notes": "ok", "mode": "full"}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = _queue(tmp, busy_once, workers=1)
+        job = await queue.submit({"workflow": {}, "prompt": "p"})
+        await _wait(lambda: job.done)
+        assert job.status == "done" and job.attempts == 2 and len(calls) == 2
+        await queue.stop()
+
+
+def test_requeue_when_provider_busy():
+    asyncio.run(_requeue_when_provider_busy())
+
+
+async def _gives_up_on_dead_provider():
+    calls = []
+
+    async def circuit_open(request):
+        calls.append(request["prompt"])
+        raise circuit_breaker.CircuitOpen("cloud", 0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = _queue(tmp, circuit_open, workers=1, max_attempts=3)
+        job = await queue.submit({"workflow": {}, "prompt": "p", "provider": "cloud"})
+        await _wait(lambda: job.done)
+        assert job.status == "failed" and job.attempts == 3 and len(calls) == 3
+        assert "circuit open" in job.error
+        await queue.stop()
+
+
+def test_gives_up_on_dead_provider():
+    asyncio.run(_gives_up_on_dead_provider())
+
+
+async def _persistence_and_expiry():
+    with tempfile.TemporaryDirectory() as tmp:
+        rewriter = FakeRewriter()
+        queue = _queue(tmp, rewriter, workers=1)
+        done = await queue.submit({"workflow": {"nodes": []}, "prompt": "done"})
+        await _wait(lambda: done.done)
+
+        rewriter.gate.clear()
+        interrupted = await queue.submit({"workflow": {}, "prompt": "interrupted"})
+        pending = await queue.submit({"workflow": {}, "prompt": "pending"})
+        await _wait(lambda: interrupted.status == "running")
+        await queue.stop()
+
+        saved = json.loads((Path(tmp) / f"{interrupted.job_id}.json").read_text(encoding="utf-8"))
+        assert saved["status"] == "queued"
+
+        # "Restart": a new queue over the same directory picks the jobs up again
+        restarted = FakeRewriter()
+        queue = _queue(tmp, restarted, workers=1)
+        await queue.start()
+        job = await queue.get(pending.job_id)
+        await _wait(lambda: job.done)
+        assert restarted.ran == ["interrupted", "pending"]
+        assert (await queue.get(done.job_id)).result["notes"] == "done"
+        await queue.stop()
+
+        # Finished jobs disappear after result_ttl_s
+        queue = _queue(tmp, restarted, workers=1, result_ttl_s=0)
+        await queue.start()
+        assert await queue.get(done.job_id) is None
+        assert not list(Path(tmp).glob("*.json"))
+        await queue.stop()
+
+
+def test_persistence_and_expiry():
+    asyncio.run(_persistence_and_expiry())
+
+
+def test_config_and_priority():
+    config = rewrite_jobs.RewriteJobConfig.from_settings({"workflow": {"rewrite": {"jobs": {"workers": "3"}}}})
+    assert config.workers == 3 and config.max_queued == 64 and config.max_attempts == 5
+    config = rewrite_jobs.RewriteJobConfig.from_settings({"workflow": {"rewrite": {"jobs": {"max_attempts": 0}}}})
+    assert config.max_attempts == 1
+    assert rewrite_jobs.parse_priority("HIGH") == 0 and rewrite_jobs.parse_priority(None) == 1
+    try:
+        rewrite_jobs.parse_priority("urgent")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("accepted unknown priority")
+
+
+if __name__ == "__main__":
+    test_priorities_and_events()
+    test_cancel_and_limits()
+    test_requeue_when_provider_busy()
+    test_gives_up_on_dead_provider()
+    test_persistence_and_expiry()
+    test_config_and_priority()
+    print("All tests passed!")
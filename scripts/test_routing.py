@@ -0,0 +1,206 @@
+"""
+Adaptive routing tests.
+
+Checks route parsing and constraint tiers, that the rolling statistics
+steer an adaptive route away from a slow or saturated provider, that pins
+and capability / context constraints are honoured, and that ChatClient
+calls feed the statistics.
+
+    python scripts/test_routing.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+provider_manager = importlib.import_module(f"{plugin_root.name}.backend.provider_manager")
+routing = importlib.import_module(f"{plugin_root.name}.backend.routing")
+provider_config = importlib.import_module(f"{plugin_root.name}.config.provider_config")
+schema = importlib.import_module(f"{plugin_root.name}.config.schema")
+
+
+def test_route_from_config():
+    assert routing.TaskRoute.from_config(["a", "b"]) == routing.TaskRoute(providers=("a", "b"))
+    assert routing.TaskRoute.from_config("a").strategy == routing.ORDERED
+
+    route = routing.TaskRoute.from_config({"requires": "vision", "min_context": "8192", "expected_tokens": "x"})
+    assert route.strategy == routing.ADAPTIVE and route.providers == ()
+    assert route.requires == ("vision",) and route.min_context == 8192
+    assert route.expected_tokens == 256  # junk ignored
+    assert routing.TaskRoute.from_config({"strategy": "bogus"}).strategy == routing.ADAPTIVE
+
+    assert routing.constraint_tier(["Vision", "tools"], 32768, ["vision"], 8192) == 0
+    assert routing.constraint_tier([], None, ["vision"]) == 1
+    assert routing.constraint_tier(["tools"], None, ["vision"]) == 2
+    assert routing.constraint_tier(["vision"], 4096, ["vision"], 8192) == 2
+
+
+def test_scores():
+    stats = routing.RoutingStats()
+    for _ in range(5):
+        stats.start("fast", "m")
+        stats.finish("fast", "m", True, ttft=0.2, tokens=100, seconds=1.0)
+        stats.start("slow", "m")
+        stats.finish("slow", "m", True, ttft=3.0, tokens=100, seconds=10.0)
+    assert stats.score("fast", "m") < stats.score("slow", "m")
+
+    idle = stats.score("fast", "m")
+    for _ in range(4):
+        stats.start("fast", "other")
+    assert stats.provider_in_flight("fast") == 4
+    assert stats.score("fast", "m", capacity=4) == idle * 2  # one full capacity of load
+
+    stats.finish("fast", "other", None)  # cancelled: no outcome recorded
+    assert stats.model("fast", "other").calls == 0
+    stats.finish("fast", "other", False)
+    assert stats.model("fast", "other").error_rate() > 0
+    assert stats.snapshot()["slow"]["m"]["ttft_s"] > 2
+
+
+def _manager(routing_cfg):
+    mgr = object.__new__(provider_manager.ProviderManager)
+    mgr.config = schema.ComfyAIConfig()
+    mgr.providers, mgr.pools, mgr.default_provider, mgr._draining = {}, {}, None, set()
+    models = {
+        "gpu": [provider_config.ModelConfig("llama3.2", context=8192, capabilities=["tools"])],
+        "cloud": [
+            provider_config.ModelConfig("gpt-mini", context=128000, capabilities=["tools"]),
+            provider_config.ModelConfig("gpt-vision", context=128000, capabilities=["tools", "vision"]),
+        ],
+    }
+    providers = {
+        name: provider_config.ProviderConfig(name=name, type="local", base_url=f"http://{name}",
+                                             models=models[name], default_model=models[name][0].name)
+        for name in ("gpu", "cloud")
+    }
+    mgr._apply_config(schema.ComfyAIConfig(providers=providers, routing=routing_cfg))
+    return mgr
+
+
+def _feed(provider, model, ttft, tps, calls=5):
+    stats = routing.get_routing_stats()
+    for _ in range(calls):
+        stats.start(provider, model)
+        stats.finish(provider, model, True, ttft=ttft, tokens=int(tps * 2), seconds=2.0)
+
+
+def test_adaptive_pick():
+    routing.get_routing_stats().reset()
+    mgr = _manager({"chat": {"strategy": "adaptive"}, "rewrite": ["cloud", "gpu"]})
+    assert mgr.failover_chain("chat") == ["gpu", "cloud"]
+
+    _feed("gpu", "llama3.2", ttft=0.2, tps=80)
+    _feed("cloud", "gpt-mini", ttft=0.8, tps=40)
+    assert mgr.pick_provider("chat").provider_name == "gpu"
+
+    # A saturated GPU box loses to the slower but idle cloud
+    stats = routing.get_routing_stats()
+    for _ in range(20):
+        stats.start("gpu", "llama3.2")
+    assert mgr.pick_provider("chat").provider_name == "cloud"
+
+    # Ordered routes ignore the statistics; pins beat everything
+    assert mgr.pick_provider("rewrite").provider_name == "cloud"
+    assert mgr.pick_provider("chat", pin="gpu").provider_name == "gpu"
+    assert mgr.pick_provider("chat", pin="missing").provider_name == "cloud"
+
+    # Open circuits are skipped
+    for _ in range(5):
+        mgr.providers["cloud"].breaker.record(False)
+    assert mgr.pick_provider("chat").provider_name == "gpu"
+    routing.get_routing_stats().reset()
+
+
+def test_constraints():
+    routing.get_routing_stats().reset()
+    mgr = _manager({"chat": {"providers": ["gpu", "cloud"], "pin": None}})
+
+    client = mgr.pick_provider("chat", requires=["vision"])
+    assert (client.provider_name, client.model) == ("cloud", "gpt-vision")
+    assert mgr.providers["cloud"].model == "gpt-mini"  # registry client untouched
+
+    client = mgr.pick_provider("chat", min_context=32000)
+    assert (client.provider_name, client.model) == ("cloud", "gpt-mini")
+
+    # Nothing fits: fall back to the unconstrained chain
+    assert mgr.pick_provider("chat", requires=["audio"]).provider_name in ("gpu", "cloud")
+
+    mgr = _manager({"chat": {"pin": "cloud"}})
+    assert mgr.pick_provider("chat").provider_name == "cloud"
+
+
+class FakeOllama:
+    def __init__(self, status=200):
+        self.status = status
+
+    async def chat(self, request):
+        body = await request.json()
+        if self.status != 200:
+            return web.Response(status=self.status, text="nope")
+        if not body.get("stream"):
+            return web.json_response({"message": {"content": "hello there"}, "done": True})
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for word in ("hello", " there", " friend"):
+            await resp.write(json.dumps({"message": {"content": word}}).encode() + b"\n")
+            await asyncio.sleep(0.02)
+        await resp.write(json.dumps({"done": True}).encode() + b"\n")
+        return resp
+
+
+async def _calls(fake, stream):
+    app = web.Application()
+    app.router.add_post("/api/chat", fake.chat)
+    server = TestServer(app)
+    await server.start_server()
+    client = agent_factory.ChatClient(
+        provider_name="ollama",
+        base_url=str(server.make_url("")).rstrip("/"),
+        api_key=None,
+        model="llama3.2",
+        provider_type="local",
+        resilience=agent_factory.ResiliencePolicy.from_options({"retry": {"attempts": 1}}),
+    )
+    messages = [{"role": "user", "content": "hi"}]
+    try:
+        if stream:
+            return "".join([chunk async for chunk in client.stream_chat(messages)])
+        return await client.chat(messages)
+    finally:
+        await client.pool.close()
+        await server.close()
+
+
+def test_client_feeds_stats():
+    stats = routing.get_routing_stats()
+    stats.reset()
+    assert asyncio.run(_calls(FakeOllama(), stream=True)) == "hello there friend"
+    model = stats.model("ollama", "llama3.2")
+    assert model.calls == 1 and model.in_flight == 0
+    assert model.ttft is not None and model.tps is not None
+
+    asyncio.run(_calls(FakeOllama(), stream=False))
+    assert model.calls == 2 and model.ttft is not None
+
+    asyncio.run(_calls(FakeOllama(status=503), stream=False))
+    assert model.errors == 1 and model.error_rate() > 0 and model.in_flight == 0
+    stats.reset()
+
+
+if __name__ == "__main__":
+    test_route_from_config()
+    test_scores()
+    test_adaptive_pick()
+    test_constraints()
+    test_client_feeds_stats()
+    print("All tests passed!")
@@ -0,0 +1,145 @@
+"""
+Settings cache tests.
+
+Checks that merged settings and resolved system prompts are served from
+memory while defaults.json / settings.json are unchanged, re-read when
+either file's mtime / inode / size changes, and kept current by
+save_settings() without a re-read.
+
+    python scripts/test_settings_cache.py
+"""
+
+import contextlib
+import importlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+metrics = importlib.import_module(f"{plugin_root.name}.backend.utils.metrics")
+paths = importlib.import_module(f"{plugin_root.name}.backend.utils.paths")
+settings = importlib.import_module(f"{plugin_root.name}.backend.utils.settings")
+
+DEFAULTS = {
+    "version": 1,
+    "system_prompt": "Be brief.",
+    "defaults": {"temperature": 0.2, "system_prompt_chat": "Chat mode."},
+}
+
+
+def _write(path, data):
+    # Replace the file like an editor would (new inode)
+    tmp = path.with_suffix(".new")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+@contextlib.contextmanager
+def config_dir(revalidate=0.0):
+    """Point settings.py at a temp defaults.json / settings.json."""
+    saved = {
+        (settings, "DEFAULTS_PATH"): settings.DEFAULTS_PATH,
+        (settings, "SETTINGS_PATH"): settings.SETTINGS_PATH,
+        (settings, "SETTINGS_REVALIDATE_INTERVAL"): settings.SETTINGS_REVALIDATE_INTERVAL,
+        (paths, "USER_CONFIG_DIR"): paths.USER_CONFIG_DIR,
+        (paths, "CACHE_DIR"): paths.CACHE_DIR,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        settings.DEFAULTS_PATH = root / "defaults.json"
+        settings.SETTINGS_PATH = root / "user" / "settings.json"
+        settings.SETTINGS_REVALIDATE_INTERVAL = revalidate
+        paths.USER_CONFIG_DIR = root / "user"
+        paths.CACHE_DIR = root / "user" / "cache"
+        _write(settings.DEFAULTS_PATH, DEFAULTS)
+        settings.invalidate_settings_cache()
+        metrics.reset()
+        try:
+            yield root
+        finally:
+            for (module, name), value in saved.items():
+                setattr(module, name, value)
+            settings.invalidate_settings_cache()
+
+
+def test_served_from_memory():
+    with config_dir():
+        first = settings.load_settings()
+        assert settings.SETTINGS_PATH.exists()  # created from the defaults
+        first["defaults"]["temperature"] = 9  # callers get their own copy
+
+        second = settings.load_settings()
+        assert second["defaults"]["temperature"] == 0.2
+        stats = settings.settings_cache_stats()
+        assert stats["misses"] == 1 and stats["hits"] == 1 and stats["invalidations"] == 0
+
+
+def test_file_change_invalidates():
+    with config_dir():
+        current = settings.load_settings()
+        current["defaults"]["temperature"] = 0.9
+        _write(settings.SETTINGS_PATH, current)
+
+        assert settings.load_settings()["defaults"]["temperature"] == 0.9
+        assert settings.settings_cache_stats()["invalidations"] == 1
+
+        # A defaults.json edit is picked up too
+        _write(settings.DEFAULTS_PATH, {**DEFAULTS, "max_history": 12})
+        assert settings.load_settings()["max_history"] == 12
+        assert settings.settings_cache_stats()["invalidations"] == 2
+
+
+def test_revalidation_window_skips_disk():
+    with config_dir(revalidate=60.0):
+        settings.load_settings()
+        _write(settings.SETTINGS_PATH, {"defaults": {"temperature": 0.5}})
+        assert settings.load_settings()["defaults"]["temperature"] == 0.2
+        settings.invalidate_settings_cache()
+        assert settings.load_settings()["defaults"]["temperature"] == 0.5
+
+
+def test_save_writes_through():
+    with config_dir():
+        current = settings.load_settings()
+        current["defaults"]["temperature"] = 0.7
+        settings.save_settings(current)
+        misses = settings.settings_cache_stats()["misses"]
+
+        assert settings.load_settings()["defaults"]["temperature"] == 0.7
+        assert settings.settings_cache_stats()["misses"] == misses
+        assert json.loads(settings.SETTINGS_PATH.read_text())["defaults"]["temperature"] == 0.7
+
+
+def _expected_prompt(mode):
+    user = json.loads(settings.SETTINGS_PATH.read_text())
+    return settings.resolve_system_prompt(mode, json.loads(settings.DEFAULTS_PATH.read_text()), user)
+
+
+def test_system_prompt_cache():
+    with config_dir():
+        prompt = settings.get_resolved_system_prompt("chat")
+        assert "Chat mode." in prompt and prompt == _expected_prompt("chat")
+        assert settings.get_resolved_system_prompt("chat") is prompt
+        stats = settings.settings_cache_stats()
+        assert stats["prompt_misses"] == 1 and stats["prompt_hits"] == 1
+
+        user = json.loads(settings.SETTINGS_PATH.read_text())
+        user["defaults"]["system_prompt_chat"] = "Answer in French."
+        _write(settings.SETTINGS_PATH, user)
+        prompt = settings.get_resolved_system_prompt("chat")
+        assert prompt.endswith("Answer in French.") and prompt == _expected_prompt("chat")
+        assert settings.settings_cache_stats()["prompt_misses"] == 2
+
+
+if __name__ == "__main__":
+    test_served_from_memory()
+    test_file_change_invalidates()
+    test_revalidation_window_skips_disk()
+    test_save_writes_through()
+    test_system_prompt_cache()
+    print("All tests passed!")
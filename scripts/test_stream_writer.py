@@ -0,0 +1,151 @@
+"""
+Chat stream transport tests.
+
+Relays fake token streams through ChatStreamWriter and checks the SSE /
+NDJSON / plain-text framing, delta coalescing (first token immediately,
+then by time and byte window), heartbeats while the model is silent, and
+error / done frames.
+
+    python scripts/test_stream_writer.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from pathlib import Path
+
+from aiohttp.test_utils import make_mocked_request
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+sse = importlib.import_module(f"{plugin_root.name}.backend.utils.sse")
+stream_writer = importlib.import_module(f"{plugin_root.name}.backend.utils.stream_writer")
+
+StreamConfig = stream_writer.StreamConfig
+
+
+class FakeResponse:
+    """Collects what the writer sends, one entry per write() call."""
+
+    def __init__(self):
+        self.writes = []
+
+    async def write(self, data):
+        self.writes.append(data)
+
+    @property
+    def body(self):
+        return b"".join(self.writes)
+
+
+async def _source(chunks, gap=0.0, fail=None):
+    for chunk in chunks:
+        if gap:
+            await asyncio.sleep(gap)
+        yield chunk
+    if fail is not None:
+        raise fail
+
+
+def _relay(fmt, source, config=StreamConfig()):
+    resp = FakeResponse()
+    writer = stream_writer.ChatStreamWriter(resp, fmt, config)
+    reason = asyncio.run(stream_writer.relay_stream(source, writer))
+    return reason, resp
+
+
+def _sse_events(body):
+    decoder = sse.SSEDecoder()
+    return [(e.event, json.loads(e.data)) for e in decoder.feed(body) + decoder.close()]
+
+
+def test_negotiation():
+    negotiate = stream_writer.negotiate_stream_format
+    plain = make_mocked_request("POST", "/api/comfyai/chat/stream")
+    sse_accept = make_mocked_request("POST", "/", headers={"Accept": "text/event-stream"})
+    nd_accept = make_mocked_request("POST", "/", headers={"Accept": "application/x-ndjson"})
+    assert negotiate(plain, {}) == "text"
+    assert negotiate(sse_accept, {}) == "sse" and negotiate(nd_accept, {}) == "ndjson"
+    assert negotiate(sse_accept, {"transport": "NDJSON"}) == "ndjson"
+    assert negotiate(plain, {"transport": "carrier-pigeon"}) == "text"
+    assert stream_writer.ChatStreamWriter.headers_for("sse")["X-Accel-Buffering"] == "no"
+
+
+def test_config_from_settings():
+    cfg = StreamConfig.from_settings({"stream": {"coalesce_ms": -5, "coalesce_bytes": 0, "heartbeat_s": 0.1}})
+    assert (cfg.coalesce_ms, cfg.coalesce_bytes, cfg.heartbeat_s) == (0.0, 1, 1.0)
+    assert StreamConfig.from_settings({"stream": {"heartbeat_s": "soon"}}) == StreamConfig()
+
+
+def test_sse_framing_and_coalescing():
+    reason, resp = _relay("sse", _source(["Hel", "lo", " wor", "ld"]))
+    events = _sse_events(resp.body)
+    assert reason == "stop"
+    # The first token goes out alone; the rest share one frame
+    assert events[0] == ("delta", {"text": "Hel"}) and events[1] == ("delta", {"text": "lo world"})
+    assert [kind for kind, _ in events[2:]] == ["usage", "done"]
+    usage = events[2][1]
+    assert usage["chunks"] == 4 and usage["chars"] == 11 and usage["ttft_ms"] is not None
+    assert events[3][1] == {"reason": "stop"}
+
+
+def test_coalesce_window_and_byte_limit():
+    # Chunks further apart than the window get their own frames
+    _, resp = _relay("ndjson", _source(["a", "b", "c"], gap=0.05), StreamConfig(coalesce_ms=10))
+    deltas = [f["text"] for f in map(json.loads, resp.body.splitlines()) if f["type"] == "delta"]
+    assert deltas == ["a", "b", "c"]
+
+    # A full buffer flushes without waiting for the window
+    config = StreamConfig(coalesce_ms=10_000, coalesce_bytes=4)
+    _, resp = _relay("ndjson", _source(["x", "ab", "cd", "e"]), config)
+    deltas = [f["text"] for f in map(json.loads, resp.body.splitlines()) if f["type"] == "delta"]
+    assert deltas == ["x", "abcd", "e"]
+
+
+def test_ndjson_framing():
+    reason, resp = _relay("ndjson", _source(["Grüße"]))
+    frames = [json.loads(line) for line in resp.body.decode("utf-8").splitlines()]
+    assert reason == "stop" and resp.body.endswith(b"\n")
+    assert frames[0] == {"type": "delta", "text": "Grüße"}
+    assert [f["type"] for f in frames] == ["delta", "usage", "done"]
+
+
+def test_heartbeats_while_silent():
+    config = StreamConfig(heartbeat_s=0.05)
+    _, resp = _relay("sse", _source(["late"], gap=0.3), config)
+    assert resp.body.count(b": heartbeat\n\n") >= 3
+    assert _sse_events(resp.body)[0] == ("delta", {"text": "late"})  # comments are not events
+
+    _, resp = _relay("ndjson", _source(["late"], gap=0.2), config)
+    assert any(json.loads(line)["type"] == "heartbeat" for line in resp.body.splitlines())
+
+    _, resp = _relay("text", _source(["late"], gap=0.2), config)
+    assert resp.body == b"late"  # plain text has no heartbeat channel
+
+
+def test_errors_and_plain_text():
+    reason, resp = _relay("sse", _source(["partial"], fail=RuntimeError("upstream died")))
+    events = _sse_events(resp.body)
+    assert reason == "error"
+    assert events == [
+        ("delta", {"text": "partial"}),
+        ("error", {"message": "upstream died"}),
+        ("done", {"reason": "error"}),
+    ]
+
+    reason, resp = _relay("text", _source(["one ", "two ", "three"]))
+    assert reason == "stop" and resp.body == b"one two three"
+
+
+if __name__ == "__main__":
+    test_negotiation()
+    test_config_from_settings()
+    test_sse_framing_and_coalescing()
+    test_coalesce_window_and_byte_limit()
+    test_ndjson_framing()
+    test_heartbeats_while_silent()
+    test_errors_and_plain_text()
+    print("All tests passed!")
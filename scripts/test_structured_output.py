@@ -0,0 +1,135 @@
+"""
+Structured output tests.
+
+Checks JSON repair of typical model slips, the streaming extractor, the
+per-provider response-format payloads (against a fake Ollama server that
+rejects schemas, like pre-0.5 versions) and the parse-failure metrics.
+
+    python scripts/test_structured_output.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from pathlib import Path
+
+from aiohttp import web
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+structured_output = importlib.import_module(f"{plugin_root.name}.backend.structured_output")
+metrics = importlib.import_module(f"{plugin_root.name}.backend.utils.metrics")
+
+
+def test_repairs_common_slips():
+    expected = {"ops": [{"op": "set_widget", "id": 3, "index": 2, "value": 30}]}
+    body = '{"ops": [{"op": "set_widget", "id": 3, "index": 2, "value": 30}]}'
+    slips = [
+        f"```json\n{body}\n```",
+        f"Sure! Here are the changes [as requested]:\n{body}\nLet me know if you need more.",
+        '{"ops": [{"op": "set_widget", "id": 3, "index": 2, "value": 30,},],}',
+        "{'ops': [{'op': 'set_widget', 'id': 3, 'index': 2, 'value': 30}]}",
+        '{ops: [{op: "set_widget", id: 3, index: 2, value: 30}]}  // done',
+        '{"ops": [{"op": "set_widget", "id": 3, "index": 2, "value": 30',  # truncated
+    ]
+    for text in slips:
+        assert structured_output.repair_json(text) == expected, text
+
+    assert structured_output.repair_json('{"a": True, "b": None, "c": "it\'s"}') == {"a": True, "b": None, "c": "it's"}
+
+    try:
+        structured_output.repair_json("I could not do that.")
+    except structured_output.StructuredOutputError:
+        pass
+    else:
+        raise AssertionError("accepted prose")
+
+
+def test_stream_extractor_stops_at_closing_bracket():
+    extractor = structured_output.JSONStreamExtractor()
+    chunks = ['Here: {"a": "x}', 'y", "b": [1, ', "2]}", " and some trailing prose"]
+    results = [extractor.feed(c) for c in chunks]
+    assert results[:2] == [None, None]
+    assert results[2] == '{"a": "x}y", "b": [1, 2]}'
+    assert extractor.done and extractor.result() == results[2]
+
+
+def test_failure_rate_metric():
+    metrics.reset()
+    structured_output.parse_json('{"a": 1}', "unit")
+    structured_output.parse_json('```json\n{"a": 1}\n```', "unit")
+    try:
+        structured_output.parse_json("nope", "unit")
+    except structured_output.StructuredOutputError:
+        pass
+    snap = json.dumps(metrics.snapshot())
+    assert metrics.get_counter("structured.unit.ok") == 1
+    assert metrics.get_counter("structured.unit.repaired") == 1
+    assert metrics.get_counter("structured.unit.failed") == 1
+    assert "structured.unit.failure_rate" in snap
+
+
+def test_provider_payloads():
+    schema = {"type": "object", "properties": {"n": {"type": "integer"}}, "required": ["n"],
+              "additionalProperties": False}
+    rf = structured_output.ResponseFormat("thing", schema)
+    assert rf.ollama() == schema
+    assert rf.openai()["type"] == "json_schema"
+    assert rf.gemini()["responseSchema"] == {"type": "object", "properties": {"n": {"type": "integer"}}, "required": ["n"]}
+    assert structured_output.ResponseFormat().openai() == {"type": "json_object"}
+    # Untyped fields cannot be expressed for Gemini: JSON mode only
+    loose = structured_output.ResponseFormat("x", {"type": "object", "properties": {"v": {}}})
+    assert "responseSchema" not in loose.gemini()
+
+
+async def _ollama_fallback():
+    formats = []
+
+    async def chat(request: web.Request) -> web.Response:
+        body = await request.json()
+        formats.append(body.get("format"))
+        if isinstance(body.get("format"), dict):
+            return web.Response(status=400, text='{"error": "invalid format"}')
+        return web.json_response({"message": {"content": '{"n": 4}'}, "done": True})
+
+    app = web.Application()
+    app.router.add_post("/api/chat", chat)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    client = agent_factory.ChatClient(
+        provider_name="ollama",
+        base_url=f"http://127.0.0.1:{port}",
+        api_key=None,
+        model="qwen2.5",
+        provider_type="local",
+    )
+    rf = structured_output.ResponseFormat("thing", {"type": "object"})
+    try:
+        raw = await structured_output.structured_chat(client, [{"role": "user", "content": "n?"}], rf)
+    finally:
+        await client.pool.close()
+        await runner.cleanup()
+
+    assert json.loads(raw) == {"n": 4}
+    assert formats == [{"type": "object"}, "json"]
+
+
+def test_ollama_schema_falls_back_to_json_mode():
+    asyncio.run(_ollama_fallback())
+
+
+if __name__ == "__main__":
+    test_repairs_common_slips()
+    test_stream_extractor_stops_at_closing_bracket()
+    test_failure_rate_metric()
+    test_provider_payloads()
+    test_ollama_schema_falls_back_to_json_mode()
+    print("All tests passed!")
@@ -0,0 +1,115 @@
+"""
+Compact workflow codec tests.
+
+Round-trips the workflows in scripts/fixtures/workflows through the codec,
+checks that model edits merge back onto the original layout, and prints the
+prompt token savings per workflow.
+
+    python scripts/test_workflow_codec.py
+"""
+
+import copy
+import importlib
+import json
+import sys
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+workflow_codec = importlib.import_module(f"{plugin_root.name}.backend.service.workflow_codec")
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "workflows"
+
+
+def _fixtures():
+    return {p.stem: json.loads(p.read_text(encoding="utf-8")) for p in sorted(FIXTURES.glob("*.json"))}
+
+
+def _through_model(encoded):
+    """What a model that changes nothing would send back."""
+    return json.loads(encoded.dumps())
+
+
+def test_lossless_round_trip():
+    for name, graph in _fixtures().items():
+        original = copy.deepcopy(graph)
+        encoded = workflow_codec.encode_workflow(graph)
+        assert workflow_codec.decode_workflow(_through_model(encoded), encoded) == original, name
+        assert graph == original, f"{name}: encode mutated its input"
+
+
+def test_compact_form_drops_layout():
+    graph = _fixtures()["sdxl_lora_hires"]
+    text = workflow_codec.encode_workflow(graph).dumps()
+    for field in ('"pos"', '"size"', '"bgcolor"', '"groups"', '"order"', '"properties"', '"links"'):
+        assert field not in text, field
+
+    nodes = workflow_codec.encode_workflow(graph).compact["nodes"]
+    assert [n["id"] for n in nodes] == list(range(1, len(nodes) + 1))
+    by_title = {n.get("title"): n for n in nodes}
+    assert by_title["Preview (base)"]["mode"] == 2
+    assert by_title["Base Sampler"]["in"]["seed"] == [6, 0]
+
+
+def test_edits_merge_back():
+    graph = _fixtures()["default_txt2img"]
+    encoded = workflow_codec.encode_workflow(graph)
+    compact = _through_model(encoded)
+    nodes = {n["type"]: n for n in compact["nodes"]}
+
+    # Change steps, drop SaveImage, insert an upscale between decode and a new save
+    nodes["KSampler"]["widgets"][2] = 30
+    compact["nodes"] = [n for n in compact["nodes"] if n["type"] != "SaveImage"]
+    decode_id = nodes["VAEDecode"]["id"]
+    compact["nodes"].append({"id": 100, "type": "ImageScaleBy", "widgets": ["lanczos", 2.0],
+                             "in": {"image": [decode_id, 0]}, "out": ["IMAGE"]})
+    compact["nodes"].append({"id": 101, "type": "SaveImage", "widgets": ["upscaled"],
+                             "in": {"images": [100, 0]}})
+
+    result = workflow_codec.decode_workflow(compact, encoded)
+    by_id = {n["id"]: n for n in result["nodes"]}
+
+    sampler = by_id[3]
+    assert sampler["widgets_values"][2] == 30
+    assert sampler["pos"] == [863, 186]  # layout restored
+    assert 9 not in by_id and all(l[0] != 9 for l in result["links"])
+
+    scale, save = by_id[10], by_id[11]
+    assert scale["type"] == "ImageScaleBy" and save["type"] == "SaveImage"
+    assert scale["pos"][0] > by_id[8]["pos"][0]
+    assert result["last_node_id"] == 11 and result["last_link_id"] == 11
+
+    links = {l[0]: l for l in result["links"]}
+    assert links[10] == [10, 8, 0, 10, 0, "IMAGE"]
+    assert links[11] == [11, 10, 0, 11, 0, "IMAGE"]
+    assert by_id[8]["outputs"][0]["links"] == [10]
+    assert by_id[4]["outputs"][1]["links"] == [3, 5]  # untouched links keep their ids
+
+
+def test_api_format_round_trip():
+    graph = _fixtures()["api_txt2img"]
+    encoded = workflow_codec.encode_workflow(graph)
+    assert "_meta" not in encoded.dumps()
+    assert workflow_codec.decode_workflow(_through_model(encoded), encoded) == graph
+
+
+def test_token_savings():
+    for name, graph in _fixtures().items():
+        report = workflow_codec.token_report(graph)
+        print(
+            f"{name:20s} {report['format']:3s} nodes={report['nodes']:3d} "
+            f"tokens {report['original_tokens']:6d} -> {report['compact_tokens']:6d} "
+            f"(-{report['saved_pct']}%)"
+        )
+        assert report["compact_tokens"] < report["original_tokens"], name
+
+
+if __name__ == "__main__":
+    test_lossless_round_trip()
+    test_compact_form_drops_layout()
+    test_edits_merge_back()
+    test_api_format_round_trip()
+    test_token_savings()
+    print("All tests passed!")
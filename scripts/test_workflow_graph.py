@@ -0,0 +1,170 @@
+"""
+Workflow graph index / subgraph selection tests.
+
+Checks adjacency and closures, that only the relevant neighbourhood of a
+large workflow is selected, and that edits to it splice back into the full
+graph without touching anything else (stubs included, flagged or not).
+
+    python scripts/test_workflow_graph.py
+"""
+
+import copy
+import importlib
+import json
+import sys
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+workflow_codec = importlib.import_module(f"{plugin_root.name}.backend.service.workflow_codec")
+workflow_graph = importlib.import_module(f"{plugin_root.name}.backend.service.workflow_graph")
+workflow_ops = importlib.import_module(f"{plugin_root.name}.backend.service.workflow_ops")
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "workflows"
+
+
+def _fixture(name):
+    return json.loads((FIXTURES / f"{name}.json").read_text(encoding="utf-8"))
+
+
+def _tiled(graph, copies):
+    """`copies` disconnected copies of a UI workflow, as one large workflow."""
+    nodes, links = [], []
+    step_n, step_l = graph["last_node_id"], graph["last_link_id"]
+    for c in range(copies):
+        for node in copy.deepcopy(graph["nodes"]):
+            node["id"] += c * step_n
+            for inp in node.get("inputs") or []:
+                if inp.get("link") is not None:
+                    inp["link"] += c * step_l
+            for out in node.get("outputs") or []:
+                if out.get("links"):
+                    out["links"] = [i + c * step_l for i in out["links"]]
+            if c and node.get("title"):
+                node["title"] += f" {c}"
+            nodes.append(node)
+        for l in graph["links"]:
+            links.append([l[0] + c * step_l, l[1] + c * step_n, l[2], l[3] + c * step_n, l[4], l[5]])
+    return {**graph, "nodes": nodes, "links": links,
+            "last_node_id": step_n * copies, "last_link_id": step_l * copies}
+
+
+def test_index_and_closures():
+    encoded = workflow_codec.encode_workflow(_fixture("default_txt2img"))
+    index = workflow_graph.GraphIndex(encoded.compact)
+    ids = {n["type"]: n["id"] for n in encoded.compact["nodes"]}
+
+    assert len(index.of_type("cliptextencode")) == 2
+    assert index.upstream_closure([ids["KSampler"]]) == {
+        ids["KSampler"], ids["CheckpointLoaderSimple"], ids["EmptyLatentImage"], *index.of_type("CLIPTextEncode")
+    }
+    assert index.downstream_closure([ids["KSampler"]]) == {ids["KSampler"], ids["VAEDecode"], ids["SaveImage"]}
+    assert index.downstream_closure([ids["CheckpointLoaderSimple"]], depth=1) == {
+        ids["CheckpointLoaderSimple"], ids["KSampler"], ids["VAEDecode"], *index.of_type("CLIPTextEncode")
+    }
+
+
+def test_selects_relevant_neighbourhood():
+    encoded = workflow_codec.encode_workflow(_tiled(_fixture("sdxl_lora_hires"), 8))
+    index = workflow_graph.GraphIndex(encoded.compact)
+    assert len(index.nodes) == 128
+
+    sub = workflow_graph.select_subgraph(index, "raise the steps on Hires Fix Sampler 5 to 25", max_nodes=12)
+    target = next(n["id"] for n in encoded.compact["nodes"] if n.get("title") == "Hires Fix Sampler 5")
+
+    assert sub.seeds[0] == target
+    assert len(sub.selected) <= 12 and target in sub.selected
+    assert index.neighbors(target) <= set(sub.selected) | set(sub.stubs)
+    assert all(n.get("stub") for n in sub.compact["nodes"] if n["id"] in sub.stubs)
+    assert len(workflow_codec.dumps_compact(sub.compact)) * 4 < len(encoded.dumps())
+
+    assert workflow_graph.select_subgraph(index, "zzz qqq", max_nodes=12) is None
+
+
+def test_splice_back_into_full_graph():
+    graph = _tiled(_fixture("default_txt2img"), 6)
+    encoded = workflow_codec.encode_workflow(graph)
+    index = workflow_graph.GraphIndex(encoded.compact)
+    sub = workflow_graph.select_subgraph(index, "change the checkpoint", max_nodes=4)
+
+    # An unchanged answer splices back to the original workflow
+    unchanged = json.loads(workflow_codec.dumps_compact(sub.compact))
+    spliced = workflow_graph.splice_subgraph(encoded.compact, sub, unchanged)
+    assert workflow_codec.decode_workflow(spliced, encoded) == graph
+
+    # Edits land on the selected nodes only; ids of nodes the model never saw become new nodes
+    edited = json.loads(workflow_codec.dumps_compact(sub.compact))
+    loader = next(n for n in edited["nodes"] if n["type"] == "CheckpointLoaderSimple")
+    loader["widgets"] = ["sd_xl_base_1.0.safetensors"]
+    hidden_id = next(i for i in index.nodes if i not in sub.selected and i not in sub.stubs)
+    edited["nodes"].append({"id": hidden_id, "type": "Note", "widgets": ["added"]})
+
+    result = workflow_codec.decode_workflow(
+        workflow_graph.splice_subgraph(encoded.compact, sub, edited), encoded
+    )
+    loaders = [n for n in result["nodes"] if n["type"] == "CheckpointLoaderSimple"]
+    assert sum(n["widgets_values"] == ["sd_xl_base_1.0.safetensors"] for n in loaders) == 1
+    assert len(result["nodes"]) == len(graph["nodes"]) + 1
+    assert result["links"] == graph["links"]
+
+
+def test_stub_echoed_without_flag():
+    graph = _tiled(_fixture("default_txt2img"), 6)
+    encoded = workflow_codec.encode_workflow(graph)
+    index = workflow_graph.GraphIndex(encoded.compact)
+    sub = workflow_graph.select_subgraph(index, "more sampler steps", max_nodes=4)
+    assert sub.stubs
+
+    # Constrained output dropped the "stub" flag: stubs are still not new nodes
+    echoed = json.loads(workflow_codec.dumps_compact(sub.compact))
+    for node in echoed["nodes"]:
+        node.pop("stub", None)
+    spliced = workflow_graph.splice_subgraph(encoded.compact, sub, echoed)
+    assert spliced["nodes"] == encoded.compact["nodes"]
+    assert workflow_codec.decode_workflow(spliced, encoded) == graph
+    assert "stub" in workflow_codec.COMPACT_SCHEMA["properties"]["nodes"]["items"]["properties"]
+
+
+def test_ops_scope():
+    encoded = workflow_codec.encode_workflow(_tiled(_fixture("default_txt2img"), 6))
+    index = workflow_graph.GraphIndex(encoded.compact)
+    sub = workflow_graph.select_subgraph(index, "more sampler steps", max_nodes=8)
+    selected, stub = sub.selected[0], sub.stubs[0]
+    outside = next(i for i in index.nodes if i not in sub.selected and i not in sub.stubs)
+
+    workflow_graph.check_ops_scope([{"op": "set_widget", "id": selected, "index": 2, "value": 30}], sub)
+    # String ids are the same nodes, as in apply_ops
+    workflow_graph.check_ops_scope([
+        {"op": "add_node", "id": "900", "type": "VAEDecode", "in": {"samples": [str(selected), 0]}},
+        {"op": "connect", "from": [str(stub), 0], "to": ["900", "vae"]},
+    ], sub)
+    for ops in (
+        [{"op": "set_widget", "id": stub, "index": 0, "value": 1}],
+        [{"op": "set_widget", "id": str(stub), "index": 0, "value": 1}],
+        [{"op": "remove_node", "id": str(outside)}],
+        [{"op": "remove_node", "id": outside}],
+        [{"op": "connect", "from": [outside, 0], "to": [selected, "model"]}],
+    ):
+        try:
+            workflow_graph.check_ops_scope(ops, sub)
+        except workflow_ops.WorkflowOpError:
+            pass
+        else:
+            raise AssertionError(f"accepted {ops!r}")
+
+
+def test_config():
+    config = workflow_graph.SubgraphConfig.from_settings({"workflow": {"rewrite": {"subgraph": {"min_nodes": None}}}})
+    assert config.min_nodes is None and config.max_nodes == 30
+
+
+if __name__ == "__main__":
+    test_index_and_closures()
+    test_selects_relevant_neighbourhood()
+    test_splice_back_into_full_graph()
+    test_stub_echoed_without_flag()
+    test_ops_scope()
+    test_config()
+    print("All tests passed!")
@@ -0,0 +1,183 @@
+"""
+Workflow graph-ops tests.
+
+Applies edit operations to the fixture workflows and checks validation,
+atomicity and the merge back onto the original layout, and that a rewrite
+whose output cannot be used (or is a provider error) reports why.
+
+    python scripts/test_workflow_ops.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+from pathlib import Path
+
+# Import the plugin as a package (backend modules use package-relative imports)
+plugin_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(plugin_root.parent))
+
+workflow_codec = importlib.import_module(f"{plugin_root.name}.backend.service.workflow_codec")
+workflow_ops = importlib.import_module(f"{plugin_root.name}.backend.service.workflow_ops")
+agent_factory = importlib.import_module(f"{plugin_root.name}.backend.agent_factory")
+rewrite_tools = importlib.import_module(f"{plugin_root.name}.backend.service.workflow_rewrite_tools")
+response_cache = importlib.import_module(f"{plugin_root.name}.backend.response_cache")
+metrics = importlib.import_module(f"{plugin_root.name}.backend.utils.metrics")
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "workflows"
+
+
+def _encoded(name):
+    graph = json.loads((FIXTURES / f"{name}.json").read_text(encoding="utf-8"))
+    return graph, workflow_codec.encode_workflow(graph)
+
+
+def _ids(encoded):
+    return {n["type"]: n["id"] for n in encoded.compact["nodes"]}
+
+
+def test_patch_applies_and_merges_back():
+    graph, encoded = _encoded("default_txt2img")
+    ids = _ids(encoded)
+    ops = workflow_ops.parse_ops({"ops": [
+        {"op": "set_widget", "id": ids["KSampler"], "index": 2, "value": 30},
+        {"op": "add_node", "id": 50, "type": "ImageScaleBy", "widgets": ["lanczos", 2.0],
+         "in": {"image": [ids["VAEDecode"], 0]}, "out": ["IMAGE"]},
+        {"op": "connect", "from": [50, 0], "to": [ids["SaveImage"], "images"]},
+    ]})
+
+    result = workflow_codec.decode_workflow(workflow_ops.apply_ops(encoded.compact, ops), encoded)
+    by_id = {n["id"]: n for n in result["nodes"]}
+
+    assert by_id[3]["widgets_values"][2] == 30
+    assert by_id[10]["type"] == "ImageScaleBy"
+    save_link = by_id[9]["inputs"][0]["link"]
+    assert [l for l in result["links"] if l[0] == save_link] == [[save_link, 10, 0, 9, 0, "IMAGE"]]
+    assert 9 not in [l[0] for l in result["links"]]  # the old decode -> save link is gone
+    # Untouched nodes keep their layout
+    assert by_id[4] == next(n for n in graph["nodes"] if n["id"] == 4)
+
+
+def test_remove_and_disconnect():
+    _, encoded = _encoded("sdxl_lora_hires")
+    nodes = {n.get("title") or n["type"]: n for n in encoded.compact["nodes"]}
+    preview, base = nodes["Preview (base)"]["id"], nodes["Base Sampler"]["id"]
+
+    patched = workflow_ops.apply_ops(encoded.compact, [
+        {"op": "remove_node", "id": nodes["Seed"]["id"]},
+        {"op": "remove_node", "id": preview},
+        {"op": "disconnect", "to": [base, "negative"]},
+    ])
+    result = workflow_codec.decode_workflow(patched, encoded)
+
+    remaining = {n["id"] for n in result["nodes"]}
+    assert 6 not in remaining and 10 not in remaining
+    assert all(l[1] in remaining and l[3] in remaining for l in result["links"])
+    sampler = next(n for n in result["nodes"] if n["id"] == 7)
+    assert {i["name"]: i["link"] for i in sampler["inputs"]}["negative"] is None
+    assert {i["name"]: i["link"] for i in sampler["inputs"]}["seed"] is None
+
+
+def test_invalid_patch_is_rejected_whole():
+    _, encoded = _encoded("default_txt2img")
+    ids = _ids(encoded)
+    before = json.loads(encoded.dumps())
+    bad_patches = [
+        [{"op": "set_widget", "id": ids["KSampler"], "index": 99, "value": 1}],
+        [{"op": "remove_node", "id": 999}],
+        [{"op": "connect", "from": [ids["EmptyLatentImage"], 3], "to": [ids["KSampler"], "latent_image"]}],
+        [{"op": "disconnect", "to": [ids["EmptyLatentImage"], "clip"]}],
+        [{"op": "add_node", "id": ids["KSampler"], "type": "KSampler"}],
+        [{"op": "set_widget", "id": ids["KSampler"], "index": 2, "value": 5}, {"op": "explode"}],
+    ]
+    for ops in bad_patches:
+        try:
+            workflow_ops.apply_ops(encoded.compact, ops)
+        except workflow_ops.WorkflowOpError as e:
+            assert e.index == len(ops) - 1
+        else:
+            raise AssertionError(f"accepted {ops!r}")
+    assert json.loads(encoded.dumps()) == before  # nothing was half-applied
+
+
+def test_patch_output_is_small():
+    _, encoded = _encoded("sdxl_lora_hires")
+    ops = [{"op": "set_widget", "id": 7, "index": 2, "value": 40}]
+    assert len(json.dumps({"ops": ops})) * 10 < len(encoded.dumps())
+
+
+class ScriptedLLM:
+    """ChatClient stand-in that answers every request with `reply`."""
+
+    provider_name, model = "box", "m"
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.params = agent_factory.SamplingParams()
+
+    def bind(self, **_):
+        return self
+
+    def supports_structured_output(self):
+        return True
+
+    async def chat(self, messages):
+        return self.reply
+
+
+async def _no_settings():
+    return {}
+
+
+async def _memory_cache_settings():
+    return {"cache": {"enabled": True, "disk": False}}
+
+
+def test_failed_rewrite_reports_reason():
+    graph, _ = _encoded("default_txt2img")
+    saved = rewrite_tools.load_settings_async
+    rewrite_tools.load_settings_async = _no_settings
+    metrics.reset()
+    try:
+        llm = ScriptedLLM("Sure! Here is your workflow: <graph>")
+        new_graph, notes = asyncio.run(rewrite_tools.rewrite_graph_with_llm(graph, "more steps", False, llm))
+        assert new_graph is graph and notes.startswith("Rewrite failed: ")
+        assert metrics.get_counter("rewrite.rejected") == 1
+
+        llm = ScriptedLLM('{"ops": [{"op": "remove_node", "id": 999}]}')
+        new_graph, ops, notes = asyncio.run(rewrite_tools.rewrite_graph_with_ops(graph, "more steps", False, llm))
+        assert new_graph is graph and ops == [] and notes.startswith("Rewrite patch rejected: ")
+    finally:
+        rewrite_tools.load_settings_async = saved
+
+
+def test_provider_error_is_not_a_rewrite():
+    # repair_json() would pull {"error": "boom"} out of this and call it a graph
+    error = '[Ollama ERROR] HTTP 500: {"error": "boom"}'
+    unencodable = {"weird": True}
+    saved = rewrite_tools.load_settings_async, response_cache._cache
+    rewrite_tools.load_settings_async = _memory_cache_settings
+    response_cache._cache = None
+    metrics.reset()
+    try:
+        new_graph, notes = asyncio.run(rewrite_tools.rewrite_graph_with_llm(unencodable, "x", True, ScriptedLLM(error)))
+        assert new_graph is unencodable and notes == f"Rewrite failed: {error}"
+        assert metrics.get_counter("structured.rewrite.failed") == 1
+
+        graph, _ = _encoded("default_txt2img")
+        new_graph, ops, notes = asyncio.run(rewrite_tools.rewrite_graph_with_ops(graph, "x", True, ScriptedLLM(error)))
+        assert new_graph is graph and ops == [] and notes == f"Rewrite patch rejected: {error}"
+        assert response_cache._cache.stats()["memory_entries"] == 0
+    finally:
+        rewrite_tools.load_settings_async, response_cache._cache = saved
+
+
+if __name__ == "__main__":
+    test_patch_applies_and_merges_back()
+    test_remove_and_disconnect()
+    test_invalid_patch_is_rejected_whole()
+    test_patch_output_is_small()
+    test_failed_rewrite_reports_reason()
+    test_provider_error_is_not_a_rewrite()
+    print("All tests passed!")